@@ -0,0 +1,97 @@
+"""Compare client IP allocation cost of the legacy host scan and the bitmap allocator.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_allocator
+"""
+
+import argparse
+import ipaddress
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from lambda_functions import wg_peer_manager as manager
+
+SUBNET = "10.8.0.0/16"
+SERVER_ADDRESS = "10.8.0.1"
+PEER_COUNTS = (10, 100, 1000, 10000, 60000)
+
+
+def _write_config(path: Path, peers: int) -> None:
+    base = int(ipaddress.ip_address(SERVER_ADDRESS)) + 1
+    lines = ["[Interface]\n", f"Address = {SERVER_ADDRESS}/16\n", "ListenPort = 51820\n"]
+    for index in range(peers):
+        lines.append("\n[Peer]\n")
+        lines.append(f"PublicKey = {index:043d}=\n")
+        lines.append(f"AllowedIPs = {ipaddress.ip_address(base + index)}/32\n")
+    path.write_text("".join(lines), encoding="utf-8")
+
+
+def _legacy_allocate(sections, client_subnet, server_address):
+    used_ips = {server_address}
+    for section in sections:
+        if section["type"].lower() != "peer":
+            continue
+        allowed_line = section["data"].get("AllowedIPs")
+        if allowed_line:
+            network = ipaddress.ip_network(allowed_line.split(",", 1)[0].strip(), strict=False)
+            if network.prefixlen == 32:
+                used_ips.add(network.network_address)
+            else:
+                for host in network.hosts():
+                    used_ips.add(host)
+    for host in client_subnet.hosts():
+        if host == server_address or host in used_ips:
+            continue
+        return host
+    return None
+
+
+def _bitmap_allocate(settings):
+    allocator = manager.load_allocator(settings)
+    address = allocator.allocate()
+    manager.save_allocator(settings, allocator)
+    return address
+
+
+def _median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'peers':>8} {'legacy ms':>12} {'bitmap ms':>12} {'parse ms':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for peers in PEER_COUNTS:
+            conf = Path(workdir) / f"wg{peers}.conf"
+            _write_config(conf, peers)
+            settings = manager.load_settings({
+                "WG_CONF_PATH": str(conf),
+                "CLIENT_SUBNET": SUBNET,
+                "SERVER_ADDRESS": SERVER_ADDRESS,
+            })
+            sections = manager.parse_config(str(conf))
+            # Prime the persisted allocator so the bitmap column measures the warm path.
+            manager.save_allocator(settings, manager.load_allocator(settings))
+
+            legacy = _median_ms(
+                lambda: _legacy_allocate(sections, settings["client_subnet"], settings["server_address"]),
+                args.repeat,
+            )
+            bitmap = _median_ms(lambda: _bitmap_allocate(settings), args.repeat)
+            parse = _median_ms(lambda: manager.parse_config(str(conf)), args.repeat)
+            print(f"{peers:>8} {legacy:>12.3f} {bitmap:>12.3f} {parse:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Measure Lambda cold-start cost (module import and first invocation) per handler path.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_cold_start                  # working tree
+    python -m benchmarks.bench_cold_start --ref HEAD~1     # compare against a git ref
+
+Each sample runs in a fresh interpreter, so imports, boto3 sessions and client
+creation are paid exactly as in a new Lambda container. AWS calls are
+answered with canned responses before anything is signed or sent, so the
+numbers isolate Python start-up work from network latency. The interpreter's
+own start-up is excluded.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+INSTANCE_ID = "i-0123456789abcdef0"
+
+# Scenario name -> (handler module, event, frozen local time or None). Most
+# scenarios take the common path that touches AWS; the rejected ones never should.
+SCENARIOS = {
+    "start_instance": ("start_instance", {"trigger": "prewarm"}, None),
+    "start_instance:403": ("start_instance", {}, "2024-01-08T09:00:00"),  # Monday morning
+    "stop_instance": ("stop_instance", {}, None),
+    "check_status": ("check_status", {"httpMethod": "GET"}, None),
+    "monitor_traffic": ("monitor_traffic", {}, None),
+    "register_peer": ("register_peer", {"httpMethod": "GET", "queryStringParameters": {"jobId": "bench"}}, None),
+    "register_peer:400": ("register_peer", {"httpMethod": "POST", "body": "not json"}, None),
+}
+
+ENVIRONMENT = {
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "AWS_DEFAULT_REGION": "ap-southeast-2",
+    "AWS_EC2_METADATA_DISABLED": "true",
+    "INSTANCE_ID": INSTANCE_ID,
+    "CLIENT_SUBNET_CIDR": "10.8.0.0/24",
+    "SERVER_ADDRESS": "10.8.0.1",
+    "TIMEZONE": "Australia/Sydney",
+}
+
+# Runs inside the child interpreter. argv: source directory, handler module, JSON event, frozen time.
+_CHILD = r"""
+import copy, json, sys, time
+from datetime import datetime, timedelta, timezone
+
+source, module_name, event, frozen = sys.argv[1], sys.argv[2], json.loads(sys.argv[3]), sys.argv[4]
+sys.path.insert(0, source)
+launched = datetime.now(timezone.utc) - timedelta(hours=3)
+instance = {
+    "InstanceId": "%(instance_id)s",
+    "State": {"Name": "stopped" if module_name == "start_instance" else "running"},
+    "LaunchTime": launched,
+    "PublicIpAddress": "203.0.113.10",
+    "PrivateIpAddress": "10.0.0.10",
+    "Placement": {"AvailabilityZone": "ap-southeast-2a"},
+    "Tags": [{"Key": "vpn-ready-at", "Value": str(int(launched.timestamp()) + 30)}],
+}
+canned = {
+    "DescribeInstances": {"Reservations": [{"Instances": [instance]}]},
+    "DescribeInstanceStatus": {"InstanceStatuses": [{
+        "InstanceId": "%(instance_id)s",
+        "InstanceState": {"Name": "running"},
+        "SystemStatus": {"Status": "ok"},
+        "InstanceStatus": {"Status": "ok"},
+    }]},
+    "GetMetricData": {"MetricDataResults": []},
+    "ListCommandInvocations": {"CommandInvocations": []},
+}
+
+import botocore.client
+botocore.client.BaseClient._make_api_call = lambda self, operation, params: copy.deepcopy(canned.get(operation, {}))
+
+started = time.perf_counter()
+module = __import__(module_name)
+imported = time.perf_counter()
+if frozen:
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.fromisoformat(frozen).replace(tzinfo=tz)
+
+    module.datetime = FrozenDatetime
+    imported = time.perf_counter()
+first = module.handler(copy.deepcopy(event), None)
+invoked = time.perf_counter()
+module.handler(copy.deepcopy(event), None)
+warm = time.perf_counter()
+print(json.dumps({
+    "importMs": (imported - started) * 1000,
+    "firstMs": (invoked - imported) * 1000,
+    "warmMs": (warm - invoked) * 1000,
+    "status": first.get("statusCode") if isinstance(first, dict) else None,
+}))
+""" % {"instance_id": INSTANCE_ID}
+
+
+def _export(ref: str, destination: Path) -> Path:
+    """Extract ``lambda_functions`` as of ``ref`` and return its directory."""
+    archive = subprocess.run(["git", "archive", ref, "lambda_functions"], cwd=REPO_ROOT,
+                             check=True, capture_output=True).stdout
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(destination, filter="data")
+    return destination / "lambda_functions"
+
+
+def sample(source: Path, scenario: str) -> dict:
+    module, event, frozen = SCENARIOS[scenario]
+    env = {**{key: value for key, value in os.environ.items() if not key.startswith("AWS_")}, **ENVIRONMENT}
+    env.pop("PYTHONPATH", None)
+    result = subprocess.run(
+        [sys.executable, "-c", _CHILD, str(source), module, json.dumps(event), frozen or ""],
+        cwd=source, env=env, check=True, capture_output=True, text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(source: Path, scenarios: list, runs: int) -> dict:
+    results = {}
+    for scenario in scenarios:
+        samples = [sample(source, scenario) for _ in range(runs)]
+        row = {key: round(statistics.median(item[key] for item in samples), 2)
+               for key in ("importMs", "firstMs", "warmMs")}
+        row["coldMs"] = round(row["importMs"] + row["firstMs"], 2)
+        row["status"] = samples[-1]["status"]
+        results[scenario] = row
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ref", help="git ref to compare against, e.g. HEAD~1")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--runs", type=int, default=7, help="fresh interpreters per scenario (median reported)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    current = measure(REPO_ROOT / "lambda_functions", args.scenario, args.runs)
+    baseline = None
+    if args.ref:
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = measure(_export(args.ref, Path(directory)), args.scenario, args.runs)
+
+    if args.json:
+        print(json.dumps({"current": current, "baseline": baseline}, indent=2))
+        return
+
+    print(f"{'scenario':<20} {'import ms':>10} {'first ms':>10} {'cold ms':>10} {'warm ms':>9} {'status':>7}"
+          + (f" {'base cold':>10} {'delta':>8}" if baseline else ""))
+    for scenario, row in current.items():
+        line = (f"{scenario:<20} {row['importMs']:>10.1f} {row['firstMs']:>10.1f} {row['coldMs']:>10.1f} "
+                f"{row['warmMs']:>9.2f} {row['status']!s:>7}")
+        if baseline:
+            base = baseline[scenario]["coldMs"]
+            line += f" {base:>10.1f} {row['coldMs'] - base:>+8.1f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
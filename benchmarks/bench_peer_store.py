@@ -0,0 +1,85 @@
+"""Measure duplicate-key lookups and registrations against the indexed peer store.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_peer_store
+"""
+
+import argparse
+import tempfile
+from pathlib import Path
+
+from benchmarks.bench_allocator import SERVER_ADDRESS, SUBNET, _median_ms, _write_config
+from lambda_functions import wg_peer_manager as manager
+
+LOOKUP_PEERS = 10000
+REGISTER_PEER_COUNTS = (10, 100, 1000, 10000, 60000)
+
+
+class NullWg:
+    def add_peers(self, peers):
+        pass
+
+    def public_key(self):
+        return ""
+
+
+def _settings(conf: Path):
+    return manager.load_settings({
+        "WG_CONF_PATH": str(conf),
+        "CLIENT_SUBNET": SUBNET,
+        "SERVER_ADDRESS": SERVER_ADDRESS,
+    })
+
+
+def _legacy_lookup(conf: Path, public_key: str):
+    for section in manager.parse_config(str(conf)):
+        if section["type"].lower() == "peer" and section["data"].get("PublicKey") == public_key:
+            return section
+    return None
+
+
+def _store_lookup(store, public_key: str):
+    with store.locked():
+        return store.lookup(public_key)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        conf = Path(workdir) / "lookup.conf"
+        _write_config(conf, LOOKUP_PEERS)
+        settings = _settings(conf)
+        warm = manager.PeerStore(settings)
+        _store_lookup(warm, "")
+        last_key = f"{LOOKUP_PEERS - 1:043d}="
+
+        legacy = _median_ms(lambda: _legacy_lookup(conf, last_key), args.repeat)
+        inline = _median_ms(lambda: _store_lookup(manager.PeerStore(settings), last_key), args.repeat)
+        agent = _median_ms(lambda: _store_lookup(warm, last_key), args.repeat)
+        print(f"duplicate lookup at {LOOKUP_PEERS} peers (ms)")
+        print(f"  legacy parse + scan : {legacy:10.3f}")
+        print(f"  index, fresh process: {inline:10.3f}")
+        print(f"  index, resident agent: {agent:9.3f}")
+        print()
+
+        print(f"{'peers':>8} {'register ms (agent)':>20}")
+        for peers in REGISTER_PEER_COUNTS:
+            conf = Path(workdir) / f"wg{peers}.conf"
+            _write_config(conf, peers)
+            settings = _settings(conf)
+            store = manager.PeerStore(settings)
+            _store_lookup(store, "")
+            counter = iter(range(peers, peers + 10 * args.repeat))
+            elapsed = _median_ms(
+                lambda: manager.register_peers([f"{next(counter):043d}="], settings, NullWg(), store),
+                args.repeat,
+            )
+            print(f"{peers:>8} {elapsed:>20.3f}")
+
+
+if __name__ == "__main__":
+    main()
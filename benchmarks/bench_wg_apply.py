@@ -0,0 +1,150 @@
+"""Compare per-peer cost of applying new peers through ``wg`` processes and netlink.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_wg_apply
+    sudo python -m benchmarks.bench_wg_apply --interface wgbench0   # against a real interface
+
+Three ways of applying a batch of new peers are timed:
+
+* ``legacy``: per peer, ``wg genpsk``, ``wg set ... allowed-ips``, the PSK
+  written to a temporary file for ``wg set ... preshared-key``, then
+  ``wg show ... public-key``. That is four processes and a secret on disk.
+* ``cli``: ``WgCli``, with in-process PSKs and one ``wg addconf`` per batch.
+* ``netlink``: ``WgNetlink``, one ``WG_CMD_SET_DEVICE`` message per about
+  300 peers and no process at all.
+
+Without ``--interface``, ``wg`` is a stand-in shell script and netlink
+requests are acknowledged in-process. The figures then cover fork/exec and
+encoding cost, which is what differs between the paths, but not the
+kernel's own work. With ``--interface`` (root, the ``wg`` tool and an
+existing WireGuard interface), every path applies the peers for real and
+removes them again afterwards.
+"""
+
+import argparse
+import base64
+import ipaddress
+import os
+import statistics
+import struct
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from lambda_functions import wg_peer_manager as manager
+
+BATCH_SIZES = (1, 10, 100, 1000)
+FIRST_ADDRESS = ipaddress.ip_address("10.250.0.2")
+STAND_IN_WG = """#!/bin/sh
+# Answers like wg without touching an interface.
+case "$1" in
+  genpsk) echo "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=" ;;
+  show) echo "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=" ;;
+  addconf) cat > /dev/null ;;
+esac
+"""
+
+
+class AckingSocket:
+    """Acknowledges every netlink request, standing in for the kernel."""
+
+    def __init__(self):
+        self._replies = []
+
+    def send(self, data):
+        seq = struct.unpack_from("=I", data, 8)[0]
+        if struct.unpack_from("=H", data, 4)[0] == manager.GENL_ID_CTRL:
+            body = manager._genl(1, manager._nla(manager.CTRL_ATTR_FAMILY_ID, struct.pack("=H", 0x1d)))
+            self._replies.append(struct.pack("=IHHII", 16 + len(body), manager.GENL_ID_CTRL, 0, seq, 0) + body)
+        else:
+            self._replies.append(struct.pack("=IHHIIi", 20, manager.NLMSG_ERROR, 0, seq, 0, 0))
+        return len(data)
+
+    def recv(self, size):
+        return self._replies.pop(0)
+
+    def close(self):
+        pass
+
+
+def _peers(count: int, offset: int):
+    return [
+        {
+            "publicKey": base64.b64encode((offset + index + 1).to_bytes(32, "big")).decode("ascii"),
+            "assignedIp": str(FIRST_ADDRESS + offset + index),
+            "presharedKey": manager.generate_psk(),
+        }
+        for index in range(count)
+    ]
+
+
+def _legacy_apply(interface: str, peers) -> None:
+    for peer in peers:
+        psk = subprocess.run(["wg", "genpsk"], check=True, capture_output=True, text=True).stdout.strip()
+        subprocess.run(["wg", "set", interface, "peer", peer["publicKey"],
+                        "allowed-ips", f"{peer['assignedIp']}/32"], check=True)
+        with tempfile.NamedTemporaryFile("w", encoding="ascii") as handle:
+            handle.write(psk)
+            handle.flush()
+            subprocess.run(["wg", "set", interface, "peer", peer["publicKey"], "preshared-key", handle.name], check=True)
+        subprocess.run(["wg", "show", interface, "public-key"], check=True, capture_output=True)
+
+
+def _apply(wg, peers) -> None:
+    wg.add_peers(peers)
+    wg.public_key()
+
+
+def _median_us_per_peer(apply, cleanup, batch: int, repeat: int) -> float:
+    samples = []
+    for round_index in range(repeat):
+        peers = _peers(batch, round_index * batch)
+        started = time.perf_counter()
+        apply(peers)
+        samples.append((time.perf_counter() - started) * 1e6 / batch)
+        cleanup([peer["publicKey"] for peer in peers])
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch", type=int, nargs="+", default=list(BATCH_SIZES), help="peers applied per call")
+    parser.add_argument("--interface", help="existing WireGuard interface to apply peers to (needs root)")
+    parser.add_argument("--legacy-max", type=int, default=100,
+                        help="largest batch timed on the legacy path, which forks four processes per peer")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.interface:
+            interface = args.interface
+            cli = manager.WgCli(interface)
+            netlink = manager.WgNetlink(interface)
+            cleanup = netlink.remove_peers
+        else:
+            interface = "wgbench0"
+            stand_in = Path(workdir) / "wg"
+            stand_in.write_text(STAND_IN_WG, encoding="utf-8")
+            stand_in.chmod(0o755)
+            os.environ["PATH"] = f"{workdir}{os.pathsep}{os.environ['PATH']}"
+            cli = manager.WgCli(interface)
+            netlink = manager.WgNetlink(interface, sock=AckingSocket())
+            cleanup = lambda public_keys: None  # noqa: E731
+
+        print(f"per-peer apply cost (us), {'interface ' + interface if args.interface else 'stand-in wg and kernel'}")
+        print(f"{'peers':>8} {'legacy':>12} {'cli':>12} {'netlink':>12} {'vs legacy':>10}")
+        for batch in args.batch:
+            legacy = (_median_us_per_peer(lambda peers: _legacy_apply(interface, peers), cleanup, batch, args.repeat)
+                      if batch <= args.legacy_max else None)
+            batched = _median_us_per_peer(lambda peers: _apply(cli, peers), cleanup, batch, args.repeat)
+            direct = _median_us_per_peer(lambda peers: _apply(netlink, peers), cleanup, batch, args.repeat)
+            if legacy is None:
+                print(f"{batch:>8} {'-':>12} {batched:12.1f} {direct:12.1f} {'-':>10}")
+            else:
+                print(f"{batch:>8} {legacy:12.1f} {batched:12.1f} {direct:12.1f} {legacy / direct:9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
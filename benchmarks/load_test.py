@@ -0,0 +1,434 @@
+"""Drive the API and scheduled handlers under concurrent load and report latency percentiles.
+
+Run from the repository root:
+
+    python -m benchmarks.load_test                                   # default mix, 20 req/s for 15 s
+    python -m benchmarks.load_test --rate 50 --duration 30 --workers 8 \\
+        --mix check_status=4 register_peer=2 start_instance=1 --latency ssm=60 ssm-exec=800
+    python -m benchmarks.load_test --save benchmarks/baselines/load_test.json
+    python -m benchmarks.load_test --baseline benchmarks/baselines/load_test.json --check
+
+Each worker is a separate interpreter that imports the handlers once, like one
+warm Lambda container, and serves its share of an open-loop schedule: request
+``n`` is due at ``n / rate`` seconds. Latency is measured from the due time,
+so a worker that falls behind reports the queueing its callers would see.
+
+AWS calls never leave the process. A small stand-in answers EC2, SSM,
+DynamoDB, SQS and CloudWatch after a configurable per-service delay. It keeps
+just enough state for the handlers' paths: instance state, SSM commands that
+finish ``ssm-exec`` ms after they are sent, and operation leases. Each worker
+has its own stand-in, so leases only coalesce requests within a worker.
+
+Results give throughput, p50/p95/p99 latency, errors and AWS calls per
+request for each handler. ``--save`` writes them as a baseline JSON, and
+``--baseline`` prints deltas against one. With ``--check`` the run fails when
+errors appear, calls per request grow by more than 5% or p95 latency grows
+by more than ``--tolerance``. Latency depends on the machine, so compare
+against a baseline saved on the same one; call counts compare anywhere.
+"""
+
+import argparse
+import base64
+import copy
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+INSTANCE_ID = "i-0123456789abcdef0"
+OPERATIONS_TABLE = "bench-operations"
+
+# Scenario name -> (handler module, event). Register keys are filled in per request.
+SCENARIOS = {
+    "start_instance": ("start_instance", {"httpMethod": "POST", "resource": "/start", "body": "{}"}),
+    "stop_instance": ("stop_instance", {"httpMethod": "POST", "resource": "/stop", "body": "{}"}),
+    "check_status": ("check_status", {"httpMethod": "GET", "resource": "/status"}),
+    "register_peer": ("register_peer", {"httpMethod": "POST", "resource": "/register"}),
+    "monitor_traffic": ("monitor_traffic", {"trigger": "schedule"}),
+}
+DEFAULT_MIX = {"check_status": 4, "register_peer": 2, "start_instance": 1, "stop_instance": 1, "monitor_traffic": 1}
+
+# Median stand-in latency per service in milliseconds; "ssm-exec" is how long a command runs on the instance.
+DEFAULT_LATENCY_MS = {"ec2": 40, "ssm": 30, "ssm-exec": 300, "dynamodb": 8, "sqs": 8, "monitoring": 35}
+JITTER = 0.25
+CALL_TOLERANCE = 0.05
+
+ENVIRONMENT = {
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "AWS_DEFAULT_REGION": "ap-southeast-2",
+    "AWS_EC2_METADATA_DISABLED": "true",
+    "INSTANCE_ID": INSTANCE_ID,
+    "CLIENT_SUBNET_CIDR": "10.8.0.0/16",
+    "SERVER_ADDRESS": "10.8.0.1",
+    "TIMEZONE": "Australia/Sydney",
+    # The start window is not under test.
+    "WEEKDAY_START_HOUR": "0",
+    "WEEKDAY_END_HOUR": "24",
+    "OPERATIONS_TABLE": OPERATIONS_TABLE,
+    "JOURNAL_QUEUE_URL": "https://sqs.ap-southeast-2.amazonaws.com/123456789012/bench-journal",
+}
+
+
+class StandIn:
+    """In-memory answers to the AWS operations the handlers make."""
+
+    def __init__(self, latency_ms: dict, rng: random.Random):
+        self.latency_ms = latency_ms
+        self.rng = rng
+        self.state = "running"
+        self.launched = datetime.now(timezone.utc) - timedelta(hours=3)
+        self.commands = {}
+        self.items = {}
+        self.next_host = 2
+        self.calls = []
+
+    def _delay(self, service: str) -> None:
+        median = self.latency_ms.get(service, 0)
+        if median:
+            time.sleep(median * (1 + self.rng.uniform(-JITTER, JITTER)) / 1000)
+
+    def call(self, service: str, operation: str, params: dict) -> dict:
+        from botocore.exceptions import ClientError
+
+        self.calls.append(f"{service}:{operation}")
+        self._delay(service)
+        handler = getattr(self, f"_{service}_{operation}", None)
+        if handler is None:
+            return {}
+        result = handler(params)
+        if isinstance(result, dict) and "Error" in result:
+            raise ClientError(result, operation)
+        return copy.deepcopy(result)
+
+    # EC2
+    def _instance(self) -> dict:
+        ready_at = int(self.launched.timestamp()) + 30
+        return {
+            "InstanceId": INSTANCE_ID,
+            "State": {"Name": self.state},
+            "LaunchTime": self.launched,
+            "PublicIpAddress": "203.0.113.10",
+            "PrivateIpAddress": "10.0.0.10",
+            "Placement": {"AvailabilityZone": "ap-southeast-2a"},
+            "Tags": [{"Key": "vpn-ready-at", "Value": str(ready_at)}],
+        }
+
+    def _ec2_DescribeInstances(self, params):
+        return {"Reservations": [{"Instances": [self._instance()]}]}
+
+    def _ec2_DescribeInstanceStatus(self, params):
+        if self.state != "running" and not params.get("IncludeAllInstances"):
+            return {"InstanceStatuses": []}
+        checks = "ok" if self.state == "running" else "not-applicable"
+        return {"InstanceStatuses": [{
+            "InstanceId": INSTANCE_ID,
+            "InstanceState": {"Name": self.state},
+            "SystemStatus": {"Status": checks},
+            "InstanceStatus": {"Status": checks},
+        }]}
+
+    def _ec2_StartInstances(self, params):
+        # Transitions settle at once, so start and stop requests keep finding work to do.
+        self.state, self.launched = "running", datetime.now(timezone.utc) - timedelta(hours=3)
+        return {"StartingInstances": [{"InstanceId": INSTANCE_ID, "CurrentState": {"Name": "pending"}}]}
+
+    def _ec2_StopInstances(self, params):
+        self.state = "stopped"
+        return {"StoppingInstances": [{"InstanceId": INSTANCE_ID, "CurrentState": {"Name": "stopping"}}]}
+
+    # SSM
+    def _ssm_SendCommand(self, params):
+        command_id = str(uuid.uuid4())
+        script = params["Parameters"]["commands"][0]
+        match = re.search(r"MESSAGE_B64='([^']+)'", script)
+        message = json.loads(base64.b64decode(match.group(1))) if match else {}
+        self.commands[command_id] = (time.monotonic(), message, params.get("Comment"))
+        return {"Command": {"CommandId": command_id}}
+
+    def _ssm_GetCommandInvocation(self, params):
+        if params["CommandId"] not in self.commands:
+            return {"Error": {"Code": "InvocationDoesNotExist", "Message": "not found"}}
+        sent, message, comment = self.commands[params["CommandId"]]
+        if (time.monotonic() - sent) * 1000 < self.latency_ms.get("ssm-exec", 0):
+            return {"Status": "InProgress", "Comment": comment}
+        results = []
+        for key in message.get("publicKeys") or []:
+            results.append({"publicKey": key, "alreadyExists": False, "presharedKey": "psk",
+                            "assignedIp": f"10.8.{self.next_host // 256}.{self.next_host % 256}"})
+            self.next_host += 1
+        finished = datetime.now(timezone.utc).isoformat()
+        return {
+            "Status": "Success",
+            "Comment": comment,
+            "StandardOutputContent": json.dumps({"results": results, "serverPublicKey": "server", "remaining": 1}),
+            "StandardErrorContent": "",
+            "ExecutionStartDateTime": finished,
+            "ExecutionEndDateTime": finished,
+        }
+
+    # DynamoDB: just the operation lease semantics of common.coalesce.
+    def _dynamodb_PutItem(self, params):
+        key = (params["TableName"], json.dumps(params["Item"]["scope"]))
+        current = self.items.get(key)
+        if (params.get("ConditionExpression") and current
+                and current["action"] == params["Item"]["action"]
+                and int(current["expiresAt"]["N"]) >= int(time.time())):
+            return {"Error": {"Code": "ConditionalCheckFailedException", "Message": "lease held"}, "Item": current}
+        self.items[key] = params["Item"]
+        return {}
+
+    def _dynamodb_GetItem(self, params):
+        item = self.items.get((params["TableName"], json.dumps(params["Key"]["scope"])))
+        return {"Item": item} if item else {}
+
+    def _dynamodb_UpdateItem(self, params):
+        item = self.items.get((params["TableName"], json.dumps(params["Key"].get("scope"))))
+        if item is not None and ":result" in params.get("ExpressionAttributeValues", {}):
+            item["status"] = {"S": "done"}
+            item["result"] = params["ExpressionAttributeValues"][":result"]
+        return {}
+
+    def _dynamodb_DeleteItem(self, params):
+        self.items.pop((params["TableName"], json.dumps(params["Key"]["scope"])), None)
+        return {}
+
+    # SQS: journal events
+    def _sqs_SendMessage(self, params):
+        return {"MessageId": str(uuid.uuid4())}
+
+    # CloudWatch: steady traffic well above any idle threshold, so the monitor keeps the instance.
+    def _monitoring_GetMetricData(self, params):
+        start, end = params["StartTime"], params["EndTime"]
+        period = params["MetricDataQueries"][0].get("MetricStat", {}).get("Period", 900)
+        timestamps = []
+        stamp = end
+        while stamp > start:
+            timestamps.append(stamp)
+            stamp -= timedelta(seconds=period)
+        return {"MetricDataResults": [
+            {"Id": query["Id"], "Label": query.get("Label", ""), "Timestamps": timestamps,
+             "Values": [200.0 * 1024 * 1024] * len(timestamps), "StatusCode": "Complete"}
+            for query in params["MetricDataQueries"] if query.get("ReturnData", True)
+        ]}
+
+
+class _Context:
+    def __init__(self, deadline_ms: int = 30000):
+        self.aws_request_id = str(uuid.uuid4())
+        self._deadline = time.monotonic() + deadline_ms / 1000
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+def _event(scenario: str, rng: random.Random) -> dict:
+    event = copy.deepcopy(SCENARIOS[scenario][1])
+    if scenario == "register_peer":
+        key = base64.b64encode(rng.randbytes(32)).decode("ascii")
+        event["body"] = json.dumps({"publicKey": key})
+    return event
+
+
+def _worker(index: int, config: dict, ready, start_at, results) -> None:
+    """Serve requests ``index``, ``index + workers``, ... of the schedule in one "container"."""
+    os.environ.update(ENVIRONMENT)
+    os.environ["EMF_METRICS_ENABLED"] = "true" if config["emf"] else "false"
+    sys.path.insert(0, str(REPO_ROOT / "lambda_functions"))
+    import logging
+
+    import botocore.client
+
+    rng = random.Random(config["seed"] + index)
+    stand_in = StandIn(config["latency"], rng)
+
+    def make_api_call(client, operation, params):
+        return stand_in.call(client.meta.service_model.endpoint_prefix, operation, params)
+
+    botocore.client.BaseClient._make_api_call = make_api_call
+    logging.disable(logging.CRITICAL)
+    modules = {name: __import__(SCENARIOS[name][0]) for name in config["mix"]}
+    # Handlers print EMF lines; keep them out of the report.
+    sys.stdout = open(os.devnull, "w", encoding="utf-8")
+
+    for name in dict.fromkeys(config["mix"]):
+        for _ in range(config["warmup"]):
+            modules[name].handler(_event(name, rng), _Context())
+
+    ready.put(index)
+    while start_at.value == 0:
+        time.sleep(0.001)
+    started = start_at.value
+
+    samples = []
+    for request in range(index, config["requests"], config["workers"]):
+        name = config["mix"][request % len(config["mix"])]
+        due = started + request / config["rate"]
+        pause = due - time.time()
+        if pause > 0:
+            time.sleep(pause)
+        stand_in.calls = []
+        try:
+            response = modules[name].handler(_event(name, rng), _Context())
+            status = response.get("statusCode", 200) if isinstance(response, dict) else 200
+        except Exception:  # pylint: disable=broad-except
+            status = None
+        finished = time.time()
+        samples.append((name, (finished - due) * 1000, status, len(stand_in.calls), finished))
+    results.put(samples)
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples: list, started: float) -> dict:
+    results = {}
+    elapsed = max(sample[4] for sample in samples) - started
+    for name in sorted({sample[0] for sample in samples}):
+        rows = [sample for sample in samples if sample[0] == name]
+        latencies = [row[1] for row in rows]
+        results[name] = {
+            "requests": len(rows),
+            "throughputRps": round(len(rows) / elapsed, 2),
+            "p50Ms": round(percentile(latencies, 0.50), 2),
+            "p95Ms": round(percentile(latencies, 0.95), 2),
+            "p99Ms": round(percentile(latencies, 0.99), 2),
+            "errors": sum(1 for row in rows if row[2] is None or row[2] >= 500),
+            "awsCallsPerRequest": round(sum(row[3] for row in rows) / len(rows), 2),
+        }
+    latencies = [sample[1] for sample in samples]
+    results["all"] = {
+        "requests": len(samples),
+        "throughputRps": round(len(samples) / elapsed, 2),
+        "p50Ms": round(percentile(latencies, 0.50), 2),
+        "p95Ms": round(percentile(latencies, 0.95), 2),
+        "p99Ms": round(percentile(latencies, 0.99), 2),
+        "errors": sum(row["errors"] for name, row in results.items() if name != "all"),
+        "awsCallsPerRequest": round(sum(sample[3] for sample in samples) / len(samples), 2),
+    }
+    return results
+
+
+def run(config: dict) -> dict:
+    context = multiprocessing.get_context("spawn")
+    ready, results = context.Queue(), context.Queue()
+    start_at = context.Value("d", 0.0)
+    workers = [
+        context.Process(target=_worker, args=(index, config, ready, start_at, results), daemon=True)
+        for index in range(config["workers"])
+    ]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.get(timeout=120)
+    start_at.value = time.time() + 0.05
+    samples = []
+    for _ in workers:
+        samples += results.get(timeout=config["requests"] / config["rate"] + 300)
+    for worker in workers:
+        worker.join()
+    return summarize(samples, start_at.value)
+
+
+def regressions(current: dict, baseline: dict, tolerance: float) -> list:
+    found = []
+    for name, row in current.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        # SSM polls follow jittered backoff, so call counts wobble slightly between runs.
+        if row["awsCallsPerRequest"] > base["awsCallsPerRequest"] * (1 + CALL_TOLERANCE) + 0.01:
+            found.append(f"{name}: AWS calls/request {base['awsCallsPerRequest']} -> {row['awsCallsPerRequest']}")
+        if row["p95Ms"] > base["p95Ms"] * (1 + tolerance):
+            found.append(f"{name}: p95 {base['p95Ms']} ms -> {row['p95Ms']} ms")
+        if row["errors"] > base["errors"]:
+            found.append(f"{name}: errors {base['errors']} -> {row['errors']}")
+    return found
+
+
+def _pairs(values: list, cast) -> dict:
+    parsed = {}
+    for value in values:
+        key, _, number = value.partition("=")
+        parsed[key] = cast(number)
+    return parsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=20.0, help="target requests per second across all workers")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of scheduled requests")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent worker processes (warm containers)")
+    parser.add_argument("--mix", nargs="+", default=[f"{name}={weight}" for name, weight in DEFAULT_MIX.items()],
+                        help="scenario=weight pairs, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--latency", nargs="+", default=[], help="service=ms overrides, e.g. ec2=60 ssm-exec=800")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured requests per scenario and worker")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--no-emf", dest="emf", action="store_false", help="disable EMF metric lines")
+    parser.add_argument("--save", type=Path, help="write the results as a baseline JSON")
+    parser.add_argument("--baseline", type=Path, help="baseline JSON to compare against")
+    parser.add_argument("--check", action="store_true", help="exit non-zero on regressions against --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative p95 growth for --check")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    weights = _pairs(args.mix, int)
+    unknown = set(weights) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    # Interleave scenarios so every stretch of the schedule carries the whole mix.
+    mix = []
+    for turn in range(max(weights.values())):
+        mix += [name for name, weight in weights.items() if weight > turn]
+    config = {
+        "rate": args.rate,
+        "requests": max(1, int(args.rate * args.duration)),
+        "workers": args.workers,
+        "mix": mix,
+        "latency": {**DEFAULT_LATENCY_MS, **_pairs(args.latency, float)},
+        "warmup": args.warmup,
+        "seed": args.seed,
+        "emf": args.emf,
+    }
+    results = run(config)
+    report = {"config": {key: config[key] for key in ("rate", "requests", "workers", "latency", "emf")},
+              "mix": weights, "results": results}
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))["results"] if args.baseline else None
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'scenario':<16} {'requests':>8} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'errors':>6} {'calls/req':>9}" + (f" {'base p95':>9} {'base calls':>10}" if baseline else ""))
+        for name, row in results.items():
+            line = (f"{name:<16} {row['requests']:>8} {row['throughputRps']:>7.2f} {row['p50Ms']:>8.1f} "
+                    f"{row['p95Ms']:>8.1f} {row['p99Ms']:>8.1f} {row['errors']:>6} {row['awsCallsPerRequest']:>9.2f}")
+            if baseline and name in baseline:
+                line += f" {baseline[name]['p95Ms']:>9.1f} {baseline[name]['awsCallsPerRequest']:>10.2f}"
+            print(line)
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.tolerance)
+        for message in found:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if found and args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Replay recorded traffic series through the idle engine under several policies.
+
+Run from the repository root:
+
+    python -m benchmarks.replay_monitor                                   # synthetic week
+    python -m benchmarks.replay_monitor traffic.csv export.json \\
+        --threshold 0.5 1 5 --window-hours 0.5 1.5 --smoothing window ewma
+
+CSV files need ``timestamp`` and ``bytes`` columns (``value`` is accepted too).
+They may also have ``activePeers`` and ``instanceId`` columns, and one series
+is read per instance. JSON files can be a ``get_metric_data`` response (one
+series per result, labelled by ``Label``) or a list of
+``{"timestamp", "bytes", "activePeers"}`` objects. Timestamps are ISO 8601 or
+epoch seconds. Nothing talks to AWS.
+"""
+
+import argparse
+import csv
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import product
+from math import ceil
+from pathlib import Path
+
+from lambda_functions import idle_engine
+
+SYNTHETIC_DAYS = 7
+SYNTHETIC_SERIES = 20
+# Rate that counts as a user being back, independent of the policy under test.
+ACTIVITY_MB_PER_HOUR = 10.0
+
+
+def _timestamp(value) -> datetime:
+    if isinstance(value, (int, float)) or str(value).replace(".", "", 1).isdigit():
+        return datetime.fromtimestamp(float(value), timezone.utc)
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _sample(timestamp, value, peers=None) -> dict:
+    sample = {"timestamp": _timestamp(timestamp), "bytes": float(value)}
+    if peers not in (None, ""):
+        sample["activePeers"] = int(float(peers))
+    return sample
+
+
+def _load_csv(path: Path) -> dict:
+    series = {}
+    with path.open(newline="", encoding="utf-8") as handle:
+        for row in csv.DictReader(handle):
+            name = row.get("instanceId") or path.stem
+            value = row.get("bytes", row.get("value"))
+            series.setdefault(name, []).append(_sample(row["timestamp"], value, row.get("activePeers")))
+    return series
+
+
+def _load_json(path: Path) -> dict:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if isinstance(data, list):
+        return {path.stem: [_sample(item["timestamp"], item.get("bytes", item.get("value")), item.get("activePeers"))
+                            for item in data]}
+    series = {}
+    for index, result in enumerate(data.get("MetricDataResults", [])):
+        name = result.get("Label") or f"{path.stem}-{index}"
+        series.setdefault(name, []).extend(
+            _sample(timestamp, value) for timestamp, value in zip(result["Timestamps"], result["Values"])
+        )
+    return series
+
+
+def load_series(paths) -> dict:
+    series = {}
+    for path in map(Path, paths):
+        loaded = _load_json(path) if path.suffix.lower() == ".json" else _load_csv(path)
+        for name, samples in loaded.items():
+            series[name if name not in series else f"{path.stem}:{name}"] = samples
+    return series
+
+
+def synthetic_series(count: int, period_seconds: int, days: int = SYNTHETIC_DAYS, seed: int = 7) -> dict:
+    """Weekday evening sessions with short pauses and keepalive trickle, one series per user."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    periods_per_hour = 3600 // period_seconds
+    series = {}
+    for user in range(count):
+        active = set()
+        for day in range(days):
+            if day % 7 >= 5 or rng.random() < 0.2:
+                continue
+            session_start = (day * 24 + rng.randint(17, 21)) * periods_per_hour
+            length = rng.randint(periods_per_hour // 2, 3 * periods_per_hour)
+            pause_at = session_start + rng.randint(1, max(1, length - 1))
+            pause = rng.randint(1, max(1, periods_per_hour // 4))
+            active.update(range(session_start, pause_at))
+            active.update(range(pause_at + pause, session_start + length + pause))
+        samples = []
+        for index in range(days * 24 * periods_per_hour):
+            megabytes_per_hour = rng.uniform(20, 400) if index in active else rng.uniform(0, 0.8)
+            samples.append({
+                "timestamp": start + timedelta(seconds=index * period_seconds),
+                "bytes": megabytes_per_hour * 1024 * 1024 / periods_per_hour,
+            })
+        series[f"synthetic-{user}"] = samples
+    return series
+
+
+def _period_seconds(samples: list, default: int) -> int:
+    stamps = sorted(sample["timestamp"] for sample in samples)
+    gaps = [(later - earlier).total_seconds() for earlier, later in zip(stamps, stamps[1:]) if later > earlier]
+    return int(min(gaps)) if gaps else default
+
+
+def run(series: dict, policies: list, activity_mb_per_hour: float = ACTIVITY_MB_PER_HOUR) -> list:
+    rows = []
+    for label, make_policy in policies:
+        totals = {"stops": 0, "falseStops": 0, "hoursSaved": 0.0, "idleHoursRunning": 0.0, "periods": 0}
+        started = time.perf_counter()
+        for samples in series.values():
+            policy = make_policy(_period_seconds(samples, 900))
+            result = idle_engine.replay(policy, samples, activity_mb_per_hour=activity_mb_per_hour)
+            for key in totals:
+                totals[key] += result[key]
+        elapsed = time.perf_counter() - started
+        rows.append({
+            "policy": label,
+            **{key: round(value, 3) if isinstance(value, float) else value for key, value in totals.items()},
+            "seriesPerSecond": round(len(series) / elapsed, 1) if elapsed else None,
+        })
+    return rows
+
+
+def _policies(args) -> list:
+    policies = []
+    for threshold, window_hours, smoothing, min_idle in product(
+        args.threshold, args.window_hours, args.smoothing, args.min_idle_points or [None]
+    ):
+        def make_policy(period_seconds, threshold=threshold, window_hours=window_hours,
+                        smoothing=smoothing, min_idle=min_idle):
+            return idle_engine.IdlePolicy(
+                threshold_mb_per_hour=threshold,
+                required_points=max(1, int(ceil(window_hours * 3600 / period_seconds))),
+                period_seconds=period_seconds,
+                resume_mb_per_hour=args.resume,
+                smoothing=smoothing,
+                ewma_alpha=args.ewma_alpha,
+                min_idle_points=min_idle,
+                grace_seconds=args.grace_seconds,
+            )
+
+        label = f"{smoothing} {threshold}MB/h {window_hours}h"
+        if min_idle:
+            label += f" min{min_idle}"
+        policies.append((label, make_policy))
+    return policies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", help="CSV or JSON series; a synthetic workload is used when omitted")
+    parser.add_argument("--threshold", type=float, nargs="+", default=[1.0])
+    parser.add_argument("--window-hours", type=float, nargs="+", default=[1.5])
+    parser.add_argument("--smoothing", choices=idle_engine.SMOOTHING_MODES, nargs="+", default=["window"])
+    parser.add_argument("--min-idle-points", type=int, nargs="+")
+    parser.add_argument("--resume", type=float, help="hysteresis upper bound in MB/hour")
+    parser.add_argument("--ewma-alpha", type=float, default=0.5)
+    parser.add_argument("--grace-seconds", type=int, default=0)
+    parser.add_argument("--activity-mb", type=float, default=ACTIVITY_MB_PER_HOUR,
+                        help="MB/hour that counts as real use when scoring false stops and wasted hours")
+    parser.add_argument("--period", type=int, default=900, help="period of the synthetic workload")
+    parser.add_argument("--series", type=int, default=SYNTHETIC_SERIES, help="size of the synthetic workload")
+    parser.add_argument("--json", action="store_true", help="print rows as JSON")
+    args = parser.parse_args()
+
+    series = load_series(args.files) if args.files else synthetic_series(args.series, args.period)
+    rows = run(series, _policies(args), args.activity_mb)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{len(series)} series, {sum(len(samples) for samples in series.values())} periods")
+    print(f"{'policy':<32} {'stops':>6} {'false':>6} {'saved h':>9} {'idle h':>9} {'series/s':>10}")
+    for row in rows:
+        print(f"{row['policy']:<32} {row['stops']:>6} {row['falseStops']:>6} {row['hoursSaved']:>9.2f} "
+              f"{row['idleHoursRunning']:>9.2f} {row['seriesPerSecond']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+#!/bin/bash
+# Installs the resident WireGuard peer agent. Rendered by terraform/agent.tf and
+# executed on the VPN instance through an SSM association.
+set -euo pipefail
+
+INSTALL_DIR=/usr/local/lib/wg-peer-agent
+UNIT_PATH=/etc/systemd/system/wg-peer-agent.service
+
+install -d -m 0755 "$INSTALL_DIR"
+echo '${manager_zip}' | base64 -d \
+  | python3 -c 'import io, sys, zipfile; sys.stdout.buffer.write(zipfile.ZipFile(io.BytesIO(sys.stdin.buffer.read())).read("wg_peer_manager.py"))' \
+  > "$INSTALL_DIR/wg_peer_manager.py.new"
+chmod 0644 "$INSTALL_DIR/wg_peer_manager.py.new"
+mv "$INSTALL_DIR/wg_peer_manager.py.new" "$INSTALL_DIR/wg_peer_manager.py"
+
+cat > "$UNIT_PATH" <<'UNIT'
+[Unit]
+Description=WireGuard peer management agent
+After=network-online.target wg-quick@${wg_interface}.service
+Wants=network-online.target
+
+[Service]
+Type=simple
+Environment=WG_CONF_PATH=${wg_conf_path}
+Environment=CLIENT_SUBNET=${client_subnet}
+Environment=SERVER_ADDRESS=${server_address}
+Environment=WG_INTERFACE=${wg_interface}
+Environment=WG_AGENT_PORT=${agent_port}
+Environment=WG_AGENT_TOKEN_PATH=/run/wg-peer-agent/token
+Environment=WG_READY_TAG=${ready_tag}
+ExecStart=/usr/bin/python3 /usr/local/lib/wg-peer-agent/wg_peer_manager.py serve
+RuntimeDirectory=wg-peer-agent
+RuntimeDirectoryMode=0700
+Restart=always
+RestartSec=2
+
+[Install]
+WantedBy=multi-user.target
+UNIT
+
+systemctl daemon-reload
+systemctl enable wg-peer-agent.service
+systemctl restart wg-peer-agent.service
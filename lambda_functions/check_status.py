@@ -1,72 +1,259 @@
+import hashlib
 import json
 import logging
 import os
-from datetime import datetime
-from zoneinfo import ZoneInfo
+import threading
+import time
+from datetime import datetime, timezone
 
-import boto3
+from common import emf, fleet, tz
+from common.aws import LazyClient
+from common.fleet import EC2_BATCH_SIZE, chunks
+from common.http import response
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-ec2 = boto3.client("ec2")
+ec2 = LazyClient("ec2")
 
-INSTANCE_ID = os.environ["INSTANCE_ID"]
-TIMEZONE = ZoneInfo(os.environ.get("TIMEZONE", "UTC"))
+INSTANCE_IDS, FLEET_TAG, FLEET_MODE, INSTANCE_ID = fleet.from_env()
+TIMEZONE = tz.local_zone()
+CACHE_TTL_SECONDS = float(os.environ.get("STATUS_CACHE_TTL_SECONDS", "5"))
+# The peer agent sets this tag to the epoch at which wg0 started listening.
+READY_TAG_KEY = os.environ.get("READY_TAG_KEY", "vpn-ready-at")
+# After this long without a ready tag the agent is assumed absent and tags stop being re-read.
+READINESS_WINDOW_SECONDS = int(os.environ.get("STATUS_READINESS_WINDOW_SECONDS", "900"))
+# Long-poll ceiling; API Gateway cuts integrations off at 29 seconds.
+MAX_WAIT_SECONDS = float(os.environ.get("STATUS_MAX_WAIT_SECONDS", "20"))
 
-DEFAULT_HEADERS = {
-    "Content-Type": "application/json",
-    "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Headers": "Content-Type,X-Api-Key",
-    "Access-Control-Allow-Methods": "OPTIONS,GET,POST"
-}
+# Long-polling clients send the ETag back as ``since``.
+EXPOSE_HEADERS = {"Access-Control-Expose-Headers": "ETag"}
 
+# Snapshot shared by every request served by this container. Addresses only
+# change across state transitions, so describe_instances runs on transitions
+# (and while a fresh start waits for its ready tag) and each other refresh
+# costs a single describe_instance_status.
+_snapshot = {"payload": None, "fetchedAt": 0.0}
+_details = {"state": None, "data": None}
+_refresh_lock = threading.Lock()
 
-def _response(status: int, data: dict) -> dict:
+
+def _response(status: int, data: dict | None, headers: dict | None = None) -> dict:
+    return response(status, data, {**EXPOSE_HEADERS, **(headers or {})})
+
+
+def _status_is_ok(status: str | None) -> bool:
+    return status in {"ok", "passed"}
+
+
+def _fleet_instances() -> list:
+    return fleet.describe_fleet(ec2, INSTANCE_IDS, FLEET_TAG)
+
+
+def _readiness(instance: dict) -> dict:
+    """Whether the agent tagged the instance as listening since its last start."""
+    tags = {tag["Key"]: tag["Value"] for tag in instance.get("Tags", [])}
+    try:
+        ready_at = int(tags.get(READY_TAG_KEY, ""))
+    except ValueError:
+        ready_at = None
+    launch_time = instance.get("LaunchTime")
+    ready = (
+        instance.get("State", {}).get("Name") == "running"
+        and ready_at is not None
+        and (launch_time is None or ready_at >= int(launch_time.timestamp()))
+    )
     return {
-        "statusCode": status,
-        "headers": DEFAULT_HEADERS,
-        "body": json.dumps(data, ensure_ascii=False)
+        "vpnReady": ready,
+        "readyAt": datetime.fromtimestamp(ready_at, TIMEZONE).isoformat() if ready else None,
+        "launchTime": launch_time
     }
 
 
-def handler(event, context):
-    try:
-        reservations = ec2.describe_instances(InstanceIds=[INSTANCE_ID])["Reservations"]
-        instances = [instance for r in reservations for instance in r.get("Instances", [])]
-        if not instances:
+def _awaiting_ready(data: dict) -> bool:
+    launch_time = data.get("launchTime")
+    if data["vpnReady"] or launch_time is None:
+        return False
+    return (datetime.now(timezone.utc) - launch_time).total_seconds() < READINESS_WINDOW_SECONDS
+
+
+def _describe_instance(state: str) -> dict:
+    cached = _details["data"]
+    if _details["state"] != state or cached is None or (state == "running" and _awaiting_ready(cached)):
+        instance = fleet.describe_instance(ec2, INSTANCE_ID)
+        if instance is None:
             raise RuntimeError("Instance metadata not found")
+        _details["data"] = {
+            "publicIp": instance.get("PublicIpAddress"),
+            "privateIp": instance.get("PrivateIpAddress"),
+            "availabilityZone": instance.get("Placement", {}).get("AvailabilityZone"),
+            **_readiness(instance)
+        }
+        _details["state"] = state
+    return _details["data"]
 
-        instance = instances[0]
-        status_resp = ec2.describe_instance_status(InstanceIds=[INSTANCE_ID], IncludeAllInstances=True)
-        status_details = status_resp.get("InstanceStatuses", [{}])
-        status_entry = status_details[0] if status_details else {}
 
-        system_status = status_entry.get("SystemStatus", {})
-        instance_status = status_entry.get("InstanceStatus", {})
+def _status_payload(instance_id: str, state: str, status_entry: dict, details: dict) -> dict:
+    system_status = status_entry.get("SystemStatus", {})
+    instance_status = status_entry.get("InstanceStatus", {})
+    status_checks_passed = (
+        state == "running"
+        and _status_is_ok(system_status.get("Status"))
+        and _status_is_ok(instance_status.get("Status"))
+    )
+    return {
+        "instanceId": instance_id,
+        "state": state,
+        "publicIp": details["publicIp"],
+        "privateIp": details["privateIp"],
+        "availabilityZone": status_entry.get("AvailabilityZone") or details["availabilityZone"],
+        "systemStatus": system_status.get("Status"),
+        "instanceStatus": instance_status.get("Status"),
+        "statusChecksPassed": status_checks_passed,
+        "vpnReady": state == "running" and details["vpnReady"],
+        "readyAt": details["readyAt"] if state == "running" else None
+    }
 
-        def _status_is_ok(status: str | None) -> bool:
-            return status in {"ok", "passed"}
 
-        status_checks_passed = (
-            instance["State"]["Name"] == "running"
-            and _status_is_ok(system_status.get("Status"))
-            and _status_is_ok(instance_status.get("Status"))
-        )
+def _fetch_status() -> dict:
+    status_resp = ec2.describe_instance_status(InstanceIds=[INSTANCE_ID], IncludeAllInstances=True)
+    status_details = status_resp.get("InstanceStatuses", [])
+    if not status_details:
+        raise RuntimeError("Instance metadata not found")
+    status_entry = status_details[0]
 
-        response_payload = {
-            "instanceId": INSTANCE_ID,
-            "state": instance["State"]["Name"],
+    state = status_entry.get("InstanceState", {}).get("Name")
+    payload = _status_payload(INSTANCE_ID, state, status_entry, _describe_instance(state))
+    payload["timestampLocal"] = datetime.now(TIMEZONE).isoformat()
+    return payload
+
+
+def _fetch_fleet_status() -> dict:
+    # Fleet membership has to be described anyway, so addresses come from the same calls.
+    instances = _fleet_instances()
+    statuses = {}
+    paginator = ec2.get_paginator("describe_instance_status")
+    for chunk in chunks([instance["InstanceId"] for instance in instances], EC2_BATCH_SIZE):
+        for page in paginator.paginate(InstanceIds=chunk, IncludeAllInstances=True):
+            for entry in page.get("InstanceStatuses", []):
+                statuses[entry["InstanceId"]] = entry
+
+    entries = []
+    for instance in instances:
+        details = {
             "publicIp": instance.get("PublicIpAddress"),
             "privateIp": instance.get("PrivateIpAddress"),
             "availabilityZone": instance.get("Placement", {}).get("AvailabilityZone"),
-            "systemStatus": system_status.get("Status"),
-            "instanceStatus": instance_status.get("Status"),
-            "statusChecksPassed": status_checks_passed,
-            "timestampLocal": datetime.now(TIMEZONE).isoformat()
+            **_readiness(instance)
+        }
+        entries.append(_status_payload(
+            instance["InstanceId"],
+            instance["State"]["Name"],
+            statuses.get(instance["InstanceId"], {}),
+            details
+        ))
+
+    return {
+        "fleet": True,
+        "instances": entries,
+        "running": sum(1 for entry in entries if entry["state"] == "running"),
+        "available": sum(1 for entry in entries if entry["statusChecksPassed"]),
+        "ready": sum(1 for entry in entries if entry["vpnReady"]),
+        "timestampLocal": datetime.now(TIMEZONE).isoformat()
+    }
+
+
+def _etag(payload: dict) -> str:
+    # The ETag covers the instance state only, so it survives refreshes that change nothing.
+    stable = {key: value for key, value in payload.items() if key != "timestampLocal"}
+    body = json.dumps(stable, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return 'W/"%s"' % hashlib.sha1(body).hexdigest()[:16]
+
+
+def _is_fresh() -> bool:
+    return _snapshot["payload"] is not None and time.monotonic() - _snapshot["fetchedAt"] < CACHE_TTL_SECONDS
+
+
+def get_snapshot() -> dict:
+    """Return the cached status snapshot, refreshing it once per TTL."""
+    if not _is_fresh():
+        with _refresh_lock:
+            # Callers that waited on the lock reuse the snapshot the holder just took.
+            if not _is_fresh():
+                with emf.timer("SnapshotRefresh"):
+                    _snapshot["payload"] = _fetch_fleet_status() if FLEET_MODE else _fetch_status()
+                _snapshot["fetchedAt"] = time.monotonic()
+    return _snapshot
+
+
+def _select_instance(payload: dict, event: dict) -> dict | None:
+    """Narrow a fleet snapshot to ``?instanceId=`` so single-instance clients keep their shape."""
+    instance_id = (event.get("queryStringParameters") or {}).get("instanceId")
+    if not payload.get("fleet") or not instance_id:
+        return payload
+    for entry in payload["instances"]:
+        if entry["instanceId"] == instance_id:
+            return {**entry, "timestampLocal": payload["timestampLocal"]}
+    return None
+
+
+def _if_none_match(event: dict) -> str | None:
+    headers = event.get("headers") or {}
+    for name, value in headers.items():
+        if name.lower() == "if-none-match":
+            return value
+    return None
+
+
+def _wait_seconds(event: dict, context) -> float:
+    raw = (event.get("queryStringParameters") or {}).get("wait")
+    try:
+        requested = float(raw) if raw else 0.0
+    except ValueError:
+        requested = 0.0
+    wait = min(max(requested, 0.0), MAX_WAIT_SECONDS)
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        # Leave time to build the response before the Lambda timeout.
+        wait = min(wait, context.get_remaining_time_in_millis() / 1000 - 3)
+    return max(wait, 0.0)
+
+
+def _current(event: dict) -> tuple:
+    snapshot = get_snapshot()
+    payload = _select_instance(snapshot["payload"], event)
+    return snapshot, payload, _etag(payload) if payload is not None else None
+
+
+@emf.instrument("check_status")
+def handler(event, context):
+    try:
+        event = event or {}
+        snapshot, payload, etag = _current(event)
+        if payload is None:
+            return _response(404, {"message": "Instance is not part of the fleet."})
+
+        # Long-poll: with ?wait=N, hold the request until the state moves away from
+        # the caller's ETag (?since= or If-None-Match), refreshing once per TTL.
+        known = (event.get("queryStringParameters") or {}).get("since") or _if_none_match(event)
+        waited_from = time.monotonic()
+        deadline = waited_from + _wait_seconds(event, context)
+        while known == etag and time.monotonic() < deadline:
+            time.sleep(max(min(snapshot["fetchedAt"] + CACHE_TTL_SECONDS, deadline) - time.monotonic(), 0.0))
+            snapshot, payload, etag = _current(event)
+        if deadline > waited_from:
+            # Kept apart from Duration so long-polls do not hide the real serving latency.
+            emf.put("LongPollWait", (time.monotonic() - waited_from) * 1000, "Milliseconds")
+
+        age = max(time.monotonic() - snapshot["fetchedAt"], 0.0)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"max-age={max(int(CACHE_TTL_SECONDS - age), 0)}"
         }
+        if _if_none_match(event) == etag:
+            return _response(304, None, headers)
 
-        return _response(200, response_payload)
+        response_payload = {**payload, "cacheAgeSeconds": round(age, 3)}
+        return _response(200, response_payload, headers)
     except Exception as exc:
         LOGGER.exception("Failed to fetch status: %s", exc)
         return _response(500, {
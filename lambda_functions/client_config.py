@@ -0,0 +1,172 @@
+"""Render complete WireGuard client configs for registered peers.
+
+A registration yields a bundle (assigned IP, preshared key, server public key)
+that is stored per client public key, so a client can download its config
+again without another SSM round-trip to the VPN host. Bundles never contain
+the client's private key: clients normally generate their own key pair and
+only send the public half. The rendered config then carries a placeholder
+for the private key. When a caller asks the server to generate the key pair,
+the private key goes into that one response and nowhere else.
+"""
+
+import base64
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+import qr
+from common.aws import LazyClient
+from common.fleet import chunks
+
+LOGGER = logging.getLogger()
+
+FORMATS = ("conf", "svg", "png")
+PRIVATE_KEY_PLACEHOLDER = "<client private key>"
+BUNDLE_FIELDS = ("assignedIp", "presharedKey", "serverPublicKey", "endpoint")
+# DynamoDB BatchWriteItem limit.
+_BATCH_SIZE = 25
+
+_P = 2 ** 255 - 19
+_A24 = 121665
+
+
+def settings_from_env(environ=None) -> Dict[str, Any]:
+    environ = os.environ if environ is None else environ
+    return {
+        "endpoint": environ.get("WG_ENDPOINT", ""),
+        "dns": environ.get("CLIENT_DNS", ""),
+        "allowedIps": environ.get("CLIENT_ALLOWED_IPS", "0.0.0.0/0, ::/0"),
+        "keepalive": int(environ.get("CLIENT_KEEPALIVE_SECONDS", "25")),
+        "table": environ.get("CLIENT_CONFIG_TABLE", ""),
+    }
+
+
+def _x25519(scalar: bytes, point: bytes) -> bytes:
+    """Curve25519 scalar multiplication (RFC 7748, section 5)."""
+    k = int.from_bytes(scalar, "little")
+    k = (k & ~7 & ~(1 << 255)) | (1 << 254)
+    x1 = int.from_bytes(point, "little") & ((1 << 255) - 1)
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    swap = 0
+    for bit in range(254, -1, -1):
+        k_bit = (k >> bit) & 1
+        if swap ^ k_bit:
+            x2, x3, z2, z3 = x3, x2, z3, z2
+        swap = k_bit
+        a, b = x2 + z2, x2 - z2
+        aa, bb = a * a % _P, b * b % _P
+        e = aa - bb
+        da, cb = (x3 - z3) * a % _P, (x3 + z3) * b % _P
+        x3, z3 = (da + cb) ** 2 % _P, x1 * (da - cb) ** 2 % _P
+        x2, z2 = aa * bb % _P, e * (aa + _A24 * e) % _P
+    if swap:
+        x2, z2 = x3, z3
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+def public_key(private_key: str) -> str:
+    """Derive the base64 public key for a base64 private key, like ``wg pubkey``."""
+    point = (9).to_bytes(32, "little")
+    return base64.b64encode(_x25519(base64.b64decode(private_key), point)).decode("ascii")
+
+
+def generate_keypair() -> Tuple[str, str]:
+    """Return ``(private_key, public_key)``, both base64, like ``wg genkey``."""
+    private_key = base64.b64encode(os.urandom(32)).decode("ascii")
+    return private_key, public_key(private_key)
+
+
+def render(bundle: Dict[str, Any], settings: Dict[str, Any], private_key: Optional[str] = None) -> str:
+    """Return the client's wg-quick config for a registration bundle."""
+    lines = [
+        "[Interface]",
+        f"PrivateKey = {private_key or PRIVATE_KEY_PLACEHOLDER}",
+        f"Address = {bundle['assignedIp']}/32",
+    ]
+    if settings.get("dns"):
+        lines.append(f"DNS = {settings['dns']}")
+    lines += ["", "[Peer]", f"PublicKey = {bundle['serverPublicKey']}"]
+    if bundle.get("presharedKey"):
+        lines.append(f"PresharedKey = {bundle['presharedKey']}")
+    lines.append(f"AllowedIPs = {settings['allowedIps']}")
+    # Pooled peers carry their own server's endpoint.
+    endpoint = bundle.get("endpoint") or settings.get("endpoint")
+    if endpoint:
+        lines.append(f"Endpoint = {endpoint}")
+    if settings.get("keepalive"):
+        lines.append(f"PersistentKeepalive = {settings['keepalive']}")
+    return "\n".join(lines) + "\n"
+
+
+def config_fields(bundle: Dict[str, Any], settings: Dict[str, Any], config_format: str,
+                  private_key: Optional[str] = None) -> Dict[str, Any]:
+    """Response fields carrying the config text and, for svg/png, its QR code."""
+    text = render(bundle, settings, private_key)
+    fields = {"config": text, "configComplete": private_key is not None}
+    if config_format == "svg":
+        fields["qr"] = {"format": "svg", "data": qr.to_svg(qr.encode(text))}
+    elif config_format == "png":
+        png = base64.b64encode(qr.to_png(qr.encode(text))).decode("ascii")
+        fields["qr"] = {"format": "png", "data": f"data:image/png;base64,{png}"}
+    return fields
+
+
+class BundleCache:
+    """Registration bundles keyed by client public key (table partition key ``publicKey``)."""
+
+    def __init__(self, table_name: str, client=None):
+        self.table_name = table_name
+        self.client = client or LazyClient("dynamodb")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.table_name)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        item = self.client.get_item(TableName=self.table_name, Key={"publicKey": {"S": key}}).get("Item")
+        if not item:
+            return None
+        return {"publicKey": key, **json.loads(item["bundle"]["S"])}
+
+    def _write(self, requests) -> None:
+        for batch in chunks(list(requests), _BATCH_SIZE):
+            pending = {self.table_name: batch}
+            # Unprocessed items are rare at this volume; one retry keeps the cache best-effort.
+            for _ in range(2):
+                pending = self.client.batch_write_item(RequestItems=pending).get("UnprocessedItems")
+                if not pending:
+                    break
+
+    def put(self, bundles: Iterable[Dict[str, Any]]) -> None:
+        """Store bundles; failures are logged because the cache only saves SSM round-trips."""
+        if not self.enabled:
+            return
+        now = str(int(time.time()))
+        requests = [
+            {"PutRequest": {"Item": {
+                "publicKey": {"S": bundle["publicKey"]},
+                "bundle": {"S": json.dumps({field: bundle.get(field) for field in BUNDLE_FIELDS})},
+                "updatedAt": {"N": now},
+            }}}
+            for bundle in bundles
+            if bundle.get("publicKey") and bundle.get("assignedIp")
+        ]
+        try:
+            self._write(requests)
+        except ClientError as err:
+            LOGGER.warning("Unable to cache client configs: %s", err)
+
+    def delete(self, keys: Iterable[str]) -> None:
+        if not self.enabled:
+            return
+        requests = [{"DeleteRequest": {"Key": {"publicKey": {"S": key}}}} for key in dict.fromkeys(keys) if key]
+        try:
+            self._write(requests)
+        except ClientError as err:
+            LOGGER.warning("Unable to drop cached client configs: %s", err)
@@ -0,0 +1,6 @@
+"""Helpers shared by the control Lambdas, shipped to them as a Lambda layer.
+
+Terraform packages this directory as ``python/common`` in the layer zip, so
+the handlers import it as the top-level ``common`` package. It must stay free
+of third-party dependencies beyond the boto3 bundled with the runtime.
+"""
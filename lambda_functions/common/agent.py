@@ -0,0 +1,56 @@
+"""SSM shell commands that hand one message to the resident WireGuard peer agent.
+
+The command writes ``<token> <base64 JSON>`` to the agent on the loopback port
+and prints its one-line reply. When the agent is not running, does not answer
+in time or replies with ``agentError`` (a stale version, for example), the
+bundled peer manager runs inline with the same message instead.
+"""
+
+import base64
+import json
+import os
+import shlex
+import textwrap
+import zlib
+
+PORT = int(os.environ.get("WG_AGENT_PORT", "51821"))
+TOKEN_PATH = os.environ.get("WG_AGENT_TOKEN_PATH", "/run/wg-peer-agent/token")
+
+
+def encode_script(source: bytes) -> str:
+    """Return the peer manager source compressed and base64-encoded for the inline fallback."""
+    # Compressed so the fallback keeps SSM commands small as the manager grows.
+    return base64.b64encode(zlib.compress(source, 9)).decode("ascii")
+
+
+def command(message: dict, script_b64: str, environment: dict, timeout: int, label: str) -> str:
+    """Return a bash command that sends ``message`` to the agent, falling back to the inline manager.
+
+    ``environment`` is exported for the fallback run only; the agent keeps its
+    own settings and reads per-server values from the message.
+    """
+    encoded_message = base64.b64encode(json.dumps(message).encode("utf-8")).decode("ascii")
+    exports = "".join(f"\n    export {name}={shlex.quote(value)}" for name, value in environment.items())
+    return textwrap.dedent(
+        f"""
+    /bin/bash <<'SCRIPT'
+    set -euo pipefail
+    MESSAGE_B64='{encoded_message}'
+    TOKEN_PATH={shlex.quote(TOKEN_PATH)}
+    if [ -r "$TOKEN_PATH" ] && exec 3<>/dev/tcp/127.0.0.1/{PORT}; then
+      printf '%s %s\\n' "$(cat "$TOKEN_PATH")" "$MESSAGE_B64" >&3
+      if IFS= read -r -t {timeout} reply <&3 && [[ "$reply" != *'"agentError"'* ]]; then
+        printf '%s\\n' "$reply"
+        exit 0
+      fi
+      exec 3<&-
+    fi 2>/dev/null
+    export WG_AGENT_MESSAGE_B64="$MESSAGE_B64"{exports}
+    python3 - <<'PY'
+    import base64, zlib
+    code = zlib.decompress(base64.b64decode('{script_b64}'))
+    exec(compile(code.decode('utf-8'), '{label}', 'exec'), globals(), globals())
+    PY
+    SCRIPT
+    """
+    ).strip()
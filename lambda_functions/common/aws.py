@@ -0,0 +1,62 @@
+"""Lazily created boto3 clients that share one session."""
+
+import threading
+
+import boto3
+from botocore.config import Config
+
+from common import emf
+
+# Fail fast on a stuck connection and keep sockets alive between warm invocations.
+CLIENT_CONFIG = Config(
+    connect_timeout=3,
+    read_timeout=15,
+    retries={"max_attempts": 3, "mode": "standard"},
+    tcp_keepalive=True,
+)
+
+_session = None
+# Sessions are not thread-safe, so client creation is serialized as well.
+_lock = threading.RLock()
+
+
+def session() -> boto3.session.Session:
+    """Return the process-wide session, so service models and credentials load once."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = boto3.session.Session()
+    return _session
+
+
+class LazyClient:
+    """Stands in for a boto3 client and creates it on first use.
+
+    Handlers bind these at module level (``ec2 = LazyClient("ec2")``) so paths
+    that never call AWS, such as a rejected start, skip client creation
+    entirely. The real client is memoized and reused for the lifetime of the
+    container, and its calls are timed by ``common.emf``.
+    """
+
+    def __init__(self, service_name: str, config: Config | None = None):
+        self._service_name = service_name
+        self._config = config or CLIENT_CONFIG
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            with _lock:
+                if self._client is None:
+                    client = session().client(self._service_name, config=self._config)
+                    emf.instrument_client(client, self._service_name)
+                    self._client = client
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __repr__(self) -> str:
+        state = "created" if self._client is not None else "pending"
+        return f"<LazyClient {self._service_name} ({state})>"
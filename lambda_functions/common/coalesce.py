@@ -0,0 +1,196 @@
+"""Coalesce concurrent start/stop requests into one EC2 call per transition.
+
+Ten people pressing Start while the instance is still ``stopped`` would
+otherwise each call ``start_instances`` and each publish a notification. The
+first request instead takes a lease in DynamoDB with a conditional write
+keyed by the scope it acts on (an instance ID or a set of fleet instances).
+The lease records the target action. Until the lease expires, later requests
+for the same action read it back instead of calling EC2. A request for the
+opposite action takes the lease over straight away, so a stop followed by a
+start is never mistaken for a duplicate.
+
+With no table configured, every request proceeds as before.
+"""
+
+import hashlib
+import json
+import os
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from common.aws import LazyClient
+
+# A start or stop settles within about a minute; later requests are new transitions.
+DEFAULT_WINDOW_SECONDS = 90
+IN_PROGRESS = "in-progress"
+DONE = "done"
+# State reported to coalesced callers while the owner has not finished yet.
+TRANSITION_STATES = {"start": "pending", "stop": "stopping"}
+
+
+def scope_key(instance_ids) -> str:
+    """Lease key for the instances an operation acts on."""
+    ids = sorted(set(instance_ids))
+    if len(ids) == 1:
+        return ids[0]
+    return "fleet#" + hashlib.sha1(",".join(ids).encode("utf-8")).hexdigest()[:20]
+
+
+def _plain(item: dict | None) -> dict | None:
+    if not item:
+        return None
+    record = {}
+    for key, value in item.items():
+        if "N" in value:
+            record[key] = int(value["N"])
+        elif key == "result":
+            record[key] = json.loads(value["S"])
+        else:
+            record[key] = value.get("S")
+    return record
+
+
+class Coalescer:
+    """Per-scope leases in the operations table (partition key ``scope``, TTL ``expiresAt``)."""
+
+    def __init__(self, table_name: str, window_seconds: int = DEFAULT_WINDOW_SECONDS, client=None):
+        self.table_name = table_name
+        self.window_seconds = window_seconds
+        self.client = client or LazyClient("dynamodb")
+
+    @classmethod
+    def from_env(cls, environ=None) -> "Coalescer":
+        environ = os.environ if environ is None else environ
+        return cls(
+            environ.get("OPERATIONS_TABLE", ""),
+            int(environ.get("COALESCE_WINDOW_SECONDS", DEFAULT_WINDOW_SECONDS)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.table_name)
+
+    def acquire(self, scope: str, action: str, request_id: str | None = None) -> tuple:
+        """Try to own ``action`` on ``scope``.
+
+        Returns ``(owned, record)``. When ``owned`` is false, ``record`` is the
+        lease of the request that got there first, including its result once
+        it has finished.
+        """
+        request_id = request_id or uuid.uuid4().hex
+        now = int(time.time())
+        item = {
+            "scope": {"S": scope},
+            "action": {"S": action},
+            "status": {"S": IN_PROGRESS},
+            "requestId": {"S": request_id},
+            "startedAt": {"N": str(now)},
+            "expiresAt": {"N": str(now + self.window_seconds)},
+        }
+        if not self.enabled:
+            return True, _plain(item)
+        current = None
+        # A second attempt covers a lease released between our write and our read.
+        for _ in range(2):
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item=item,
+                    ConditionExpression="attribute_not_exists(#scope) OR #action <> :action OR expiresAt < :now",
+                    ExpressionAttributeNames={"#scope": "scope", "#action": "action"},
+                    ExpressionAttributeValues={":action": {"S": action}, ":now": {"N": str(now)}},
+                    ReturnValuesOnConditionCheckFailure="ALL_OLD",
+                )
+                return True, _plain(item)
+            except ClientError as err:
+                if err.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise
+                current = err.response.get("Item") or self.client.get_item(
+                    TableName=self.table_name, Key={"scope": {"S": scope}}, ConsistentRead=True
+                ).get("Item")
+                if current:
+                    break
+        return False, _plain(current)
+
+    def complete(self, lease: dict, result: dict) -> None:
+        """Store the owner's result so coalesced callers can report it."""
+        if not self.enabled:
+            return
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key={"scope": {"S": lease["scope"]}},
+                UpdateExpression="SET #status = :done, #result = :result",
+                ConditionExpression="requestId = :request",
+                ExpressionAttributeNames={"#status": "status", "#result": "result"},
+                ExpressionAttributeValues={
+                    ":done": {"S": DONE},
+                    ":result": {"S": json.dumps(result, ensure_ascii=False, default=str)},
+                    ":request": {"S": lease["requestId"]},
+                },
+            )
+        except ClientError as err:
+            # A newer transition already replaced this lease.
+            if err.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+
+    def release(self, lease: dict) -> None:
+        """Drop a lease whose operation failed, so the next request retries at once."""
+        if not self.enabled:
+            return
+        try:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key={"scope": {"S": lease["scope"]}},
+                ConditionExpression="requestId = :request",
+                ExpressionAttributeValues={":request": {"S": lease["requestId"]}},
+            )
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+
+    def run(self, scope: str, action: str, operation, request_id: str | None = None) -> dict:
+        """Call ``operation()`` unless another request owns this transition.
+
+        Returns the operation's result, or, for a coalesced request, the
+        owner's status from ``summary``.
+        """
+        owned, lease = self.acquire(scope, action, request_id)
+        if not owned:
+            return summary(lease, action)
+        try:
+            result = operation()
+        except Exception:
+            self.release(lease)
+            raise
+        self.complete(lease, result)
+        return result
+
+
+def describe(record: dict | None) -> dict | None:
+    """The in-flight (or just finished) operation as returned to coalesced callers."""
+    if record is None:
+        return None
+    return {
+        "action": record.get("action"),
+        "status": record.get("status"),
+        "requestId": record.get("requestId"),
+        "startedAt": record.get("startedAt"),
+        "result": record.get("result"),
+    }
+
+
+def summary(record: dict | None, action: str) -> dict:
+    """Response fields for a request that joined an operation already under way."""
+    operation = describe(record) or {"action": action, "status": IN_PROGRESS}
+    done = operation["status"] == DONE
+    result = {key: value for key, value in (operation.get("result") or {}).items() if key != "message"}
+    return {
+        "state": TRANSITION_STATES.get(action),
+        **result,
+        "message": f"{action.capitalize()} already {'issued' if done else 'in progress'} by another request.",
+        "coalesced": True,
+        "operation": operation,
+    }
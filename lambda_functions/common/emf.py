@@ -0,0 +1,180 @@
+"""CloudWatch Embedded Metric Format (EMF) instrumentation.
+
+Each invocation prints EMF JSON lines to stdout, and CloudWatch Logs turns
+them into metrics, so recording a metric costs no API call. Wrapping a
+handler with ``instrument`` records its duration, cold starts and faults.
+Clients created through ``common.aws`` report the latency of every AWS call.
+Handlers add their own values with ``put`` or ``timer``. Setting
+``EMF_METRICS_ENABLED=false`` turns all of this into no-ops.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+ENABLED = os.environ.get("EMF_METRICS_ENABLED", "true").lower() == "true"
+NAMESPACE = os.environ.get("EMF_NAMESPACE", "WireGuardVPN/Lambda")
+# EMF accepts at most 100 values per metric in one document.
+MAX_VALUES = 100
+
+_cold = True
+_current = None
+_lock = threading.Lock()
+
+
+class _Invocation:
+    """Values recorded while one handler invocation runs."""
+
+    def __init__(self, function: str, endpoint: str):
+        self.function = function
+        self.endpoint = endpoint
+        self.metrics = {}
+        self.calls = {}
+
+    def put(self, name: str, value: float, unit: str) -> None:
+        with _lock:
+            self.metrics.setdefault(name, (unit, []))[1].append(value)
+
+    def call(self, service: str, operation: str, milliseconds: float, failed: bool) -> None:
+        with _lock:
+            latencies, errors = self.calls.setdefault((service, operation), ([], [0]))
+            latencies.append(milliseconds)
+            errors[0] += int(failed)
+
+
+def _endpoint(event) -> str:
+    if isinstance(event, dict):
+        if event.get("httpMethod"):
+            return f"{event['httpMethod']} {event.get('resource') or event.get('path') or '/'}"
+        if event.get("trigger"):
+            return str(event["trigger"])
+    return "invoke"
+
+
+def _document(dimensions: dict, metrics: dict, properties: dict) -> dict:
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [list(dimensions)],
+                "Metrics": [{"Name": name, "Unit": unit} for name, (unit, _) in metrics.items()],
+            }],
+        },
+        **properties,
+        **dimensions,
+    }
+    for name, (_, values) in metrics.items():
+        values = [round(value, 3) for value in values[:MAX_VALUES]]
+        document[name] = values[0] if len(values) == 1 else values
+    return document
+
+
+def _emit(record: _Invocation, request_id: str | None) -> None:
+    properties = {"requestId": request_id} if request_id else {}
+    lines = [_document({"Function": record.function, "Endpoint": record.endpoint}, record.metrics, properties)]
+    for (service, operation), (latencies, errors) in sorted(record.calls.items()):
+        lines.append(_document(
+            {"Function": record.function, "Service": service, "Operation": operation},
+            {"AwsCallLatency": ("Milliseconds", latencies), "AwsCallErrors": ("Count", errors)},
+            properties,
+        ))
+    for line in lines:
+        print(json.dumps(line, separators=(",", ":")), flush=True)
+
+
+def instrument(function: str):
+    """Decorate a Lambda handler so each invocation emits its metrics when it returns."""
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            global _cold, _current
+            if not ENABLED:
+                return handler(event, context)
+            record = _Invocation(function, _endpoint(event))
+            record.put("ColdStart", int(_cold), "Count")
+            _cold = False
+            _current = record
+            started = time.perf_counter()
+            fault = 1
+            try:
+                result = handler(event, context)
+                status = result.get("statusCode") if isinstance(result, dict) else None
+                fault = int(isinstance(status, int) and status >= 500)
+                return result
+            finally:
+                record.put("Duration", (time.perf_counter() - started) * 1000, "Milliseconds")
+                record.put("Fault", fault, "Count")
+                _current = None
+                _emit(record, getattr(context, "aws_request_id", None))
+        return wrapper
+    return decorate
+
+
+def put(name: str, value: float, unit: str = "Count") -> None:
+    """Record a value for the running invocation; ignored outside an instrumented handler."""
+    record = _current
+    if record is not None:
+        record.put(name, value, unit)
+
+
+@contextlib.contextmanager
+def timer(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        put(name, (time.perf_counter() - started) * 1000, "Milliseconds")
+
+
+def _as_datetime(value) -> datetime | None:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, str) and value:
+        try:
+            return _as_datetime(datetime.fromisoformat(value.replace("Z", "+00:00")))
+        except ValueError:
+            return None
+    return None
+
+
+def put_ssm_timing(requested_at, started_at, finished_at) -> None:
+    """Record how long an SSM command waited for the agent and how long it ran.
+
+    Accepts datetimes or the ISO strings ``get_command_invocation`` returns.
+    Instance and service clocks can disagree slightly, so negative spans
+    are dropped.
+    """
+    requested, started, finished = map(_as_datetime, (requested_at, started_at, finished_at))
+    if requested and started and started >= requested:
+        put("SsmQueueTime", (started - requested).total_seconds() * 1000, "Milliseconds")
+    if started and finished and finished >= started:
+        put("SsmExecutionTime", (finished - started).total_seconds() * 1000, "Milliseconds")
+
+
+def instrument_client(client, service: str) -> None:
+    """Time every call made through ``client``, including retries and paginated pages."""
+    if not ENABLED:
+        return
+
+    def started(model, context, **_):
+        context["emfCall"] = (model.name, time.perf_counter())
+
+    def finished(context, parsed=None, exception=None, **_):
+        call = context.pop("emfCall", None)
+        record = _current
+        if call is None or record is None:
+            return
+        operation, began = call
+        failed = exception is not None or bool(isinstance(parsed, dict) and parsed.get("Error"))
+        record.call(service, operation, (time.perf_counter() - began) * 1000, failed)
+
+    # provide-client-params fires before any handler can short-circuit the
+    # request, and after-call fires for stubbed responses too.
+    client.meta.events.register("provide-client-params.*.*", started)
+    client.meta.events.register("after-call.*.*", finished)
+    client.meta.events.register("after-call-error.*.*", finished)
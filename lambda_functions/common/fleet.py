@@ -0,0 +1,83 @@
+"""Instance selection shared by the single-instance and fleet code paths."""
+
+import json
+import os
+
+# describe_instances, start_instances and stop_instances accept 1000 IDs per call.
+EC2_BATCH_SIZE = 1000
+
+
+def from_env(environ=None) -> tuple:
+    """Return ``(instance_ids, fleet_tag, fleet_mode, instance_id)`` from the Lambda environment.
+
+    ``INSTANCE_ID`` is only required when neither ``INSTANCE_IDS`` nor
+    ``FLEET_TAG`` selects a fleet.
+    """
+    environ = os.environ if environ is None else environ
+    instance_ids = [value.strip() for value in environ.get("INSTANCE_IDS", "").split(",") if value.strip()]
+    fleet_tag = environ.get("FLEET_TAG", "")
+    fleet_mode = bool(instance_ids or fleet_tag)
+    instance_id = environ.get("INSTANCE_ID", "") if fleet_mode else environ["INSTANCE_ID"]
+    return instance_ids, fleet_tag, fleet_mode, instance_id
+
+
+def chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def describe_fleet(ec2, instance_ids: list, fleet_tag: str) -> list:
+    """Describe every fleet instance, batching up to EC2_BATCH_SIZE IDs per call."""
+    paginator = ec2.get_paginator("describe_instances")
+    if fleet_tag:
+        key, _, value = fleet_tag.partition("=")
+        requests = [{
+            "Filters": [
+                {"Name": f"tag:{key}", "Values": [value]},
+                {"Name": "instance-state-name", "Values": ["pending", "running", "stopping", "stopped"]}
+            ],
+            "PaginationConfig": {"PageSize": EC2_BATCH_SIZE}
+        }]
+    else:
+        requests = [{"InstanceIds": chunk} for chunk in chunks(instance_ids, EC2_BATCH_SIZE)]
+
+    instances = []
+    for request in requests:
+        for page in paginator.paginate(**request):
+            for reservation in page.get("Reservations", []):
+                instances.extend(reservation.get("Instances", []))
+    return instances
+
+
+def describe_instance(ec2, instance_id: str) -> dict | None:
+    reservations = ec2.describe_instances(InstanceIds=[instance_id]).get("Reservations", [])
+    instances = [instance for r in reservations for instance in r.get("Instances", [])]
+    return instances[0] if instances else None
+
+
+def current_state(ec2, instance_id: str) -> str:
+    instance = describe_instance(ec2, instance_id)
+    if instance is None:
+        raise RuntimeError("Instance metadata not found")
+    return instance["State"]["Name"]
+
+
+def requested_ids(event: dict) -> set | None:
+    """Optional ``instanceIds`` narrowing the fleet, from the JSON body or a direct invocation.
+
+    Raises ``ValueError`` unless every entry is a non-empty string.
+    """
+    if not isinstance(event, dict):
+        return None
+    requested = event.get("instanceIds")
+    if requested is None and event.get("body"):
+        try:
+            body = json.loads(event["body"])
+        except (TypeError, ValueError):
+            body = {}
+        requested = body.get("instanceIds") if isinstance(body, dict) else None
+    if requested is None or requested == []:
+        return None
+    if not isinstance(requested, list) or not all(isinstance(value, str) and value.strip() for value in requested):
+        raise ValueError("instanceIds must be a list of instance ID strings.")
+    return set(requested)
@@ -0,0 +1,18 @@
+"""API Gateway proxy responses."""
+
+import json
+
+DEFAULT_HEADERS = {
+    "Content-Type": "application/json",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,X-Api-Key",
+    "Access-Control-Allow-Methods": "OPTIONS,GET,POST"
+}
+
+
+def response(status: int, data: dict | None, headers: dict | None = None) -> dict:
+    return {
+        "statusCode": status,
+        "headers": {**DEFAULT_HEADERS, **(headers or {})},
+        "body": json.dumps(data, ensure_ascii=False) if data is not None else ""
+    }
@@ -0,0 +1,80 @@
+"""Audit events handed to the event journal without waiting on SNS or S3.
+
+Handlers call ``record`` once they have issued a start, stop, registration or
+monitor decision. The event is one compact JSON object sent to the
+``JOURNAL_QUEUE_URL`` SQS queue, a single-digit-millisecond call that is made
+with tight timeouts and never fails the request. The ``event_journal`` Lambda
+drains the queue in batches: it appends the events to S3 as JSON Lines and
+sends one SNS digest per batch. Without a queue the event is only logged.
+"""
+
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+
+from botocore.config import Config
+
+from common import emf
+from common.aws import LazyClient
+
+LOGGER = logging.getLogger()
+
+QUEUE_URL = os.environ.get("JOURNAL_QUEUE_URL", "")
+SCHEMA_VERSION = 1
+# One retry at most: a slow queue must not hold up the API response.
+CLIENT_CONFIG = Config(
+    connect_timeout=1,
+    read_timeout=2,
+    retries={"max_attempts": 2, "mode": "standard"},
+    tcp_keepalive=True,
+)
+
+sqs = LazyClient("sqs", CLIENT_CONFIG)
+
+
+def request_details(event) -> dict:
+    """Caller details API Gateway (REST or HTTP API) attaches to a proxy event."""
+    request_context = {}
+    if isinstance(event, dict):
+        request_context = event.get("requestContext", {}) or {}
+
+    identity = request_context.get("identity", {}) or {}
+    http_ctx = request_context.get("http", {}) or {}
+
+    return {
+        "sourceIp": identity.get("sourceIp") or http_ctx.get("sourceIp"),
+        "userAgent": identity.get("userAgent") or http_ctx.get("userAgent"),
+        "requestId": request_context.get("requestId"),
+    }
+
+
+def build(kind: str, event, context, **fields) -> dict:
+    """Return the journal record for ``kind``; fields set to ``None`` are left out."""
+    entry = {
+        "v": SCHEMA_VERSION,
+        "id": uuid.uuid4().hex,
+        "at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "kind": kind,
+        "function": os.environ.get("AWS_LAMBDA_FUNCTION_NAME"),
+        "invocationId": getattr(context, "aws_request_id", None),
+        **request_details(event),
+        **fields,
+    }
+    return {key: value for key, value in entry.items() if value is not None}
+
+
+def record(kind: str, event, context, **fields) -> dict:
+    """Queue one event for the journal and return it. Failures are logged, not raised."""
+    entry = build(kind, event, context, **fields)
+    body = json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str)
+    if not QUEUE_URL:
+        LOGGER.info("Journal event: %s", body)
+        return entry
+    try:
+        sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=body)
+    except Exception as exc:  # pylint: disable=broad-except
+        emf.put("JournalDropped", 1)
+        LOGGER.warning("Unable to queue journal event %s: %s", body, exc)
+    return entry
@@ -0,0 +1,296 @@
+"""Place WireGuard peers on the least-loaded server of a pool.
+
+Each server in ``WG_SERVER_POOL`` runs its own interface with its own slice of
+the client address space. A new key goes to the server with the lowest load
+score, which combines its peer count with its recent tunnel traffic. The
+placement is then recorded, so the same key always returns to the same
+server.
+
+Both live in one DynamoDB table (partition key ``id``):
+
+* ``server#<instanceId>``: ``peers`` and ``trafficMbPerHour``. Peer counts
+  are set from what each server reports after a command and bumped when a
+  key is placed. The traffic monitor records traffic. The primary's row also
+  carries ``adoptedAt`` once the keys it held before the pool are recorded.
+* ``peer#<publicKey>``: the ``instanceId`` the key lives on.
+
+Loads are read with one ``BatchGetItem`` and cached per container for
+``PLACEMENT_CACHE_SECONDS``. Choosing a server is then a scan of the small,
+in-memory pool, not a query to every server.
+
+With no pool configured, every peer stays on ``INSTANCE_ID`` as before.
+"""
+
+import json
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from common.aws import LazyClient
+from common.fleet import chunks
+
+LOGGER = logging.getLogger()
+
+DEFAULT_CACHE_SECONDS = 30
+# Traffic equivalent to one peer when scoring load: a server moving 50 MB/h
+# counts like a server with one more peer.
+DEFAULT_MB_PER_PEER = 50.0
+# DynamoDB BatchGetItem and BatchWriteItem limits.
+_GET_BATCH = 100
+_WRITE_BATCH = 25
+# Unprocessed batch items are retried with a short linear backoff; any still
+# left after the last attempt raise rather than pass as read or written.
+_BATCH_ATTEMPTS = 5
+
+
+def pool_from_env(environ=None) -> list:
+    """Servers from ``WG_SERVER_POOL``, a JSON list of objects with ``instanceId``,
+    ``clientSubnet``, ``serverAddress`` and ``endpoint``."""
+    environ = os.environ if environ is None else environ
+    raw = environ.get("WG_SERVER_POOL", "").strip()
+    if not raw:
+        return []
+    servers = json.loads(raw)
+    for server in servers:
+        missing = {"instanceId", "clientSubnet", "serverAddress"} - set(server)
+        if missing:
+            raise ValueError(f"WG_SERVER_POOL entry lacks {', '.join(sorted(missing))}: {server}")
+    return servers
+
+
+def _server_key(instance_id: str) -> dict:
+    return {"id": {"S": f"server#{instance_id}"}}
+
+
+def _peer_key(public_key: str) -> dict:
+    return {"id": {"S": f"peer#{public_key}"}}
+
+
+class Placement:
+    """Sticky, least-loaded assignment of public keys to pool servers."""
+
+    def __init__(self, servers: list, table_name: str, cache_seconds: float = DEFAULT_CACHE_SECONDS,
+                 mb_per_peer: float = DEFAULT_MB_PER_PEER, client=None):
+        self.servers = {server["instanceId"]: server for server in servers}
+        self.table_name = table_name
+        self.cache_seconds = cache_seconds
+        self.mb_per_peer = mb_per_peer
+        self.client = client or LazyClient("dynamodb")
+        self._loads = None
+        self._loaded_at = 0.0
+        self._adopted = False
+
+    @classmethod
+    def from_env(cls, environ=None) -> "Placement":
+        environ = os.environ if environ is None else environ
+        return cls(
+            pool_from_env(environ),
+            environ.get("PLACEMENT_TABLE", ""),
+            float(environ.get("PLACEMENT_CACHE_SECONDS", DEFAULT_CACHE_SECONDS)),
+            float(environ.get("PLACEMENT_MB_PER_PEER", DEFAULT_MB_PER_PEER)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.table_name) and bool(self.servers)
+
+    @property
+    def primary(self) -> str:
+        """Server that holds keys registered before the pool existed."""
+        return next(iter(self.servers))
+
+    def _batch_get(self, keys: list) -> list:
+        items = []
+        for batch in chunks(keys, _GET_BATCH):
+            pending = {self.table_name: {"Keys": batch}}
+            for attempt in range(_BATCH_ATTEMPTS):
+                if not pending:
+                    break
+                time.sleep(0.05 * attempt)
+                result = self.client.batch_get_item(RequestItems=pending)
+                items.extend(result.get("Responses", {}).get(self.table_name, []))
+                pending = result.get("UnprocessedKeys")
+            if pending:
+                raise RuntimeError(f"{len(pending[self.table_name]['Keys'])} key(s) left unread in {self.table_name}")
+        return items
+
+    def _batch_write(self, requests: list) -> None:
+        for batch in chunks(requests, _WRITE_BATCH):
+            pending = {self.table_name: batch}
+            for attempt in range(_BATCH_ATTEMPTS):
+                if not pending:
+                    break
+                time.sleep(0.05 * attempt)
+                pending = self.client.batch_write_item(RequestItems=pending).get("UnprocessedItems")
+            if pending:
+                raise RuntimeError(f"{len(pending[self.table_name])} item(s) left unwritten in {self.table_name}")
+
+    def loads(self) -> dict:
+        """``{instanceId: {"peers": n, "trafficMbPerHour": x}}``, cached briefly."""
+        if self._loads is None or time.monotonic() - self._loaded_at >= self.cache_seconds:
+            loads = {instance_id: {"peers": 0, "trafficMbPerHour": 0.0} for instance_id in self.servers}
+            for item in self._batch_get([_server_key(instance_id) for instance_id in self.servers]):
+                instance_id = item["id"]["S"].split("#", 1)[1]
+                if instance_id == self.primary and "adoptedAt" in item:
+                    self._adopted = True
+                if instance_id in loads:
+                    loads[instance_id] = {
+                        "peers": int(item.get("peers", {}).get("N", 0)),
+                        "trafficMbPerHour": float(item.get("trafficMbPerHour", {}).get("N", 0)),
+                    }
+            self._loads, self._loaded_at = loads, time.monotonic()
+        return self._loads
+
+    @property
+    def adopted(self) -> bool:
+        """Whether the keys the primary held before the pool have been recorded."""
+        if not self._adopted:
+            self.loads()
+        return self._adopted
+
+    def adopt(self, public_keys: list) -> None:
+        """Record every key the primary holds, so none is placed a second time elsewhere."""
+        keys = [key for key in dict.fromkeys(public_keys) if key]
+        # The keys come from the primary's own inventory, so they live there
+        # whatever an earlier placement says.
+        self._batch_write([
+            {"PutRequest": {"Item": {**_peer_key(key), "instanceId": {"S": self.primary}}}} for key in keys
+        ])
+        self.report(self.primary, len(keys))
+        self._set(self.primary, "adoptedAt", str(int(time.time())))
+        self._adopted = True
+
+    def score(self, load: dict) -> float:
+        return load["peers"] + load["trafficMbPerHour"] / self.mb_per_peer
+
+    def locate(self, public_keys: list) -> dict:
+        """Recorded server per key; keys never placed are absent."""
+        keys = list(dict.fromkeys(public_keys))
+        items = self._batch_get([_peer_key(key) for key in keys])
+        located = {item["id"]["S"].split("#", 1)[1]: item["instanceId"]["S"] for item in items}
+        # A key placed on a server since removed from the pool is placed again.
+        return {key: server for key, server in located.items() if server in self.servers}
+
+    def assign(self, public_keys: list) -> dict:
+        """Group keys by server, placing new ones on the least-loaded server.
+
+        Returns ``{instanceId: [keys]}`` in pool order.
+        """
+        return self.place(public_keys)[0]
+
+    def place(self, public_keys: list) -> tuple:
+        """Like :meth:`assign`, but also return ``{key: instanceId}`` for the keys this call recorded.
+
+        Those are the placements to :meth:`release` if registering them fails.
+        """
+        located = self.locate(public_keys)
+        loads = self.loads()
+        placed = {}
+        for key in dict.fromkeys(public_keys):
+            if key in located:
+                continue
+            instance_id = min(self.servers, key=lambda server: self.score(loads[server]))
+            loads[instance_id]["peers"] += 1
+            placed[key] = instance_id
+        recorded = self._record(placed) if placed else {}
+        located.update(placed)
+
+        groups = {}
+        for key in dict.fromkeys(public_keys):
+            groups.setdefault(located[key], []).append(key)
+        return {instance_id: groups[instance_id] for instance_id in self.servers if instance_id in groups}, recorded
+
+    def _record(self, placed: dict) -> dict:
+        # Requests racing to place the same key must agree on one server, so
+        # each key is written only if no pool server holds it yet.
+        pool = {f":s{index}": {"S": server} for index, server in enumerate(self.servers)}
+        recorded = {}
+        for key, instance_id in placed.items():
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={**_peer_key(key), "instanceId": {"S": instance_id}},
+                    # Placements on servers that left the pool may be replaced.
+                    ConditionExpression=f"attribute_not_exists(id) OR NOT instanceId IN ({', '.join(pool)})",
+                    ExpressionAttributeValues=pool,
+                )
+            except ClientError as err:
+                if err.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise
+                continue
+            recorded[key] = instance_id
+        lost = [key for key in placed if key not in recorded]
+        if lost:
+            # The winners' requests already counted those keys.
+            placed.update(self.locate(lost))
+        self._count(recorded, 1)
+        return recorded
+
+    def release(self, recorded: dict) -> None:
+        """Undo placements from :meth:`place` whose servers never registered the keys."""
+        released = {}
+        for key, instance_id in recorded.items():
+            try:
+                self.client.delete_item(
+                    TableName=self.table_name,
+                    Key=_peer_key(key),
+                    # Leave the row alone if the key has been placed anew since.
+                    ConditionExpression="instanceId = :server",
+                    ExpressionAttributeValues={":server": {"S": instance_id}},
+                )
+            except ClientError as err:
+                if err.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise
+                continue
+            released[key] = instance_id
+            if self._loads is not None and instance_id in self._loads:
+                self._loads[instance_id]["peers"] -= 1
+        self._count(released, -1)
+
+    def _count(self, placements: dict, sign: int) -> None:
+        counts = {}
+        for instance_id in placements.values():
+            counts[instance_id] = counts.get(instance_id, 0) + sign
+        for instance_id, count in counts.items():
+            self.client.update_item(
+                TableName=self.table_name,
+                Key=_server_key(instance_id),
+                UpdateExpression="ADD peers :count",
+                ExpressionAttributeValues={":count": {"N": str(count)}},
+            )
+
+    def route(self, public_keys: list) -> dict:
+        """Group keys by the server they live on, without placing new ones."""
+        located = self.locate(public_keys)
+        groups = {}
+        for key in dict.fromkeys(public_keys):
+            groups.setdefault(located.get(key, self.primary), []).append(key)
+        return groups
+
+    def forget(self, public_keys: list) -> None:
+        """Drop placements of revoked or pruned keys."""
+        self._batch_write([{"DeleteRequest": {"Key": _peer_key(key)}} for key in dict.fromkeys(public_keys) if key])
+
+    def report(self, instance_id: str, peers: int) -> None:
+        """Store the peer count a server reported after running a command."""
+        self._set(instance_id, "peers", str(int(peers)))
+        if self._loads is not None and instance_id in self._loads:
+            self._loads[instance_id]["peers"] = int(peers)
+
+    def record_traffic(self, instance_id: str, mb_per_hour: float) -> None:
+        self._set(instance_id, "trafficMbPerHour", f"{mb_per_hour:.3f}")
+
+    def _set(self, instance_id: str, attribute: str, value: str) -> None:
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key=_server_key(instance_id),
+                UpdateExpression="SET #attribute = :value, updatedAt = :now",
+                ExpressionAttributeNames={"#attribute": attribute},
+                ExpressionAttributeValues={":value": {"N": value}, ":now": {"N": str(int(time.time()))}},
+            )
+        except ClientError as err:
+            # Load figures only steer placement; a missed update is corrected by the next one.
+            LOGGER.warning("Unable to update %s for %s: %s", attribute, instance_id, err)
@@ -0,0 +1,15 @@
+"""Cached time zone lookups."""
+
+import functools
+import os
+from zoneinfo import ZoneInfo
+
+
+@functools.lru_cache(maxsize=None)
+def zone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+
+def local_zone() -> ZoneInfo:
+    """The deployment's ``TIMEZONE`` (UTC when unset)."""
+    return zone(os.environ.get("TIMEZONE", "UTC"))
@@ -0,0 +1,125 @@
+"""Drain the event journal queue into an S3 log and SNS digests.
+
+The control Lambdas queue one compact JSON record per start, stop, peer
+change and monitor decision (see ``common.journal``). SQS hands them to this
+function in batches of up to 100, waiting up to the configured batching
+window. Each batch becomes:
+
+* one gzipped JSON Lines object under
+  ``<JOURNAL_PREFIX>/dt=YYYY-MM-DD/`` in ``JOURNAL_BUCKET``, which Athena
+  queries through the ``events`` table Terraform defines, and
+* at most one SNS message. It lists the batch's events whose kind is in
+  ``JOURNAL_NOTIFY_EVENTS``, so a burst of starts produces one email, not ten.
+
+A failure raises, so SQS redelivers the batch and moves it to the
+dead-letter queue after repeated failures. Delivery is therefore at least
+once; readers deduplicate on the event ``id``.
+"""
+
+import gzip
+import json
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from common import emf
+from common.aws import LazyClient
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+JOURNAL_BUCKET = os.environ.get("JOURNAL_BUCKET", "")
+JOURNAL_PREFIX = os.environ.get("JOURNAL_PREFIX", "events").strip("/")
+NOTIFICATION_TOPIC_ARN = os.environ.get("NOTIFICATION_TOPIC_ARN", "")
+NOTIFY_KINDS = {kind.strip() for kind in os.environ.get("JOURNAL_NOTIFY_EVENTS", "start").split(",") if kind.strip()}
+# Keeps a digest well under the 256 KB SNS message limit.
+DIGEST_MAX_EVENTS = 50
+SUBJECT_MAX_LENGTH = 100
+SUBJECTS = {
+    "start": "VPN start requested",
+    "stop": "VPN stop issued",
+    "register": "WireGuard peer registration",
+    "revoke": "WireGuard peer revocation",
+    "prune": "WireGuard peer prune",
+    "monitor": "VPN idle check",
+}
+
+s3 = LazyClient("s3")
+sns = LazyClient("sns")
+
+
+def _parse(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    events = []
+    for record in records:
+        try:
+            event = json.loads(record.get("body") or "")
+        except json.JSONDecodeError:
+            event = None
+        if not isinstance(event, dict) or "kind" not in event:
+            # Redelivery cannot fix a malformed body, so it is dropped rather than retried.
+            LOGGER.error("Dropping malformed journal message %s: %s", record.get("messageId"), record.get("body"))
+            continue
+        events.append(event)
+    return sorted(events, key=lambda event: event.get("at", ""))
+
+
+def object_key(events: List[Dict[str, Any]], batch_id: str) -> str:
+    """Partition by the day of the batch's first event, as ``dt=YYYY-MM-DD`` for Athena."""
+    first = events[0].get("at") or datetime.now(timezone.utc).isoformat()
+    stamp = first[:19].replace("-", "").replace(":", "")
+    return f"{JOURNAL_PREFIX}/dt={first[:10]}/{stamp}Z-{batch_id}.jsonl.gz"
+
+
+def _append(events: List[Dict[str, Any]], batch_id: str) -> str:
+    lines = "".join(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n" for event in events)
+    key = object_key(events, batch_id)
+    # A redelivered batch keeps its first message ID and overwrites its own object.
+    s3.put_object(
+        Bucket=JOURNAL_BUCKET,
+        Key=key,
+        Body=gzip.compress(lines.encode("utf-8"), mtime=0),
+        ContentType="application/x-ndjson",
+        ContentEncoding="gzip",
+    )
+    return key
+
+
+def digest(events: List[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+    """Build one SNS message for the events worth notifying about, or ``None``."""
+    selected = [event for event in events if event.get("kind") in NOTIFY_KINDS]
+    if not selected:
+        return None
+    counts = Counter(event["kind"] for event in selected)
+    if len(selected) == 1:
+        subject = SUBJECTS.get(selected[0]["kind"], f"VPN {selected[0]['kind']} event")
+    else:
+        subject = "VPN events: " + ", ".join(f"{count} {kind}" for kind, count in counts.most_common())
+    body = {
+        "message": subject,
+        "counts": dict(counts),
+        "events": selected[:DIGEST_MAX_EVENTS],
+    }
+    if len(selected) > DIGEST_MAX_EVENTS:
+        body["omitted"] = len(selected) - DIGEST_MAX_EVENTS
+    return {"Subject": subject[:SUBJECT_MAX_LENGTH], "Message": json.dumps(body, ensure_ascii=False)}
+
+
+@emf.instrument("event_journal")
+def handler(event, context):
+    records = event.get("Records") or []
+    events = _parse(records)
+    if not events:
+        return {"appended": 0, "notified": 0}
+
+    key = _append(events, records[0].get("messageId", "batch")) if JOURNAL_BUCKET else None
+    message = digest(events) if NOTIFICATION_TOPIC_ARN else None
+    if message:
+        sns.publish(TopicArn=NOTIFICATION_TOPIC_ARN, **message)
+    notified = sum(event["kind"] in NOTIFY_KINDS for event in events) if message else 0
+
+    emf.put("JournalEvents", len(events))
+    emf.put("JournalNotified", notified)
+    LOGGER.info("Journaled %d event(s) to %s, notified %d", len(events), key, notified)
+    return {"appended": len(events) if key else 0, "notified": notified, "key": key}
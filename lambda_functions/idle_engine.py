@@ -0,0 +1,180 @@
+"""Idle-detection policy for the auto-stop monitor.
+
+Everything here is pure: the monitor Lambda feeds it the per-period samples it
+fetched from CloudWatch, and ``replay`` feeds it recorded series so policies
+can be compared offline. Samples are dicts with ``timestamp`` (aware
+datetime), ``bytes`` and optionally ``activePeers``.
+"""
+
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, Optional
+
+SMOOTHING_MODES = ("window", "ewma")
+
+
+class IdlePolicy:
+    """When a run of per-period samples counts as idle enough to stop the instance.
+
+    ``window`` (the original rule) stops once the last ``required_points``
+    periods were all idle. ``ewma`` stops once an exponentially smoothed rate
+    drops under the threshold, which reacts sooner after a burst ends. Both
+    apply hysteresis: a period between ``threshold`` and ``resume`` can extend
+    an idle streak but not start one, and any active peer breaks it.
+    ``min_idle_points`` is the streak length needed before stopping, so short
+    periods (60 s detailed monitoring) can stop well before the window ends.
+    """
+
+    def __init__(self, threshold_mb_per_hour: float = 1.0, required_points: int = 6,
+                 period_seconds: int = 900, resume_mb_per_hour: Optional[float] = None,
+                 smoothing: str = "window", ewma_alpha: float = 0.5, min_idle_points: Optional[int] = None,
+                 grace_seconds: int = 0):
+        if smoothing not in SMOOTHING_MODES:
+            raise ValueError(f"Unknown smoothing mode: {smoothing}")
+        self.threshold_mb_per_hour = threshold_mb_per_hour
+        self.required_points = max(1, required_points)
+        self.period_seconds = period_seconds
+        self.resume_mb_per_hour = max(resume_mb_per_hour if resume_mb_per_hour is not None else threshold_mb_per_hour,
+                                      threshold_mb_per_hour)
+        self.smoothing = smoothing
+        self.ewma_alpha = ewma_alpha
+        if min_idle_points is None:
+            min_idle_points = self.required_points if smoothing == "window" else 1
+        self.min_idle_points = max(1, min_idle_points)
+        self.grace_seconds = grace_seconds
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None, required_points: int = 6,
+                 period_seconds: int = 900) -> "IdlePolicy":
+        environ = os.environ if environ is None else environ
+        resume = environ.get("MONITOR_RESUME_MB")
+        min_idle = environ.get("MONITOR_MIN_IDLE_POINTS")
+        return cls(
+            threshold_mb_per_hour=float(environ.get("MONITOR_THRESHOLD_MB", 1)),
+            required_points=required_points,
+            period_seconds=period_seconds,
+            resume_mb_per_hour=float(resume) if resume else None,
+            smoothing=environ.get("MONITOR_SMOOTHING", "window"),
+            ewma_alpha=float(environ.get("MONITOR_EWMA_ALPHA", 0.5)),
+            min_idle_points=int(min_idle) if min_idle else None,
+            grace_seconds=int(environ.get("MONITOR_GRACE_SECONDS", 0)),
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "thresholdMbPerHour": self.threshold_mb_per_hour,
+            "resumeMbPerHour": self.resume_mb_per_hour,
+            "requiredPoints": self.required_points,
+            "smoothing": self.smoothing,
+            "ewmaAlpha": self.ewma_alpha if self.smoothing == "ewma" else None,
+            "minIdlePoints": self.min_idle_points,
+            "graceSeconds": self.grace_seconds,
+        }
+
+
+def to_points(samples: List[Dict[str, Any]], period_seconds: int) -> List[Dict[str, Any]]:
+    """Convert raw samples into the MB and MB/hour evaluation points the API reports."""
+    per_hour_factor = 3600 / period_seconds
+    points = []
+    for sample in sorted(samples, key=lambda item: item["timestamp"]):
+        mb_transferred = sample["bytes"] / (1024 * 1024)
+        point = {
+            "timestamp": sample["timestamp"].isoformat(),
+            "megabytesPeriod": round(mb_transferred, 3),
+            "megabytesPerHour": round(mb_transferred * per_hour_factor, 3),
+        }
+        if sample.get("activePeers") is not None:
+            point["activePeers"] = int(sample["activePeers"])
+        points.append(point)
+    return points
+
+
+def decide(policy: IdlePolicy, points: List[Dict[str, Any]], started_at: Optional[datetime] = None,
+           now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Decide whether the instance should stop, given its most recent evaluation points."""
+    window = points[-policy.required_points:]
+    streak = 0
+    smoothed = None
+    for point in window:
+        rate = point["megabytesPerHour"]
+        if point.get("activePeers") or rate > policy.resume_mb_per_hour:
+            streak = 0
+        elif rate <= policy.threshold_mb_per_hour or streak:
+            streak += 1
+        smoothed = rate if smoothed is None else policy.ewma_alpha * rate + (1 - policy.ewma_alpha) * smoothed
+
+    decision = {
+        "stop": False,
+        "idleStreak": streak,
+        "smoothedMbPerHour": round(smoothed, 3) if smoothed is not None and policy.smoothing == "ewma" else None,
+    }
+    if not window:
+        decision["reason"] = "no data"
+        return decision
+    if started_at is not None and now is not None and (now - started_at).total_seconds() < policy.grace_seconds:
+        decision["reason"] = "within grace period after start"
+        return decision
+
+    if policy.smoothing == "ewma":
+        idle = smoothed <= policy.threshold_mb_per_hour and streak >= policy.min_idle_points
+    else:
+        idle = streak >= policy.min_idle_points
+    decision["stop"] = idle
+    decision["reason"] = "idle" if idle else "active"
+    return decision
+
+
+def replay(policy: IdlePolicy, samples: List[Dict[str, Any]], started_at: Optional[datetime] = None,
+           false_stop_periods: int = 4, activity_mb_per_hour: Optional[float] = None) -> Dict[str, Any]:
+    """Run a recorded series through ``decide`` one period at a time.
+
+    A period is user activity when a peer was active or the rate exceeds
+    ``activity_mb_per_hour`` (the policy threshold by default), so policies
+    with different thresholds can be compared against the same workload. A
+    stop is followed by the instance staying off until the next active
+    period, when it is assumed to be started again (with a fresh grace
+    period). A stop counts as false when activity returns within
+    ``false_stop_periods`` periods. Wasted hours are idle periods spent
+    running; saved hours are periods spent stopped.
+    """
+    if activity_mb_per_hour is None:
+        activity_mb_per_hour = policy.threshold_mb_per_hour
+    points = to_points(samples, policy.period_seconds)
+    ordered = sorted(samples, key=lambda item: item["timestamp"])
+    hours_per_period = policy.period_seconds / 3600
+    running = True
+    stopped_for = 0
+    stops = false_stops = 0
+    saved = wasted = 0.0
+    recent = []
+
+    for sample, point in zip(ordered, points):
+        active = bool(point.get("activePeers")) or point["megabytesPerHour"] > activity_mb_per_hour
+        if not running:
+            if not active:
+                saved += hours_per_period
+                stopped_for += 1
+                continue
+            if stopped_for < false_stop_periods:
+                false_stops += 1
+            running = True
+            started_at = sample["timestamp"]
+            recent = []
+
+        recent.append(point)
+        recent = recent[-policy.required_points:]
+        if not active:
+            wasted += hours_per_period
+        decision = decide(policy, recent, started_at=started_at, now=sample["timestamp"])
+        if decision["stop"]:
+            stops += 1
+            running = False
+            stopped_for = 0
+
+    return {
+        "periods": len(points),
+        "stops": stops,
+        "falseStops": false_stops,
+        "hoursSaved": round(saved, 3),
+        "idleHoursRunning": round(wasted, 3),
+    }
@@ -1,81 +1,519 @@
+import hashlib
 import json
 import logging
 import os
-from collections import defaultdict
+import time
 from datetime import datetime, timedelta, timezone
 from math import ceil
-from zoneinfo import ZoneInfo
+from pathlib import Path
 
-import boto3
+from botocore.exceptions import ClientError
+
+import idle_engine
+from common import agent, coalesce, emf, fleet, journal, tz
+from common.aws import LazyClient
+from common.fleet import EC2_BATCH_SIZE, chunks
+from common.http import response as _response
+from common.placement import Placement
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-INSTANCE_ID = os.environ["INSTANCE_ID"]
-TIMEZONE = ZoneInfo(os.environ.get("TIMEZONE", "UTC"))
+INSTANCE_IDS, FLEET_TAG, FLEET_MODE, INSTANCE_ID = fleet.from_env()
+# GetMetricData accepts 500 queries per request; each instance needs three.
+METRIC_QUERY_LIMIT = 500
+TIMEZONE = tz.local_zone()
 THRESHOLD_MB = float(os.environ.get("MONITOR_THRESHOLD_MB", 1))
 WINDOW_HOURS = float(os.environ.get("MONITOR_WINDOW_HRS", 1.5))
 PERIOD_SECONDS = int(os.environ.get("MONITOR_PERIOD_SECONDS", 900))
 REQUIRED_POINTS = max(1, int(ceil((WINDOW_HOURS * 3600) / PERIOD_SECONDS)))
+# "network" evaluates EC2 NetworkIn/Out; "wireguard" samples tunnel counters on the instance.
+MONITOR_SOURCE = os.environ.get("MONITOR_SOURCE", "network")
+METRIC_NAMESPACE = os.environ.get("MONITOR_METRIC_NAMESPACE", "WireGuardVPN")
+CLIENT_SUBNET = os.environ.get("CLIENT_SUBNET_CIDR", "")
+SERVER_ADDRESS = os.environ.get("SERVER_ADDRESS", "")
+WG_INTERFACE = os.environ.get("WG_INTERFACE", "wg0")
+WG_CONF_PATH = os.environ.get("WG_CONF_PATH", "/etc/wireguard/wg0.conf")
+USAGE_COMMAND_COMMENT = "monitor-usage"
+USAGE_TIMEOUT_SECONDS = 20
+SSM_TARGET_LIMIT = 50
+PUT_METRIC_LIMIT = 1000
+PENDING_STATUSES = {"Pending", "InProgress", "Delayed"}
+# Rolling evaluator state, kept as one S3 object: it outgrows an SSM parameter's
+# 8 KB once a fleet has a few dozen instances or short periods. Leave the
+# bucket unset to query the whole window on every run.
+STATE_BUCKET = os.environ.get("MONITOR_STATE_BUCKET", "")
+STATE_KEY = os.environ.get("MONITOR_STATE_KEY", "monitor/state.json")
+# Periods re-read on each run because CloudWatch datapoints can land a few minutes late.
+LATE_PERIODS = int(os.environ.get("MONITOR_LATE_PERIODS", "2"))
+STATE_VERSION = 1
+HIBERNATE_ON_STOP = os.environ.get("HIBERNATE_ON_STOP", "false").lower() == "true"
+POLICY = idle_engine.IdlePolicy.from_env(required_points=REQUIRED_POINTS, period_seconds=PERIOD_SECONDS)
+_MANAGER_PATH = Path(__file__).with_name("wg_peer_manager.py")
+_PEER_MANAGER_SOURCE = _MANAGER_PATH.read_bytes() if _MANAGER_PATH.exists() else b""
+PEER_MANAGER_VERSION = hashlib.sha256(_PEER_MANAGER_SOURCE).hexdigest()[:16]
+
+cloudwatch = LazyClient("cloudwatch")
+ec2 = LazyClient("ec2")
+ssm = LazyClient("ssm")
+s3 = LazyClient("s3")
+operations = coalesce.Coalescer.from_env()
+placement = Placement.from_env()
+
+
+def _running_instance() -> dict | None:
+    instance = fleet.describe_instance(ec2, INSTANCE_ID)
+    if instance is None or instance["State"]["Name"] != "running":
+        return None
+    return instance
+
+
+def _stop_instances(instance_ids: list) -> bool:
+    """Stop (hibernating when enabled) and report whether hibernation was requested."""
+    if HIBERNATE_ON_STOP:
+        try:
+            ec2.stop_instances(InstanceIds=instance_ids, Hibernate=True)
+            return True
+        except ClientError as err:
+            LOGGER.warning("Hibernate stop rejected, stopping normally: %s", err)
+    ec2.stop_instances(InstanceIds=instance_ids)
+    return False
+
+
+def _stop_once(instance_ids: list, context) -> dict:
+    """Stop through the shared operation lease, so a concurrent API or scheduled stop is not repeated."""
+    def stop() -> dict:
+        hibernated = [_stop_instances(chunk) for chunk in chunks(instance_ids, EC2_BATCH_SIZE)]
+        return {"state": "stopping", "stopped": instance_ids, "hibernate": all(hibernated)}
+
+    return operations.run(coalesce.scope_key(instance_ids), "stop", stop, getattr(context, "aws_request_id", None))
 
-cloudwatch = boto3.client("cloudwatch")
-ec2 = boto3.client("ec2")
 
-DEFAULT_HEADERS = {
-    "Content-Type": "application/json",
-    "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Headers": "Content-Type,X-Api-Key",
-    "Access-Control-Allow-Methods": "OPTIONS,GET,POST"
-}
+def _fleet_instances() -> list:
+    return fleet.describe_fleet(ec2, INSTANCE_IDS, FLEET_TAG)
 
 
-def _response(status: int, data: dict) -> dict:
-    return {
-        "statusCode": status,
-        "headers": DEFAULT_HEADERS,
-        "body": json.dumps(data, ensure_ascii=False)
+def _metric_stat(query_id: str, namespace: str, metric_name: str, instance_id: str,
+                 stat: str, unit: str, return_data: bool) -> dict:
+    query = {
+        "Id": query_id,
+        "MetricStat": {
+            "Metric": {
+                "Namespace": namespace,
+                "MetricName": metric_name,
+                "Dimensions": [{"Name": "InstanceId", "Value": instance_id}]
+            },
+            "Period": PERIOD_SECONDS,
+            "Stat": stat,
+            "Unit": unit
+        },
+        "ReturnData": return_data
     }
+    if return_data:
+        query["Label"] = instance_id
+    return query
+
+
+def _metric_queries(instance_ids: list) -> list:
+    queries = []
+    for index, instance_id in enumerate(instance_ids):
+        if MONITOR_SOURCE == "wireguard":
+            queries.extend([
+                _metric_stat(f"total{index}", METRIC_NAMESPACE, "TunnelBytes", instance_id, "Sum", "Bytes", True),
+                _metric_stat(f"peers{index}", METRIC_NAMESPACE, "ActivePeers", instance_id, "Maximum", "Count", True)
+            ])
+            continue
+        queries.extend([
+            _metric_stat(f"in{index}", "AWS/EC2", "NetworkIn", instance_id, "Sum", "Bytes", False),
+            _metric_stat(f"out{index}", "AWS/EC2", "NetworkOut", instance_id, "Sum", "Bytes", False),
+            {"Id": f"total{index}", "Expression": f"in{index} + out{index}", "Label": instance_id, "ReturnData": True}
+        ])
+    return queries
+
+
+def _collect_fleet_metrics(start: datetime, end: datetime, instance_ids: list) -> tuple:
+    """Return per-instance total bytes and active peer counts per period from batched queries."""
+    totals = {instance_id: {} for instance_id in instance_ids}
+    active = {instance_id: {} for instance_id in instance_ids}
+    for chunk in chunks(instance_ids, METRIC_QUERY_LIMIT // 3):
+        request = {
+            "MetricDataQueries": _metric_queries(chunk),
+            "StartTime": start,
+            "EndTime": end,
+            "ScanBy": "TimestampAscending"
+        }
+        while True:
+            response = cloudwatch.get_metric_data(**request)
+            for result in response.get("MetricDataResults", []):
+                result_id = result.get("Id", "")
+                prefix = result_id.rstrip("0123456789")
+                if prefix not in {"total", "peers"}:
+                    continue
+                target = totals if prefix == "total" else active
+                series = target[chunk[int(result_id[len(prefix):])]]
+                for timestamp, value in zip(result.get("Timestamps", []), result.get("Values", [])):
+                    series[timestamp] = series.get(timestamp, 0.0) + value
+            next_token = response.get("NextToken")
+            if not next_token:
+                break
+            request["NextToken"] = next_token
+    return totals, active
+
+
+def _build_usage_commands() -> list:
+    message = {"op": "usage", "version": PEER_MANAGER_VERSION}
+    environment = {
+        "WG_CONF_PATH": WG_CONF_PATH,
+        "CLIENT_SUBNET": CLIENT_SUBNET,
+        "SERVER_ADDRESS": SERVER_ADDRESS,
+        "WG_INTERFACE": WG_INTERFACE,
+    }
+    script_b64 = agent.encode_script(_PEER_MANAGER_SOURCE)
+    return [agent.command(message, script_b64, environment, USAGE_TIMEOUT_SECONDS, "<monitor_usage>")]
+
 
+def _parse_usage(output: str) -> dict | None:
+    for line in reversed((output or "").strip().splitlines()):
+        try:
+            sample = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(sample, dict) and "activePeers" in sample:
+            return sample
+    return None
 
-def _instance_is_running() -> bool:
-    status = ec2.describe_instances(InstanceIds=[INSTANCE_ID])
-    reservations = status.get("Reservations", [])
-    instances = [instance for r in reservations for instance in r.get("Instances", [])]
-    if not instances:
-        return False
-    return instances[0]["State"]["Name"] == "running"
+
+def _sample_wireguard(instance_ids: list) -> dict:
+    """Collect tunnel usage from every instance with one SSM command per 50 targets."""
+    commands = _build_usage_commands()
+    pending = set()
+    for chunk in chunks(instance_ids, SSM_TARGET_LIMIT):
+        command = ssm.send_command(
+            InstanceIds=chunk,
+            DocumentName="AWS-RunShellScript",
+            Parameters={"commands": commands},
+            TimeoutSeconds=60,
+            Comment=USAGE_COMMAND_COMMENT
+        )
+        pending.add(command["Command"]["CommandId"])
+
+    samples = {}
+    deadline = time.monotonic() + USAGE_TIMEOUT_SECONDS
+    delay = 0.25
+    polls = 0
+    while pending:
+        polls += 1
+        for command_id in sorted(pending):
+            invocations = []
+            paginator = ssm.get_paginator("list_command_invocations")
+            for page in paginator.paginate(CommandId=command_id, Details=True):
+                invocations.extend(page.get("CommandInvocations", []))
+            if not invocations or any(item.get("Status") in PENDING_STATUSES for item in invocations):
+                continue
+            pending.discard(command_id)
+            for item in invocations:
+                for plugin in item.get("CommandPlugins", []):
+                    emf.put_ssm_timing(item.get("RequestedDateTime"), plugin.get("ResponseStartDateTime"),
+                                       plugin.get("ResponseFinishDateTime"))
+                output = "".join(plugin.get("Output", "") for plugin in item.get("CommandPlugins", []))
+                sample = _parse_usage(output) if item.get("Status") == "Success" else None
+                if sample is None:
+                    LOGGER.warning("No usage sample from %s: %s", item.get("InstanceId"), item.get("Status"))
+                    continue
+                samples[item["InstanceId"]] = sample
+        if pending:
+            if time.monotonic() + delay > deadline:
+                LOGGER.warning("Usage sampling timed out for commands %s", sorted(pending))
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+    emf.put("SsmPollCount", polls)
+    return samples
+
+
+def _first_handshakes(samples: dict, launched: dict) -> dict:
+    """Seconds from each instance's start to its first handshake, for handshakes new since the last sample.
+
+    The agent records the first handshake after every boot or hibernation
+    resume; EC2 ``LaunchTime`` marks when the start request was accepted.
+    """
+    measured = {}
+    for instance_id, sample in samples.items():
+        readiness = sample.get("readiness") or {}
+        first = readiness.get("firstHandshakeAt")
+        launch_time = launched.get(instance_id)
+        if first is None or launch_time is None or first < launch_time.timestamp():
+            continue
+        interval = sample.get("intervalSeconds")
+        if interval is not None and first <= sample["sampledAt"] - interval:
+            continue
+        measured[instance_id] = {
+            "wake": readiness.get("wake"),
+            "firstHandshakeAt": first,
+            "seconds": round(first - launch_time.timestamp(), 3)
+        }
+    return measured
+
+
+def _publish_usage(samples: dict, first_handshakes: dict | None = None) -> None:
+    """Publish aggregate tunnel counters for every sampled instance in one PutMetricData batch."""
+    metric_data = []
+    for instance_id, sample in samples.items():
+        timestamp = datetime.fromtimestamp(sample["sampledAt"], timezone.utc)
+        dimensions = [{"Name": "InstanceId", "Value": instance_id}]
+        metric_data.extend([
+            {
+                "MetricName": "TunnelBytes",
+                "Dimensions": dimensions,
+                "Timestamp": timestamp,
+                "Value": float(sample.get("rxBytes", 0) + sample.get("txBytes", 0)),
+                "Unit": "Bytes"
+            },
+            {
+                "MetricName": "ActivePeers",
+                "Dimensions": dimensions,
+                "Timestamp": timestamp,
+                "Value": float(sample.get("activePeers", 0)),
+                "Unit": "Count"
+            }
+        ])
+    for instance_id, measured in (first_handshakes or {}).items():
+        metric_data.append({
+            "MetricName": "TimeToFirstHandshake",
+            "Dimensions": [{"Name": "InstanceId", "Value": instance_id}, {"Name": "Wake", "Value": measured["wake"] or "boot"}],
+            "Timestamp": datetime.fromtimestamp(measured["firstHandshakeAt"], timezone.utc),
+            "Value": float(measured["seconds"]),
+            "Unit": "Seconds"
+        })
+    for chunk in chunks(metric_data, PUT_METRIC_LIMIT):
+        cloudwatch.put_metric_data(Namespace=METRIC_NAMESPACE, MetricData=chunk)
+
+
+def _refresh_usage(instance_ids: list, launched: dict | None = None) -> dict:
+    """Sample and publish tunnel usage; returns the time-to-first-handshake measured this run."""
+    if MONITOR_SOURCE != "wireguard":
+        return {}
+    try:
+        samples = _sample_wireguard(instance_ids)
+        first_handshakes = _first_handshakes(samples, launched or {})
+        _publish_usage(samples, first_handshakes)
+        LOGGER.info("Tunnel usage samples: %s", samples)
+        if first_handshakes:
+            LOGGER.info("Time to first handshake: %s", first_handshakes)
+        return first_handshakes
+    except Exception as exc:  # pylint: disable=broad-except
+        # Fall back to the history already in CloudWatch.
+        LOGGER.exception("Failed to sample tunnel usage: %s", exc)
+        return {}
 
 
 def _collect_metrics(start: datetime, end: datetime) -> dict:
-    totals = defaultdict(float)
-    for metric_name in ("NetworkIn", "NetworkOut"):
-        response = cloudwatch.get_metric_statistics(
-            Namespace="AWS/EC2",
-            MetricName=metric_name,
-            Dimensions=[{"Name": "InstanceId", "Value": INSTANCE_ID}],
-            StartTime=start,
-            EndTime=end,
-            Period=PERIOD_SECONDS,
-            Statistics=["Sum"],
-            Unit="Bytes"
+    return _collect_fleet_metrics(start, end, [INSTANCE_ID])[0][INSTANCE_ID]
+
+
+def _evaluate(metrics: dict, active_peers: dict | None = None, started_at: datetime | None = None) -> tuple:
+    """Convert per-period byte totals into MB/hour points and run the idle policy over them.
+
+    With tunnel metrics, a period only counts as idle when no peer was active too.
+    ``started_at`` (the instance launch time) applies the policy's grace period.
+    """
+    samples = []
+    for timestamp, total_bytes in metrics.items():
+        sample = {"timestamp": timestamp, "bytes": total_bytes}
+        if active_peers is not None:
+            sample["activePeers"] = active_peers.get(timestamp, 0)
+        samples.append(sample)
+    evaluation = idle_engine.to_points(samples, PERIOD_SECONDS)
+    decision = idle_engine.decide(POLICY, evaluation, started_at=started_at, now=datetime.now(timezone.utc))
+    return evaluation, decision
+
+
+def _load_state() -> dict:
+    """Stored ring buffers per instance; empty (a full-window query) when none can be read."""
+    try:
+        raw = s3.get_object(Bucket=STATE_BUCKET, Key=STATE_KEY)["Body"].read()
+    except ClientError as err:
+        if err.response.get("Error", {}).get("Code") != "NoSuchKey":
+            LOGGER.warning("Failed to load monitor state, querying the whole window: %s", err)
+        return {}
+    try:
+        state = json.loads(raw)
+    except json.JSONDecodeError:
+        return {}
+    # Points are only comparable under the same period and metric source.
+    if (state.get("v"), state.get("period"), state.get("source")) != (STATE_VERSION, PERIOD_SECONDS, MONITOR_SOURCE):
+        return {}
+    return state.get("instances") or {}
+
+
+def _save_state(instances: dict) -> None:
+    value = json.dumps({
+        "v": STATE_VERSION,
+        "period": PERIOD_SECONDS,
+        "source": MONITOR_SOURCE,
+        "instances": instances
+    }, separators=(",", ":"))
+    try:
+        s3.put_object(Bucket=STATE_BUCKET, Key=STATE_KEY, Body=value.encode("utf-8"), ContentType="application/json")
+    except ClientError as err:
+        # The next run re-reads from the last saved high-water mark; the decision stands.
+        emf.put("MonitorStateSaveFailed", 1)
+        LOGGER.warning("Failed to save monitor state: %s", err)
+
+
+def _decode_series(entry: dict) -> tuple:
+    """Expand a stored ring buffer ({"t0", "bytes", "peers"}) into timestamp-keyed series."""
+    totals, active = {}, {}
+    start = entry.get("t0", 0)
+    for index, value in enumerate(entry.get("bytes", [])):
+        if value is not None:
+            totals[datetime.fromtimestamp(start + index * PERIOD_SECONDS, timezone.utc)] = value
+    for index, value in enumerate(entry.get("peers", [])):
+        if value is not None:
+            active[datetime.fromtimestamp(start + index * PERIOD_SECONDS, timezone.utc)] = value
+    return totals, active
+
+
+def _encode_series(totals: dict, active: dict, window_start: int, high_water: int) -> dict:
+    slots = range(window_start, high_water, PERIOD_SECONDS)
+    keys = [datetime.fromtimestamp(slot, timezone.utc) for slot in slots]
+    entry = {"hwm": high_water, "t0": window_start, "bytes": [totals.get(key) for key in keys]}
+    if active:
+        entry["peers"] = [active.get(key) for key in keys]
+    return entry
+
+
+def _collect_incremental(instance_ids: list) -> tuple:
+    """Fetch only the periods completed since the last run and merge them into the stored buffer."""
+    high_water = int(time.time()) // PERIOD_SECONDS * PERIOD_SECONDS
+    window_start = high_water - REQUIRED_POINTS * PERIOD_SECONDS
+    state = _load_state()
+
+    groups = {}
+    for instance_id in instance_ids:
+        previous = (state.get(instance_id) or {}).get("hwm")
+        start = window_start if previous is None else max(window_start, previous - LATE_PERIODS * PERIOD_SECONDS)
+        groups.setdefault(start, []).append(instance_id)
+
+    fetched_totals, fetched_active = {}, {}
+    for start, group in groups.items():
+        totals, active = _collect_fleet_metrics(
+            datetime.fromtimestamp(start, timezone.utc),
+            datetime.fromtimestamp(high_water, timezone.utc),
+            group
         )
-        for datapoint in response.get("Datapoints", []):
-            totals[datapoint["Timestamp"]] += datapoint["Sum"]
-    return totals
+        fetched_totals.update(totals)
+        fetched_active.update(active)
+
+    merged_totals, merged_active, new_state = {}, {}, {}
+    window_floor = datetime.fromtimestamp(window_start, timezone.utc)
+    for instance_id in instance_ids:
+        totals, active = _decode_series(state.get(instance_id) or {})
+        totals.update(fetched_totals[instance_id])
+        active.update(fetched_active[instance_id])
+        merged_totals[instance_id] = {key: value for key, value in totals.items() if key >= window_floor}
+        merged_active[instance_id] = {key: value for key, value in active.items() if key >= window_floor}
+        new_state[instance_id] = _encode_series(merged_totals[instance_id], merged_active[instance_id], window_start, high_water)
+        LOGGER.info("New periods for %s: %s", instance_id, {key.isoformat(): value for key, value in sorted(fetched_totals[instance_id].items())})
+
+    # Instances that stopped drop out of the state, which keeps the object small.
+    _save_state(new_state)
+    return merged_totals, merged_active
+
+
+def _collect_window(instance_ids: list) -> tuple:
+    if STATE_BUCKET:
+        return _collect_incremental(instance_ids)
+    end_time = datetime.now(timezone.utc)
+    start_time = end_time - timedelta(hours=WINDOW_HOURS)
+    return _collect_fleet_metrics(start_time, end_time, instance_ids)
 
 
+def _record_load(metrics: dict) -> None:
+    """Feed each pool server's recent traffic into peer placement."""
+    if not placement.enabled:
+        return
+    for instance_id, totals in metrics.items():
+        if instance_id in placement.servers and totals:
+            hours = len(totals) * PERIOD_SECONDS / 3600
+            placement.record_traffic(instance_id, sum(totals.values()) / (1024 * 1024) / hours)
+
+
+def _monitor_fleet(event=None, context=None) -> dict:
+    launched = {
+        instance["InstanceId"]: instance.get("LaunchTime")
+        for instance in _fleet_instances() if instance["State"]["Name"] == "running"
+    }
+    running = list(launched)
+    if not running:
+        LOGGER.info("No fleet instance running. Skipping traffic evaluation.")
+        return _response(200, {
+            "message": "No fleet instance is in a running state. No action taken.",
+            "timestampLocal": datetime.now(TIMEZONE).isoformat()
+        })
+
+    first_handshakes = _refresh_usage(running, launched)
+    metrics, active = _collect_window(running)
+    _record_load(metrics)
+    tunnel = MONITOR_SOURCE == "wireguard"
+
+    results = []
+    to_stop = []
+    for instance_id in running:
+        if not metrics[instance_id]:
+            results.append({"instanceId": instance_id, "action": "skipped", "reason": "no metrics"})
+            continue
+        evaluation, decision = _evaluate(metrics[instance_id], active[instance_id] if tunnel else None, launched[instance_id])
+        if decision["stop"]:
+            to_stop.append(instance_id)
+        results.append({
+            "instanceId": instance_id,
+            "action": "stop" if decision["stop"] else "keep",
+            "decision": decision,
+            "evaluation": evaluation
+        })
+
+    LOGGER.info("Fleet decisions: %s", {item["instanceId"]: item["action"] for item in results})
+    emf.put("InstancesEvaluated", len(running))
+    emf.put("InstancesStopped", len(to_stop))
+    stop = _stop_once(to_stop, context) if to_stop else {}
+    journal.record("monitor", event, context, instanceIds=running, stopped=to_stop, source=MONITOR_SOURCE,
+                   decisions={item["instanceId"]: item["action"] for item in results})
+
+    return _response(200, {
+        "message": f"Stop command issued for {len(to_stop)} of {len(running)} running instance(s).",
+        "stopped": to_stop,
+        "hibernate": bool(stop.get("hibernate")),
+        "coalesced": bool(stop.get("coalesced")),
+        "firstHandshakes": first_handshakes,
+        "instances": results,
+        "source": MONITOR_SOURCE,
+        "thresholdMbPerHour": THRESHOLD_MB,
+        "windowHours": WINDOW_HOURS,
+        "requiredPoints": REQUIRED_POINTS,
+        "policy": POLICY.describe(),
+        "timestampLocal": datetime.now(TIMEZONE).isoformat()
+    })
+
+
+@emf.instrument("monitor_traffic")
 def handler(event, context):
     try:
-        if not _instance_is_running():
+        if FLEET_MODE:
+            return _monitor_fleet(event, context)
+
+        instance = _running_instance()
+        if instance is None:
             LOGGER.info("Instance not running. Skipping traffic evaluation.")
             return _response(200, {
                 "message": "Instance is not in a running state. No action taken.",
                 "timestampLocal": datetime.now(TIMEZONE).isoformat()
             })
 
-        end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(hours=WINDOW_HOURS)
-        metrics = _collect_metrics(start_time, end_time)
+        first_handshake = _refresh_usage([INSTANCE_ID], {INSTANCE_ID: instance.get("LaunchTime")}).get(INSTANCE_ID)
+        metrics, active = _collect_window([INSTANCE_ID])
+        metrics = metrics[INSTANCE_ID]
+        active_peers = active[INSTANCE_ID] if MONITOR_SOURCE == "wireguard" else None
 
         if not metrics:
             LOGGER.info("No traffic metrics available in window. Skipping auto-stop.")
@@ -84,34 +522,28 @@ def handler(event, context):
                 "timestampLocal": datetime.now(TIMEZONE).isoformat()
             })
 
-        sorted_points = sorted(metrics.items(), key=lambda item: item[0])
-        evaluation = []
-        per_hour_factor = 3600 / PERIOD_SECONDS
-        for timestamp, total_bytes in sorted_points:
-            mb_transferred = total_bytes / (1024 * 1024)
-            mb_per_hour = mb_transferred * per_hour_factor
-            evaluation.append({
-                "timestamp": timestamp.isoformat(),
-                "megabytesPeriod": round(mb_transferred, 3),
-                "megabytesPerHour": round(mb_per_hour, 3)
-            })
-
-        low_utilization = [item for item in evaluation if item["megabytesPerHour"] <= THRESHOLD_MB]
-        valid_points = evaluation[-REQUIRED_POINTS:]
-        should_stop = len(valid_points) >= REQUIRED_POINTS and all(item["megabytesPerHour"] <= THRESHOLD_MB for item in valid_points)
-
-        LOGGER.info("Evaluation results: %s", evaluation)
-        LOGGER.info("Low utilization periods: %s", low_utilization)
+        evaluation, decision = _evaluate(metrics, active_peers, instance.get("LaunchTime"))
+        LOGGER.info("Evaluated %d period(s): %s, latest %s", len(evaluation), decision, evaluation[-1])
+        emf.put("InstancesEvaluated", 1)
+        emf.put("InstancesStopped", int(decision["stop"]))
+        journal.record("monitor", event, context, instanceIds=[INSTANCE_ID], source=MONITOR_SOURCE,
+                       action="stop" if decision["stop"] else "keep", decision=decision)
 
-        if should_stop:
+        if decision["stop"]:
             LOGGER.info("Threshold satisfied. Issuing stop command.")
-            ec2.stop_instances(InstanceIds=[INSTANCE_ID])
+            stop = _stop_once([INSTANCE_ID], context)
             return _response(200, {
                 "message": "Traffic remained below threshold. Stop command issued.",
+                "hibernate": bool(stop.get("hibernate")),
+                "coalesced": bool(stop.get("coalesced")),
                 "evaluation": evaluation,
                 "thresholdMbPerHour": THRESHOLD_MB,
                 "windowHours": WINDOW_HOURS,
                 "requiredPoints": REQUIRED_POINTS,
+                "decision": decision,
+                "policy": POLICY.describe(),
+                "firstHandshake": first_handshake,
+                "source": MONITOR_SOURCE,
                 "timestampLocal": datetime.now(TIMEZONE).isoformat()
             })
 
@@ -121,6 +553,10 @@ def handler(event, context):
             "thresholdMbPerHour": THRESHOLD_MB,
             "windowHours": WINDOW_HOURS,
             "requiredPoints": REQUIRED_POINTS,
+            "decision": decision,
+            "policy": POLICY.describe(),
+            "firstHandshake": first_handshake,
+            "source": MONITOR_SOURCE,
             "timestampLocal": datetime.now(TIMEZONE).isoformat()
         })
     except Exception as exc:
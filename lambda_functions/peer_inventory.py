@@ -0,0 +1,200 @@
+"""List registered WireGuard peers a page at a time.
+
+The peer manager's ``inventory`` op joins one ``wg show <if> dump`` pass with
+its peer index and prints every live peer as a compact row, sorted by public
+key. SSM truncates inline command output at 24,000 characters, so that
+command writes its output to S3. The parsed snapshot is then kept in S3
+under ``snapshots/<instanceId>.json`` and in memory until it is
+``PEERS_CACHE_TTL_SECONDS`` old. Paging through thousands of peers therefore
+costs one SSM command per server per TTL, not one per request.
+
+Pages use the last public key returned as their cursor, so page boundaries
+stay put when a refreshed snapshot adds or drops peers.
+"""
+
+import base64
+import binascii
+import heapq
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from common.aws import LazyClient
+
+LOGGER = logging.getLogger()
+
+# Must match wg_peer_manager.INVENTORY_FIELDS.
+ROW_FIELDS = ("publicKey", "assignedIp", "latestHandshake", "rxBytes", "txBytes", "registeredAt")
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+MAX_ACTIVE_MINUTES = 525600
+SNAPSHOT_PREFIX = "snapshots"
+COMMAND_PREFIX = "commands"
+
+
+def settings_from_env(environ=None) -> Dict[str, Any]:
+    environ = os.environ if environ is None else environ
+    return {
+        "bucket": environ.get("PEERS_SNAPSHOT_BUCKET", ""),
+        "ttl": float(environ.get("PEERS_CACHE_TTL_SECONDS", "30")),
+    }
+
+
+def encode_cursor(public_key: str) -> str:
+    return base64.urlsafe_b64encode(public_key.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        public_key = base64.b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError("cursor appears invalid.") from exc
+    if not public_key:
+        raise ValueError("cursor appears invalid.")
+    return public_key
+
+
+def parse_query(query: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Validate ``limit``, ``cursor``, ``activeWithinMinutes`` and ``instanceId``."""
+    params = {"limit": DEFAULT_LIMIT, "after": None, "activeWithinMinutes": None,
+              "instanceId": (query.get("instanceId") or "").strip() or None}
+    raw_limit = query.get("limit")
+    if raw_limit not in (None, ""):
+        if not str(raw_limit).isdigit() or not 1 <= int(raw_limit) <= MAX_LIMIT:
+            return None, f"limit must be between 1 and {MAX_LIMIT}."
+        params["limit"] = int(raw_limit)
+    if query.get("cursor"):
+        try:
+            params["after"] = decode_cursor(query["cursor"])
+        except ValueError as exc:
+            return None, str(exc)
+    raw_active = query.get("activeWithinMinutes")
+    if raw_active not in (None, ""):
+        if not str(raw_active).isdigit() or not 1 <= int(raw_active) <= MAX_ACTIVE_MINUTES:
+            return None, f"activeWithinMinutes must be between 1 and {MAX_ACTIVE_MINUTES}."
+        params["activeWithinMinutes"] = int(raw_active)
+    return params, None
+
+
+def parse_snapshot(output: str) -> Dict[str, Any]:
+    """Parse the inventory op's JSON line; the peer manager prints nothing after it."""
+    if not output.strip():
+        raise ValueError("Empty inventory output")
+    snapshot = json.loads(output.strip().splitlines()[-1])
+    if not isinstance(snapshot, dict) or "peers" not in snapshot:
+        raise ValueError(snapshot.get("error") if isinstance(snapshot, dict) else "Malformed inventory output")
+    if snapshot.get("fields") != list(ROW_FIELDS):
+        raise ValueError(f"Unexpected inventory fields: {snapshot.get('fields')}")
+    return snapshot
+
+
+def _iso(epoch: Optional[int]) -> Optional[str]:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat() if epoch else None
+
+
+def to_api(row: List[Any], instance_id: Optional[str] = None) -> Dict[str, Any]:
+    peer = dict(zip(ROW_FIELDS, row))
+    peer["latestHandshake"] = _iso(peer["latestHandshake"])
+    peer["registeredAt"] = _iso(peer["registeredAt"])
+    if instance_id:
+        peer["instanceId"] = instance_id
+    return peer
+
+
+def _keyed(instance_id: str, snapshot: Dict[str, Any]):
+    return ((row[0], instance_id, row) for row in snapshot["peers"])
+
+
+def select(snapshots: List[Tuple[str, Dict[str, Any]]], params: Dict[str, Any], now: float,
+           tag_servers: bool = False) -> Dict[str, Any]:
+    """Merge per-server snapshots by public key and cut one filtered page from them.
+
+    Returns the page, the cursor of the next one (``None`` on the last page)
+    and how many peers match the filters across all pages.
+    """
+    active_since = now - params["activeWithinMinutes"] * 60 if params["activeWithinMinutes"] else None
+    after = params["after"]
+    streams = [_keyed(instance_id, snapshot) for instance_id, snapshot in snapshots]
+    page = []
+    matched = 0
+    for public_key, instance_id, row in heapq.merge(*streams):
+        if active_since is not None and (row[2] or 0) < active_since:
+            continue
+        matched += 1
+        if (after is None or public_key > after) and len(page) <= params["limit"]:
+            page.append(to_api(row, instance_id if tag_servers else None))
+    next_cursor = None
+    if len(page) > params["limit"]:
+        page.pop()
+        next_cursor = encode_cursor(page[-1]["publicKey"])
+    return {"peers": page, "nextCursor": next_cursor, "matched": matched}
+
+
+def output_key(prefix: str, command_id: str, instance_id: str) -> str:
+    """Where SSM writes ``AWS-RunShellScript`` stdout when given an output bucket."""
+    return f"{prefix}/{command_id}/{instance_id}/awsrunShellScript/0.awsrunShellScript/stdout"
+
+
+class SnapshotCache:
+    """Inventory snapshots per server, in memory and shared through S3."""
+
+    def __init__(self, bucket: str, ttl: float, client=None):
+        self.bucket = bucket
+        self.ttl = ttl
+        self.client = client or LazyClient("s3")
+        self._memory = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.bucket)
+
+    def _fresh(self, snapshot: Optional[Dict[str, Any]]) -> bool:
+        return snapshot is not None and time.time() - snapshot.get("generatedAt", 0) < self.ttl
+
+    def get(self, instance_id: str) -> Optional[Dict[str, Any]]:
+        """Return a snapshot younger than the TTL, or ``None`` if it must be refreshed."""
+        snapshot = self._memory.get(instance_id)
+        if self._fresh(snapshot):
+            return snapshot
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=f"{SNAPSHOT_PREFIX}/{instance_id}.json")["Body"]
+            snapshot = json.loads(body.read())
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code") not in {"NoSuchKey", "404"}:
+                LOGGER.warning("Unable to read peer snapshot for %s: %s", instance_id, err)
+            return None
+        if not self._fresh(snapshot):
+            return None
+        self._memory[instance_id] = snapshot
+        return snapshot
+
+    def command_output(self, command_id: str, instance_id: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        try:
+            body = self.client.get_object(
+                Bucket=self.bucket, Key=output_key(COMMAND_PREFIX, command_id, instance_id))["Body"]
+        except ClientError as err:
+            LOGGER.warning("Unable to read inventory output of %s: %s", command_id, err)
+            return None
+        return body.read().decode("utf-8")
+
+    def put(self, instance_id: str, snapshot: Dict[str, Any]) -> None:
+        self._memory[instance_id] = snapshot
+        if not self.enabled:
+            return
+        try:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=f"{SNAPSHOT_PREFIX}/{instance_id}.json",
+                Body=json.dumps(snapshot, separators=(",", ":")).encode("utf-8"),
+                ContentType="application/json",
+            )
+        except ClientError as err:
+            # Other containers simply take their own snapshot.
+            LOGGER.warning("Unable to share peer snapshot for %s: %s", instance_id, err)
@@ -0,0 +1,335 @@
+"""Minimal QR Code encoder (ISO/IEC 18004, byte mode) with SVG and PNG output.
+
+Pure Python so the register Lambda can render client configs as QR codes
+without packaging a native imaging library. ``encode`` picks the smallest
+version (1-40) that fits the payload at the requested error-correction level
+and the mask with the lowest penalty score, as the standard prescribes.
+"""
+
+import struct
+import zlib
+from typing import List, Optional, Union
+
+# Error-correction level -> (table row, format bits).
+ECC_LEVELS = {"L": (0, 1), "M": (1, 0), "Q": (2, 3), "H": (3, 2)}
+
+# Per version (index 0 unused): error-correction codewords per block, and block count.
+_ECC_CODEWORDS_PER_BLOCK = (
+    (-1, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28,
+     28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    (-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26,
+     26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    (-1, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30,
+     28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    (-1, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28,
+     30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+)
+_ERROR_CORRECTION_BLOCKS = (
+    (-1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8,
+     8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    (-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16,
+     17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    (-1, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20,
+     23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    (-1, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25,
+     25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+)
+
+_MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+_FINDER_LIKE = ("10111010000", "00001011101")
+
+
+def _gf_multiply(x: int, y: int) -> int:
+    """Multiply in GF(2^8) modulo x^8 + x^4 + x^3 + x^2 + 1."""
+    product = 0
+    for shift in range(7, -1, -1):
+        product = (product << 1) ^ ((product >> 7) * 0x11D)
+        product ^= ((y >> shift) & 1) * x
+    return product
+
+
+def _rs_divisor(degree: int) -> List[int]:
+    divisor = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for index in range(degree):
+            divisor[index] = _gf_multiply(divisor[index], root)
+            if index + 1 < degree:
+                divisor[index] ^= divisor[index + 1]
+        root = _gf_multiply(root, 0x02)
+    return divisor
+
+
+def _rs_remainder(data: List[int], divisor: List[int]) -> List[int]:
+    remainder = [0] * len(divisor)
+    for byte in data:
+        factor = byte ^ remainder.pop(0)
+        remainder.append(0)
+        for index, coefficient in enumerate(divisor):
+            remainder[index] ^= _gf_multiply(coefficient, factor)
+    return remainder
+
+
+def _raw_modules(version: int) -> int:
+    """Data and error-correction bits available in a symbol of this version."""
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        alignments = version // 7 + 2
+        result -= (25 * alignments - 10) * alignments - 55
+        if version >= 7:
+            result -= 36
+    return result
+
+
+def _data_codewords(version: int, row: int) -> int:
+    return (_raw_modules(version) // 8
+            - _ECC_CODEWORDS_PER_BLOCK[row][version] * _ERROR_CORRECTION_BLOCKS[row][version])
+
+
+def _alignment_positions(version: int) -> List[int]:
+    if version == 1:
+        return []
+    count = version // 7 + 2
+    step = (version * 8 + count * 3 + 5) // (count * 4 - 4) * 2
+    size = version * 4 + 17
+    return [6] + sorted(size - 7 - index * step for index in range(count - 1))
+
+
+def _codewords(data: bytes, version: int, row: int) -> List[int]:
+    """Encode ``data`` in byte mode and interleave it with its error correction."""
+    bits = []
+
+    def append(value: int, length: int) -> None:
+        bits.extend((value >> shift) & 1 for shift in range(length - 1, -1, -1))
+
+    capacity = _data_codewords(version, row) * 8
+    append(0b0100, 4)
+    append(len(data), 8 if version < 10 else 16)
+    for byte in data:
+        append(byte, 8)
+    append(0, min(4, capacity - len(bits)))
+    append(0, -len(bits) % 8)
+    padding = 0xEC
+    while len(bits) < capacity:
+        append(padding, 8)
+        padding ^= 0xEC ^ 0x11
+    codewords = [int("".join(map(str, bits[index:index + 8])), 2) for index in range(0, capacity, 8)]
+
+    blocks_count = _ERROR_CORRECTION_BLOCKS[row][version]
+    ecc_length = _ECC_CODEWORDS_PER_BLOCK[row][version]
+    raw_codewords = _raw_modules(version) // 8
+    short_blocks = blocks_count - raw_codewords % blocks_count
+    short_length = raw_codewords // blocks_count
+    divisor = _rs_divisor(ecc_length)
+    blocks = []
+    offset = 0
+    for index in range(blocks_count):
+        length = short_length - ecc_length + (0 if index < short_blocks else 1)
+        block = codewords[offset:offset + length]
+        offset += length
+        ecc = _rs_remainder(block, divisor)
+        if index < short_blocks:
+            block.append(0)  # placeholder so every block has the same length
+        blocks.append(block + ecc)
+
+    result = []
+    for position in range(len(blocks[0])):
+        for index, block in enumerate(blocks):
+            if position != short_length - ecc_length or index >= short_blocks:
+                result.append(block[position])
+    return result
+
+
+class _Symbol:
+    def __init__(self, version: int):
+        self.version = version
+        self.size = version * 4 + 17
+        self.modules = [[False] * self.size for _ in range(self.size)]
+        self.reserved = [[False] * self.size for _ in range(self.size)]
+
+    def set(self, x: int, y: int, dark: bool) -> None:
+        self.modules[y][x] = dark
+        self.reserved[y][x] = True
+
+    def draw_function_patterns(self) -> None:
+        size = self.size
+        for index in range(size):
+            self.set(6, index, index % 2 == 0)
+            self.set(index, 6, index % 2 == 0)
+        for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    x, y = cx + dx, cy + dy
+                    if 0 <= x < size and 0 <= y < size:
+                        self.set(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+        positions = _alignment_positions(self.version)
+        last = len(positions) - 1
+        for i, cx in enumerate(positions):
+            for j, cy in enumerate(positions):
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self.set(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+        self.draw_format(0, 0)
+        if self.version >= 7:
+            remainder = self.version
+            for _ in range(12):
+                remainder = (remainder << 1) ^ ((remainder >> 11) * 0x1F25)
+            bits = self.version << 12 | remainder
+            for index in range(18):
+                dark = (bits >> index) & 1 == 1
+                a, b = size - 11 + index % 3, index // 3
+                self.set(a, b, dark)
+                self.set(b, a, dark)
+
+    def draw_format(self, format_bits: int, mask: int) -> None:
+        data = format_bits << 3 | mask
+        remainder = data
+        for _ in range(10):
+            remainder = (remainder << 1) ^ ((remainder >> 9) * 0x537)
+        bits = (data << 10 | remainder) ^ 0x5412
+        bit = [(bits >> index) & 1 == 1 for index in range(15)]
+        size = self.size
+        for index in range(6):
+            self.set(8, index, bit[index])
+        self.set(8, 7, bit[6])
+        self.set(8, 8, bit[7])
+        self.set(7, 8, bit[8])
+        for index in range(9, 15):
+            self.set(14 - index, 8, bit[index])
+        for index in range(8):
+            self.set(size - 1 - index, 8, bit[index])
+        for index in range(8, 15):
+            self.set(8, size - 15 + index, bit[index])
+        self.set(8, size - 8, True)
+
+    def draw_codewords(self, codewords: List[int]) -> None:
+        size = self.size
+        total = len(codewords) * 8
+        index = 0
+        right = size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5
+            upward = (right + 1) & 2 == 0
+            for vertical in range(size):
+                y = size - 1 - vertical if upward else vertical
+                for x in (right, right - 1):
+                    if not self.reserved[y][x] and index < total:
+                        self.modules[y][x] = (codewords[index >> 3] >> (7 - (index & 7))) & 1 == 1
+                        index += 1
+            right -= 2
+
+    def masked(self, mask: int) -> List[List[bool]]:
+        pattern = _MASKS[mask]
+        return [
+            [dark ^ (not self.reserved[y][x] and pattern(x, y)) for x, dark in enumerate(row)]
+            for y, row in enumerate(self.modules)
+        ]
+
+
+def _penalty(modules: List[List[bool]]) -> int:
+    size = len(modules)
+    score = 0
+    lines = ["".join("1" if dark else "0" for dark in row) for row in modules]
+    lines += ["".join(lines[y][x] for y in range(size)) for x in range(size)]
+    for line in lines:
+        run = 1
+        for index in range(1, size + 1):
+            if index < size and line[index] == line[index - 1]:
+                run += 1
+                continue
+            if run >= 5:
+                score += run - 2
+            run = 1
+        for pattern in _FINDER_LIKE:
+            start = line.find(pattern)
+            while start != -1:
+                score += 40
+                start = line.find(pattern, start + 1)
+    for y in range(size - 1):
+        for x in range(size - 1):
+            if modules[y][x] == modules[y][x + 1] == modules[y + 1][x] == modules[y + 1][x + 1]:
+                score += 3
+    dark = sum(row.count(True) for row in modules)
+    score += abs(dark * 20 - size * size * 10) // (size * size) * 10
+    return score
+
+
+def encode(data: Union[str, bytes], ecc: str = "M", mask: Optional[int] = None) -> List[List[bool]]:
+    """Return the QR symbol for ``data`` as rows of booleans (True is dark)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if ecc not in ECC_LEVELS:
+        raise ValueError(f"Unknown error-correction level: {ecc}")
+    row, format_bits = ECC_LEVELS[ecc]
+    for version in range(1, 41):
+        header_bits = 4 + (8 if version < 10 else 16)
+        if header_bits + len(data) * 8 <= _data_codewords(version, row) * 8:
+            break
+    else:
+        raise ValueError(f"{len(data)} bytes do not fit in a QR code at level {ecc}")
+
+    symbol = _Symbol(version)
+    symbol.draw_function_patterns()
+    symbol.draw_codewords(_codewords(data, version, row))
+    candidates = range(8) if mask is None else (mask,)
+    best = None
+    for candidate in candidates:
+        symbol.draw_format(format_bits, candidate)
+        modules = symbol.masked(candidate)
+        score = _penalty(modules) if mask is None else 0
+        if best is None or score < best[0]:
+            best = (score, modules)
+    return best[1]
+
+
+def to_svg(modules: List[List[bool]], scale: int = 8, border: int = 4) -> str:
+    """Render as an SVG document with one path, crisp at any zoom level."""
+    size = len(modules) + border * 2
+    path = "".join(
+        f"M{x + border},{y + border}h1v1h-1z"
+        for y, row in enumerate(modules) for x, dark in enumerate(row) if dark
+    )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+        f'width="{size * scale}" height="{size * scale}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/><path d="{path}" fill="#000"/></svg>'
+    )
+
+
+def _png_chunk(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload))
+
+
+def to_png(modules: List[List[bool]], scale: int = 8, border: int = 4) -> bytes:
+    """Render as a 1-bit grayscale PNG."""
+    size = (len(modules) + border * 2) * scale
+    blank = [False] * border
+    raw = bytearray()
+    for row in [[False] * len(modules)] * border + modules + [[False] * len(modules)] * border:
+        pixels = [dark for dark in blank + row + blank for _ in range(scale)]
+        packed = bytearray(b"\x00")  # filter type: none
+        for offset in range(0, size, 8):
+            byte = 0
+            for bit, dark in enumerate(pixels[offset:offset + 8]):
+                if not dark:
+                    byte |= 0x80 >> bit
+            packed.append(byte)
+        raw += bytes(packed) * scale
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(bytes(raw), 9))
+        + _png_chunk(b"IEND", b"")
+    )
@@ -1,21 +1,27 @@
-"""Lambda function to register WireGuard peers via SSM."""
+"""Lambda function to register, revoke and list WireGuard peers via SSM."""
 
-import base64
+import hashlib
 import json
 import logging
 import os
-import shlex
-import textwrap
+import random
 import time
-from typing import Any, Dict, List
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-import boto3
 from botocore.exceptions import ClientError
 
+import client_config
+import peer_inventory
+from common import agent, emf, http, journal
+from common.aws import LazyClient
+from common.placement import Placement
+
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-ssm = boto3.client("ssm")
+ssm = LazyClient("ssm")
 
 INSTANCE_ID = os.environ["INSTANCE_ID"]
 CLIENT_SUBNET = os.environ["CLIENT_SUBNET_CIDR"]
@@ -23,179 +29,602 @@ SERVER_ADDRESS = os.environ["SERVER_ADDRESS"]
 WG_INTERFACE = os.environ.get("WG_INTERFACE", "wg0")
 WG_CONF_PATH = os.environ.get("WG_CONF_PATH", "/etc/wireguard/wg0.conf")
 COMMAND_TIMEOUT = int(os.environ.get("SSM_COMMAND_TIMEOUT_SECONDS", "60"))
-DEFAULT_HEADERS = {
-    "Content-Type": "application/json",
-    "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Headers": "Content-Type,X-Api-Key",
-    "Access-Control-Allow-Methods": "OPTIONS,GET,POST",
+# SSM keeps only the first 24,000 characters of a command's inline stdout and
+# each new peer prints up to about 185 of them, so a batch is capped where its
+# results still fit. Past that, peers would be added but their keys lost.
+SSM_OUTPUT_LIMIT = 24000
+PEER_RESULT_MAX_CHARS = 185
+MAX_BATCH_SIZE = min(int(os.environ.get("REGISTER_MAX_BATCH_SIZE", "100")),
+                     (SSM_OUTPUT_LIMIT - 1000) // PEER_RESULT_MAX_CHARS)
+POLL_INITIAL_SECONDS = float(os.environ.get("SSM_POLL_INITIAL_SECONDS", "0.1"))
+POLL_MAX_SECONDS = float(os.environ.get("SSM_POLL_MAX_SECONDS", "2"))
+RESPONSE_MARGIN_SECONDS = 2.0
+PENDING_STATUSES = {"Pending", "InProgress", "Delayed"}
+# SSM keeps command invocations for 30 days, so the command itself doubles as the job record.
+SINGLE_JOB_COMMENT = "register-peer"
+BATCH_JOB_COMMENT = "register-peer-batch"
+REVOKE_JOB_COMMENT = "revoke-peers"
+PRUNE_JOB_COMMENT = "prune-peers"
+# Inventory commands only refresh GET /peers snapshots and are not pollable jobs.
+INVENTORY_COMMENT = "peer-inventory"
+# Job label and failure message per command comment.
+JOB_KINDS = {
+    SINGLE_JOB_COMMENT: ("Registration", "Failed to register peer."),
+    BATCH_JOB_COMMENT: ("Registration", "Failed to register peer."),
+    REVOKE_JOB_COMMENT: ("Revocation", "Failed to revoke peer."),
+    PRUNE_JOB_COMMENT: ("Prune", "Failed to prune peers."),
+}
+LIST_FAILURE = "Failed to list peers."
+MAX_PRUNE_DAYS = 3650
+AGENT_TIMEOUT_SECONDS = 30
+_PEER_MANAGER_SOURCE = Path(__file__).with_name("wg_peer_manager.py").read_bytes()
+PEER_MANAGER_SCRIPT_B64 = agent.encode_script(_PEER_MANAGER_SOURCE)
+# Must match wg_peer_manager.script_version() so the resident agent can detect stale code.
+PEER_MANAGER_VERSION = hashlib.sha256(_PEER_MANAGER_SOURCE).hexdigest()[:16]
+METHOD_HEADERS = {"Access-Control-Allow-Methods": "OPTIONS,GET,POST,DELETE"}
+CLIENT_SETTINGS = client_config.settings_from_env()
+# Job results polled later than this are not written back to the config cache,
+# so reading an old registration job cannot resurrect a revoked peer's config.
+CACHE_FRESH_SECONDS = 600
+bundles = client_config.BundleCache(CLIENT_SETTINGS["table"])
+placement = Placement.from_env()
+PEERS_SETTINGS = peer_inventory.settings_from_env()
+snapshots = peer_inventory.SnapshotCache(PEERS_SETTINGS["bucket"], PEERS_SETTINGS["ttl"])
+# The server every peer lives on when no pool is configured.
+DEFAULT_SERVER = {
+    "instanceId": INSTANCE_ID,
+    "clientSubnet": CLIENT_SUBNET,
+    "serverAddress": SERVER_ADDRESS,
+    "endpoint": CLIENT_SETTINGS["endpoint"],
 }
 
 
 def _response(status: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return http.response(status, payload, METHOD_HEADERS)
+
+
+def _parse_public_keys(payload: Dict[str, Any]) -> Tuple[List[str], Optional[str]]:
+    if "publicKeys" in payload:
+        raw_keys = payload.get("publicKeys")
+        if not isinstance(raw_keys, list) or not raw_keys:
+            return [], "publicKeys must be a non-empty list."
+        if len(raw_keys) > MAX_BATCH_SIZE:
+            return [], f"publicKeys accepts at most {MAX_BATCH_SIZE} keys per request."
+    else:
+        raw_keys = [payload.get("publicKey") or ""]
+
+    public_keys = []
+    for raw_key in raw_keys:
+        public_key = raw_key.strip() if isinstance(raw_key, str) else ""
+        if not public_key:
+            return [], "publicKey is required."
+        if len(public_key) < 32:
+            return [], f"publicKey appears invalid: {public_key}"
+        public_keys.append(public_key)
+    return public_keys, None
+
+
+def _parse_prune(payload: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    inactive_days = payload.get("inactiveDays")
+    if isinstance(inactive_days, bool) or not isinstance(inactive_days, (int, float)):
+        return None, "inactiveDays must be a number."
+    if not 0 < inactive_days <= MAX_PRUNE_DAYS:
+        return None, f"inactiveDays must be between 1 and {MAX_PRUNE_DAYS}."
+    dry_run = payload.get("dryRun", False)
+    if not isinstance(dry_run, bool):
+        return None, "dryRun must be a boolean."
+    return {"op": "prune", "inactiveDays": inactive_days, "dryRun": dry_run}, None
+
+
+def _parse_config_format(value: Any) -> Tuple[Optional[str], Optional[str]]:
+    """``config`` may be true (plain ``.conf`` text) or one of ``conf``, ``svg``, ``png``."""
+    if value is None or value is False:
+        return None, None
+    if value is True or (isinstance(value, str) and value.lower() in {"1", "true", "yes"}):
+        return "conf", None
+    if isinstance(value, str) and value.lower() in client_config.FORMATS:
+        return value.lower(), None
+    return None, f"config must be true or one of: {', '.join(client_config.FORMATS)}."
+
+
+def _build_ssm_commands(message: Dict[str, Any], server: Optional[Dict[str, Any]] = None) -> List[str]:
+    # Ask the resident peer agent first; fall back to running the manager inline.
+    server = server or DEFAULT_SERVER
+    # The agent was installed with the stack-wide subnet, so each server's slice goes with the message.
+    message = {**message, "version": PEER_MANAGER_VERSION,
+               "clientSubnet": server["clientSubnet"], "serverAddress": server["serverAddress"]}
+    environment = {
+        "WG_CONF_PATH": WG_CONF_PATH,
+        "CLIENT_SUBNET": server["clientSubnet"],
+        "SERVER_ADDRESS": server["serverAddress"],
+        "WG_INTERFACE": WG_INTERFACE,
+    }
+    return [agent.command(message, PEER_MANAGER_SCRIPT_B64, environment, AGENT_TIMEOUT_SECONDS, "<register_peer>")]
+
+
+def _batch_response(results: List[Dict[str, Any]], server_public_key: Optional[str]) -> Dict[str, Any]:
+    registered = sum(1 for item in results if not item.get("error") and not item.get("alreadyExists"))
+    existing = sum(1 for item in results if item.get("alreadyExists"))
+    failed = sum(1 for item in results if item.get("error"))
     return {
-        "statusCode": status,
-        "headers": DEFAULT_HEADERS,
-        "body": json.dumps(payload, ensure_ascii=False),
+        "message": f"Registered {registered} peer(s); {existing} already registered; {failed} failed.",
+        "registered": registered,
+        "alreadyRegistered": existing,
+        "failed": failed,
+        "results": results,
+        "serverPublicKey": server_public_key,
     }
 
 
-def _build_ssm_commands(public_key: str) -> List[str]:
-    # Inline Python writes WireGuard peer configuration atomically and emits JSON.
-    python_script = textwrap.dedent(
-        r"""
-import base64
-import ipaddress
-import json
-import os
-import pathlib
-import subprocess
-import tempfile
-
-public_key = base64.b64decode(os.environ["PUBLIC_KEY_B64"]).decode("utf-8").strip()
-wg_conf_path = os.environ.get("WG_CONF_PATH", "/etc/wireguard/wg0.conf")
-client_subnet = ipaddress.ip_network(os.environ["CLIENT_SUBNET"], strict=False)
-server_address = ipaddress.ip_address(os.environ["SERVER_ADDRESS"])
-wg_interface = os.environ.get("WG_INTERFACE", "wg0")
-
-if not public_key:
-    raise SystemExit("Missing public key")
-
-sections = []
-current = None
-with open(wg_conf_path, "r", encoding="utf-8") as fh:
-    for raw in fh:
-        stripped = raw.strip()
-        if stripped.startswith("[") and stripped.endswith("]"):
-            if current is not None:
-                sections.append(current)
-            current = {"type": stripped.strip("[]"), "lines": [raw], "data": {}}
-        else:
-            if current is None:
-                continue
-            current["lines"].append(raw)
-            if "=" in stripped:
-                key, value = map(str.strip, stripped.split("=", 1))
-                current["data"][key] = value
-if current is not None:
-    sections.append(current)
-
-existing_peer = None
-used_ips = {server_address}
-for section in sections:
-    if section["type"].lower() != "peer":
-        continue
-    if section["data"].get("PublicKey") == public_key:
-        existing_peer = section
-    allowed_line = section["data"].get("AllowedIPs")
-    if allowed_line:
-        first_entry = allowed_line.split(",", 1)[0].strip()
-        network = ipaddress.ip_network(first_entry, strict=False)
-        if network.prefixlen == 32:
-            used_ips.add(network.network_address)
-        else:
-            for host in network.hosts():
-                used_ips.add(host)
-
-result = {"alreadyExists": False, "assignedIp": None, "presharedKey": None}
-
-if existing_peer:
-    allowed = existing_peer["data"].get("AllowedIPs", "").split(",", 1)[0].strip()
-    if allowed:
-        result["assignedIp"] = allowed.split("/", 1)[0]
-    result["alreadyExists"] = True
-    result["presharedKey"] = existing_peer["data"].get("PreSharedKey")
-else:
-    available_ip = None
-    for host in client_subnet.hosts():
-        if host == server_address or host in used_ips:
-            continue
-        available_ip = host
-        break
-    if available_ip is None:
-        raise SystemExit(json.dumps({"error": "No available client IP addresses"}))
-
-    assigned_ip = str(available_ip)
-    preshared_key = subprocess.run(
-        ["wg", "genpsk"],
-        check=True,
-        capture_output=True,
-        text=True,
-    ).stdout.strip()
-
-    with open(wg_conf_path, "a", encoding="utf-8") as fh:
-        fh.write("\n[Peer]\n")
-        fh.write(f"PublicKey = {public_key}\n")
-        fh.write(f"AllowedIPs = {assigned_ip}/32\n")
-        if preshared_key:
-            fh.write(f"PreSharedKey = {preshared_key}\n")
-
-    subprocess.run(
-        ["wg", "set", wg_interface, "peer", public_key, "allowed-ips", f"{assigned_ip}/32"],
-        check=True,
+def _revoke_response(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    revoked = sum(1 for item in results if item.get("removed"))
+    missing = len(results) - revoked
+    return {
+        "message": f"Revoked {revoked} peer(s); {missing} not found.",
+        "revoked": revoked,
+        "notFound": missing,
+        "results": results,
+    }
+
+
+def _prune_response(result: Dict[str, Any]) -> Dict[str, Any]:
+    pruned = result.get("pruned") or []
+    verb = "Would prune" if result.get("dryRun") else "Pruned"
+    return {
+        "message": f"{verb} {len(pruned)} peer(s) inactive for {result.get('inactiveDays')} day(s).",
+        "pruned": pruned,
+        "dryRun": result.get("dryRun", False),
+        "inactiveDays": result.get("inactiveDays"),
+        "remaining": result.get("remaining"),
+    }
+
+
+def _send_command(message: Dict[str, Any], comment: str, server: Optional[Dict[str, Any]] = None,
+                  output_bucket: Optional[str] = None) -> str:
+    server = server or DEFAULT_SERVER
+    commands = _build_ssm_commands(message, server)
+    # Output beyond SSM's inline limit is only complete in the output bucket.
+    output = {"OutputS3BucketName": output_bucket, "OutputS3KeyPrefix": peer_inventory.COMMAND_PREFIX} \
+        if output_bucket else {}
+    command = ssm.send_command(
+        InstanceIds=[server["instanceId"]],
+        DocumentName="AWS-RunShellScript",
+        Parameters={"commands": commands},
+        TimeoutSeconds=COMMAND_TIMEOUT,
+        Comment=comment,
+        **output,
     )
+    command_id = command["Command"]["CommandId"]
+    LOGGER.info("Sent %s command %s via SSM to %s for %d key(s)", message["op"], command_id,
+                server["instanceId"], len(message.get("publicKeys") or []))
+    return command_id
 
-    if preshared_key:
-        with tempfile.NamedTemporaryFile("w", delete=False) as tmp:
-            tmp.write(preshared_key)
-            temp_path = tmp.name
+
+def _targets(message: Dict[str, Any], context) -> Tuple[List[Tuple[Dict[str, Any], Dict[str, Any]]], Dict[str, str]]:
+    """Split a peer manager message into ``(server, message)`` pairs, one per server it touches.
+
+    Also returns the placements recorded for new keys, ``{key: instanceId}``.
+    """
+    if not placement.enabled:
+        return [(DEFAULT_SERVER, message)], {}
+    if message["op"] == "prune":
+        return [(server, message) for server in placement.servers.values()], {}
+    if message["op"] == "register" and not placement.adopted:
+        _adopt_primary_keys(_deadline(context))
+    keys = message["publicKeys"]
+    groups, placed = placement.place(keys) if message["op"] == "register" else (placement.route(keys), {})
+    targets = [(placement.servers[instance_id], {**message, "publicKeys": group})
+               for instance_id, group in groups.items()]
+    return targets, placed
+
+
+def _job_id(jobs: List[Tuple[str, str]]) -> str:
+    """Plain command ID for the default server, ``command@instance`` pairs otherwise."""
+    if len(jobs) == 1 and jobs[0][1] == INSTANCE_ID:
+        return jobs[0][0]
+    return ",".join(f"{command_id}@{instance_id}" for command_id, instance_id in jobs)
+
+
+def _parse_job_id(job_id: str) -> Optional[List[Tuple[str, str]]]:
+    jobs = []
+    for part in job_id.split(","):
+        command_id, _, instance_id = part.strip().partition("@")
+        instance_id = instance_id or INSTANCE_ID
+        if not command_id or (instance_id != INSTANCE_ID and instance_id not in placement.servers):
+            return None
+        jobs.append((command_id, instance_id))
+    return jobs
+
+
+class ExponentialBackoff:
+    """Wait strategy yielding exponentially growing, jittered poll delays.
+
+    Any object with a ``delays()`` method returning an iterator of seconds can
+    be passed to ``_wait_for_invocation`` instead.
+    """
+
+    def __init__(self, initial: float = 0.1, factor: float = 2.0, cap: float = 2.0,
+                 jitter: float = 0.5, rng=None):
+        self.initial = initial
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+        self.rng = rng or random.random
+
+    def delays(self) -> Iterator[float]:
+        delay = self.initial
+        while True:
+            yield delay * (1 - self.jitter * self.rng())
+            delay = min(delay * self.factor, self.cap)
+
+
+def _deadline(context) -> float:
+    budget = float(COMMAND_TIMEOUT)
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        # Leave room to build and return the response before Lambda times out.
+        budget = min(budget, context.get_remaining_time_in_millis() / 1000 - RESPONSE_MARGIN_SECONDS)
+    return time.monotonic() + max(budget, 0.0)
+
+
+def _wait_for_invocation(command_id: str, deadline: float, strategy=None,
+                         instance_id: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    strategy = strategy or ExponentialBackoff(POLL_INITIAL_SECONDS, cap=POLL_MAX_SECONDS)
+    delays = strategy.delays()
+    stats = {"count": 0, "waitedSeconds": 0.0}
+    while True:
+        stats["count"] += 1
         try:
-            subprocess.run(
-                ["wg", "set", wg_interface, "peer", public_key, "preshared-key", temp_path],
-                check=True,
+            invocation = ssm.get_command_invocation(
+                CommandId=command_id,
+                InstanceId=instance_id or INSTANCE_ID,
             )
-        finally:
-            pathlib.Path(temp_path).unlink(missing_ok=True)
-
-    result["assignedIp"] = assigned_ip
-    result["presharedKey"] = preshared_key
-
-try:
-    server_public_key = subprocess.run(
-        ["wg", "show", wg_interface, "public-key"],
-        check=True,
-        capture_output=True,
-        text=True,
-    ).stdout.strip()
-except subprocess.CalledProcessError:
-    server_public_key = ""
-
-result["publicKey"] = public_key
-result["serverPublicKey"] = server_public_key
-
-print(json.dumps(result))
-"""
-    ).strip()
-
-    encoded_script = base64.b64encode(python_script.encode("utf-8")).decode("ascii")
-    encoded_key = base64.b64encode(public_key.strip().encode("utf-8")).decode("ascii")
-
-    shell_script = textwrap.dedent(
-        f"""
-    /bin/bash <<'SCRIPT'
-    set -euo pipefail
-    export PUBLIC_KEY_B64='{encoded_key}'
-    export WG_CONF_PATH={shlex.quote(WG_CONF_PATH)}
-    export CLIENT_SUBNET={shlex.quote(CLIENT_SUBNET)}
-    export SERVER_ADDRESS={shlex.quote(SERVER_ADDRESS)}
-    export WG_INTERFACE={shlex.quote(WG_INTERFACE)}
-    python3 - <<'PY'
-    import base64
-    code = base64.b64decode('{encoded_script}')
-    exec(compile(code.decode('utf-8'), '<register_peer>', 'exec'), globals(), globals())
-    PY
-    SCRIPT
+        except ClientError as err:  # handle eventual consistency
+            code = err.response.get("Error", {}).get("Code")
+            if code != "InvocationDoesNotExist":
+                raise
+            invocation = {"Status": "Pending"}
+        if invocation.get("Status") not in PENDING_STATUSES:
+            stats["waitedSeconds"] = round(stats["waitedSeconds"], 3)
+            return invocation, stats
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"SSM command {command_id} still running after {stats['count']} polls")
+        delay = min(next(delays), remaining)
+        time.sleep(delay)
+        stats["waitedSeconds"] += delay
+
+
+def _with_fields(response: Dict[str, Any], fields: Dict[str, Any]) -> Dict[str, Any]:
+    body = json.loads(response["body"])
+    body.update(fields)
+    response["body"] = json.dumps(body, ensure_ascii=False)
+    return response
+
+
+def _combine(finished: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+             placed: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Merge one job's per-server invocations into the shape of a single invocation.
+
+    Each registration result is tagged with the server it landed on, and each
+    server's reported peer count refreshes its load. Servers whose command
+    failed are listed under ``failedServers`` so the others' results, keys
+    included, still reach the caller; only a job failing everywhere fails.
+    New keys ``placed`` on a failed server are released so they can be placed
+    afresh next time.
+    """
+    if not placement.enabled:
+        return finished[0][1]
+    merged = {"results": [], "pruned": [], "remaining": 0}
+    failed = []
+    for server, invocation in finished:
+        try:
+            result = json.loads((invocation.get("StandardOutputContent") or "{}").strip().splitlines()[-1])
+        except (json.JSONDecodeError, IndexError):
+            result = None
+        if invocation.get("Status") != "Success" or not isinstance(result, dict) or result.get("error"):
+            error = result.get("error") if isinstance(result, dict) else None
+            failed.append((invocation, {
+                "instanceId": server["instanceId"],
+                "error": error or invocation.get("StandardErrorContent") or invocation.get("Status"),
+            }))
+            continue
+        for item in result.get("results") or []:
+            if "assignedIp" in item or "error" in item:
+                item.update({"instanceId": server["instanceId"], "endpoint": server.get("endpoint"),
+                             "serverPublicKey": result.get("serverPublicKey")})
+            merged["results"].append(item)
+        merged["pruned"] += result.get("pruned") or []
+        merged["remaining"] += result.get("remaining") or 0
+        merged.setdefault("serverPublicKey", result.get("serverPublicKey"))
+        merged.update({key: result[key] for key in ("dryRun", "inactiveDays") if key in result})
+        if "remaining" in result:
+            placement.report(server["instanceId"], result["remaining"])
+    failed_ids = {server_error["instanceId"] for _, server_error in failed}
+    if placed and failed_ids:
+        placement.release({key: instance_id for key, instance_id in placed.items() if instance_id in failed_ids})
+    if len(failed) == len(finished):
+        return failed[0][0]  # reported as the job's failure
+    if failed:
+        merged["failedServers"] = [server_error for _, server_error in failed]
+    return {
+        "Status": "Success",
+        "StandardOutputContent": json.dumps(merged),
+        "ExecutionStartDateTime": min(invocation.get("ExecutionStartDateTime") or "" for _, invocation in finished),
+        "ExecutionEndDateTime": max(invocation.get("ExecutionEndDateTime") or "" for _, invocation in finished),
+    }
+
+
+def _invocation_response(invocation: Dict[str, Any], comment: str, config_format: Optional[str] = None,
+                         private_key: Optional[str] = None, cache: bool = True) -> Dict[str, Any]:
+    """Translate a finished SSM invocation into the API response.
+
+    Successful registrations are written to the config cache (unless ``cache``
+    is false) and revoked or pruned peers are dropped from it.
     """
-    ).strip()
+    failure = JOB_KINDS[comment][1]
+    status = invocation.get("Status")
+    if status != "Success":
+        error_output = invocation.get("StandardErrorContent")
+        LOGGER.error("SSM command failed: %s", error_output)
+        return _response(500, {
+            "message": failure,
+            "error": error_output or status,
+        })
+
+    output = invocation.get("StandardOutputContent") or "{}"
+    try:
+        result = json.loads(output.strip().splitlines()[-1])
+    except json.JSONDecodeError:
+        LOGGER.error("Unable to parse SSM output: %s", output)
+        return _response(500, {
+            "message": "Unexpected response from peer command.",
+            "rawOutput": output,
+        })
+
+    if result.get("error"):
+        return _response(500, {
+            "message": failure,
+            "error": result["error"],
+        })
+
+    # A pool job that failed on some servers still reports the others, as 207 Multi-Status.
+    failed_servers = result.get("failedServers")
+    status_code, partial = (207, {"failedServers": failed_servers}) if failed_servers else (200, {})
+    if failed_servers:
+        LOGGER.error("Peer command failed on some servers: %s", failed_servers)
+    if comment == PRUNE_JOB_COMMENT:
+        if not result.get("dryRun"):
+            _forget([item.get("publicKey") for item in result.get("pruned") or []])
+        return _response(status_code, {**_prune_response(result), **partial})
+    results = result.get("results") or []
+    if comment == REVOKE_JOB_COMMENT:
+        _forget([item.get("publicKey") for item in results])
+        return _response(status_code, {**_revoke_response(results), **partial})
+    if comment == BATCH_JOB_COMMENT:
+        if cache:
+            bundles.put({"serverPublicKey": result.get("serverPublicKey"), **item}
+                        for item in results if not item.get("error"))
+        return _response(status_code, {**_batch_response(results, result.get("serverPublicKey")), **partial})
+
+    peer = results[0] if results else {}
+    if peer.get("error"):
+        return _response(500, {
+            "message": "Failed to register peer.",
+            "error": peer["error"],
+        })
+    response_body = {
+        "message": "Peer registered." if not peer.get("alreadyExists") else "Peer already registered.",
+        "assignedIp": peer.get("assignedIp"),
+        "presharedKey": peer.get("presharedKey"),
+        "alreadyExists": peer.get("alreadyExists", False),
+        "publicKey": peer.get("publicKey"),
+        "serverPublicKey": peer.get("serverPublicKey") or result.get("serverPublicKey"),
+        "endpoint": peer.get("endpoint") or CLIENT_SETTINGS["endpoint"],
+    }
+    if peer.get("instanceId"):
+        response_body["instanceId"] = peer["instanceId"]
+    if cache:
+        bundles.put([response_body])
+    if config_format:
+        response_body.update(client_config.config_fields(response_body, CLIENT_SETTINGS, config_format, private_key))
+    return _response(200, response_body)
+
+
+def _forget(public_keys: List[str]) -> None:
+    """Drop cached configs and placements of peers that no longer exist."""
+    bundles.delete(public_keys)
+    if placement.enabled:
+        placement.forget(public_keys)
+
+
+def _finished_recently(invocation: Dict[str, Any]) -> bool:
+    finished = invocation.get("ExecutionEndDateTime")
+    if isinstance(finished, str) and finished:
+        finished = datetime.fromisoformat(finished.replace("Z", "+00:00"))
+    if not isinstance(finished, datetime):
+        return False
+    return (datetime.now(timezone.utc) - finished).total_seconds() < CACHE_FRESH_SECONDS
+
+
+def _download_config(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Serve a registered peer's config from the cache, without touching the VPN host."""
+    query = event.get("queryStringParameters") or {}
+    public_key = (query.get("publicKey") or "").strip()
+    config_format, error = _parse_config_format(query.get("config") or "conf")
+    if not public_key:
+        error = "publicKey query parameter is required."
+    if error:
+        return _response(400, {"message": error})
+    if not bundles.enabled:
+        return _response(404, {"message": "Config downloads are not enabled.", "publicKey": public_key})
+
+    bundle = bundles.get(public_key)
+    emf.put("ConfigCacheHit", 1 if bundle else 0)
+    if bundle is None:
+        return _response(404, {
+            "message": "No stored config for this key. Register it again (POST /register with config) to rebuild it.",
+            "publicKey": public_key,
+        })
+    return _response(200, {
+        "message": "Client config.",
+        **bundle,
+        **client_config.config_fields(bundle, CLIENT_SETTINGS, config_format),
+    })
+
+
+def _job_status(event: Dict[str, Any]) -> Dict[str, Any]:
+    query = event.get("queryStringParameters") or {}
+    if "publicKey" in query:
+        return _download_config(event)
+    job_id = (query.get("jobId") or "").strip()
+    if not job_id:
+        return _response(400, {"message": "jobId or publicKey query parameter is required."})
+    config_format, error = _parse_config_format(query.get("config"))
+    if error:
+        return _response(400, {"message": error})
+
+    jobs = _parse_job_id(job_id)
+    if not jobs:
+        return _response(400, {"message": "jobId appears invalid.", "jobId": job_id})
+
+    finished = []
+    for command_id, instance_id in jobs:
+        try:
+            invocation = ssm.get_command_invocation(CommandId=command_id, InstanceId=instance_id)
+        except ClientError as err:
+            code = err.response.get("Error", {}).get("Code")
+            if code == "InvocationDoesNotExist":
+                return _response(404, {"message": "Job not found.", "jobId": job_id})
+            if code in {"InvalidCommandId", "ValidationException"}:
+                return _response(400, {"message": "jobId appears invalid.", "jobId": job_id})
+            raise
+
+        comment = invocation.get("Comment")
+        if comment not in JOB_KINDS:
+            return _response(404, {"message": "Job not found.", "jobId": job_id})
+
+        status = invocation.get("Status")
+        if status in PENDING_STATUSES:
+            return _response(200, {
+                "message": f"{JOB_KINDS[comment][0]} in progress.",
+                "jobId": job_id,
+                "status": status,
+            })
+        finished.append((placement.servers.get(instance_id, DEFAULT_SERVER), invocation))
+
+    invocation = _combine(finished)
+    status = invocation.get("Status")
+
+    emf.put_ssm_timing(None, invocation.get("ExecutionStartDateTime"), invocation.get("ExecutionEndDateTime"))
+    response = _invocation_response(invocation, comment, config_format, cache=_finished_recently(invocation))
+    return _with_fields(response, {"jobId": job_id, "status": status})
+
+
+def _take_snapshots(servers: List[Dict[str, Any]], deadline: float) -> Dict[str, Dict[str, Any]]:
+    """Run the inventory op on every server at once and share the parsed snapshots."""
+    sent = [
+        (_send_command({"op": "inventory"}, INVENTORY_COMMENT, server, snapshots.bucket), server["instanceId"])
+        for server in servers
+    ]
+    taken = {}
+    for command_id, instance_id in sent:
+        invocation, _ = _wait_for_invocation(command_id, deadline, instance_id=instance_id)
+        if invocation.get("Status") != "Success":
+            raise RuntimeError(invocation.get("StandardErrorContent") or invocation.get("Status"))
+        output = snapshots.command_output(command_id, instance_id) or invocation.get("StandardOutputContent") or ""
+        taken[instance_id] = peer_inventory.parse_snapshot(output)
+        snapshots.put(instance_id, taken[instance_id])
+    return taken
+
+
+def _adopt_primary_keys(deadline: float) -> None:
+    """Record the keys the primary held before the pool existed, so they are not placed again."""
+    primary = placement.servers[placement.primary]
+    snapshot = snapshots.get(primary["instanceId"]) if snapshots.enabled else None
+    if snapshot is None:
+        snapshot = _take_snapshots([primary], deadline)[primary["instanceId"]]
+    placement.adopt([row[0] for row in snapshot["peers"]])
+    LOGGER.info("Recorded %d key(s) already on %s", len(snapshot["peers"]), primary["instanceId"])
+
+
+def _list_peers(event: Dict[str, Any], context) -> Dict[str, Any]:
+    """Serve one page of ``GET /peers`` from cached ``wg show dump`` snapshots."""
+    params, error = peer_inventory.parse_query(event.get("queryStringParameters") or {})
+    if error:
+        return _response(400, {"message": error})
+    if not snapshots.enabled:
+        return _response(404, {"message": "Peer listing is not enabled."})
+
+    servers = list(placement.servers.values()) if placement.enabled else [DEFAULT_SERVER]
+    if params["instanceId"]:
+        servers = [server for server in servers if server["instanceId"] == params["instanceId"]]
+        if not servers:
+            return _response(400, {"message": "instanceId is not a WireGuard server.", "instanceId": params["instanceId"]})
+
+    loaded = {server["instanceId"]: snapshots.get(server["instanceId"]) for server in servers}
+    stale = [server for server in servers if loaded[server["instanceId"]] is None]
+    emf.put("PeerSnapshotRefresh", len(stale))
+    if stale:
+        try:
+            loaded.update(_take_snapshots(stale, _deadline(context)))
+        except TimeoutError as exc:
+            LOGGER.warning("Peer snapshot still running: %s", exc)
+            return _response(503, {"message": "Peer snapshot is still being taken. Retry shortly."})
+        except (ClientError, RuntimeError, ValueError) as exc:
+            LOGGER.error("Peer snapshot failed: %s", exc)
+            return _response(500, {"message": LIST_FAILURE, "error": str(exc)})
+
+    page = peer_inventory.select(
+        [(server["instanceId"], loaded[server["instanceId"]]) for server in servers],
+        params,
+        datetime.now(timezone.utc).timestamp(),
+        tag_servers=placement.enabled,
+    )
+    generated_at = min(snapshot["generatedAt"] for snapshot in loaded.values())
+    return _response(200, {
+        "message": f"Listed {len(page['peers'])} of {page['matched']} peer(s).",
+        **page,
+        "limit": params["limit"],
+        "generatedAt": datetime.fromtimestamp(generated_at, timezone.utc).isoformat(),
+    })
+
 
-    return [shell_script]
+def _wants_async(event: Dict[str, Any], payload: Dict[str, Any]) -> bool:
+    query_value = (event.get("queryStringParameters") or {}).get("async")
+    if query_value is not None:
+        return query_value.lower() in {"1", "true", "yes"}
+    return payload.get("async") is True
 
 
+def _parse_request(method: str, payload: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], str, Optional[str]]:
+    """Return the peer manager message and job comment for a POST or DELETE body."""
+    if method == "DELETE" and "inactiveDays" in payload:
+        message, error = _parse_prune(payload)
+        return message, PRUNE_JOB_COMMENT, error
+
+    public_keys, error = _parse_public_keys(payload)
+    if method == "DELETE":
+        return {"op": "revoke", "publicKeys": public_keys}, REVOKE_JOB_COMMENT, error
+    comment = BATCH_JOB_COMMENT if "publicKeys" in payload else SINGLE_JOB_COMMENT
+    return {"op": "register", "publicKeys": public_keys}, comment, error
+
+
+@emf.instrument("register_peer")
 def handler(event, context):
+    method = event.get("httpMethod")
+    comment = REVOKE_JOB_COMMENT if method == "DELETE" else SINGLE_JOB_COMMENT
     try:
-        if event.get("httpMethod") == "OPTIONS":
+        if method == "OPTIONS":
             return _response(200, {"message": "OK"})
 
-        if event.get("httpMethod") != "POST":
+        if method == "GET":
+            if event.get("resource") == "/peers":
+                comment = INVENTORY_COMMENT
+                return _list_peers(event, context)
+            return _job_status(event)
+
+        if method not in {"POST", "DELETE"}:
             return _response(405, {"message": "Method Not Allowed"})
 
         try:
@@ -203,80 +632,76 @@ def handler(event, context):
         except json.JSONDecodeError:
             return _response(400, {"message": "Request body must be valid JSON."})
 
-        public_key = (payload.get("publicKey") or "").strip()
-        if not public_key:
-            return _response(400, {"message": "publicKey is required."})
-        if len(public_key) < 32:
-            return _response(400, {"message": "publicKey appears invalid."})
-
-        commands = _build_ssm_commands(public_key)
-        LOGGER.info("Sending registration command via SSM")
-        command = ssm.send_command(
-            InstanceIds=[INSTANCE_ID],
-            DocumentName="AWS-RunShellScript",
-            Parameters={"commands": commands},
-            TimeoutSeconds=COMMAND_TIMEOUT,
-        )
-        command_id = command["Command"]["CommandId"]
-
-        start = time.time()
-        while True:
-            try:
-                invocation = ssm.get_command_invocation(
-                    CommandId=command_id,
-                    InstanceId=INSTANCE_ID,
-                )
-            except ClientError as err:  # handle eventual consistency
-                code = err.response.get("Error", {}).get("Code")
-                if code == "InvocationDoesNotExist":
-                    if time.time() - start > COMMAND_TIMEOUT:
-                        raise TimeoutError("SSM command invocation not found before timeout")
-                    time.sleep(2)
-                    continue
-                raise
-            status = invocation.get("Status")
-            if status in {"Pending", "InProgress", "Delayed"}:
-                if time.time() - start > COMMAND_TIMEOUT:
-                    raise TimeoutError("SSM command timed out")
-                time.sleep(2)
-                continue
-            if status != "Success":
-                error_output = invocation.get("StandardErrorContent")
-                LOGGER.error("SSM command failed: %s", error_output)
-                return _response(500, {
-                    "message": "Failed to register peer.",
-                    "error": error_output or status,
-                })
-            output = invocation.get("StandardOutputContent") or "{}"
-            break
+        if not isinstance(payload, dict):
+            return _response(400, {"message": "Request body must be a JSON object."})
+
+        config_format, error = _parse_config_format(payload.get("config"))
+        private_key = None
+        if not error and payload.get("generateKeys") is True:
+            if method != "POST" or "publicKey" in payload or "publicKeys" in payload:
+                error = "generateKeys registers one new key pair and cannot be combined with publicKey(s)."
+            else:
+                # The private key only ever appears in this response.
+                private_key, public_key = client_config.generate_keypair()
+                payload = {**payload, "publicKey": public_key}
+                config_format = config_format or "conf"
+        if error:
+            return _response(400, {"message": error})
+
+        message, comment, error = _parse_request(method, payload)
+        if error:
+            return _response(400, {"message": error})
+
+        label = JOB_KINDS[comment][0]
+        sent_at = datetime.now(timezone.utc)
+        targets, placed = _targets(message, context)
+        jobs = [(_send_command(part, comment, server), server) for server, part in targets]
+        job_id = _job_id([(command_id, server["instanceId"]) for command_id, server in jobs])
+        # Recorded once the commands are sent: the job ID leads to the outcome.
+        journal.record(message["op"], event, context, jobId=job_id,
+                       instanceIds=[server["instanceId"] for _, server in jobs],
+                       **{key: value for key, value in message.items() if key != "op"})
+        # A generated private key cannot be recovered later, so such requests never go async.
+        pending_fields = {"privateKey": private_key, "publicKey": payload["publicKey"]} if private_key else {}
+        if _wants_async(event, payload) and not private_key:
+            return _response(202, {
+                "message": f"{label} accepted.",
+                "jobId": job_id,
+                "status": "Pending",
+            })
 
+        deadline = _deadline(context)
+        finished = []
+        poll_stats = {"count": 0, "waitedSeconds": 0.0}
         try:
-            result = json.loads(output.strip().splitlines()[-1])
-        except json.JSONDecodeError:
-            LOGGER.error("Unable to parse SSM output: %s", output)
-            return _response(500, {
-                "message": "Unexpected response from registration command.",
-                "rawOutput": output,
+            for command_id, server in jobs:
+                invocation, stats = _wait_for_invocation(command_id, deadline, instance_id=server["instanceId"])
+                finished.append((server, invocation))
+                poll_stats = {key: round(poll_stats[key] + stats[key], 3) for key in poll_stats}
+        except TimeoutError as exc:
+            emf.put("SsmPollTimeout", 1)
+            LOGGER.warning("%s still running, handing back job ID: %s", label, exc)
+            return _response(202, {
+                "message": f"{label} is still running. Poll GET /register?jobId=... for the result.",
+                "jobId": job_id,
+                "status": "InProgress",
+                **pending_fields,
             })
-
-        response_body = {
-            "message": "Peer registered." if not result.get("alreadyExists") else "Peer already registered.",
-            "assignedIp": result.get("assignedIp"),
-            "presharedKey": result.get("presharedKey"),
-            "alreadyExists": result.get("alreadyExists", False),
-            "publicKey": public_key,
-            "serverPublicKey": result.get("serverPublicKey"),
-        }
-        return _response(200, response_body)
+        invocation = _combine(finished, placed)
+        emf.put("SsmPollCount", poll_stats["count"])
+        emf.put("SsmPollWait", poll_stats["waitedSeconds"] * 1000, "Milliseconds")
+        emf.put_ssm_timing(sent_at, invocation.get("ExecutionStartDateTime"), invocation.get("ExecutionEndDateTime"))
+        response = _invocation_response(invocation, comment, config_format, private_key)
+        return _with_fields(response, {"poll": poll_stats})
     except (ClientError, TimeoutError) as exc:
-        LOGGER.exception("Registration failed: %s", exc)
+        LOGGER.exception("Peer command failed: %s", exc)
         return _response(500, {
-            "message": "Failed to register peer.",
+            "message": LIST_FAILURE if comment == INVENTORY_COMMENT else JOB_KINDS[comment][1],
             "error": str(exc),
         })
     except Exception as exc:  # pylint: disable=broad-except
         LOGGER.exception("Unhandled error: %s", exc)
         return _response(500, {
-            "message": "Unexpected error during registration.",
+            "message": "Unexpected error while managing peers.",
             "error": str(exc),
         })
@@ -1,92 +1,109 @@
-import json
 import logging
 import os
 from datetime import datetime
-from zoneinfo import ZoneInfo
 
-import boto3
+from common import coalesce, emf, fleet, journal, tz
+from common.aws import LazyClient
+from common.fleet import EC2_BATCH_SIZE, chunks, requested_ids
+from common.http import response as _response
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-INSTANCE_ID = os.environ["INSTANCE_ID"]
-TIMEZONE = ZoneInfo(os.environ.get("TIMEZONE", "UTC"))
+INSTANCE_IDS, FLEET_TAG, FLEET_MODE, INSTANCE_ID = fleet.from_env()
+TIMEZONE = tz.local_zone()
 WEEKDAY_START_HOUR = int(os.environ.get("WEEKDAY_START_HOUR", 13))
 WEEKDAY_END_HOUR = int(os.environ.get("WEEKDAY_END_HOUR", 24))
-NOTIFICATION_TOPIC_ARN = os.environ.get("START_NOTIFICATION_TOPIC_ARN", "")
 
-DEFAULT_HEADERS = {
-    "Content-Type": "application/json",
-    "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Headers": "Content-Type,X-Api-Key",
-    "Access-Control-Allow-Methods": "OPTIONS,GET,POST"
-}
+# Created on first use, so a rejected start never pays for client setup.
+ec2 = LazyClient("ec2")
+operations = coalesce.Coalescer.from_env()
 
-ec2 = boto3.client("ec2")
-sns = boto3.client("sns")
 
-
-def _response(status: int, data: dict) -> dict:
-    return {
-        "statusCode": status,
-        "headers": DEFAULT_HEADERS,
-        "body": json.dumps(data, ensure_ascii=False)
-    }
+def _current_state() -> str:
+    return fleet.current_state(ec2, INSTANCE_ID)
 
 
-def _current_state() -> str:
-    reservations = ec2.describe_instances(InstanceIds=[INSTANCE_ID])["Reservations"]
-    instances = [instance for r in reservations for instance in r.get("Instances", [])]
-    if not instances:
-        raise RuntimeError("Instance metadata not found")
-    return instances[0]["State"]["Name"]
+def _fleet_instances() -> list:
+    return fleet.describe_fleet(ec2, INSTANCE_IDS, FLEET_TAG)
 
 
-def _extract_request_details(event: dict) -> dict:
-    request_context = {}
-    if isinstance(event, dict):
-        request_context = event.get("requestContext", {}) or {}
+def _trigger(event: dict) -> str:
+    # Only direct invocations (the scheduler) set a top-level trigger; API Gateway cannot.
+    if isinstance(event, dict) and event.get("trigger"):
+        return str(event["trigger"])
+    return "api"
 
-    identity = request_context.get("identity", {}) or {}
-    http_ctx = request_context.get("http", {}) or {}
 
-    return {
-        "sourceIp": identity.get("sourceIp") or http_ctx.get("sourceIp"),
-        "userAgent": identity.get("userAgent") or http_ctx.get("userAgent"),
-        "requestId": request_context.get("requestId") or request_context.get("requestId")
-    }
+def _record_start(event: dict, context, instance_ids: list, trigger: str) -> None:
+    # The journal consumer sends the notification, so SNS latency stays off this request.
+    journal.record("start", event, context, trigger=trigger, instanceIds=instance_ids)
 
 
-def _publish_start_event(request_meta: dict) -> None:
-    if not NOTIFICATION_TOPIC_ARN:
-        return
+def _request_id(context) -> str | None:
+    return getattr(context, "aws_request_id", None)
 
-    now_iso = datetime.now(TIMEZONE).isoformat()
-    body = {
-        "message": "VPN start initiated",
-        "instanceId": INSTANCE_ID,
-        "timestamp": now_iso,
-        "sourceIp": request_meta.get("sourceIp"),
-        "userAgent": request_meta.get("userAgent"),
-        "requestId": request_meta.get("requestId")
-    }
 
+def _start_fleet(event: dict, context) -> dict:
     try:
-        sns.publish(
-            TopicArn=NOTIFICATION_TOPIC_ARN,
-            Subject="VPN start requested",
-            Message=json.dumps(body, ensure_ascii=False)
-        )
-    except Exception as exc:  # pylint: disable=broad-except
-        LOGGER.exception("Failed to publish start notification: %s", exc)
+        requested = requested_ids(event)
+    except ValueError as exc:
+        return _response(400, {"message": str(exc)})
+
+    def start() -> dict:
+        instances = [
+            instance for instance in _fleet_instances()
+            if requested is None or instance["InstanceId"] in requested
+        ]
+        states = {instance["InstanceId"]: instance["State"]["Name"] for instance in instances}
+        to_start = [instance_id for instance_id, state in states.items() if state == "stopped"]
+        LOGGER.info("Fleet states: %s", states)
+
+        for chunk in chunks(to_start, EC2_BATCH_SIZE):
+            ec2.start_instances(InstanceIds=chunk)
+        if to_start:
+            _record_start(event, context, to_start, _trigger(event))
+            states.update({instance_id: "pending" for instance_id in to_start})
+
+        return {
+            "message": f"Start command issued for {len(to_start)} of {len(states)} instance(s).",
+            "started": to_start,
+            "instances": [{"instanceId": instance_id, "state": state} for instance_id, state in states.items()]
+        }
+
+    # Identical requests (the whole fleet, or the same instanceIds) share one start.
+    scope = coalesce.scope_key(requested) if requested else "fleet#all"
+    return _response(200, operations.run(scope, "start", start, _request_id(context)))
+
+
+def _start_instance(event: dict, trigger: str, context) -> dict:
+    current_state = _current_state()
+    LOGGER.info("Current instance state: %s", current_state)
+
+    if current_state in {"pending", "running"}:
+        return {
+            "message": "Instance is already running.",
+            "state": current_state
+        }
+
+    ec2.start_instances(InstanceIds=[INSTANCE_ID])
+    _record_start(event, context, [INSTANCE_ID], trigger)
+    return {
+        "message": "Start command issued successfully.",
+        "state": "pending",
+        "trigger": trigger
+    }
 
 
+@emf.instrument("start_instance")
 def handler(event, context):
     try:
         now = datetime.now(TIMEZONE)
-        LOGGER.info("Start request received at %s", now.isoformat())
+        trigger = _trigger(event)
+        LOGGER.info("Start request received at %s trigger=%s", now.isoformat(), trigger)
 
-        if now.weekday() < 5:
+        # The pre-warm schedule fires shortly before the weekday window opens.
+        if now.weekday() < 5 and trigger != "prewarm":
             if not (WEEKDAY_START_HOUR <= now.hour < WEEKDAY_END_HOUR):
                 return _response(403, {
                     "message": "VPN start is disabled until 13:00 Australia/Sydney on weekdays.",
@@ -94,22 +111,12 @@ def handler(event, context):
                     "allowedHoursLocal": [WEEKDAY_START_HOUR, WEEKDAY_END_HOUR]
                 })
 
-        current_state = _current_state()
-        LOGGER.info("Current instance state: %s", current_state)
-
-        if current_state in {"pending", "running"}:
-            return _response(200, {
-                "message": "Instance is already running.",
-                "state": current_state
-            })
-
-        request_meta = _extract_request_details(event)
-        ec2.start_instances(InstanceIds=[INSTANCE_ID])
-        _publish_start_event(request_meta)
-        return _response(200, {
-            "message": "Start command issued successfully.",
-            "state": "pending"
-        })
+        if FLEET_MODE:
+            return _start_fleet(event, context)
+
+        # Requests arriving while another start is under way get its status instead.
+        result = operations.run(INSTANCE_ID, "start", lambda: _start_instance(event, trigger, context), _request_id(context))
+        return _response(200, result)
     except Exception as exc:
         LOGGER.exception("Failed to start instance: %s", exc)
         return _response(500, {
@@ -1,65 +1,117 @@
-import json
 import logging
 import os
 from datetime import datetime
-from zoneinfo import ZoneInfo
 
-import boto3
+from botocore.exceptions import ClientError
+
+from common import coalesce, emf, fleet, journal, tz
+from common.aws import LazyClient
+from common.fleet import EC2_BATCH_SIZE, chunks, requested_ids
+from common.http import response as _response
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-ec2 = boto3.client("ec2")
+ec2 = LazyClient("ec2")
+operations = coalesce.Coalescer.from_env()
 
-INSTANCE_ID = os.environ["INSTANCE_ID"]
-TIMEZONE = ZoneInfo(os.environ.get("TIMEZONE", "UTC"))
+INSTANCE_IDS, FLEET_TAG, FLEET_MODE, INSTANCE_ID = fleet.from_env()
+TIMEZONE = tz.local_zone()
+# Hibernated instances resume with RAM and the WireGuard interface intact.
+HIBERNATE_ON_STOP = os.environ.get("HIBERNATE_ON_STOP", "false").lower() == "true"
 
-DEFAULT_HEADERS = {
-    "Content-Type": "application/json",
-    "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Headers": "Content-Type,X-Api-Key",
-    "Access-Control-Allow-Methods": "OPTIONS,GET,POST"
-}
 
+def _current_state() -> str:
+    return fleet.current_state(ec2, INSTANCE_ID)
 
-def _response(status: int, data: dict) -> dict:
-    return {
-        "statusCode": status,
-        "headers": DEFAULT_HEADERS,
-        "body": json.dumps(data, ensure_ascii=False)
-    }
 
+def _fleet_instances() -> list:
+    return fleet.describe_fleet(ec2, INSTANCE_IDS, FLEET_TAG)
+
+
+def _stop_instances(instance_ids: list) -> bool:
+    """Stop (hibernating when enabled) and report whether hibernation was requested."""
+    if HIBERNATE_ON_STOP:
+        try:
+            ec2.stop_instances(InstanceIds=instance_ids, Hibernate=True)
+            return True
+        except ClientError as err:
+            # Not configured for hibernation, or not ready to hibernate yet right after launch.
+            LOGGER.warning("Hibernate stop rejected, stopping normally: %s", err)
+    ec2.stop_instances(InstanceIds=instance_ids)
+    return False
 
-def _current_state() -> str:
-    reservations = ec2.describe_instances(InstanceIds=[INSTANCE_ID])["Reservations"]
-    instances = [instance for r in reservations for instance in r.get("Instances", [])]
-    if not instances:
-        raise RuntimeError("Instance metadata not found")
-    return instances[0]["State"]["Name"]
 
+def _request_id(context) -> str | None:
+    return getattr(context, "aws_request_id", None)
 
+
+def _stop_fleet(event: dict, trigger: str, context) -> dict:
+    try:
+        requested = requested_ids(event)
+    except ValueError as exc:
+        return _response(400, {"message": str(exc)})
+
+    def stop() -> dict:
+        instances = [
+            instance for instance in _fleet_instances()
+            if requested is None or instance["InstanceId"] in requested
+        ]
+        states = {instance["InstanceId"]: instance["State"]["Name"] for instance in instances}
+        to_stop = [instance_id for instance_id, state in states.items() if state in {"pending", "running"}]
+        LOGGER.info("Fleet states: %s", states)
+
+        hibernated = [_stop_instances(chunk) for chunk in chunks(to_stop, EC2_BATCH_SIZE)]
+        if to_stop:
+            journal.record("stop", event, context, trigger=trigger, instanceIds=to_stop,
+                           hibernate=all(hibernated))
+        states.update({instance_id: "stopping" for instance_id in to_stop})
+
+        return {
+            "message": f"Stop command issued for {len(to_stop)} of {len(states)} instance(s).",
+            "stopped": to_stop,
+            "hibernate": bool(hibernated) and all(hibernated),
+            "instances": [{"instanceId": instance_id, "state": state} for instance_id, state in states.items()],
+            "timestampLocal": datetime.now(TIMEZONE).isoformat()
+        }
+
+    scope = coalesce.scope_key(requested) if requested else "fleet#all"
+    return _response(200, {**operations.run(scope, "stop", stop, _request_id(context)), "trigger": trigger})
+
+
+def _stop_instance(event: dict, trigger: str, context) -> dict:
+    current_state = _current_state()
+    LOGGER.info("Current instance state: %s", current_state)
+
+    if current_state in {"stopping", "stopped"}:
+        return {
+            "message": "Instance is already stopping or stopped.",
+            "state": current_state
+        }
+
+    hibernate = _stop_instances([INSTANCE_ID])
+    journal.record("stop", event, context, trigger=trigger, instanceIds=[INSTANCE_ID], hibernate=hibernate)
+    return {
+        "message": "Stop command issued successfully.",
+        "state": "stopping",
+        "hibernate": hibernate,
+        "timestampLocal": datetime.now(TIMEZONE).isoformat()
+    }
+
+
+@emf.instrument("stop_instance")
 def handler(event, context):
     try:
         trigger = event.get("trigger") or event.get("source") or "api"
         LOGGER.info("Stop request trigger=%s", trigger)
 
-        current_state = _current_state()
-        LOGGER.info("Current instance state: %s", current_state)
-
-        if current_state in {"stopping", "stopped"}:
-            return _response(200, {
-                "message": "Instance is already stopping or stopped.",
-                "state": current_state,
-                "trigger": trigger
-            })
-
-        ec2.stop_instances(InstanceIds=[INSTANCE_ID])
-        return _response(200, {
-            "message": "Stop command issued successfully.",
-            "state": "stopping",
-            "trigger": trigger,
-            "timestampLocal": datetime.now(TIMEZONE).isoformat()
-        })
+        if FLEET_MODE:
+            return _stop_fleet(event, trigger, context)
+
+        # The midnight schedule, the idle monitor and API callers can race; one stop wins.
+        result = operations.run(INSTANCE_ID, "stop", lambda: _stop_instance(event, trigger, context),
+                                _request_id(context))
+        return _response(200, {**result, "trigger": trigger})
     except Exception as exc:
         LOGGER.exception("Failed to stop instance: %s", exc)
         return _response(500, {
@@ -0,0 +1,1365 @@
+"""WireGuard peer management script executed on the VPN instance via SSM.
+
+The register Lambda ships this file base64-encoded inside an
+``AWS-RunShellScript`` command, so it must only rely on the Python standard
+library available on the instance. Inputs arrive through environment variables
+and the result is printed as a single JSON line on stdout.
+
+Peers are indexed by public key in a sidecar file next to wg0.conf, and all
+writers serialize on a file lock before regenerating wg0.conf atomically.
+
+Run with ``serve`` (see ``instance/install_peer_agent.sh``) the same file acts
+as a resident agent that keeps the parsed peer table in memory and answers
+requests on a localhost socket, so SSM commands only need to send one line.
+The agent also tracks readiness after every boot or hibernation resume and,
+when ``WG_READY_TAG`` is set, tags the instance once ``wg0`` is listening.
+"""
+
+import base64
+import bisect
+import contextlib
+import fcntl
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import pathlib
+import re
+import secrets
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+ALLOCATOR_VERSION = 1
+INDEX_VERSION = 1
+DEFAULT_AGENT_PORT = 51821
+DEFAULT_AGENT_TOKEN_PATH = "/run/wg-peer-agent/token"
+DEFAULT_READINESS_PATH = "/run/wg-peer-agent/readiness.json"
+MAX_AGENT_MESSAGE_BYTES = 1 << 20
+# Keeps each ``wg set`` argument list well below the kernel's argv limit.
+WG_SET_CHUNK = 500
+# WireGuard re-handshakes every two minutes while traffic flows.
+ACTIVE_HANDSHAKE_SECONDS = 180
+# ListCommandInvocations truncates output at 2,500 characters, so only the top talkers are listed.
+MAX_USAGE_PEERS = 10
+# Column order of ``inventory`` rows; a compact row keeps snapshots of thousands of peers small.
+INVENTORY_FIELDS = ("publicKey", "assignedIp", "latestHandshake", "rxBytes", "txBytes", "registeredAt")
+# A jump in suspended time larger than this means the host resumed from hibernation.
+WAKE_JUMP_SECONDS = 5
+HANDSHAKE_POLL_MAX_SECONDS = 10.0
+IMDS_URL = "http://169.254.169.254"
+# Generic netlink and WireGuard constants from <linux/netlink.h>, <linux/genetlink.h> and <linux/wireguard.h>.
+NETLINK_GENERIC = 16
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLA_F_NESTED = 0x8000
+NLA_TYPE_MASK = 0x3FFF
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+WG_GENL_NAME = "wireguard"
+WG_GENL_VERSION = 1
+WG_CMD_GET_DEVICE = 0
+WG_CMD_SET_DEVICE = 1
+WGDEVICE_A_IFNAME = 2
+WGDEVICE_A_PUBLIC_KEY = 4
+WGDEVICE_A_LISTEN_PORT = 6
+WGDEVICE_A_PEERS = 8
+WGPEER_A_PUBLIC_KEY = 1
+WGPEER_A_PRESHARED_KEY = 2
+WGPEER_A_FLAGS = 3
+WGPEER_A_LAST_HANDSHAKE_TIME = 6
+WGPEER_A_RX_BYTES = 7
+WGPEER_A_TX_BYTES = 8
+WGPEER_A_ALLOWEDIPS = 9
+WGPEER_F_REMOVE_ME = 1
+WGALLOWEDIP_A_FAMILY = 1
+WGALLOWEDIP_A_IPADDR = 2
+WGALLOWEDIP_A_CIDR_MASK = 3
+# Peers per WG_CMD_SET_DEVICE message, bounded in bytes (about 300 new peers)
+# like wg(8) does. The peers travel in one WGDEVICE_A_PEERS attribute, whose
+# 16-bit length caps them at 65,531 bytes.
+NETLINK_MESSAGE_BYTES = 32768
+NLA_MAX_LENGTH = 0xFFFF
+# Kernel dump messages are at most 32 KiB.
+NETLINK_RECV_BYTES = 65536
+EC2_API_VERSION = "2016-11-15"
+_NOT_FULL_BYTE = re.compile(b"[^\xff]")
+
+
+def load_settings(environ: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    environ = os.environ if environ is None else environ
+    wg_conf_path = environ.get("WG_CONF_PATH", "/etc/wireguard/wg0.conf")
+    conf = pathlib.Path(wg_conf_path)
+    return {
+        "wg_conf_path": wg_conf_path,
+        "alloc_path": environ.get("WG_ALLOC_PATH") or str(conf.with_suffix(".ipalloc")),
+        "index_path": environ.get("WG_INDEX_PATH") or str(conf.with_suffix(".peers.json")),
+        "lock_path": str(conf.with_suffix(".lock")),
+        "usage_path": environ.get("WG_USAGE_PATH") or str(conf.with_suffix(".usage")),
+        "readiness_path": environ.get("WG_READINESS_PATH") or DEFAULT_READINESS_PATH,
+        "client_subnet": ipaddress.ip_network(environ["CLIENT_SUBNET"], strict=False),
+        "server_address": ipaddress.ip_address(environ["SERVER_ADDRESS"]),
+        "wg_interface": environ.get("WG_INTERFACE", "wg0"),
+        # "auto" uses netlink and falls back to the wg tool; "cli" or "netlink" force one.
+        "wg_control": environ.get("WG_CONTROL", "auto"),
+    }
+
+
+def parse_config(path: str) -> List[Dict[str, Any]]:
+    sections = []
+    current = None
+    with open(path, "r", encoding="utf-8") as fh:
+        for raw in fh:
+            stripped = raw.strip()
+            if stripped.startswith("[") and stripped.endswith("]"):
+                if current is not None:
+                    sections.append(current)
+                current = {"type": stripped.strip("[]"), "lines": [raw], "data": {}}
+            else:
+                if current is None:
+                    continue
+                current["lines"].append(raw)
+                if "=" in stripped:
+                    key, value = map(str.strip, stripped.split("=", 1))
+                    current["data"][key] = value
+    if current is not None:
+        sections.append(current)
+    return sections
+
+
+def _file_fingerprint(path: str) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtimeNs": stat.st_mtime_ns}
+
+
+def _atomic_write(path: str, data: bytes, mode: int = 0o600) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        pathlib.Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+class IpAllocator:
+    """Bitmap allocator over the host offsets of the client subnet.
+
+    Every offset below ``cursor`` is known to be taken, so the next free address
+    is found by skipping full bytes from the cursor onwards. Releasing an address
+    moves the cursor back, which keeps allocation O(1) amortized.
+    """
+
+    def __init__(self, subnet, bitmap: Optional[bytearray] = None, cursor: int = 0):
+        self.subnet = subnet
+        self._base = int(subnet.network_address)
+        self._size = subnet.num_addresses
+        self._bits = bitmap if bitmap is not None else bytearray((self._size + 7) // 8)
+        self._cursor = cursor
+        if bitmap is None and self._size > 2:
+            self._set(0)
+            self._set(self._size - 1)
+
+    @classmethod
+    def from_allowed_ips(cls, subnet, allowed_ips, reserved=()) -> "IpAllocator":
+        """Build an allocator from each peer's first AllowedIPs entry."""
+        allocator = cls(subnet)
+        for address in reserved:
+            allocator.reserve(address)
+        for entry in allowed_ips:
+            if entry:
+                allocator.reserve(entry)
+        return allocator
+
+    def _set(self, offset: int) -> None:
+        self._bits[offset >> 3] |= 1 << (offset & 7)
+
+    def _is_set(self, offset: int) -> bool:
+        return bool(self._bits[offset >> 3] & (1 << (offset & 7)))
+
+    def _offset(self, address) -> Optional[int]:
+        offset = int(ipaddress.ip_address(address)) - self._base
+        if 0 <= offset < self._size:
+            return offset
+        return None
+
+    def reserve(self, entry) -> None:
+        """Mark an address or network (clipped to the subnet) as used."""
+        network = ipaddress.ip_network(entry, strict=False)
+        if network.version != self.subnet.version:
+            return
+        first = max(int(network.network_address), self._base) - self._base
+        last = min(int(network.broadcast_address), self._base + self._size - 1) - self._base
+        if first > last:
+            return
+        if network.prefixlen < network.max_prefixlen and network.num_addresses > 2:
+            # Mirror ipaddress.hosts(): network and broadcast addresses stay unused.
+            first = max(first, int(network.network_address) + 1 - self._base)
+            last = min(last, int(network.broadcast_address) - 1 - self._base)
+        offset = first
+        while offset <= last and offset & 7:
+            self._set(offset)
+            offset += 1
+        full_bytes = (last + 1 - offset) >> 3
+        if full_bytes > 0:
+            self._bits[offset >> 3:(offset >> 3) + full_bytes] = b"\xff" * full_bytes
+            offset += full_bytes << 3
+        while offset <= last:
+            self._set(offset)
+            offset += 1
+
+    def is_allocated(self, address) -> bool:
+        offset = self._offset(address)
+        return offset is not None and self._is_set(offset)
+
+    def allocate(self):
+        match = _NOT_FULL_BYTE.search(self._bits, self._cursor >> 3)
+        while match is not None:
+            index = match.start()
+            value = self._bits[index]
+            for bit in range(8):
+                offset = (index << 3) | bit
+                if offset >= self._size:
+                    break
+                if offset >= self._cursor and not value & (1 << bit):
+                    self._set(offset)
+                    self._cursor = offset + 1
+                    return ipaddress.ip_address(self._base + offset)
+            match = _NOT_FULL_BYTE.search(self._bits, index + 1)
+        self._cursor = self._size
+        return None
+
+    def release(self, address) -> bool:
+        offset = self._offset(address)
+        if offset is None or not self._is_set(offset):
+            return False
+        self._bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+        self._cursor = min(self._cursor, offset)
+        return True
+
+    def dumps(self, source: Optional[Dict[str, int]] = None) -> bytes:
+        return json.dumps({
+            "version": ALLOCATOR_VERSION,
+            "subnet": str(self.subnet),
+            "cursor": self._cursor,
+            "bitmap": base64.b64encode(zlib.compress(bytes(self._bits))).decode("ascii"),
+            "source": source,
+        }).encode("utf-8")
+
+    @classmethod
+    def loads(cls, raw: bytes, subnet, source: Optional[Dict[str, int]] = None) -> Optional["IpAllocator"]:
+        """Restore a persisted allocator, or return None when it is stale."""
+        try:
+            state = json.loads(raw)
+            if state.get("version") != ALLOCATOR_VERSION or state.get("subnet") != str(subnet):
+                return None
+            if source is not None and state.get("source") != source:
+                return None
+            bitmap = bytearray(zlib.decompress(base64.b64decode(state["bitmap"])))
+        except (ValueError, KeyError, TypeError, zlib.error):
+            return None
+        if len(bitmap) != (subnet.num_addresses + 7) // 8:
+            return None
+        return cls(subnet, bitmap=bitmap, cursor=int(state.get("cursor", 0)))
+
+
+def load_allocator(settings: Dict[str, Any], allowed_ips=None) -> IpAllocator:
+    """Load the allocator persisted next to wg0.conf, rebuilding it if the config changed."""
+    source = _file_fingerprint(settings["wg_conf_path"])
+    try:
+        with open(settings["alloc_path"], "rb") as fh:
+            allocator = IpAllocator.loads(fh.read(), settings["client_subnet"], source)
+    except FileNotFoundError:
+        allocator = None
+    if allocator is None:
+        if allowed_ips is None:
+            allowed_ips = [entry["allowedIps"] for entry in scan_peers(settings["wg_conf_path"]).values()]
+        allocator = IpAllocator.from_allowed_ips(
+            settings["client_subnet"],
+            allowed_ips,
+            reserved=[settings["server_address"]],
+        )
+    return allocator
+
+
+def save_allocator(settings: Dict[str, Any], allocator: IpAllocator) -> None:
+    source = _file_fingerprint(settings["wg_conf_path"])
+    _atomic_write(settings["alloc_path"], allocator.dumps(source))
+
+
+def generate_psk() -> str:
+    # Same 32 random bytes ``wg genpsk`` produces, without forking per peer.
+    return base64.b64encode(os.urandom(32)).decode("ascii")
+
+
+def render_peer(peer: Dict[str, Any]) -> str:
+    lines = ["", "[Peer]", f"PublicKey = {peer['publicKey']}", f"AllowedIPs = {peer['assignedIp']}/32"]
+    if peer.get("presharedKey"):
+        lines.append(f"PreSharedKey = {peer['presharedKey']}")
+    return "\n".join(lines) + "\n"
+
+
+class WgCli:
+    """Thin wrapper over the ``wg`` command line tool."""
+
+    def __init__(self, interface: str):
+        self.interface = interface
+
+    def add_peers(self, peers: List[Dict[str, Any]]) -> None:
+        if not peers:
+            return
+        # addconf reads the fragment from stdin so preshared keys never touch disk.
+        subprocess.run(
+            ["wg", "addconf", self.interface, "/dev/stdin"],
+            input="".join(render_peer(peer) for peer in peers),
+            check=True,
+            text=True,
+        )
+
+    def remove_peers(self, public_keys: List[str]) -> None:
+        # Removing an unknown peer is a no-op for wg, so retries are safe.
+        for start in range(0, len(public_keys), WG_SET_CHUNK):
+            args = ["wg", "set", self.interface]
+            for public_key in public_keys[start:start + WG_SET_CHUNK]:
+                args += ["peer", public_key, "remove"]
+            subprocess.run(args, check=True)
+
+    def latest_handshakes(self) -> Dict[str, int]:
+        output = subprocess.run(
+            ["wg", "show", self.interface, "latest-handshakes"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        handshakes = {}
+        for line in output.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1].isdigit():
+                handshakes[parts[0]] = int(parts[1])
+        return handshakes
+
+    def dump(self) -> Iterator[Dict[str, Any]]:
+        """Yield per-peer transfer counters and handshake times from one ``wg show dump``.
+
+        Lines are parsed as ``wg`` writes them, so thousands of peers never sit
+        in memory as one output string.
+        """
+        with subprocess.Popen(["wg", "show", self.interface, "dump"], stdout=subprocess.PIPE, text=True) as proc:
+            # The first line describes the interface itself.
+            proc.stdout.readline()
+            for line in proc.stdout:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) >= 8:
+                    yield {
+                        "publicKey": fields[0],
+                        "allowedIps": fields[3],
+                        "latestHandshake": int(fields[4]),
+                        "rxBytes": int(fields[5]),
+                        "txBytes": int(fields[6]),
+                    }
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+    def listen_port(self) -> int:
+        try:
+            output = subprocess.run(
+                ["wg", "show", self.interface, "listen-port"],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.strip()
+        except subprocess.CalledProcessError:
+            return 0
+        return int(output) if output.isdigit() else 0
+
+    def public_key(self) -> str:
+        try:
+            return subprocess.run(
+                ["wg", "show", self.interface, "public-key"],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.strip()
+        except subprocess.CalledProcessError:
+            return ""
+
+
+def _nla(attr_type: int, payload: bytes) -> bytes:
+    length = 4 + len(payload)
+    if length > NLA_MAX_LENGTH:
+        raise ValueError(f"Netlink attribute {attr_type & NLA_TYPE_MASK} is {length} bytes; the limit is {NLA_MAX_LENGTH}")
+    return struct.pack("=HH", length, attr_type) + payload + b"\0" * (-length % 4)
+
+
+def _nla_nested(attr_type: int, payload: bytes) -> bytes:
+    return _nla(attr_type | NLA_F_NESTED, payload)
+
+
+def _nla_parse(data: bytes) -> Iterator[Tuple[int, bytes]]:
+    offset = 0
+    while offset + 4 <= len(data):
+        length, attr_type = struct.unpack_from("=HH", data, offset)
+        if length < 4:
+            return
+        yield attr_type & NLA_TYPE_MASK, data[offset + 4:offset + length]
+        offset += (length + 3) & ~3
+
+
+def _genl(command: int, attrs: bytes, version: int = WG_GENL_VERSION) -> bytes:
+    return struct.pack("=BBH", command, version, 0) + attrs
+
+
+def _key_bytes(key: str) -> bytes:
+    raw = base64.b64decode(key, validate=True)
+    if len(raw) != 32:
+        raise ValueError(f"WireGuard keys are 32 bytes: {key}")
+    return raw
+
+
+def _peer_attrs(peer: Dict[str, Any]) -> bytes:
+    """Encode one peer to add, as ``wg addconf`` would with ``render_peer``."""
+    address = ipaddress.ip_address(peer["assignedIp"])
+    allowed_ip = _nla_nested(0, (
+        _nla(WGALLOWEDIP_A_FAMILY, struct.pack("=H", socket.AF_INET if address.version == 4 else socket.AF_INET6))
+        + _nla(WGALLOWEDIP_A_IPADDR, address.packed)
+        + _nla(WGALLOWEDIP_A_CIDR_MASK, bytes([address.max_prefixlen]))
+    ))
+    attrs = _nla(WGPEER_A_PUBLIC_KEY, _key_bytes(peer["publicKey"]))
+    if peer.get("presharedKey"):
+        attrs += _nla(WGPEER_A_PRESHARED_KEY, _key_bytes(peer["presharedKey"]))
+    return _nla_nested(0, attrs + _nla_nested(WGPEER_A_ALLOWEDIPS, allowed_ip))
+
+
+def _decode_peer(data: bytes) -> Dict[str, Any]:
+    peer = {"publicKey": "", "allowed": [], "latestHandshake": 0, "rxBytes": 0, "txBytes": 0}
+    for attr_type, value in _nla_parse(data):
+        if attr_type == WGPEER_A_PUBLIC_KEY:
+            peer["publicKey"] = base64.b64encode(value).decode("ascii")
+        elif attr_type == WGPEER_A_LAST_HANDSHAKE_TIME:
+            peer["latestHandshake"] = struct.unpack_from("=q", value)[0]
+        elif attr_type == WGPEER_A_RX_BYTES:
+            peer["rxBytes"] = struct.unpack_from("=Q", value)[0]
+        elif attr_type == WGPEER_A_TX_BYTES:
+            peer["txBytes"] = struct.unpack_from("=Q", value)[0]
+        elif attr_type == WGPEER_A_ALLOWEDIPS:
+            for _, allowed in _nla_parse(value):
+                fields = dict(_nla_parse(allowed))
+                address = ipaddress.ip_address(fields[WGALLOWEDIP_A_IPADDR])
+                peer["allowed"].append(f"{address}/{fields[WGALLOWEDIP_A_CIDR_MASK][0]}")
+    return peer
+
+
+class WgNetlink:
+    """Drives the interface over WireGuard's generic netlink family instead of forking ``wg``.
+
+    It offers the same methods as ``WgCli``. Additions and removals go out as
+    ``WG_CMD_SET_DEVICE`` messages holding as many peers as fit in
+    ``NETLINK_MESSAGE_BYTES``, and preshared keys pass straight from memory
+    into the kernel. Reads take one ``WG_CMD_GET_DEVICE`` dump. Construction
+    raises ``OSError`` when the kernel has no ``wireguard`` family.
+    """
+
+    def __init__(self, interface: str, sock=None):
+        self.interface = interface
+        if sock is None:
+            if not hasattr(socket, "AF_NETLINK"):
+                raise OSError("netlink sockets are not available on this platform")
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        self._sock = sock
+        self._seq = 0
+        # The readiness watcher and the request handler share one socket.
+        self._lock = threading.Lock()
+        try:
+            self.family = self.resolve_family(WG_GENL_NAME)
+        except OSError:
+            self._sock.close()
+            raise
+
+    def _transact(self, msg_type: int, flags: int, payload: bytes) -> List[bytes]:
+        """Send one request and return the payloads of its replies, raising ``OSError`` on a netlink error."""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._sock.send(struct.pack("=IHHII", 16 + len(payload), msg_type, flags | NLM_F_REQUEST, seq, 0) + payload)
+            replies = []
+            while True:
+                data = self._sock.recv(NETLINK_RECV_BYTES)
+                offset = 0
+                while offset + 16 <= len(data):
+                    length, kind, reply_flags, reply_seq, _ = struct.unpack_from("=IHHII", data, offset)
+                    body = data[offset + 16:offset + length]
+                    offset += (length + 3) & ~3
+                    if reply_seq != seq:
+                        continue
+                    if kind == NLMSG_ERROR:
+                        error = -struct.unpack_from("=i", body)[0]
+                        if error:
+                            raise OSError(error, os.strerror(error))
+                        return replies
+                    if kind == NLMSG_DONE:
+                        return replies
+                    replies.append(body)
+                    if not reply_flags & NLM_F_MULTI and not flags & NLM_F_ACK:
+                        return replies
+
+    def resolve_family(self, name: str) -> int:
+        request = _genl(CTRL_CMD_GETFAMILY, _nla(CTRL_ATTR_FAMILY_NAME, name.encode("ascii") + b"\0"), version=1)
+        for reply in self._transact(GENL_ID_CTRL, 0, request):
+            for attr_type, value in _nla_parse(reply[4:]):
+                if attr_type == CTRL_ATTR_FAMILY_ID:
+                    return struct.unpack_from("=H", value)[0]
+        raise OSError(f"generic netlink family {name!r} has no ID")
+
+    def _ifname(self) -> bytes:
+        return _nla(WGDEVICE_A_IFNAME, self.interface.encode("ascii") + b"\0")
+
+    def _set_peers(self, encoded: Iterator[bytes]) -> None:
+        batch, size = [], 0
+        for peer in encoded:
+            if batch and size + len(peer) > NETLINK_MESSAGE_BYTES:
+                self._set_device(batch)
+                batch, size = [], 0
+            batch.append(peer)
+            size += len(peer)
+        if batch:
+            self._set_device(batch)
+
+    def _set_device(self, peers: List[bytes]) -> None:
+        attrs = self._ifname() + _nla_nested(WGDEVICE_A_PEERS, b"".join(peers))
+        self._transact(self.family, NLM_F_ACK, _genl(WG_CMD_SET_DEVICE, attrs))
+
+    def _get_device(self) -> List[bytes]:
+        """Return the attributes of every message in one device dump."""
+        replies = self._transact(self.family, NLM_F_DUMP, _genl(WG_CMD_GET_DEVICE, self._ifname()))
+        return [reply[4:] for reply in replies]
+
+    def _device_value(self, wanted: int) -> Optional[bytes]:
+        try:
+            replies = self._get_device()
+        except OSError:
+            return None
+        for attrs in replies[:1]:
+            for attr_type, value in _nla_parse(attrs):
+                if attr_type == wanted:
+                    return value
+        return None
+
+    def add_peers(self, peers: List[Dict[str, Any]]) -> None:
+        self._set_peers(_peer_attrs(peer) for peer in peers)
+
+    def remove_peers(self, public_keys: List[str]) -> None:
+        # Removing an unknown peer is a no-op for the kernel too, so retries are safe.
+        self._set_peers(
+            _nla_nested(0, _nla(WGPEER_A_PUBLIC_KEY, _key_bytes(public_key))
+                        + _nla(WGPEER_A_FLAGS, struct.pack("=I", WGPEER_F_REMOVE_ME)))
+            for public_key in public_keys
+        )
+
+    def latest_handshakes(self) -> Dict[str, int]:
+        return {peer["publicKey"]: peer["latestHandshake"] for peer in self.dump()}
+
+    def dump(self) -> Iterator[Dict[str, Any]]:
+        """Yield peers as ``WgCli.dump`` does.
+
+        A peer whose allowed IPs do not fit in one dump message continues in
+        the next under the same public key, so consecutive entries are merged.
+        """
+        current = None
+        for attrs in self._get_device():
+            for attr_type, value in _nla_parse(attrs):
+                if attr_type != WGDEVICE_A_PEERS:
+                    continue
+                for _, peer_attrs in _nla_parse(value):
+                    peer = _decode_peer(peer_attrs)
+                    if current is not None and peer["publicKey"] == current["publicKey"]:
+                        current["allowed"] += peer["allowed"]
+                        continue
+                    if current is not None:
+                        yield self._row(current)
+                    current = peer
+        if current is not None:
+            yield self._row(current)
+
+    @staticmethod
+    def _row(peer: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "publicKey": peer["publicKey"],
+            "allowedIps": ",".join(peer["allowed"]) or "(none)",
+            "latestHandshake": peer["latestHandshake"],
+            "rxBytes": peer["rxBytes"],
+            "txBytes": peer["txBytes"],
+        }
+
+    def listen_port(self) -> int:
+        value = self._device_value(WGDEVICE_A_LISTEN_PORT)
+        return struct.unpack_from("=H", value)[0] if value else 0
+
+    def public_key(self) -> str:
+        value = self._device_value(WGDEVICE_A_PUBLIC_KEY)
+        return base64.b64encode(value).decode("ascii") if value else ""
+
+
+def open_wg(interface: str, control: str = "auto"):
+    """Return ``WgNetlink`` for ``interface``, or ``WgCli`` when netlink is unavailable or ``control`` is "cli"."""
+    if control != "cli":
+        try:
+            return WgNetlink(interface)
+        except OSError as exc:
+            if control == "netlink":
+                raise
+            print(f"WireGuard netlink unavailable, using wg: {exc}", file=sys.stderr)
+    return WgCli(interface)
+
+
+def _read_peer_block(data: bytes) -> Dict[str, str]:
+    values = {}
+    for raw in data.decode("utf-8").splitlines():
+        stripped = raw.strip()
+        if "=" in stripped and not stripped.startswith("["):
+            key, value = map(str.strip, stripped.split("=", 1))
+            values[key] = value
+    return values
+
+
+def scan_peers(path: str) -> Dict[str, Dict[str, Any]]:
+    """Index ``[Peer]`` sections by public key in a single pass, recording byte ranges."""
+    peers = {}
+    current = None
+    offset = 0
+
+    def _close(end: int) -> None:
+        if current is not None and current["publicKey"]:
+            peers[current["publicKey"]] = {
+                "allowedIps": current["allowedIps"],
+                "offset": current["offset"],
+                "length": end - current["offset"],
+            }
+
+    with open(path, "rb") as fh:
+        for raw in fh:
+            stripped = raw.strip()
+            if stripped.startswith(b"[") and stripped.endswith(b"]"):
+                _close(offset)
+                current = None
+                if stripped[1:-1].strip().lower() == b"peer":
+                    current = {"publicKey": None, "allowedIps": None, "offset": offset}
+            elif current is not None and b"=" in stripped:
+                key, value = (part.strip() for part in stripped.split(b"=", 1))
+                if key == b"PublicKey":
+                    current["publicKey"] = value.decode("utf-8")
+                elif key == b"AllowedIPs":
+                    current["allowedIps"] = value.split(b",", 1)[0].strip().decode("utf-8")
+            offset += len(raw)
+    _close(offset)
+    return peers
+
+
+class PeerStore:
+    """Sidecar index of wg0.conf peers keyed by public key.
+
+    Each entry maps to the peer's first AllowedIPs entry, the byte range of its
+    ``[Peer]`` block, its registration time and the last time it was seen
+    active, so duplicate lookups never parse the whole config. The index is a
+    JSON-lines journal: registrations append entries followed by the new
+    wg0.conf fingerprint, removals rewrite it, and the journal is rebuilt from
+    wg0.conf whenever its last fingerprint no longer matches the file.
+    """
+
+    def __init__(self, settings: Dict[str, Any]):
+        self.settings = settings
+        self.conf_path = settings["wg_conf_path"]
+        self.index_path = settings["index_path"]
+        self.fingerprint = None
+        self.peers = {}
+        self._allocator = None
+
+    @property
+    def allocator(self) -> IpAllocator:
+        if self._allocator is None:
+            allowed_ips = [entry["allowedIps"] for entry in self.peers.values()]
+            self._allocator = load_allocator(self.settings, allowed_ips)
+        return self._allocator
+
+    def is_current(self) -> bool:
+        try:
+            return self.fingerprint is not None and _file_fingerprint(self.conf_path) == self.fingerprint
+        except FileNotFoundError:
+            return False
+
+    def _read_index(self) -> Tuple[Dict[str, Dict[str, Any]], Optional[Dict[str, int]]]:
+        """Replay the index journal; the last ``source`` line must be the final line."""
+        try:
+            with open(self.index_path, "rb") as fh:
+                header, _, body = fh.read().partition(b"\n")
+            if json.loads(header or b"{}").get("version") != INDEX_VERSION:
+                return {}, None
+        except FileNotFoundError:
+            return {}, None
+        except (ValueError, AttributeError):
+            return {}, None
+
+        lines = [line for line in body.split(b"\n") if line]
+        torn = False
+        try:
+            # One json.loads over the whole journal is much faster than one per line.
+            records = json.loads(b"[" + b",".join(lines) + b"]")
+        except ValueError:
+            # A torn append leaves a partial line: salvage what parses, but report stale.
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    torn = True
+
+        peers = {}
+        source = None
+        for record in records:
+            if "source" in record:
+                source = record["source"]
+                continue
+            source = None
+            peers[record.pop("publicKey")] = record
+        return peers, None if torn else source
+
+    def load(self) -> None:
+        fingerprint = _file_fingerprint(self.conf_path)
+        previous, source = self._read_index()
+        if source is not None and source == fingerprint:
+            self.peers = previous
+            self.fingerprint = fingerprint
+            self._allocator = None
+            return
+
+        peers = scan_peers(self.conf_path)
+        for public_key, entry in peers.items():
+            known = previous.get(public_key) or {}
+            entry["registeredAt"] = known.get("registeredAt")
+            entry["lastSeen"] = known.get("lastSeen")
+        self.peers = peers
+        self.fingerprint = fingerprint
+        self._allocator = None
+        self._save_index()
+
+    @staticmethod
+    def _index_lines(peers: Dict[str, Dict[str, Any]], source: Dict[str, int]) -> bytes:
+        lines = [json.dumps({"publicKey": key, **entry}, separators=(",", ":")) for key, entry in peers.items()]
+        lines.append(json.dumps({"source": source}, separators=(",", ":")))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def _save_index(self) -> None:
+        header = json.dumps({"version": INDEX_VERSION}).encode("utf-8") + b"\n"
+        _atomic_write(self.index_path, header + self._index_lines(self.peers, self.fingerprint))
+
+    def flush(self) -> None:
+        """Rewrite the index from memory, e.g. after updating ``lastSeen``. Call with the lock held."""
+        self._save_index()
+
+    def _append_index(self, peers: Dict[str, Dict[str, Any]]) -> None:
+        # Appending keeps registration cost proportional to the batch, not the peer count.
+        with open(self.index_path, "ab") as fh:
+            fh.write(self._index_lines(peers, self.fingerprint))
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Serialize writers across processes and refresh the index if the config moved."""
+        with open(self.settings["lock_path"], "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if not self.is_current():
+                    self.load()
+                yield self
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def lookup(self, public_key: str) -> Optional[Dict[str, Any]]:
+        entry = self.peers.get(public_key)
+        if entry is None:
+            return None
+        with open(self.conf_path, "rb") as fh:
+            fh.seek(entry["offset"])
+            values = _read_peer_block(fh.read(entry["length"]))
+        allowed = entry.get("allowedIps") or ""
+        return {
+            "publicKey": public_key,
+            "alreadyExists": True,
+            "assignedIp": allowed.split("/", 1)[0] if allowed else None,
+            "presharedKey": values.get("PreSharedKey"),
+        }
+
+    def add(self, new_peers: List[Dict[str, Any]]) -> None:
+        """Append peers by regenerating wg0.conf atomically. Call with the lock held."""
+        with open(self.conf_path, "rb") as fh:
+            current = fh.read()
+        if current and not current.endswith(b"\n"):
+            current += b"\n"
+        blocks = [render_peer(peer).encode("utf-8") for peer in new_peers]
+        _atomic_write(self.conf_path, current + b"".join(blocks), os.stat(self.conf_path).st_mode & 0o777)
+
+        offset = len(current)
+        registered_at = int(time.time())
+        added = {}
+        for peer, block in zip(new_peers, blocks):
+            added[peer["publicKey"]] = {
+                "allowedIps": f"{peer['assignedIp']}/32",
+                "offset": offset,
+                "length": len(block),
+                "registeredAt": registered_at,
+            }
+            offset += len(block)
+        self.peers.update(added)
+        self.fingerprint = _file_fingerprint(self.conf_path)
+        save_allocator(self.settings, self.allocator)
+        self._append_index(added)
+
+    def remove(self, public_keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Cut peers out of wg0.conf and return their addresses to the pool. Call with the lock held."""
+        removed = {key: self.peers[key] for key in public_keys if key in self.peers}
+        if not removed:
+            return {}
+        allocator = self.allocator
+        with open(self.conf_path, "rb") as fh:
+            current = fh.read()
+        spans = sorted((entry["offset"], entry["offset"] + entry["length"]) for entry in removed.values())
+        parts = []
+        position = 0
+        for start, end in spans:
+            parts.append(current[position:start])
+            position = end
+        parts.append(current[position:])
+        _atomic_write(self.conf_path, b"".join(parts), os.stat(self.conf_path).st_mode & 0o777)
+
+        # Shift surviving byte ranges by the bytes cut out in front of them.
+        starts = [start for start, _ in spans]
+        cut_before = [0]
+        for start, end in spans:
+            cut_before.append(cut_before[-1] + end - start)
+        peers = {}
+        for key, entry in self.peers.items():
+            if key not in removed:
+                entry["offset"] -= cut_before[bisect.bisect_right(starts, entry["offset"])]
+                peers[key] = entry
+        self.peers = peers
+        self.fingerprint = _file_fingerprint(self.conf_path)
+
+        for entry in removed.values():
+            network = ipaddress.ip_network(entry.get("allowedIps") or "0.0.0.0/0", strict=False)
+            if network.num_addresses == 1:
+                allocator.release(network.network_address)
+            elif entry.get("allowedIps"):
+                # Wider hand-written ranges may overlap other peers; rebuild instead.
+                allocator = IpAllocator.from_allowed_ips(
+                    self.settings["client_subnet"],
+                    [peer["allowedIps"] for peer in peers.values()],
+                    reserved=[self.settings["server_address"]],
+                )
+                break
+        self._allocator = allocator
+        save_allocator(self.settings, allocator)
+        self._save_index()
+        return removed
+
+
+def register_peers(public_keys: List[str], settings: Dict[str, Any], wg,
+                   store: Optional[PeerStore] = None) -> Dict[str, Any]:
+    """Register a batch of peers with one index lookup pass, one write and one ``wg addconf``."""
+    public_keys = [key.strip() for key in public_keys]
+    if not public_keys or not all(public_keys):
+        raise SystemExit("Missing public key")
+
+    store = store or PeerStore(settings)
+    with store.locked():
+        results = []
+        new_peers = []
+        seen = {}
+        for public_key in public_keys:
+            if public_key in seen:
+                results.append(seen[public_key])
+                continue
+            result = store.lookup(public_key)
+            if result is None:
+                available_ip = store.allocator.allocate()
+                if available_ip is None:
+                    result = {"publicKey": public_key, "error": "No available client IP addresses"}
+                else:
+                    result = {
+                        "publicKey": public_key,
+                        "alreadyExists": False,
+                        "assignedIp": str(available_ip),
+                        "presharedKey": generate_psk(),
+                    }
+                    new_peers.append(result)
+            seen[public_key] = result
+            results.append(result)
+
+        if new_peers:
+            store.add(new_peers)
+            wg.add_peers(new_peers)
+        remaining = len(store.peers)
+
+    return {"results": results, "serverPublicKey": wg.public_key(), "remaining": remaining}
+
+
+def _released_ip(entry: Dict[str, Any]) -> Optional[str]:
+    allowed = entry.get("allowedIps") or ""
+    return allowed.split("/", 1)[0] if allowed else None
+
+
+def revoke_peers(public_keys: List[str], settings: Dict[str, Any], wg,
+                 store: Optional[PeerStore] = None) -> Dict[str, Any]:
+    """Remove peers from the live interface and wg0.conf, releasing their addresses."""
+    public_keys = list(dict.fromkeys(key.strip() for key in public_keys))
+    if not public_keys or not all(public_keys):
+        raise SystemExit("Missing public key")
+
+    store = store or PeerStore(settings)
+    with store.locked():
+        # Drop the live peers first: if the config rewrite fails, a retry still finds them there.
+        wg.remove_peers(public_keys)
+        removed = store.remove(public_keys)
+        remaining = len(store.peers)
+
+    results = []
+    for public_key in public_keys:
+        entry = removed.get(public_key)
+        results.append({
+            "publicKey": public_key,
+            "removed": entry is not None,
+            "releasedIp": _released_ip(entry) if entry else None,
+        })
+    return {"results": results, "remaining": remaining}
+
+
+def prune_peers(inactive_days, settings: Dict[str, Any], wg, store: Optional[PeerStore] = None,
+                dry_run: bool = False, now: Optional[int] = None) -> Dict[str, Any]:
+    """Revoke peers whose last handshake is older than ``inactive_days``.
+
+    Handshake times reset when the interface restarts, so each run folds them
+    into the ``lastSeen`` time kept in the index. Peers never seen and with no
+    known registration time start their clock at the first prune that sees them.
+    """
+    if isinstance(inactive_days, bool) or not isinstance(inactive_days, (int, float)) or inactive_days <= 0:
+        raise SystemExit("inactiveDays must be a positive number")
+
+    store = store or PeerStore(settings)
+    with store.locked():
+        now = int(time.time()) if now is None else now
+        cutoff = now - int(inactive_days * 86400)
+        handshakes = wg.latest_handshakes()
+        stale = []
+        for public_key, entry in store.peers.items():
+            last_seen = max(
+                handshakes.get(public_key, 0),
+                entry.get("lastSeen") or 0,
+                entry.get("registeredAt") or 0,
+            ) or now
+            entry["lastSeen"] = last_seen
+            if last_seen < cutoff:
+                stale.append(public_key)
+
+        pruned = [
+            {"publicKey": key, "releasedIp": _released_ip(store.peers[key]), "lastSeen": store.peers[key]["lastSeen"]}
+            for key in stale
+        ]
+        if stale and not dry_run:
+            wg.remove_peers(stale)
+            store.remove(stale)
+        else:
+            store.flush()
+
+    return {
+        "pruned": pruned,
+        "dryRun": dry_run,
+        "inactiveDays": inactive_days,
+        "remaining": len(store.peers),
+    }
+
+
+def sample_usage(settings: Dict[str, Any], wg, now: Optional[float] = None) -> Dict[str, Any]:
+    """Diff the interface transfer counters against the previous sample kept next to wg0.conf."""
+    now = time.time() if now is None else now
+    try:
+        with open(settings["usage_path"], "rb") as fh:
+            previous = json.loads(fh.read())
+    except (FileNotFoundError, ValueError):
+        previous = {}
+    last_counters = previous.get("peers") or {}
+
+    counters = {}
+    talkers = []
+    rx_total = tx_total = active = 0
+    for peer in wg.dump():
+        public_key = peer["publicKey"]
+        rx, tx = peer["rxBytes"], peer["txBytes"]
+        last_rx, last_tx = last_counters.get(public_key) or (0, 0)
+        # Counters restart from zero when the interface comes back up.
+        delta_rx = rx - last_rx if rx >= last_rx else rx
+        delta_tx = tx - last_tx if tx >= last_tx else tx
+        counters[public_key] = [rx, tx]
+        rx_total += delta_rx
+        tx_total += delta_tx
+        if peer["latestHandshake"] and now - peer["latestHandshake"] <= ACTIVE_HANDSHAKE_SECONDS:
+            active += 1
+        if delta_rx or delta_tx:
+            talkers.append({"publicKey": public_key, "rxBytes": delta_rx, "txBytes": delta_tx})
+
+    _atomic_write(settings["usage_path"], json.dumps({"sampledAt": now, "peers": counters}).encode("utf-8"))
+    talkers.sort(key=lambda item: item["rxBytes"] + item["txBytes"], reverse=True)
+    sampled_at = previous.get("sampledAt")
+    return {
+        "sampledAt": int(now),
+        "intervalSeconds": round(now - sampled_at, 3) if sampled_at else None,
+        "rxBytes": rx_total,
+        "txBytes": tx_total,
+        "activePeers": active,
+        "peerCount": len(counters),
+        "topPeers": talkers[:MAX_USAGE_PEERS],
+        "readiness": read_readiness(settings),
+    }
+
+
+def peer_inventory(settings: Dict[str, Any], wg, store: Optional[PeerStore] = None,
+                   now: Optional[float] = None) -> Dict[str, Any]:
+    """List every live peer from one ``wg show dump`` pass joined with the index.
+
+    Each peer is a compact row in ``INVENTORY_FIELDS`` order, sorted by public
+    key so callers can page through it with the last key as a cursor.
+    """
+    store = store or PeerStore(settings)
+    with store.locked():
+        registered = {key: entry.get("registeredAt") for key, entry in store.peers.items()}
+    now = time.time() if now is None else now
+
+    rows = []
+    for peer in wg.dump():
+        allowed = peer.get("allowedIps") or ""
+        address = allowed.split(",", 1)[0].split("/", 1)[0].strip()
+        rows.append([
+            peer["publicKey"],
+            address if address and address != "(none)" else None,
+            peer["latestHandshake"] or None,
+            peer["rxBytes"],
+            peer["txBytes"],
+            registered.get(peer["publicKey"]),
+        ])
+    rows.sort()
+    return {
+        "generatedAt": int(now),
+        "serverPublicKey": wg.public_key(),
+        "fields": list(INVENTORY_FIELDS),
+        "peers": rows,
+    }
+
+
+def _suspended_seconds() -> float:
+    """Time the host has spent suspended or hibernated since boot."""
+    return time.clock_gettime(time.CLOCK_BOOTTIME) - time.monotonic()
+
+
+def read_readiness(settings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    try:
+        with open(settings["readiness_path"], "rb") as fh:
+            return json.loads(fh.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class ReadinessTracker:
+    """Records when the host last woke (boot or hibernation resume), when ``wg0`` listened and its first handshake.
+
+    The resident agent ticks it about once a second; ``wg`` is only polled
+    (with backoff) until the interface listens and the first handshake after
+    a wake is seen. ``announce`` publishes the listening time off the box
+    and is retried on later polls until it succeeds.
+    """
+
+    def __init__(self, settings: Dict[str, Any], wg, woke_at: float, suspended: float, announce=None):
+        self.settings = settings
+        self.wg = wg
+        self.suspended = suspended
+        self.announce = announce
+        self._wake("boot", woke_at)
+
+    def _wake(self, kind: str, woke_at: float) -> None:
+        self.state = {
+            "wake": kind,
+            "wokeAt": int(woke_at),
+            "listeningAt": None,
+            "announced": False,
+            "firstHandshakeAt": None,
+            "secondsToFirstHandshake": None,
+        }
+        self._poll_delay = 1.0
+        self._next_poll = 0.0
+        self._save()
+
+    def _save(self) -> None:
+        _atomic_write(self.settings["readiness_path"], json.dumps(self.state).encode("utf-8"))
+
+    def _pending(self) -> bool:
+        state = self.state
+        unannounced = self.announce is not None and not state["announced"]
+        return state["listeningAt"] is None or unannounced or state["firstHandshakeAt"] is None
+
+    def tick(self, now: float, suspended: float) -> None:
+        if suspended - self.suspended > WAKE_JUMP_SECONDS:
+            self._wake("resume", now)
+        self.suspended = suspended
+        if not self._pending() or now < self._next_poll:
+            return
+
+        state = self.state
+        if state["listeningAt"] is None and self.wg.listen_port():
+            state["listeningAt"] = int(now)
+            self._save()
+        if state["listeningAt"] is not None and self.announce is not None and not state["announced"]:
+            try:
+                self.announce(state["listeningAt"])
+                state["announced"] = True
+                self._save()
+            except Exception as exc:  # pylint: disable=broad-except
+                print(f"readiness announce failed: {exc}", file=sys.stderr)
+        if state["firstHandshakeAt"] is None:
+            recent = [at for at in self.wg.latest_handshakes().values() if at >= state["wokeAt"]]
+            if recent:
+                state["firstHandshakeAt"] = min(recent)
+                state["secondsToFirstHandshake"] = min(recent) - state["wokeAt"]
+                self._save()
+        if self._pending():
+            self._poll_delay = min(self._poll_delay * 1.5, HANDSHAKE_POLL_MAX_SECONDS)
+            self._next_poll = now + self._poll_delay
+
+
+def _imds(path: str, token: Optional[str] = None, method: str = "GET") -> str:
+    headers = {"X-aws-ec2-metadata-token": token} if token else {"X-aws-ec2-metadata-token-ttl-seconds": "300"}
+    request = urllib.request.Request(IMDS_URL + path, method=method, headers=headers)
+    with urllib.request.urlopen(request, timeout=2) as response:
+        return response.read().decode("utf-8")
+
+
+def instance_identity() -> Dict[str, Any]:
+    """Instance ID, region and instance-profile credentials from IMDSv2."""
+    token = _imds("/latest/api/token", method="PUT")
+    role = _imds("/latest/meta-data/iam/security-credentials/", token).split()[0]
+    credentials = json.loads(_imds(f"/latest/meta-data/iam/security-credentials/{role}", token))
+    return {
+        "instanceId": _imds("/latest/meta-data/instance-id", token),
+        "region": _imds("/latest/meta-data/placement/region", token),
+        "credentials": {
+            "accessKeyId": credentials["AccessKeyId"],
+            "secretAccessKey": credentials["SecretAccessKey"],
+            "token": credentials.get("Token"),
+        },
+    }
+
+
+def sigv4_headers(method: str, host: str, region: str, service: str, body: bytes,
+                  credentials: Dict[str, Any], now: float) -> Dict[str, str]:
+    """Sign a form-encoded request to ``https://<host>/`` with AWS Signature Version 4."""
+    amz_date = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(now))
+    headers = {
+        "content-type": "application/x-www-form-urlencoded; charset=utf-8",
+        "host": host,
+        "x-amz-date": amz_date,
+    }
+    if credentials.get("token"):
+        headers["x-amz-security-token"] = credentials["token"]
+    signed_headers = ";".join(sorted(headers))
+    canonical_request = "\n".join([
+        method,
+        "/",
+        "",
+        *(f"{name}:{headers[name]}" for name in sorted(headers)),
+        "",
+        signed_headers,
+        hashlib.sha256(body).hexdigest(),
+    ])
+    scope = f"{amz_date[:8]}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256",
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+    ])
+    key = ("AWS4" + credentials["secretAccessKey"]).encode("utf-8")
+    for part in (amz_date[:8], region, service, "aws4_request"):
+        key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+    headers["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={credentials['accessKeyId']}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return headers
+
+
+def announce_ready(tag_key: str, ready_at: int, identity: Optional[Dict[str, Any]] = None) -> None:
+    """Tag this instance with the time ``wg0`` started listening, using only the standard library."""
+    identity = identity or instance_identity()
+    host = f"ec2.{identity['region']}.amazonaws.com"
+    body = urllib.parse.urlencode({
+        "Action": "CreateTags",
+        "Version": EC2_API_VERSION,
+        "ResourceId.1": identity["instanceId"],
+        "Tag.1.Key": tag_key,
+        "Tag.1.Value": str(int(ready_at)),
+    }).encode("ascii")
+    headers = sigv4_headers("POST", host, identity["region"], "ec2", body, identity["credentials"], time.time())
+    request = urllib.request.Request(f"https://{host}/", data=body, headers=headers, method="POST")
+    with urllib.request.urlopen(request, timeout=5) as response:
+        response.read()
+
+
+def watch_readiness(tracker: ReadinessTracker) -> None:
+    while True:
+        try:
+            tracker.tick(time.time(), _suspended_seconds())
+        except Exception:  # pylint: disable=broad-except
+            # The interface may be down while wg-quick restarts; keep watching.
+            pass
+        time.sleep(1)
+
+
+def script_version(source: bytes) -> str:
+    return hashlib.sha256(source).hexdigest()[:16]
+
+
+class PeerAgent:
+    """Dispatches peer-management requests against a cached peer table.
+
+    The same dispatcher serves the resident agent and the one-shot inline
+    fallback; only the resident agent checks the caller's script version.
+    """
+
+    def __init__(self, settings: Dict[str, Any], wg, version: Optional[str] = None):
+        self.settings = settings
+        self.wg = wg
+        self.version = version
+        self.store = PeerStore(settings)
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        if self.version is not None and message.get("version") != self.version:
+            return {"agentError": "version-mismatch", "version": self.version}
+
+        op = message.get("op")
+        try:
+            self._use_server(message)
+            if op == "ping":
+                return {"ok": True, "version": self.version}
+            if op == "register":
+                return register_peers(message.get("publicKeys") or [], self.settings, self.wg, self.store)
+            if op == "usage":
+                return sample_usage(self.settings, self.wg)
+            if op == "inventory":
+                return peer_inventory(self.settings, self.wg, self.store)
+            if op == "revoke":
+                return revoke_peers(message.get("publicKeys") or [], self.settings, self.wg, self.store)
+            if op == "prune":
+                return prune_peers(
+                    message.get("inactiveDays"),
+                    self.settings,
+                    self.wg,
+                    self.store,
+                    dry_run=bool(message.get("dryRun")),
+                )
+        except SystemExit as exc:
+            return {"error": str(exc.code)}
+        except Exception as exc:  # pylint: disable=broad-except
+            # Drop cached state; the caller falls back to the inline script.
+            self.store = PeerStore(self.settings)
+            return {"agentError": f"{type(exc).__name__}: {exc}"}
+        return {"agentError": f"Unsupported operation: {op}"}
+
+    def _use_server(self, message: Dict[str, Any]) -> None:
+        """Allocate from the client subnet and server address the caller assigned to this server.
+
+        Every server of a pool runs the same agent install, so its slice of the
+        client range travels with each request.
+        """
+        if not message.get("clientSubnet") or not message.get("serverAddress"):
+            return
+        server = {
+            "client_subnet": ipaddress.ip_network(message["clientSubnet"], strict=False),
+            "server_address": ipaddress.ip_address(message["serverAddress"]),
+        }
+        if any(self.settings[key] != value for key, value in server.items()):
+            self.settings = {**self.settings, **server}
+            self.store = PeerStore(self.settings)
+
+
+def serve(agent: PeerAgent, port: int, token_path: str) -> None:
+    """Serve newline-delimited ``<token> <base64 JSON>`` requests on localhost."""
+    token = secrets.token_hex(32)
+    _atomic_write(token_path, token.encode("ascii"), 0o600)
+
+    class Handler(socketserver.StreamRequestHandler):
+        timeout = 10
+
+        def handle(self):
+            line = self.rfile.readline(MAX_AGENT_MESSAGE_BYTES)
+            try:
+                supplied, encoded = line.decode("ascii").strip().split(" ", 1)
+                if hmac.compare_digest(supplied, token):
+                    reply = agent.handle(json.loads(base64.b64decode(encoded)))
+                else:
+                    reply = {"agentError": "unauthorized"}
+            except (ValueError, UnicodeDecodeError):
+                reply = {"agentError": "malformed request"}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+    socketserver.TCPServer.allow_reuse_address = True
+    # A single-threaded server serializes requests, so no two registrations race.
+    with socketserver.TCPServer(("127.0.0.1", port), Handler) as server:
+        server.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    settings = load_settings()
+    wg = open_wg(settings["wg_interface"], settings["wg_control"])
+
+    if argv and argv[0] == "serve":
+        version = script_version(pathlib.Path(__file__).read_bytes())
+        booted_at = time.time() - time.clock_gettime(time.CLOCK_BOOTTIME)
+        tag_key = os.environ.get("WG_READY_TAG", "")
+        announce = (lambda ready_at: announce_ready(tag_key, ready_at)) if tag_key else None
+        tracker = ReadinessTracker(settings, wg, booted_at, _suspended_seconds(), announce)
+        threading.Thread(target=watch_readiness, args=(tracker,), daemon=True).start()
+        serve(
+            PeerAgent(settings, wg, version),
+            int(os.environ.get("WG_AGENT_PORT", DEFAULT_AGENT_PORT)),
+            os.environ.get("WG_AGENT_TOKEN_PATH", DEFAULT_AGENT_TOKEN_PATH),
+        )
+        return
+
+    message = json.loads(base64.b64decode(os.environ["WG_AGENT_MESSAGE_B64"]).decode("utf-8"))
+    result = PeerAgent(settings, wg).handle(message)
+    if "agentError" in result:
+        raise SystemExit(result["agentError"])
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# The manager ships deflated, as the Lambdas' inline fallback does, so the
+# association's commands parameter stays small as the script grows.
+data "archive_file" "peer_agent" {
+  type        = "zip"
+  source_file = "${path.module}/../lambda_functions/wg_peer_manager.py"
+  output_path = "${path.module}/build/peer_agent.zip"
+}
+
+resource "aws_ssm_association" "peer_agent" {
+  name             = "AWS-RunShellScript"
+  association_name = "${var.project_name}-peer-agent"
+
+  targets {
+    key    = var.fleet_tag != "" ? "tag:${local.fleet_tag_key}" : "InstanceIds"
+    values = var.fleet_tag != "" ? [local.fleet_tag_value] : distinct(concat([aws_instance.vpn.id], var.fleet_instance_ids))
+  }
+
+  parameters = {
+    commands = templatefile("${path.module}/../instance/install_peer_agent.sh", {
+      manager_zip    = filebase64(data.archive_file.peer_agent.output_path)
+      wg_conf_path   = local.wireguard_config_path
+      # Defaults only: register requests carry each wg_server_pool server's own slice.
+      client_subnet  = local.wireguard_client_subnet
+      server_address = local.wireguard_server_address
+      wg_interface   = local.wireguard_interface_name
+      agent_port     = var.peer_agent_port
+      ready_tag      = local.ready_tag_key
+    })
+  }
+}
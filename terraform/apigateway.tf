@@ -31,6 +31,12 @@ resource "aws_api_gateway_resource" "register" {
   path_part   = "register"
 }
 
+resource "aws_api_gateway_resource" "peers" {
+  rest_api_id = aws_api_gateway_rest_api.vpn.id
+  parent_id   = aws_api_gateway_rest_api.vpn.root_resource_id
+  path_part   = "peers"
+}
+
 resource "aws_api_gateway_method" "start" {
   rest_api_id      = aws_api_gateway_rest_api.vpn.id
   resource_id      = aws_api_gateway_resource.start.id
@@ -87,6 +93,22 @@ resource "aws_api_gateway_method" "register" {
   api_key_required = true
 }
 
+resource "aws_api_gateway_method" "register_job" {
+  rest_api_id      = aws_api_gateway_rest_api.vpn.id
+  resource_id      = aws_api_gateway_resource.register.id
+  http_method      = "GET"
+  authorization    = "NONE"
+  api_key_required = true
+}
+
+resource "aws_api_gateway_method" "register_revoke" {
+  rest_api_id      = aws_api_gateway_rest_api.vpn.id
+  resource_id      = aws_api_gateway_resource.register.id
+  http_method      = "DELETE"
+  authorization    = "NONE"
+  api_key_required = true
+}
+
 resource "aws_api_gateway_method" "register_options" {
   rest_api_id      = aws_api_gateway_rest_api.vpn.id
   resource_id      = aws_api_gateway_resource.register.id
@@ -95,6 +117,22 @@ resource "aws_api_gateway_method" "register_options" {
   api_key_required = false
 }
 
+resource "aws_api_gateway_method" "peers" {
+  rest_api_id      = aws_api_gateway_rest_api.vpn.id
+  resource_id      = aws_api_gateway_resource.peers.id
+  http_method      = "GET"
+  authorization    = "NONE"
+  api_key_required = true
+}
+
+resource "aws_api_gateway_method" "peers_options" {
+  rest_api_id      = aws_api_gateway_rest_api.vpn.id
+  resource_id      = aws_api_gateway_resource.peers.id
+  http_method      = "OPTIONS"
+  authorization    = "NONE"
+  api_key_required = false
+}
+
 resource "aws_api_gateway_integration" "start" {
   rest_api_id             = aws_api_gateway_rest_api.vpn.id
   resource_id             = aws_api_gateway_resource.start.id
@@ -164,6 +202,24 @@ resource "aws_api_gateway_integration" "register" {
   uri                     = aws_lambda_function.register_peer.invoke_arn
 }
 
+resource "aws_api_gateway_integration" "register_job" {
+  rest_api_id             = aws_api_gateway_rest_api.vpn.id
+  resource_id             = aws_api_gateway_resource.register.id
+  http_method             = aws_api_gateway_method.register_job.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.register_peer.invoke_arn
+}
+
+resource "aws_api_gateway_integration" "register_revoke" {
+  rest_api_id             = aws_api_gateway_rest_api.vpn.id
+  resource_id             = aws_api_gateway_resource.register.id
+  http_method             = aws_api_gateway_method.register_revoke.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.register_peer.invoke_arn
+}
+
 resource "aws_api_gateway_integration" "register_options" {
   rest_api_id = aws_api_gateway_rest_api.vpn.id
   resource_id = aws_api_gateway_resource.register.id
@@ -175,6 +231,26 @@ resource "aws_api_gateway_integration" "register_options" {
   }
 }
 
+resource "aws_api_gateway_integration" "peers" {
+  rest_api_id             = aws_api_gateway_rest_api.vpn.id
+  resource_id             = aws_api_gateway_resource.peers.id
+  http_method             = aws_api_gateway_method.peers.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.register_peer.invoke_arn
+}
+
+resource "aws_api_gateway_integration" "peers_options" {
+  rest_api_id = aws_api_gateway_rest_api.vpn.id
+  resource_id = aws_api_gateway_resource.peers.id
+  http_method = aws_api_gateway_method.peers_options.http_method
+  type        = "MOCK"
+
+  request_templates = {
+    "application/json" = "{\"statusCode\": 200}"
+  }
+}
+
 resource "aws_api_gateway_method_response" "start_200" {
   rest_api_id = aws_api_gateway_rest_api.vpn.id
   resource_id = aws_api_gateway_resource.start.id
@@ -254,6 +330,20 @@ resource "aws_api_gateway_method_response" "register_200" {
   status_code = "200"
 }
 
+resource "aws_api_gateway_method_response" "register_job_200" {
+  rest_api_id = aws_api_gateway_rest_api.vpn.id
+  resource_id = aws_api_gateway_resource.register.id
+  http_method = aws_api_gateway_method.register_job.http_method
+  status_code = "200"
+}
+
+resource "aws_api_gateway_method_response" "register_revoke_200" {
+  rest_api_id = aws_api_gateway_rest_api.vpn.id
+  resource_id = aws_api_gateway_resource.register.id
+  http_method = aws_api_gateway_method.register_revoke.http_method
+  status_code = "200"
+}
+
 resource "aws_api_gateway_method_response" "register_options_200" {
   rest_api_id = aws_api_gateway_rest_api.vpn.id
   resource_id = aws_api_gateway_resource.register.id
@@ -271,6 +361,30 @@ resource "aws_api_gateway_method_response" "register_options_200" {
   }
 }
 
+resource "aws_api_gateway_method_response" "peers_200" {
+  rest_api_id = aws_api_gateway_rest_api.vpn.id
+  resource_id = aws_api_gateway_resource.peers.id
+  http_method = aws_api_gateway_method.peers.http_method
+  status_code = "200"
+}
+
+resource "aws_api_gateway_method_response" "peers_options_200" {
+  rest_api_id = aws_api_gateway_rest_api.vpn.id
+  resource_id = aws_api_gateway_resource.peers.id
+  http_method = aws_api_gateway_method.peers_options.http_method
+  status_code = "200"
+
+  response_models = {
+    "application/json" = "Empty"
+  }
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = true,
+    "method.response.header.Access-Control-Allow-Methods" = true,
+    "method.response.header.Access-Control-Allow-Origin"  = true
+  }
+}
+
 locals {
   api_cors_allow_headers = "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token"
 }
@@ -322,7 +436,20 @@ resource "aws_api_gateway_integration_response" "register_options_200" {
 
   response_parameters = {
     "method.response.header.Access-Control-Allow-Headers" = "'${local.api_cors_allow_headers}'",
-    "method.response.header.Access-Control-Allow-Methods" = "'OPTIONS,POST'",
+    "method.response.header.Access-Control-Allow-Methods" = "'OPTIONS,GET,POST,DELETE'",
+    "method.response.header.Access-Control-Allow-Origin"  = "'*'"
+  }
+}
+
+resource "aws_api_gateway_integration_response" "peers_options_200" {
+  rest_api_id = aws_api_gateway_rest_api.vpn.id
+  resource_id = aws_api_gateway_resource.peers.id
+  http_method = aws_api_gateway_method.peers_options.http_method
+  status_code = aws_api_gateway_method_response.peers_options_200.status_code
+
+  response_parameters = {
+    "method.response.header.Access-Control-Allow-Headers" = "'${local.api_cors_allow_headers}'",
+    "method.response.header.Access-Control-Allow-Methods" = "'OPTIONS,GET'",
     "method.response.header.Access-Control-Allow-Origin"  = "'*'"
   }
 }
@@ -335,14 +462,19 @@ resource "aws_api_gateway_deployment" "vpn" {
       aws_api_gateway_integration.stop.id,
       aws_api_gateway_integration.status.id,
       aws_api_gateway_integration.register.id,
+      aws_api_gateway_integration.register_job.id,
+      aws_api_gateway_integration.register_revoke.id,
+      aws_api_gateway_integration.peers.id,
       aws_api_gateway_integration.start_options.id,
       aws_api_gateway_integration.stop_options.id,
       aws_api_gateway_integration.status_options.id,
       aws_api_gateway_integration.register_options.id,
+      aws_api_gateway_integration.peers_options.id,
       aws_api_gateway_integration_response.start_options_200.id,
       aws_api_gateway_integration_response.stop_options_200.id,
       aws_api_gateway_integration_response.status_options_200.id,
-      aws_api_gateway_integration_response.register_options_200.id
+      aws_api_gateway_integration_response.register_options_200.id,
+      aws_api_gateway_integration_response.peers_options_200.id
     ]))
   }
 
@@ -355,14 +487,19 @@ resource "aws_api_gateway_deployment" "vpn" {
     aws_api_gateway_method_response.stop_200,
     aws_api_gateway_method_response.status_200,
     aws_api_gateway_method_response.register_200,
+    aws_api_gateway_method_response.register_job_200,
+    aws_api_gateway_method_response.register_revoke_200,
+    aws_api_gateway_method_response.peers_200,
     aws_api_gateway_method_response.start_options_200,
     aws_api_gateway_method_response.stop_options_200,
     aws_api_gateway_method_response.status_options_200,
     aws_api_gateway_method_response.register_options_200,
+    aws_api_gateway_method_response.peers_options_200,
     aws_api_gateway_integration_response.start_options_200,
     aws_api_gateway_integration_response.stop_options_200,
     aws_api_gateway_integration_response.status_options_200,
-    aws_api_gateway_integration_response.register_options_200
+    aws_api_gateway_integration_response.register_options_200,
+    aws_api_gateway_integration_response.peers_options_200
   ]
 }
 
@@ -380,7 +517,7 @@ resource "aws_api_gateway_gateway_response" "default_4xx" {
   response_parameters = {
     "gatewayresponse.header.Access-Control-Allow-Origin"  = "'*'",
     "gatewayresponse.header.Access-Control-Allow-Headers" = "'${local.api_cors_allow_headers}'",
-    "gatewayresponse.header.Access-Control-Allow-Methods" = "'OPTIONS,GET,POST'"
+    "gatewayresponse.header.Access-Control-Allow-Methods" = "'OPTIONS,GET,POST,DELETE'"
   }
 }
 
@@ -391,7 +528,7 @@ resource "aws_api_gateway_gateway_response" "default_5xx" {
   response_parameters = {
     "gatewayresponse.header.Access-Control-Allow-Origin"  = "'*'",
     "gatewayresponse.header.Access-Control-Allow-Headers" = "'${local.api_cors_allow_headers}'",
-    "gatewayresponse.header.Access-Control-Allow-Methods" = "'OPTIONS,GET,POST'"
+    "gatewayresponse.header.Access-Control-Allow-Methods" = "'OPTIONS,GET,POST,DELETE'"
   }
 }
 
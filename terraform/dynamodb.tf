@@ -0,0 +1,54 @@
+# One lease per instance (or fleet request) so concurrent start/stop requests
+# share a single EC2 call and notification. Leases expire on their own.
+resource "aws_dynamodb_table" "operations" {
+  name         = "${var.project_name}-operations"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "scope"
+
+  attribute {
+    name = "scope"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
+  tags = local.tags
+}
+
+# Registration bundles (assigned IP, preshared key, server key) per client
+# public key, so configs and QR codes can be downloaded again without an SSM
+# round-trip to the VPN host. Client private keys are never stored.
+resource "aws_dynamodb_table" "client_configs" {
+  name         = "${var.project_name}-client-configs"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "publicKey"
+
+  attribute {
+    name = "publicKey"
+    type = "S"
+  }
+
+  server_side_encryption {
+    enabled = true
+  }
+
+  tags = local.tags
+}
+
+# Peer placement across wg_server_pool: one row per server with its peer count
+# and recent traffic, and one row per client key naming the server it lives on.
+resource "aws_dynamodb_table" "placements" {
+  name         = "${var.project_name}-placements"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "id"
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+
+  tags = local.tags
+}
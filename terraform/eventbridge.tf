@@ -53,3 +53,33 @@ resource "aws_lambda_permission" "scheduler_monitor" {
   principal     = "scheduler.amazonaws.com"
   source_arn    = aws_scheduler_schedule.monitor.arn
 }
+
+resource "aws_scheduler_schedule" "prewarm" {
+  count                        = var.prewarm_lead_minutes > 0 ? 1 : 0
+  name                         = "${var.project_name}-prewarm"
+  description                  = "Start the VPN instance shortly before the weekday window opens"
+  schedule_expression          = local.prewarm_cron
+  schedule_expression_timezone = local.timezone_name
+  state                        = "ENABLED"
+
+  flexible_time_window {
+    mode = "OFF"
+  }
+
+  target {
+    arn      = aws_lambda_function.start_instance.arn
+    role_arn = aws_iam_role.scheduler.arn
+    input = jsonencode({
+      trigger = "prewarm"
+    })
+  }
+}
+
+resource "aws_lambda_permission" "scheduler_prewarm" {
+  count         = var.prewarm_lead_minutes > 0 ? 1 : 0
+  statement_id  = "AllowSchedulerPrewarm"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.start_instance.function_name
+  principal     = "scheduler.amazonaws.com"
+  source_arn    = aws_scheduler_schedule.prewarm[0].arn
+}
@@ -18,7 +18,25 @@ data "aws_iam_policy_document" "lambda_control" {
       "ec2:StartInstances",
       "ec2:StopInstances"
     ]
-    resources = [aws_instance.vpn.arn]
+    resources = concat([aws_instance.vpn.arn], local.fleet_instance_arns)
+  }
+
+  dynamic "statement" {
+    for_each = var.fleet_tag != "" ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "ec2:StartInstances",
+        "ec2:StopInstances"
+      ]
+      resources = ["arn:aws:ec2:${var.aws_region}:${data.aws_caller_identity.current.account_id}:instance/*"]
+
+      condition {
+        test     = "StringEquals"
+        variable = "ec2:ResourceTag/${local.fleet_tag_key}"
+        values   = [local.fleet_tag_value]
+      }
+    }
   }
 
   statement {
@@ -40,27 +58,80 @@ data "aws_iam_policy_document" "lambda_control" {
     resources = ["*"]
   }
 
+  statement {
+    effect    = "Allow"
+    actions   = ["cloudwatch:PutMetricData"]
+    resources = ["*"]
+
+    condition {
+      test     = "StringEquals"
+      variable = "cloudwatch:namespace"
+      values   = [var.monitor_metric_namespace]
+    }
+  }
+
   statement {
     effect = "Allow"
     actions = [
       "ssm:SendCommand",
       "ssm:GetCommandInvocation"
     ]
-    resources = [
-      aws_instance.vpn.arn,
+    resources = concat([aws_instance.vpn.arn], local.fleet_instance_arns, local.wg_server_pool_arns, [
       "arn:aws:ssm:${var.aws_region}:${data.aws_caller_identity.current.account_id}:document/AWS-RunShellScript",
       "arn:aws:ssm:${var.aws_region}::document/AWS-RunShellScript"
-    ]
+    ])
+  }
+
+  dynamic "statement" {
+    for_each = var.fleet_tag != "" ? [1] : []
+    content {
+      effect    = "Allow"
+      actions   = ["ssm:SendCommand"]
+      resources = ["arn:aws:ec2:${var.aws_region}:${data.aws_caller_identity.current.account_id}:instance/*"]
+
+      condition {
+        test     = "StringEquals"
+        variable = "ssm:resourceTag/${local.fleet_tag_key}"
+        values   = [local.fleet_tag_value]
+      }
+    }
   }
 
   statement {
     effect = "Allow"
     actions = [
-      "ssm:GetCommandInvocation"
+      "ssm:GetCommandInvocation",
+      "ssm:ListCommandInvocations"
     ]
     resources = ["*"]
   }
 
+  statement {
+    effect = "Allow"
+    actions = [
+      "dynamodb:PutItem",
+      "dynamodb:GetItem",
+      "dynamodb:UpdateItem",
+      "dynamodb:DeleteItem",
+      "dynamodb:BatchGetItem",
+      "dynamodb:BatchWriteItem"
+    ]
+    resources = [
+      aws_dynamodb_table.operations.arn,
+      aws_dynamodb_table.client_configs.arn,
+      aws_dynamodb_table.placements.arn
+    ]
+  }
+
+  statement {
+    effect = "Allow"
+    actions = [
+      "s3:GetObject",
+      "s3:PutObject"
+    ]
+    resources = ["${aws_s3_bucket.peer_snapshots.arn}/*"]
+  }
+
   statement {
     effect = "Allow"
     actions = [
@@ -69,6 +140,25 @@ data "aws_iam_policy_document" "lambda_control" {
     resources = [aws_sns_topic.start_notifications.arn]
   }
 
+  statement {
+    effect = "Allow"
+    actions = [
+      "sqs:SendMessage",
+      "sqs:ReceiveMessage",
+      "sqs:DeleteMessage",
+      "sqs:GetQueueAttributes"
+    ]
+    resources = [aws_sqs_queue.journal.arn]
+  }
+
+  statement {
+    effect = "Allow"
+    actions = [
+      "s3:PutObject"
+    ]
+    resources = ["${aws_s3_bucket.journal.arn}/events/*"]
+  }
+
   statement {
     effect = "Allow"
     actions = [
@@ -120,6 +210,48 @@ resource "aws_iam_role_policy_attachment" "instance_ssm" {
   policy_arn = "arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore"
 }
 
+data "aws_iam_policy_document" "instance_readiness" {
+  statement {
+    effect    = "Allow"
+    actions   = ["ec2:CreateTags"]
+    resources = ["arn:aws:ec2:${var.aws_region}:${data.aws_caller_identity.current.account_id}:instance/*"]
+
+    # Each instance may only set its own readiness tag.
+    condition {
+      test     = "StringEquals"
+      variable = "aws:ARN"
+      values   = ["$${ec2:SourceInstanceARN}"]
+    }
+
+    condition {
+      test     = "ForAllValues:StringEquals"
+      variable = "aws:TagKeys"
+      values   = [local.ready_tag_key]
+    }
+  }
+}
+
+resource "aws_iam_role_policy" "instance_readiness" {
+  name   = "${var.project_name}-instance-readiness"
+  role   = aws_iam_role.instance.id
+  policy = data.aws_iam_policy_document.instance_readiness.json
+}
+
+# SSM uploads inventory command output with the instance's own credentials.
+data "aws_iam_policy_document" "instance_command_output" {
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:PutObject"]
+    resources = ["${aws_s3_bucket.peer_snapshots.arn}/commands/*"]
+  }
+}
+
+resource "aws_iam_role_policy" "instance_command_output" {
+  name   = "${var.project_name}-instance-command-output"
+  role   = aws_iam_role.instance.id
+  policy = data.aws_iam_policy_document.instance_command_output.json
+}
+
 resource "aws_iam_instance_profile" "instance" {
   name = "${var.project_name}-instance-profile"
   role = aws_iam_role.instance.name
@@ -146,7 +278,8 @@ data "aws_iam_policy_document" "scheduler_invoke_lambda" {
     ]
     resources = [
       aws_lambda_function.stop_instance.arn,
-      aws_lambda_function.monitor_traffic.arn
+      aws_lambda_function.monitor_traffic.arn,
+      aws_lambda_function.start_instance.arn
     ]
   }
 }
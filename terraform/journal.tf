@@ -0,0 +1,178 @@
+# Event journal: handlers queue compact audit events here instead of calling
+# SNS on the request path. The event_journal Lambda drains the queue in
+# batches, appends each batch to S3 as gzipped JSON Lines and sends one SNS
+# digest per batch.
+resource "aws_sqs_queue" "journal_dlq" {
+  name                      = "${var.project_name}-journal-dlq"
+  message_retention_seconds = 1209600
+  tags                      = local.tags
+}
+
+resource "aws_sqs_queue" "journal" {
+  name                       = "${var.project_name}-journal"
+  message_retention_seconds  = 345600
+  visibility_timeout_seconds = 180
+  sqs_managed_sse_enabled    = true
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.journal_dlq.arn
+    maxReceiveCount     = 5
+  })
+
+  tags = local.tags
+}
+
+resource "aws_lambda_event_source_mapping" "journal" {
+  event_source_arn                   = aws_sqs_queue.journal.arn
+  function_name                      = aws_lambda_function.event_journal.arn
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = var.journal_batch_window_seconds
+
+  scaling_config {
+    maximum_concurrency = 2
+  }
+}
+
+resource "aws_s3_bucket" "journal" {
+  bucket_prefix = "${local.default_bucket_prefix}-journal-"
+  force_destroy = true
+  tags          = local.tags
+}
+
+resource "aws_s3_bucket_public_access_block" "journal" {
+  bucket = aws_s3_bucket.journal.id
+
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+resource "aws_s3_bucket_server_side_encryption_configuration" "journal" {
+  bucket = aws_s3_bucket.journal.id
+
+  rule {
+    apply_server_side_encryption_by_default {
+      sse_algorithm = "AES256"
+    }
+  }
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "journal" {
+  bucket = aws_s3_bucket.journal.id
+
+  rule {
+    id     = "expire-events"
+    status = "Enabled"
+
+    filter {
+      prefix = "events/"
+    }
+
+    expiration {
+      days = var.journal_retention_days
+    }
+  }
+}
+
+# Partition projection lets Athena prune by dt without running MSCK REPAIR:
+#   SELECT at, kind, sourceip, instanceids FROM events WHERE dt >= '2024-05-01' AND kind = 'start'
+resource "aws_glue_catalog_database" "journal" {
+  name = "${replace(var.project_name, "-", "_")}_journal"
+}
+
+resource "aws_glue_catalog_table" "journal_events" {
+  name          = "events"
+  database_name = aws_glue_catalog_database.journal.name
+  table_type    = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification"              = "json"
+    "projection.enabled"          = "true"
+    "projection.dt.type"          = "date"
+    "projection.dt.format"        = "yyyy-MM-dd"
+    "projection.dt.range"         = "2024-01-01,NOW"
+    "projection.dt.interval"      = "1"
+    "projection.dt.interval.unit" = "DAYS"
+    "storage.location.template"   = "s3://${aws_s3_bucket.journal.id}/events/dt=$${dt}/"
+  }
+
+  partition_keys {
+    name = "dt"
+    type = "string"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.journal.id}/events/"
+    input_format  = "org.apache.hadoop.mapred.TextInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.openx.data.jsonserde.JsonSerDe"
+      parameters = {
+        "ignore.malformed.json" = "true"
+      }
+    }
+
+    columns {
+      name = "v"
+      type = "int"
+    }
+    columns {
+      name = "id"
+      type = "string"
+    }
+    columns {
+      name = "at"
+      type = "string"
+    }
+    columns {
+      name = "kind"
+      type = "string"
+    }
+    columns {
+      name = "function"
+      type = "string"
+    }
+    columns {
+      name = "trigger"
+      type = "string"
+    }
+    columns {
+      name = "requestid"
+      type = "string"
+    }
+    columns {
+      name = "invocationid"
+      type = "string"
+    }
+    columns {
+      name = "sourceip"
+      type = "string"
+    }
+    columns {
+      name = "useragent"
+      type = "string"
+    }
+    columns {
+      name = "instanceids"
+      type = "array<string>"
+    }
+    columns {
+      name = "jobid"
+      type = "string"
+    }
+    columns {
+      name = "publickeys"
+      type = "array<string>"
+    }
+    columns {
+      name = "action"
+      type = "string"
+    }
+    columns {
+      name = "hibernate"
+      type = "boolean"
+    }
+  }
+}
@@ -1,3 +1,26 @@
+# Shared helpers (lazy boto3 clients, fleet selection, responses) ship once as
+# a layer; Lambda extracts it to /opt/python, which is on sys.path.
+data "archive_file" "common_layer" {
+  type        = "zip"
+  output_path = "${path.module}/build/common_layer.zip"
+
+  dynamic "source" {
+    for_each = fileset("${path.module}/../lambda_functions/common", "*.py")
+    content {
+      content  = file("${path.module}/../lambda_functions/common/${source.value}")
+      filename = "python/common/${source.value}"
+    }
+  }
+}
+
+resource "aws_lambda_layer_version" "common" {
+  layer_name               = "${var.project_name}-common"
+  filename                 = data.archive_file.common_layer.output_path
+  source_code_hash         = data.archive_file.common_layer.output_base64sha256
+  compatible_runtimes      = ["python3.12"]
+  compatible_architectures = ["x86_64"]
+}
+
 data "archive_file" "start_instance" {
   type        = "zip"
   source_file = "${path.module}/../lambda_functions/start_instance.py"
@@ -16,16 +39,60 @@ data "archive_file" "check_status" {
   output_path = "${path.module}/build/check_status.zip"
 }
 
+data "archive_file" "event_journal" {
+  type        = "zip"
+  source_file = "${path.module}/../lambda_functions/event_journal.py"
+  output_path = "${path.module}/build/event_journal.zip"
+}
+
 data "archive_file" "monitor_traffic" {
   type        = "zip"
-  source_file = "${path.module}/../lambda_functions/monitor_traffic.py"
   output_path = "${path.module}/build/monitor_traffic.zip"
+
+  source {
+    content  = file("${path.module}/../lambda_functions/monitor_traffic.py")
+    filename = "monitor_traffic.py"
+  }
+
+  source {
+    content  = file("${path.module}/../lambda_functions/idle_engine.py")
+    filename = "idle_engine.py"
+  }
+
+  source {
+    content  = file("${path.module}/../lambda_functions/wg_peer_manager.py")
+    filename = "wg_peer_manager.py"
+  }
 }
 
 data "archive_file" "register_peer" {
   type        = "zip"
-  source_file = "${path.module}/../lambda_functions/register_peer.py"
   output_path = "${path.module}/build/register_peer.zip"
+
+  source {
+    content  = file("${path.module}/../lambda_functions/register_peer.py")
+    filename = "register_peer.py"
+  }
+
+  source {
+    content  = file("${path.module}/../lambda_functions/wg_peer_manager.py")
+    filename = "wg_peer_manager.py"
+  }
+
+  source {
+    content  = file("${path.module}/../lambda_functions/client_config.py")
+    filename = "client_config.py"
+  }
+
+  source {
+    content  = file("${path.module}/../lambda_functions/peer_inventory.py")
+    filename = "peer_inventory.py"
+  }
+
+  source {
+    content  = file("${path.module}/../lambda_functions/qr.py")
+    filename = "qr.py"
+  }
 }
 
 resource "aws_lambda_function" "start_instance" {
@@ -35,12 +102,11 @@ resource "aws_lambda_function" "start_instance" {
   runtime          = "python3.12"
   filename         = data.archive_file.start_instance.output_path
   source_code_hash = data.archive_file.start_instance.output_base64sha256
+  layers           = [aws_lambda_layer_version.common.arn]
   timeout          = 30
 
   environment {
-    variables = merge(local.lambda_env_common, {
-      START_NOTIFICATION_TOPIC_ARN = aws_sns_topic.start_notifications.arn
-    })
+    variables = local.lambda_env_common
   }
 }
 
@@ -51,6 +117,7 @@ resource "aws_lambda_function" "stop_instance" {
   runtime          = "python3.12"
   filename         = data.archive_file.stop_instance.output_path
   source_code_hash = data.archive_file.stop_instance.output_base64sha256
+  layers           = [aws_lambda_layer_version.common.arn]
   timeout          = 30
 
   environment {
@@ -67,10 +134,11 @@ resource "aws_lambda_function" "check_status" {
   runtime          = "python3.12"
   filename         = data.archive_file.check_status.output_path
   source_code_hash = data.archive_file.check_status.output_base64sha256
-  timeout          = 15
+  layers           = [aws_lambda_layer_version.common.arn]
+  timeout          = 30
 
   environment {
-    variables = local.lambda_env_common
+    variables = local.lambda_env_status
   }
 }
 
@@ -81,10 +149,11 @@ resource "aws_lambda_function" "monitor_traffic" {
   runtime          = "python3.12"
   filename         = data.archive_file.monitor_traffic.output_path
   source_code_hash = data.archive_file.monitor_traffic.output_base64sha256
+  layers           = [aws_lambda_layer_version.common.arn]
   timeout          = 60
 
   environment {
-    variables = merge(local.lambda_env_common, {
+    variables = merge(local.lambda_env_monitor, {
       AUTO_STOP_SOURCE = "monitor"
     })
   }
@@ -97,6 +166,7 @@ resource "aws_lambda_function" "register_peer" {
   runtime          = "python3.12"
   filename         = data.archive_file.register_peer.output_path
   source_code_hash = data.archive_file.register_peer.output_base64sha256
+  layers           = [aws_lambda_layer_version.common.arn]
   timeout          = 120
   tracing_config {
     mode = "Active"
@@ -106,3 +176,24 @@ resource "aws_lambda_function" "register_peer" {
     variables = local.lambda_env_register
   }
 }
+
+resource "aws_lambda_function" "event_journal" {
+  function_name    = "${var.project_name}-journal"
+  role             = aws_iam_role.lambda.arn
+  handler          = "event_journal.handler"
+  runtime          = "python3.12"
+  filename         = data.archive_file.event_journal.output_path
+  source_code_hash = data.archive_file.event_journal.output_base64sha256
+  layers           = [aws_lambda_layer_version.common.arn]
+  timeout          = 30
+
+  environment {
+    variables = {
+      JOURNAL_BUCKET         = aws_s3_bucket.journal.id
+      NOTIFICATION_TOPIC_ARN = aws_sns_topic.start_notifications.arn
+      JOURNAL_NOTIFY_EVENTS  = join(",", var.journal_notify_events)
+      EMF_METRICS_ENABLED    = tostring(var.emf_metrics_enabled)
+      EMF_NAMESPACE          = "${var.project_name}/Lambda"
+    }
+  }
+}
@@ -14,6 +14,7 @@ locals {
   wireguard_interface_name = var.wireguard_interface_name
   wireguard_config_path    = var.wireguard_config_path
   register_command_timeout = var.register_command_timeout_seconds
+  ready_tag_key            = "vpn-ready-at"
   admin_basic_auth_header  = "Basic ${base64encode("${var.admin_basic_auth_username}:${var.admin_basic_auth_password}")}"
 
   default_bucket_prefix = replace(var.project_name, "_", "-")
@@ -23,21 +24,86 @@ locals {
   vpn_private_ip = var.vpn_private_ip != "" ? var.vpn_private_ip : cidrhost(var.public_subnet_cidr, 10)
 
   lambda_env_common = {
-    INSTANCE_ID            = aws_instance.vpn.id
-    TIMEZONE               = local.timezone_name
-    WEEKDAY_START_HOUR     = tostring(local.weekday_start_hour)
-    WEEKDAY_END_HOUR       = tostring(local.weekday_end_hour)
-    MONITOR_THRESHOLD_MB   = tostring(local.monitor_threshold_mb)
-    MONITOR_WINDOW_HRS     = tostring(local.monitor_evaluation_hrs)
-    MONITOR_PERIOD_SECONDS = tostring(local.monitor_period_seconds)
+    INSTANCE_ID             = aws_instance.vpn.id
+    TIMEZONE                = local.timezone_name
+    WEEKDAY_START_HOUR      = tostring(local.weekday_start_hour)
+    WEEKDAY_END_HOUR        = tostring(local.weekday_end_hour)
+    MONITOR_THRESHOLD_MB    = tostring(local.monitor_threshold_mb)
+    MONITOR_WINDOW_HRS      = tostring(local.monitor_evaluation_hrs)
+    MONITOR_PERIOD_SECONDS  = tostring(local.monitor_period_seconds)
+    INSTANCE_IDS            = join(",", var.fleet_instance_ids)
+    FLEET_TAG               = var.fleet_tag
+    HIBERNATE_ON_STOP       = tostring(var.hibernate_on_stop)
+    EMF_METRICS_ENABLED     = tostring(var.emf_metrics_enabled)
+    EMF_NAMESPACE           = "${var.project_name}/Lambda"
+    OPERATIONS_TABLE        = aws_dynamodb_table.operations.name
+    COALESCE_WINDOW_SECONDS = tostring(var.coalesce_window_seconds)
+    JOURNAL_QUEUE_URL       = aws_sqs_queue.journal.url
   }
 
-  lambda_env_register = merge(local.lambda_env_common, {
+  prewarm_minute_of_day = max(0, local.weekday_start_hour * 60 - var.prewarm_lead_minutes)
+  prewarm_cron          = format("cron(%d %d ? * MON-FRI *)", local.prewarm_minute_of_day % 60, floor(local.prewarm_minute_of_day / 60))
+
+  fleet_tag_key   = split("=", var.fleet_tag)[0]
+  fleet_tag_value = join("=", slice(split("=", var.fleet_tag), 1, length(split("=", var.fleet_tag))))
+  fleet_instance_arns = [
+    for instance_id in var.fleet_instance_ids :
+    "arn:aws:ec2:${var.aws_region}:${data.aws_caller_identity.current.account_id}:instance/${instance_id}"
+  ]
+
+  lambda_env_status = merge(local.lambda_env_common, {
+    STATUS_CACHE_TTL_SECONDS = tostring(var.status_cache_ttl_seconds)
+    STATUS_MAX_WAIT_SECONDS  = tostring(var.status_max_wait_seconds)
+    READY_TAG_KEY            = local.ready_tag_key
+  })
+
+  placement_env = {
+    PLACEMENT_TABLE       = aws_dynamodb_table.placements.name
+    PLACEMENT_MB_PER_PEER = tostring(var.placement_mb_per_peer)
+    WG_SERVER_POOL = jsonencode([
+      for server in var.wg_server_pool : {
+        instanceId    = server.instance_id
+        clientSubnet  = server.client_subnet
+        serverAddress = server.server_address
+        endpoint      = server.endpoint
+      }
+    ])
+  }
+  wg_server_pool_arns = [
+    for server in var.wg_server_pool :
+    "arn:aws:ec2:${var.aws_region}:${data.aws_caller_identity.current.account_id}:instance/${server.instance_id}"
+  ]
+
+  lambda_env_monitor = merge(local.lambda_env_common, local.placement_env, {
+    MONITOR_SOURCE           = var.monitor_source
+    MONITOR_METRIC_NAMESPACE = var.monitor_metric_namespace
+    MONITOR_STATE_BUCKET     = aws_s3_bucket.peer_snapshots.id
+    MONITOR_SMOOTHING        = var.monitor_smoothing
+    MONITOR_EWMA_ALPHA       = tostring(var.monitor_ewma_alpha)
+    MONITOR_RESUME_MB        = var.monitor_resume_mb_per_hour > 0 ? tostring(var.monitor_resume_mb_per_hour) : ""
+    MONITOR_MIN_IDLE_POINTS  = var.monitor_min_idle_points > 0 ? tostring(var.monitor_min_idle_points) : ""
+    MONITOR_GRACE_SECONDS    = tostring(var.monitor_grace_seconds)
+    CLIENT_SUBNET_CIDR       = local.wireguard_client_subnet
+    SERVER_ADDRESS           = local.wireguard_server_address
+    WG_INTERFACE             = local.wireguard_interface_name
+    WG_CONF_PATH             = local.wireguard_config_path
+    WG_AGENT_PORT            = tostring(var.peer_agent_port)
+  })
+
+  lambda_env_register = merge(local.lambda_env_common, local.placement_env, {
     CLIENT_SUBNET_CIDR          = local.wireguard_client_subnet
     SERVER_ADDRESS              = local.wireguard_server_address
     WG_INTERFACE                = local.wireguard_interface_name
     WG_CONF_PATH                = local.wireguard_config_path
     SSM_COMMAND_TIMEOUT_SECONDS = tostring(local.register_command_timeout)
+    WG_AGENT_PORT               = tostring(var.peer_agent_port)
+    WG_ENDPOINT                 = "${aws_eip.vpn.public_ip}:51820"
+    CLIENT_DNS                  = var.client_dns
+    CLIENT_ALLOWED_IPS          = var.client_allowed_ips
+    CLIENT_KEEPALIVE_SECONDS    = tostring(var.client_keepalive_seconds)
+    CLIENT_CONFIG_TABLE         = aws_dynamodb_table.client_configs.name
+    PEERS_SNAPSHOT_BUCKET       = aws_s3_bucket.peer_snapshots.id
+    PEERS_CACHE_TTL_SECONDS     = tostring(var.peers_cache_ttl_seconds)
   })
 
   custom_domain_enabled = var.web_custom_domain != ""
@@ -104,6 +104,8 @@ resource "aws_instance" "vpn" {
   availability_zone    = var.public_subnet_az
   key_name             = aws_key_pair.vpn.key_name
   iam_instance_profile = aws_iam_instance_profile.instance.name
+  monitoring           = var.detailed_monitoring
+  hibernation          = var.hibernate_on_stop
 
   network_interface {
     device_index         = 0
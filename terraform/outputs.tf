@@ -55,6 +55,16 @@ output "ssh_private_key_pem" {
 }
 
 output "start_notification_topic_arn" {
-  description = "SNS topic ARN that receives VPN start notifications."
+  description = "SNS topic ARN that receives event journal digests (VPN starts by default)."
   value       = aws_sns_topic.start_notifications.arn
 }
+
+output "journal_bucket_name" {
+  description = "S3 bucket holding the event journal as gzipped JSON Lines under events/dt=YYYY-MM-DD/."
+  value       = aws_s3_bucket.journal.id
+}
+
+output "journal_athena_table" {
+  description = "Glue/Athena table that queries the event journal."
+  value       = "${aws_glue_catalog_database.journal.name}.${aws_glue_catalog_table.journal_events.name}"
+}
@@ -0,0 +1,45 @@
+# Peer inventory snapshots for GET /peers. Inventory commands write their full
+# output under commands/ (SSM truncates inline output at 24,000 characters)
+# and the register Lambda shares parsed snapshots under snapshots/. The
+# monitor keeps its rolling evaluator state in monitor/state.json.
+resource "aws_s3_bucket" "peer_snapshots" {
+  bucket_prefix = "${local.default_bucket_prefix}-peers-"
+  force_destroy = true
+  tags          = local.tags
+}
+
+resource "aws_s3_bucket_public_access_block" "peer_snapshots" {
+  bucket = aws_s3_bucket.peer_snapshots.id
+
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+resource "aws_s3_bucket_server_side_encryption_configuration" "peer_snapshots" {
+  bucket = aws_s3_bucket.peer_snapshots.id
+
+  rule {
+    apply_server_side_encryption_by_default {
+      sse_algorithm = "AES256"
+    }
+  }
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "peer_snapshots" {
+  bucket = aws_s3_bucket.peer_snapshots.id
+
+  rule {
+    id     = "expire-command-output"
+    status = "Enabled"
+
+    filter {
+      prefix = "commands/"
+    }
+
+    expiration {
+      days = 1
+    }
+  }
+}
@@ -76,6 +76,35 @@ variable "monitor_schedule_expression" {
   default     = "cron(0/15 * * * ? *)"
 }
 
+variable "hibernate_on_stop" {
+  description = "Configure the VPN instance for hibernation and hibernate it on API, scheduled and idle stops, so RAM and the WireGuard interface are restored on start. Changing this replaces the instance; the root volume must hold the instance's RAM."
+  type        = bool
+  default     = false
+}
+
+variable "coalesce_window_seconds" {
+  description = "How long a start or stop lease lasts. Requests for the same action within this window join the in-flight operation instead of calling EC2 again."
+  type        = number
+  default     = 90
+}
+
+variable "emf_metrics_enabled" {
+  description = "Emit per-invocation latency, cold-start and AWS call metrics from every Lambda as CloudWatch Embedded Metric Format log lines (namespace \"<project_name>/Lambda\")."
+  type        = bool
+  default     = true
+}
+
+variable "prewarm_lead_minutes" {
+  description = "Start the VPN instance this many minutes before allowed_weekday_start_hour on weekdays, so it is ready when the window opens. 0 disables the pre-warm schedule."
+  type        = number
+  default     = 0
+
+  validation {
+    condition     = var.prewarm_lead_minutes >= 0
+    error_message = "prewarm_lead_minutes must not be negative."
+  }
+}
+
 variable "weekday_stop_cron_expression" {
   description = "EventBridge Scheduler cron expression (interpreted in timezone_name) for the automatic weekday stop event."
   type        = string
@@ -95,11 +124,69 @@ variable "monitor_evaluation_hours" {
 }
 
 variable "monitor_period_seconds" {
-  description = "CloudWatch metric period in seconds for traffic evaluation."
+  description = "CloudWatch metric period in seconds for traffic evaluation. Periods under 300 need detailed_monitoring (or monitor_source = \"wireguard\")."
   type        = number
   default     = 900
 }
 
+variable "detailed_monitoring" {
+  description = "Enable 1-minute EC2 detailed monitoring on the VPN instance so monitor_period_seconds can be 60."
+  type        = bool
+  default     = false
+}
+
+variable "monitor_smoothing" {
+  description = "Idle rule: \"window\" stops when every period in the window is idle, \"ewma\" stops when an exponentially smoothed rate drops under the threshold."
+  type        = string
+  default     = "window"
+
+  validation {
+    condition     = contains(["window", "ewma"], var.monitor_smoothing)
+    error_message = "monitor_smoothing must be \"window\" or \"ewma\"."
+  }
+}
+
+variable "monitor_ewma_alpha" {
+  description = "Weight of the newest period in the \"ewma\" smoothed rate (0-1]."
+  type        = number
+  default     = 0.5
+}
+
+variable "monitor_resume_mb_per_hour" {
+  description = "Hysteresis upper bound in MB per hour: periods between the threshold and this value extend an idle streak but cannot start one. 0 disables the band."
+  type        = number
+  default     = 0
+}
+
+variable "monitor_min_idle_points" {
+  description = "Consecutive idle periods required before stopping. 0 uses the whole evaluation window for \"window\" and 1 for \"ewma\"."
+  type        = number
+  default     = 0
+}
+
+variable "monitor_grace_seconds" {
+  description = "Seconds after an instance (re)starts during which the monitor never stops it."
+  type        = number
+  default     = 0
+}
+
+variable "monitor_source" {
+  description = "Traffic source for the auto-stop decision: \"network\" (EC2 NetworkIn/NetworkOut) or \"wireguard\" (tunnel bytes and active peers sampled on the instance)."
+  type        = string
+  default     = "network"
+
+  validation {
+    condition     = contains(["network", "wireguard"], var.monitor_source)
+    error_message = "monitor_source must be \"network\" or \"wireguard\"."
+  }
+}
+
+variable "monitor_metric_namespace" {
+  description = "CloudWatch namespace for the TunnelBytes and ActivePeers metrics published when monitor_source is \"wireguard\"."
+  type        = string
+  default     = "WireGuardVPN"
+}
+
 variable "wireguard_client_subnet" {
   description = "CIDR block containing WireGuard client addresses."
   type        = string
@@ -130,6 +217,82 @@ variable "register_command_timeout_seconds" {
   default     = 120
 }
 
+variable "client_dns" {
+  description = "DNS server(s) written into generated client configs. Leave empty to omit the DNS line."
+  type        = string
+  default     = "1.1.1.1"
+}
+
+variable "client_allowed_ips" {
+  description = "AllowedIPs for the server peer in generated client configs (full tunnel by default)."
+  type        = string
+  default     = "0.0.0.0/0, ::/0"
+}
+
+variable "client_keepalive_seconds" {
+  description = "PersistentKeepalive in generated client configs; 0 omits it."
+  type        = number
+  default     = 25
+}
+
+variable "peers_cache_ttl_seconds" {
+  description = "Seconds a GET /peers snapshot (one wg show dump per server) is reused before the next request takes a fresh one over SSM."
+  type        = number
+  default     = 30
+}
+
+variable "peer_agent_port" {
+  description = "Localhost TCP port of the resident WireGuard peer agent on the EC2 host."
+  type        = number
+  default     = 51821
+}
+
+variable "status_cache_ttl_seconds" {
+  description = "Seconds a warm status Lambda reuses its EC2 status snapshot before calling EC2 again."
+  type        = number
+  default     = 5
+}
+
+variable "status_max_wait_seconds" {
+  description = "Longest a GET /status?wait=N long-poll is held open waiting for a state change."
+  type        = number
+  default     = 20
+
+  validation {
+    condition     = var.status_max_wait_seconds >= 0 && var.status_max_wait_seconds <= 25
+    error_message = "status_max_wait_seconds must be between 0 and 25 (API Gateway times out at 29 seconds)."
+  }
+}
+
+variable "fleet_instance_ids" {
+  description = "Optional list of VPN instance IDs managed together by the start, stop, status and monitor Lambdas. Leave empty to manage only the instance created by this stack."
+  type        = list(string)
+  default     = []
+}
+
+variable "fleet_tag" {
+  description = "Optional Key=Value tag selecting the VPN instances managed as a fleet. Takes precedence over fleet_instance_ids."
+  type        = string
+  default     = ""
+}
+
+variable "wg_server_pool" {
+  description = "Optional WireGuard servers that new peers are spread across, each with its own client subnet slice. Registration picks the least-loaded server and keeps each key on it. Include this stack's instance to keep using it. Leave empty to register every peer on the instance created by this stack."
+  type = list(object({
+    instance_id    = string
+    client_subnet  = string
+    server_address = string
+    endpoint       = string
+  }))
+  default = []
+}
+
+variable "placement_mb_per_peer" {
+  description = "Hourly tunnel traffic (MB) that weighs as much as one peer when choosing the least-loaded server."
+  type        = number
+  default     = 50
+}
+
 variable "start_notification_emails" {
   description = "Email addresses to subscribe to VPN start notifications. Leave empty to manage subscriptions manually."
   type        = list(string)
@@ -189,3 +352,21 @@ variable "web_custom_domain" {
   type        = string
   default     = ""
 }
+
+variable "journal_batch_window_seconds" {
+  description = "Seconds SQS gathers journal events before invoking the journal Lambda; events within one window share a single SNS digest."
+  type        = number
+  default     = 60
+}
+
+variable "journal_notify_events" {
+  description = "Journal event kinds (start, stop, register, revoke, prune, monitor) that are sent to the notification topic."
+  type        = list(string)
+  default     = ["start"]
+}
+
+variable "journal_retention_days" {
+  description = "Days journal events are kept in S3."
+  type        = number
+  default     = 365
+}
@@ -0,0 +1,23 @@
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# The Lambdas import their siblings and the ``common`` layer as top-level
+# modules, exactly as they are laid out in the deployment zips.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lambda_functions"))
+
+from common import journal  # noqa: E402
+
+
+@pytest.fixture
+def journal_events(monkeypatch):
+    """Collect the events handlers queue for the event journal."""
+    sent = []
+    monkeypatch.setattr(journal, "QUEUE_URL", "https://sqs.ap-northeast-1.amazonaws.com/123456789012/vpn-journal")
+    monkeypatch.setattr(journal, "sqs", SimpleNamespace(
+        send_message=lambda **kwargs: sent.append(json.loads(kwargs["MessageBody"])) or {"MessageId": "1"}
+    ))
+    return sent
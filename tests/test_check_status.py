@@ -0,0 +1,162 @@
+import importlib
+import json
+import time
+
+import boto3
+import pytest
+from moto import mock_ec2
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def status_module(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    monkeypatch.setenv("STATUS_CACHE_TTL_SECONDS", "5")
+
+    with mock_ec2():
+        ec2_client = boto3.client("ec2")
+        ami_id = ec2_client.register_image(
+            Name="vpn-test-ami",
+            Architecture="x86_64",
+            RootDeviceName="/dev/sda1",
+            VirtualizationType="hvm"
+        )["ImageId"]
+        instance_id = ec2_client.run_instances(ImageId=ami_id, MinCount=1, MaxCount=1)["Instances"][0]["InstanceId"]
+        monkeypatch.setenv("INSTANCE_ID", instance_id)
+
+        module = importlib.reload(importlib.import_module("lambda_functions.check_status"))
+        monkeypatch.setattr(module, "time", FakeClock())
+        calls = []
+        module.ec2.meta.events.register(
+            "before-call.ec2.*",
+            lambda model, **kwargs: calls.append(model.name),
+        )
+        yield module, calls
+
+
+def test_snapshot_is_reused_within_ttl(status_module):
+    module, calls = status_module
+
+    first = module.handler({}, None)
+    module.time.now += 2
+    second = module.handler({}, None)
+
+    assert calls == ["DescribeInstanceStatus", "DescribeInstances"]
+    body = json.loads(second["body"])
+    assert body["state"] == "running"
+    assert body["cacheAgeSeconds"] == 2
+    assert first["headers"]["ETag"] == second["headers"]["ETag"]
+    assert second["headers"]["Cache-Control"] == "max-age=3"
+
+
+def _tag_ready(module, instance_id):
+    module.ec2.create_tags(
+        Resources=[instance_id],
+        Tags=[{"Key": module.READY_TAG_KEY, "Value": str(int(time.time()) + 60)}]
+    )
+
+
+def test_refresh_after_ttl_skips_address_lookup_without_transition(status_module):
+    module, calls = status_module
+    _tag_ready(module, module.INSTANCE_ID)
+    calls.clear()
+
+    module.handler({}, None)
+    module.time.now += 6
+    module.handler({}, None)
+    assert calls == ["DescribeInstanceStatus", "DescribeInstances", "DescribeInstanceStatus"]
+
+    module.ec2.stop_instances(InstanceIds=[module.INSTANCE_ID])
+    calls.clear()
+    module.time.now += 6
+    body = json.loads(module.handler({}, None)["body"])
+    assert body["state"] == "stopped"
+    assert calls == ["DescribeInstanceStatus", "DescribeInstances"]
+
+
+def test_tags_are_reread_until_the_agent_reports_ready(status_module):
+    module, calls = status_module
+
+    body = json.loads(module.handler({}, None)["body"])
+    assert (body["vpnReady"], body["readyAt"]) == (False, None)
+
+    _tag_ready(module, module.INSTANCE_ID)
+    calls.clear()
+    module.time.now += 6
+    body = json.loads(module.handler({}, None)["body"])
+    assert body["vpnReady"] is True
+    assert calls == ["DescribeInstanceStatus", "DescribeInstances"]
+
+    calls.clear()
+    module.time.now += 6
+    module.handler({}, None)
+    assert calls == ["DescribeInstanceStatus"]
+
+
+def test_long_poll_returns_when_readiness_changes(status_module):
+    module, calls = status_module
+
+    first = module.handler({}, None)
+    etag = first["headers"]["ETag"]
+    calls.clear()
+    unchanged = module.handler({"queryStringParameters": {"wait": "12", "since": etag}}, None)
+    assert unchanged["statusCode"] == 200
+    assert unchanged["headers"]["ETag"] == etag
+    assert calls.count("DescribeInstanceStatus") == 2
+    assert module.time.now == 1012
+
+    _tag_ready(module, module.INSTANCE_ID)
+    calls.clear()
+    ready = module.handler({"queryStringParameters": {"wait": "20"}, "headers": {"If-None-Match": etag}}, None)
+    assert ready["statusCode"] == 200
+    assert json.loads(ready["body"])["vpnReady"] is True
+    assert module.time.now == 1015
+    assert module._wait_seconds({"queryStringParameters": {"wait": "600"}}, None) == module.MAX_WAIT_SECONDS
+
+
+def test_matching_etag_returns_not_modified(status_module):
+    module, _ = status_module
+
+    etag = module.handler({}, None)["headers"]["ETag"]
+    module.time.now += 6
+    response = module.handler({"headers": {"if-none-match": etag}}, None)
+
+    assert response["statusCode"] == 304
+    assert response["body"] == ""
+
+
+def test_fleet_snapshot_batches_describes_and_filters_by_instance(status_module, monkeypatch):
+    module, calls = status_module
+    extra = module.ec2.run_instances(
+        ImageId=module.ec2.describe_images(Owners=["self"])["Images"][0]["ImageId"],
+        MinCount=2,
+        MaxCount=2
+    )["Instances"]
+    fleet = [module.INSTANCE_ID] + [instance["InstanceId"] for instance in extra]
+    module.ec2.stop_instances(InstanceIds=[fleet[2]])
+    calls.clear()
+    monkeypatch.setattr(module, "FLEET_MODE", True)
+    monkeypatch.setattr(module, "INSTANCE_IDS", fleet)
+
+    body = json.loads(module.handler({}, None)["body"])
+    assert calls == ["DescribeInstances", "DescribeInstanceStatus"]
+    assert [entry["instanceId"] for entry in body["instances"]] == fleet
+    assert (body["running"], body["instances"][2]["state"]) == (2, "stopped")
+
+    single = module.handler({"queryStringParameters": {"instanceId": fleet[1]}}, None)
+    assert json.loads(single["body"])["instanceId"] == fleet[1]
+    assert calls == ["DescribeInstances", "DescribeInstanceStatus"]
+    missing = module.handler({"queryStringParameters": {"instanceId": "i-0000000000000000f"}}, None)
+    assert missing["statusCode"] == 404
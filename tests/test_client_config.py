@@ -0,0 +1,98 @@
+import base64
+import struct
+import zlib
+
+import pytest
+
+from lambda_functions import client_config, qr
+
+# "wireguard" in byte mode, level M, mask 2, as printed by a reference encoder.
+WIREGUARD_M2 = [
+    "#######..##.#.#######",
+    "#.....#..##...#.....#",
+    "#.###.#.#.#...#.###.#",
+    "#.###.#.#...#.#.###.#",
+    "#.###.#.#.#.#.#.###.#",
+    "#.....#.####..#.....#",
+    "#######.#.#.#.#######",
+    "........#.#..........",
+    "#.#####....#..#####..",
+    "..#.##...#.##...#...#",
+    "###.#.##.#..#.#..###.",
+    "#.####...#.###...####",
+    "..##.###....#.##.#.#.",
+    "........#...##.##.###",
+    "#######..#.#.......#.",
+    "#.....#.#.#......###.",
+    "#.###.#.#..#........#",
+    "#.###.#.#..####.###..",
+    "#.###.#.#.#.#.#..##..",
+    "#.....#..######.###..",
+    "#######.###.#......#.",
+]
+
+SETTINGS = {"endpoint": "203.0.113.10:51820", "dns": "1.1.1.1", "allowedIps": "0.0.0.0/0, ::/0", "keepalive": 25}
+BUNDLE = {"assignedIp": "10.8.0.2", "presharedKey": "psk=", "serverPublicKey": "server="}
+
+
+def _rows(modules):
+    return ["".join("#" if dark else "." for dark in row) for row in modules]
+
+
+def test_qr_matrix_matches_reference_encoder():
+    assert _rows(qr.encode("wireguard", "M", mask=2)) == WIREGUARD_M2
+
+
+@pytest.mark.parametrize("length, ecc, size", [(17, "L", 21), (300, "M", 69), (700, "H", 137), (2900, "L", 177)])
+def test_qr_picks_smallest_version(length, ecc, size):
+    modules = qr.encode(b"x" * length, ecc)
+    assert len(modules) == size and all(len(row) == size for row in modules)
+
+
+def test_qr_rejects_oversized_payloads():
+    with pytest.raises(ValueError):
+        qr.encode(b"x" * 3000, "L")
+
+
+def test_png_and_svg_output_are_well_formed():
+    modules = qr.encode("wireguard")
+    png = qr.to_png(modules, scale=2, border=1)
+    assert png.startswith(b"\x89PNG\r\n\x1a\n")
+    width, height, depth = struct.unpack(">IIB", png[16:25])
+    assert width == height == (21 + 2) * 2 and depth == 1
+    idat = png.index(b"IDAT")
+    (length,) = struct.unpack(">I", png[idat - 4:idat])
+    rows = zlib.decompress(png[idat + 4:idat + 4 + length])
+    assert len(rows) == height * (1 + (width + 7) // 8)
+
+    svg = qr.to_svg(modules)
+    assert svg.startswith("<svg") and svg.count("h1v1h-1z") == sum(row.count(True) for row in modules)
+
+
+def test_x25519_matches_rfc_7748_vector():
+    private_key = base64.b64encode(bytes.fromhex(
+        "77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a")).decode()
+    assert base64.b64decode(client_config.public_key(private_key)).hex() == (
+        "8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a")
+    generated, public = client_config.generate_keypair()
+    assert client_config.public_key(generated) == public
+
+
+def test_rendered_config_has_placeholder_unless_key_given():
+    text = client_config.render(BUNDLE, SETTINGS)
+    assert text.splitlines() == [
+        "[Interface]",
+        f"PrivateKey = {client_config.PRIVATE_KEY_PLACEHOLDER}",
+        "Address = 10.8.0.2/32",
+        "DNS = 1.1.1.1",
+        "",
+        "[Peer]",
+        "PublicKey = server=",
+        "PresharedKey = psk=",
+        "AllowedIPs = 0.0.0.0/0, ::/0",
+        "Endpoint = 203.0.113.10:51820",
+        "PersistentKeepalive = 25",
+    ]
+    fields = client_config.config_fields(BUNDLE, SETTINGS, "png", private_key="secret=")
+    assert "PrivateKey = secret=" in fields["config"] and fields["configComplete"] is True
+    assert fields["qr"]["data"].startswith("data:image/png;base64,")
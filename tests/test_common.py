@@ -0,0 +1,250 @@
+import base64
+import importlib
+import json
+import socket
+import subprocess
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from moto import mock_dynamodb
+
+from common import agent, aws, emf, fleet, http, placement, tz
+
+
+def test_lazy_client_is_created_once_on_first_use(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    created = []
+    original = aws.session().client
+
+    def counting_client(*args, **kwargs):
+        created.append(args[0])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(aws.session(), "client", counting_client)
+    ec2 = aws.LazyClient("ec2")
+    assert created == [] and "pending" in repr(ec2)
+
+    assert ec2.meta.service_model.service_name == "ec2"
+    assert ec2.client is ec2.client
+    assert created == ["ec2"]
+    assert ec2.meta.config.connect_timeout == 3
+    assert ec2.meta.config.retries["mode"] == "standard"
+
+
+def test_lazy_client_works_with_stubber(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    ec2 = aws.LazyClient("ec2")
+    with Stubber(ec2.client) as stubber:
+        stubber.add_response("describe_instances", {"Reservations": [
+            {"Instances": [{"InstanceId": "i-1", "State": {"Name": "stopped"}}]}
+        ]}, {"InstanceIds": ["i-1"]})
+        assert fleet.current_state(ec2, "i-1") == "stopped"
+
+
+def test_fleet_from_env_and_requested_ids():
+    assert fleet.from_env({"INSTANCE_IDS": "i-1, i-2,", "FLEET_TAG": ""}) == (["i-1", "i-2"], "", True, "")
+    assert fleet.from_env({"INSTANCE_ID": "i-9"}) == ([], "", False, "i-9")
+    assert list(fleet.chunks([1, 2, 3], 2)) == [[1, 2], [3]]
+    assert fleet.requested_ids({"body": '{"instanceIds": ["i-1"]}'}) == {"i-1"}
+    assert fleet.requested_ids({"body": "not json"}) is None
+    for invalid in ([["i-1"]], [{"id": "i-1"}], ["i-1", ""], "i-1"):
+        with pytest.raises(ValueError):
+            fleet.requested_ids({"instanceIds": invalid})
+
+
+def test_response_merges_headers_and_zone_is_cached(monkeypatch):
+    result = http.response(204, None, {"Access-Control-Allow-Methods": "OPTIONS,DELETE"})
+    assert result["body"] == ""
+    assert result["headers"]["Access-Control-Allow-Methods"] == "OPTIONS,DELETE"
+    assert result["headers"]["Content-Type"] == "application/json"
+
+    monkeypatch.setenv("TIMEZONE", "Australia/Sydney")
+    assert importlib.reload(tz).local_zone() is tz.zone("Australia/Sydney")
+
+
+def _emf_lines(output: str) -> list:
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{"_aws"')]
+
+
+def test_instrumented_handler_emits_invocation_and_call_metrics(monkeypatch, capsys):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(emf, "_cold", True)
+    ssm = aws.LazyClient("ssm")
+
+    @emf.instrument("register_peer")
+    def handler(event, context):
+        ssm.get_command_invocation(CommandId="0" * 36, InstanceId="i-1")
+        emf.put("SsmPollCount", 3)
+        emf.put_ssm_timing("2024-01-01T00:00:00Z", "2024-01-01T00:00:00.250Z", "2024-01-01T00:00:01.250Z")
+        return {"statusCode": 200}
+
+    with Stubber(ssm.client) as stubber:
+        stubber.add_response("get_command_invocation", {"Status": "Success"})
+        stubber.add_client_error("get_command_invocation", "InvocationDoesNotExist")
+        handler({"httpMethod": "POST", "resource": "/register"}, SimpleNamespace(aws_request_id="req-1"))
+        with pytest.raises(ClientError):
+            handler({"httpMethod": "GET", "resource": "/register"}, None)
+
+    first, call, second, failed_call = _emf_lines(capsys.readouterr().out)
+    assert first["Function"] == "register_peer" and first["Endpoint"] == "POST /register"
+    assert first["requestId"] == "req-1"
+    assert first["ColdStart"] == 1 and second["ColdStart"] == 0
+    assert first["SsmPollCount"] == 3 and first["Fault"] == 0
+    assert first["SsmQueueTime"] == 250 and first["SsmExecutionTime"] == 1000
+    assert {metric["Name"] for metric in first["_aws"]["CloudWatchMetrics"][0]["Metrics"]} >= {"Duration", "ColdStart"}
+    assert call["Service"] == "ssm" and call["Operation"] == "GetCommandInvocation"
+    assert call["AwsCallErrors"] == 0 and call["AwsCallLatency"] >= 0
+    assert failed_call["AwsCallErrors"] == 1 and second["Fault"] == 1
+
+
+def test_disabled_metrics_emit_nothing(monkeypatch, capsys):
+    monkeypatch.setattr(emf, "ENABLED", False)
+
+    @emf.instrument("start_instance")
+    def handler(event, context):
+        emf.put("Ignored", 1)
+        return {"statusCode": 403}
+
+    assert handler({}, None) == {"statusCode": 403}
+    assert _emf_lines(capsys.readouterr().out) == []
+
+
+def test_agent_command_asks_the_agent_then_falls_back_to_the_inline_manager(tmp_path, monkeypatch):
+    source = Path(__file__).parents[1] / "lambda_functions" / "wg_peer_manager.py"
+    manager = agent.encode_script(source.read_bytes())
+    environment = {"WG_CONF_PATH": str(tmp_path / "wg0.conf"), "CLIENT_SUBNET": "10.8.0.0/24",
+                   "SERVER_ADDRESS": "10.8.0.1", "WG_INTERFACE": "wg-test"}
+    monkeypatch.setattr(agent, "TOKEN_PATH", str(tmp_path / "token"))
+
+    def run():
+        command = agent.command({"op": "ping"}, manager, environment, 5, "<test>")
+        return subprocess.run(["bash", "-c", command], capture_output=True, text=True, check=True).stdout
+
+    # No token file means no agent: the bundled manager answers inline.
+    assert json.loads(run()) == {"ok": True, "version": None}
+
+    (tmp_path / "token").write_text("secret")
+    listener = socket.create_server(("127.0.0.1", 0))
+    monkeypatch.setattr(agent, "PORT", listener.getsockname()[1])
+    received = []
+
+    def serve_once():
+        connection, _ = listener.accept()
+        with connection, connection.makefile("rw") as stream:
+            received.append(stream.readline().split())
+            stream.write('{"ok": true, "version": "resident"}\n')
+
+    server = threading.Thread(target=serve_once)
+    server.start()
+    assert json.loads(run())["version"] == "resident"
+    server.join()
+    listener.close()
+    token, message = received[0]
+    assert token == "secret" and json.loads(base64.b64decode(message)) == {"op": "ping"}
+
+
+POOL = [
+    {"instanceId": "i-a", "clientSubnet": "10.8.0.0/24", "serverAddress": "10.8.0.1", "endpoint": "a:51820"},
+    {"instanceId": "i-b", "clientSubnet": "10.8.1.0/24", "serverAddress": "10.8.1.1", "endpoint": "b:51820"},
+]
+
+
+@pytest.fixture
+def placements(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_dynamodb():
+        boto3.client("dynamodb").create_table(
+            TableName="vpn-placements",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield placement.Placement(POOL, "vpn-placements", cache_seconds=0, client=boto3.client("dynamodb"))
+
+
+def test_placement_spreads_new_keys_and_keeps_them_sticky(placements):
+    assert placements.assign(["k1", "k2", "k3", "k4"]) == {"i-a": ["k1", "k3"], "i-b": ["k2", "k4"]}
+    assert placements.loads() == {
+        "i-a": {"peers": 2, "trafficMbPerHour": 0.0},
+        "i-b": {"peers": 2, "trafficMbPerHour": 0.0},
+    }
+
+    # 500 MB/h weighs like ten more peers, so new keys avoid the busy server.
+    placements.record_traffic("i-a", 500)
+    assert placements.assign(["k1", "k5", "k6"]) == {"i-a": ["k1"], "i-b": ["k5", "k6"]}
+
+    placements.report("i-b", 30)
+    assert placements.assign(["k7"]) == {"i-a": ["k7"]}
+
+    placements.forget(["k2"])
+    assert placements.route(["k2", "k4"]) == {"i-a": ["k2"], "i-b": ["k4"]}
+
+
+def test_placement_follows_concurrent_winners(placements, monkeypatch):
+    placements.client.put_item(TableName="vpn-placements", Item={"id": {"S": "peer#k1"}, "instanceId": {"S": "i-b"}})
+    placements.client.put_item(TableName="vpn-placements", Item={"id": {"S": "peer#k3"}, "instanceId": {"S": "i-a"}})
+    located = placement.Placement.locate
+    lookups = []
+
+    def racing_locate(self, keys):
+        # The first lookup runs before the other requests' writes land.
+        lookups.append(keys)
+        return {} if len(lookups) == 1 else located(self, keys)
+
+    monkeypatch.setattr(placement.Placement, "locate", racing_locate)
+    assert placements.assign(["k1"]) == {"i-b": ["k1"]}
+    assert placements.loads()["i-a"]["peers"] == 0
+
+    # k2 and k3 would be spread over both servers; k3 follows its recorded server.
+    lookups.clear()
+    assert placements.assign(["k2", "k3"]) == {"i-a": ["k2", "k3"]}
+    assert lookups[1:] == [["k3"]]
+    assert placements.loads() == {
+        "i-a": {"peers": 1, "trafficMbPerHour": 0.0},
+        "i-b": {"peers": 0, "trafficMbPerHour": 0.0},
+    }
+
+def test_released_placements_are_undone_unless_placed_anew(placements):
+    placements.assign(["k1"])
+    groups, recorded = placements.place(["k1", "k2", "k3"])
+    assert groups == {"i-a": ["k1", "k3"], "i-b": ["k2"]}
+    assert recorded == {"k2": "i-b", "k3": "i-a"}
+
+    # k3 moved on since, so only k2's placement goes.
+    placements.client.put_item(TableName="vpn-placements", Item={"id": {"S": "peer#k3"}, "instanceId": {"S": "i-b"}})
+    placements.release(recorded)
+    assert placements.locate(["k1", "k2", "k3"]) == {"k1": "i-a", "k3": "i-b"}
+    assert {server: load["peers"] for server, load in placements.loads().items()} == {"i-a": 2, "i-b": 0}
+
+
+def test_placement_raises_when_batch_items_stay_unprocessed(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(placement.time, "sleep", lambda seconds: None)
+    client = boto3.client("dynamodb")
+    placements = placement.Placement(POOL, "vpn-placements", cache_seconds=0, client=client)
+    throttled_read = {"vpn-placements": {"Keys": [{"id": {"S": "peer#k1"}}]}}
+    throttled_write = {"vpn-placements": [{"DeleteRequest": {"Key": {"id": {"S": "peer#k1"}}}}]}
+    with Stubber(client) as stubber:
+        for _ in range(placement._BATCH_ATTEMPTS):
+            stubber.add_response("batch_get_item", {"Responses": {}, "UnprocessedKeys": throttled_read})
+        for _ in range(placement._BATCH_ATTEMPTS):
+            stubber.add_response("batch_write_item", {"UnprocessedItems": throttled_write})
+
+        with pytest.raises(RuntimeError, match="left unread"):
+            placements.locate(["k1"])
+        with pytest.raises(RuntimeError, match="left unwritten"):
+            placements.forget(["k1"])
+        stubber.assert_no_pending_responses()
@@ -0,0 +1,80 @@
+import gzip
+import importlib
+import json
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from common import journal
+
+
+def _record(kind, at, message_id=None, **fields):
+    body = {"v": 1, "id": f"{kind}-{at}", "at": at, "kind": kind, **fields}
+    return {"messageId": message_id or f"msg-{at}", "body": json.dumps(body)}
+
+
+@pytest.fixture
+def journal_module(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    monkeypatch.setenv("JOURNAL_BUCKET", "vpn-journal")
+    monkeypatch.setenv("NOTIFICATION_TOPIC_ARN", "arn:aws:sns:ap-northeast-1:123456789012:vpn-start-events")
+    monkeypatch.setenv("JOURNAL_NOTIFY_EVENTS", "start,stop")
+    with mock_s3():
+        client = boto3.client("s3", region_name="ap-northeast-1")
+        client.create_bucket(Bucket="vpn-journal", CreateBucketConfiguration={"LocationConstraint": "ap-northeast-1"})
+        module = importlib.reload(importlib.import_module("lambda_functions.event_journal"))
+        monkeypatch.setattr(module, "s3", client)
+        published = []
+        monkeypatch.setattr(module, "sns", SimpleNamespace(publish=lambda **kwargs: published.append(kwargs)))
+        yield module, client, published
+
+
+def test_burst_becomes_one_log_object_and_one_digest(journal_module):
+    module, client, published = journal_module
+    records = [
+        _record("start", "2024-05-01T10:00:02.000+00:00", sourceIp="198.51.100.10"),
+        _record("monitor", "2024-05-01T10:00:01.000+00:00", action="keep"),
+        _record("start", "2024-05-01T10:00:03.000+00:00", sourceIp="198.51.100.11"),
+        _record("stop", "2024-05-01T10:00:04.000+00:00"),
+        {"messageId": "broken", "body": "not json"},
+    ]
+    result = module.handler({"Records": records}, None)
+
+    assert result["appended"] == 4
+    assert result["key"] == "events/dt=2024-05-01/20240501T100001Z-msg-2024-05-01T10:00:02.000+00:00.jsonl.gz"
+    body = client.get_object(Bucket="vpn-journal", Key=result["key"])["Body"].read()
+    lines = [json.loads(line) for line in gzip.decompress(body).decode("utf-8").splitlines()]
+    assert [line["kind"] for line in lines] == ["monitor", "start", "start", "stop"]
+
+    assert len(published) == 1
+    assert published[0]["Subject"] == "VPN events: 2 start, 1 stop"
+    message = json.loads(published[0]["Message"])
+    assert message["counts"] == {"start": 2, "stop": 1}
+    assert [event["sourceIp"] for event in message["events"] if event["kind"] == "start"] == [
+        "198.51.100.10", "198.51.100.11",
+    ]
+
+
+def test_quiet_batches_are_logged_without_notifying(journal_module):
+    module, client, published = journal_module
+    result = module.handler({"Records": [_record("monitor", "2024-05-01T10:15:00.000+00:00")]}, None)
+    assert (result["appended"], result["notified"]) == (1, 0)
+    assert published == []
+
+    single = module.digest([json.loads(_record("start", "2024-05-01T10:16:00.000+00:00")["body"])])
+    assert single["Subject"] == "VPN start requested"
+
+
+def test_records_carry_api_caller_details(journal_events):
+    event = {"requestContext": {"http": {"sourceIp": "203.0.113.5", "userAgent": "curl"}, "requestId": "api-1"}}
+    journal.record("stop", event, SimpleNamespace(aws_request_id="invocation-1"), trigger="api", hibernate=None)
+
+    assert len(journal_events) == 1
+    sent = journal_events[0]
+    assert (sent["kind"], sent["sourceIp"], sent["userAgent"]) == ("stop", "203.0.113.5", "curl")
+    assert (sent["requestId"], sent["invocationId"], sent["trigger"]) == ("api-1", "invocation-1", "api")
+    assert "hibernate" not in sent and sent["v"] == journal.SCHEMA_VERSION
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from lambda_functions import idle_engine
+
+MB = 1024 * 1024
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _series(mb_per_minute, period_seconds=60, peers=None):
+    samples = []
+    for index, megabytes in enumerate(mb_per_minute):
+        sample = {"timestamp": START + timedelta(seconds=index * period_seconds), "bytes": megabytes * MB}
+        if peers is not None:
+            sample["activePeers"] = peers[index]
+        samples.append(sample)
+    return samples
+
+
+def _points(values, period_seconds=60, peers=None):
+    return idle_engine.to_points(_series(values, period_seconds, peers), period_seconds)
+
+
+def test_window_mode_matches_the_all_points_rule():
+    policy = idle_engine.IdlePolicy(threshold_mb_per_hour=1, required_points=3, period_seconds=900)
+    assert idle_engine.decide(policy, _points([0.1, 0.1, 0.1], 900))["stop"] is True
+    assert idle_engine.decide(policy, _points([5, 0.1, 0.1], 900))["stop"] is False
+    assert idle_engine.decide(policy, _points([0.1, 0.1], 900))["stop"] is False
+    assert idle_engine.decide(policy, [])["reason"] == "no data"
+
+
+def test_hysteresis_band_extends_but_does_not_start_a_streak():
+    # 1 MB/hour stop threshold, 6 MB/hour resume threshold at 60 s periods.
+    policy = idle_engine.IdlePolicy(threshold_mb_per_hour=1, resume_mb_per_hour=6, required_points=4,
+                                    period_seconds=60)
+    keepalive = 0.05  # 3 MB/hour: inside the band
+    assert idle_engine.decide(policy, _points([0.0, keepalive, 0.0, keepalive]))["stop"] is True
+    assert idle_engine.decide(policy, _points([keepalive] * 4))["stop"] is False
+    assert idle_engine.decide(policy, _points([0.0, 0.2, 0.0, 0.0]))["idleStreak"] == 2
+
+
+def test_active_peer_breaks_an_idle_streak():
+    policy = idle_engine.IdlePolicy(threshold_mb_per_hour=1, required_points=3, period_seconds=60)
+    decision = idle_engine.decide(policy, _points([0, 0, 0], peers=[0, 1, 0]))
+    assert decision == {"stop": False, "idleStreak": 1, "smoothedMbPerHour": None, "reason": "active"}
+
+
+def test_ewma_reacts_before_the_window_fills():
+    policy = idle_engine.IdlePolicy(threshold_mb_per_hour=1, required_points=90, period_seconds=60,
+                                    smoothing="ewma", ewma_alpha=0.5, min_idle_points=10)
+    busy_then_quiet = [50] * 30 + [0] * 12
+    decision = idle_engine.decide(policy, _points(busy_then_quiet))
+    assert decision["stop"] is True
+    assert decision["smoothedMbPerHour"] <= 1
+    window = idle_engine.IdlePolicy(threshold_mb_per_hour=1, required_points=90, period_seconds=60)
+    assert idle_engine.decide(window, _points(busy_then_quiet))["stop"] is False
+
+
+def test_grace_period_after_start_keeps_instance_running():
+    policy = idle_engine.IdlePolicy(threshold_mb_per_hour=1, required_points=3, period_seconds=60,
+                                    grace_seconds=600)
+    points = _points([0, 0, 0])
+    now = START + timedelta(minutes=3)
+    assert idle_engine.decide(policy, points, started_at=START, now=now)["reason"] == "within grace period after start"
+    assert idle_engine.decide(policy, points, started_at=START - timedelta(hours=1), now=now)["stop"] is True
+
+
+def test_from_env_reads_policy_settings():
+    policy = idle_engine.IdlePolicy.from_env({
+        "MONITOR_THRESHOLD_MB": "2",
+        "MONITOR_RESUME_MB": "8",
+        "MONITOR_SMOOTHING": "ewma",
+        "MONITOR_EWMA_ALPHA": "0.3",
+        "MONITOR_MIN_IDLE_POINTS": "15",
+        "MONITOR_GRACE_SECONDS": "900",
+    }, required_points=90, period_seconds=60)
+    assert policy.describe() == {
+        "thresholdMbPerHour": 2.0,
+        "resumeMbPerHour": 8.0,
+        "requiredPoints": 90,
+        "smoothing": "ewma",
+        "ewmaAlpha": 0.3,
+        "minIdlePoints": 15,
+        "graceSeconds": 900,
+    }
+    with pytest.raises(ValueError):
+        idle_engine.IdlePolicy(smoothing="median")
+
+
+def test_replay_trades_wasted_hours_against_false_stops():
+    # Two sessions separated by a 5 minute pause, then a long idle tail.
+    samples = _series([10] * 30 + [0] * 5 + [10] * 30 + [0] * 120)
+    eager = idle_engine.IdlePolicy(threshold_mb_per_hour=1, required_points=3, period_seconds=60)
+    patient = idle_engine.IdlePolicy(threshold_mb_per_hour=1, required_points=15, period_seconds=60)
+
+    eager_result = idle_engine.replay(eager, samples)
+    patient_result = idle_engine.replay(patient, samples)
+
+    assert eager_result["stops"] == 2 and eager_result["falseStops"] == 1
+    assert patient_result["stops"] == 1 and patient_result["falseStops"] == 0
+    assert eager_result["idleHoursRunning"] < patient_result["idleHoursRunning"]
+    assert eager_result["periods"] == patient_result["periods"] == 185
@@ -0,0 +1,318 @@
+import importlib
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import ANY, Stubber
+
+INSTANCE_ID = "i-0123456789abcdef0"
+
+
+@pytest.fixture
+def monitor_module(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    monkeypatch.setenv("INSTANCE_ID", INSTANCE_ID)
+    monkeypatch.setenv("MONITOR_THRESHOLD_MB", "1")
+    monkeypatch.setenv("MONITOR_WINDOW_HRS", "0.5")
+    monkeypatch.setenv("MONITOR_PERIOD_SECONDS", "900")
+    return importlib.reload(importlib.import_module("lambda_functions.monitor_traffic"))
+
+
+def _metric_page(timestamps, values, next_token=None, query_id="total0"):
+    page = {
+        "MetricDataResults": [{
+            "Id": query_id,
+            "Label": INSTANCE_ID,
+            "Timestamps": timestamps,
+            "Values": values,
+            "StatusCode": "Complete"
+        }]
+    }
+    if next_token:
+        page["NextToken"] = next_token
+    return page
+
+
+def _stub_running(stubber):
+    stubber.add_response(
+        "describe_instances",
+        {"Reservations": [{"Instances": [{"InstanceId": INSTANCE_ID, "State": {"Code": 16, "Name": "running"}}]}]},
+        {"InstanceIds": [INSTANCE_ID]}
+    )
+
+
+def test_collect_metrics_follows_pagination_in_one_query(monitor_module):
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    first, second = now - timedelta(minutes=30), now - timedelta(minutes=15)
+    with Stubber(monitor_module.cloudwatch) as stubber:
+        stubber.add_response("get_metric_data", _metric_page([first], [10.0], next_token="page-2"), {
+            "MetricDataQueries": ANY,
+            "StartTime": ANY,
+            "EndTime": ANY,
+            "ScanBy": "TimestampAscending"
+        })
+        stubber.add_response("get_metric_data", _metric_page([second], [20.0]), {
+            "MetricDataQueries": ANY,
+            "StartTime": ANY,
+            "EndTime": ANY,
+            "ScanBy": "TimestampAscending",
+            "NextToken": "page-2"
+        })
+        totals = monitor_module._collect_metrics(now - timedelta(hours=1), now)
+        stubber.assert_no_pending_responses()
+
+    assert totals == {first: 10.0, second: 20.0}
+    expression = [query for query in monitor_module._metric_queries([INSTANCE_ID]) if query.get("ReturnData")]
+    assert expression == [{"Id": "total0", "Expression": "in0 + out0", "Label": INSTANCE_ID, "ReturnData": True}]
+
+
+def test_quiet_window_stops_instance(monitor_module, journal_events):
+    now = datetime.now(timezone.utc)
+    points = [now - timedelta(minutes=30), now - timedelta(minutes=15)]
+    with Stubber(monitor_module.ec2) as ec2_stubber, Stubber(monitor_module.cloudwatch) as cw_stubber:
+        _stub_running(ec2_stubber)
+        cw_stubber.add_response("get_metric_data", _metric_page(points, [1024.0, 2048.0]))
+        ec2_stubber.add_response(
+            "stop_instances",
+            {"StoppingInstances": []},
+            {"InstanceIds": [INSTANCE_ID]}
+        )
+        response = monitor_module.handler({}, None)
+        ec2_stubber.assert_no_pending_responses()
+
+    body = json.loads(response["body"])
+    assert body["message"].startswith("Traffic remained below threshold")
+    assert len(body["evaluation"]) == 2
+    assert [(event["kind"], event["action"], event["instanceIds"]) for event in journal_events] == [
+        ("monitor", "stop", [INSTANCE_ID]),
+    ]
+
+
+def test_recent_start_is_kept_through_the_grace_period(monitor_module, monkeypatch):
+    monkeypatch.setattr(monitor_module, "POLICY", monitor_module.idle_engine.IdlePolicy(
+        threshold_mb_per_hour=1, required_points=2, period_seconds=900, grace_seconds=3600
+    ))
+    now = datetime.now(timezone.utc)
+    points = [now - timedelta(minutes=30), now - timedelta(minutes=15)]
+    with Stubber(monitor_module.ec2) as ec2_stubber, Stubber(monitor_module.cloudwatch) as cw_stubber:
+        ec2_stubber.add_response(
+            "describe_instances",
+            {"Reservations": [{"Instances": [{
+                "InstanceId": INSTANCE_ID,
+                "State": {"Code": 16, "Name": "running"},
+                "LaunchTime": now - timedelta(minutes=40)
+            }]}]},
+            {"InstanceIds": [INSTANCE_ID]}
+        )
+        cw_stubber.add_response("get_metric_data", _metric_page(points, [0.0, 0.0]))
+        response = monitor_module.handler({}, None)
+        ec2_stubber.assert_no_pending_responses()
+
+    body = json.loads(response["body"])
+    assert body["decision"]["stop"] is False
+    assert body["decision"]["reason"] == "within grace period after start"
+    assert body["policy"]["graceSeconds"] == 3600
+
+
+def test_fleet_is_evaluated_from_one_metric_query(monitor_module, monkeypatch):
+    busy, idle, stopped = "i-00000000000000001", "i-00000000000000002", "i-00000000000000003"
+    monkeypatch.setattr(monitor_module, "FLEET_MODE", True)
+    monkeypatch.setattr(monitor_module, "INSTANCE_IDS", [busy, idle, stopped])
+    now = datetime.now(timezone.utc)
+    points = [now - timedelta(minutes=30), now - timedelta(minutes=15)]
+    instances = [
+        {"InstanceId": busy, "State": {"Code": 16, "Name": "running"}},
+        {"InstanceId": idle, "State": {"Code": 16, "Name": "running"}},
+        {"InstanceId": stopped, "State": {"Code": 80, "Name": "stopped"}},
+    ]
+    with Stubber(monitor_module.ec2) as ec2_stubber, Stubber(monitor_module.cloudwatch) as cw_stubber:
+        ec2_stubber.add_response(
+            "describe_instances",
+            {"Reservations": [{"Instances": instances}]},
+            {"InstanceIds": [busy, idle, stopped]}
+        )
+        cw_stubber.add_response("get_metric_data", {"MetricDataResults": [
+            _metric_page(points, [500e6, 500e6], query_id="total0")["MetricDataResults"][0],
+            _metric_page(points, [1024.0, 0.0], query_id="total1")["MetricDataResults"][0],
+        ]})
+        ec2_stubber.add_response("stop_instances", {"StoppingInstances": []}, {"InstanceIds": [idle]})
+        response = monitor_module.handler({}, None)
+        ec2_stubber.assert_no_pending_responses()
+        cw_stubber.assert_no_pending_responses()
+
+    body = json.loads(response["body"])
+    assert body["stopped"] == [idle]
+    assert [item["action"] for item in body["instances"]] == ["keep", "stop"]
+
+
+def test_tunnel_source_publishes_usage_and_respects_active_peers(monitor_module, monkeypatch):
+    command_id = "11111111-2222-3333-4444-555555555555"
+    monkeypatch.setattr(monitor_module, "MONITOR_SOURCE", "wireguard")
+    now = datetime.now(timezone.utc)
+    points = [now - timedelta(minutes=30), now - timedelta(minutes=15)]
+    sample = {"sampledAt": int(now.timestamp()), "rxBytes": 10, "txBytes": 5, "activePeers": 1}
+
+    with Stubber(monitor_module.ec2) as ec2_stubber, \
+            Stubber(monitor_module.ssm) as ssm_stubber, \
+            Stubber(monitor_module.cloudwatch) as cw_stubber:
+        _stub_running(ec2_stubber)
+        ssm_stubber.add_response(
+            "send_command",
+            {"Command": {"CommandId": command_id}},
+            {
+                "InstanceIds": [INSTANCE_ID],
+                "DocumentName": "AWS-RunShellScript",
+                "Parameters": {"commands": ANY},
+                "TimeoutSeconds": ANY,
+                "Comment": "monitor-usage"
+            }
+        )
+        ssm_stubber.add_response(
+            "list_command_invocations",
+            {"CommandInvocations": [{
+                "InstanceId": INSTANCE_ID,
+                "Status": "Success",
+                "CommandPlugins": [{"Output": "warning\n" + json.dumps(sample)}]
+            }]},
+            {"CommandId": command_id, "Details": True}
+        )
+        cw_stubber.add_response("put_metric_data", {}, {"Namespace": "WireGuardVPN", "MetricData": ANY})
+        cw_stubber.add_response("get_metric_data", {"MetricDataResults": [
+            _metric_page(points, [0.0, 0.0], query_id="total0")["MetricDataResults"][0],
+            _metric_page(points, [0.0, 1.0], query_id="peers0")["MetricDataResults"][0],
+        ]})
+        response = monitor_module.handler({}, None)
+        cw_stubber.assert_no_pending_responses()
+
+    body = json.loads(response["body"])
+    assert body["message"].startswith("Traffic above threshold")
+    assert [point["activePeers"] for point in body["evaluation"]] == [0, 1]
+    assert body["source"] == "wireguard"
+
+
+class FakeObjectStore:
+    def __init__(self, fail_puts=False):
+        self.body = None
+        self.fail_puts = fail_puts
+
+    def get_object(self, Bucket, Key):
+        if self.body is None:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.body)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if self.fail_puts:
+            raise ClientError({"Error": {"Code": "SlowDown"}}, "PutObject")
+        self.body = Body
+
+
+class FakeCloudWatch:
+    def __init__(self, series):
+        self.series = series
+        self.requests = []
+
+    def get_metric_data(self, **kwargs):
+        self.requests.append(kwargs)
+        points = sorted(ts for ts in self.series if kwargs["StartTime"] <= ts < kwargs["EndTime"])
+        return _metric_page(points, [self.series[ts] for ts in points])
+
+
+def test_incremental_evaluator_only_fetches_new_periods(monitor_module, monkeypatch):
+    period = 900
+    high_water = 1888889 * period
+    stamp = lambda epoch: datetime.fromtimestamp(epoch, timezone.utc)  # noqa: E731
+    store = FakeObjectStore()
+    cloudwatch = FakeCloudWatch({
+        stamp(high_water - 2 * period): 5 * 1024 * 1024,
+        stamp(high_water - period): 1024.0,
+        stamp(high_water): 2048.0,
+    })
+    monkeypatch.setattr(monitor_module, "STATE_BUCKET", "vpn-peers")
+    monkeypatch.setattr(monitor_module, "s3", store)
+    monkeypatch.setattr(monitor_module, "cloudwatch", cloudwatch)
+
+    monkeypatch.setattr(monitor_module.time, "time", lambda: high_water + 50)
+    totals, _ = monitor_module._collect_window([INSTANCE_ID])
+    assert cloudwatch.requests[0]["StartTime"] == stamp(high_water - 2 * period)
+    assert sorted(totals[INSTANCE_ID].values()) == [1024.0, 5 * 1024 * 1024]
+
+    monkeypatch.setattr(monitor_module.time, "time", lambda: high_water + period + 50)
+    totals, _ = monitor_module._collect_window([INSTANCE_ID])
+    assert cloudwatch.requests[1]["StartTime"] == stamp(high_water - period)
+    assert totals[INSTANCE_ID] == {stamp(high_water - period): 1024.0, stamp(high_water): 2048.0}
+    assert monitor_module._evaluate(totals[INSTANCE_ID])[1]["stop"] is True
+
+    state = json.loads(store.body)
+    assert state["instances"][INSTANCE_ID] == {"hwm": high_water + period, "t0": high_water - period, "bytes": [1024.0, 2048.0]}
+
+
+def test_state_for_a_large_fleet_round_trips_past_parameter_limits(monitor_module, monkeypatch):
+    store = FakeObjectStore()
+    monkeypatch.setattr(monitor_module, "STATE_BUCKET", "vpn-peers")
+    monkeypatch.setattr(monitor_module, "s3", store)
+    # 60 instances with two hours of one-minute periods each.
+    instances = {
+        f"i-{index:017x}": {"hwm": 1700007200, "t0": 1700000000, "bytes": [123456.0] * 120}
+        for index in range(60)
+    }
+
+    monitor_module._save_state(instances)
+
+    assert len(store.body) > 8192
+    assert monitor_module._load_state() == instances
+
+
+def test_failed_state_save_does_not_fail_the_run(monitor_module, monkeypatch):
+    period = 900
+    high_water = 1888889 * period
+    stamp = lambda epoch: datetime.fromtimestamp(epoch, timezone.utc)  # noqa: E731
+    cloudwatch = FakeCloudWatch({stamp(high_water - period): 1024.0, stamp(high_water - 2 * period): 2048.0})
+    monkeypatch.setattr(monitor_module, "STATE_BUCKET", "vpn-peers")
+    monkeypatch.setattr(monitor_module, "s3", FakeObjectStore(fail_puts=True))
+    monkeypatch.setattr(monitor_module, "cloudwatch", cloudwatch)
+    monkeypatch.setattr(monitor_module.time, "time", lambda: high_water + 50)
+
+    for _ in range(2):
+        totals, _ = monitor_module._collect_window([INSTANCE_ID])
+        assert totals[INSTANCE_ID] == {stamp(high_water - 2 * period): 2048.0, stamp(high_water - period): 1024.0}
+    # Without saved state, every run queries the whole window.
+    assert [request["StartTime"] for request in cloudwatch.requests] == [stamp(high_water - 2 * period)] * 2
+
+
+def test_idle_stop_hibernates_and_falls_back_when_unsupported(monitor_module, monkeypatch):
+    monkeypatch.setattr(monitor_module, "HIBERNATE_ON_STOP", True)
+    now = datetime.now(timezone.utc)
+    points = [now - timedelta(minutes=30), now - timedelta(minutes=15)]
+    with Stubber(monitor_module.ec2) as ec2_stubber, Stubber(monitor_module.cloudwatch) as cw_stubber:
+        _stub_running(ec2_stubber)
+        cw_stubber.add_response("get_metric_data", _metric_page(points, [0.0, 0.0]))
+        ec2_stubber.add_client_error(
+            "stop_instances",
+            service_error_code="UnsupportedHibernationConfiguration",
+            expected_params={"InstanceIds": [INSTANCE_ID], "Hibernate": True}
+        )
+        ec2_stubber.add_response("stop_instances", {"StoppingInstances": []}, {"InstanceIds": [INSTANCE_ID]})
+        response = monitor_module.handler({}, None)
+        ec2_stubber.assert_no_pending_responses()
+
+    assert json.loads(response["body"])["hibernate"] is False
+
+
+def test_first_handshake_is_measured_from_launch_once(monitor_module):
+    launch = datetime(2024, 1, 1, 8, 0, tzinfo=timezone.utc)
+    start = int(launch.timestamp())
+    readiness = {"wake": "resume", "wokeAt": start + 20, "firstHandshakeAt": start + 35}
+    fresh = {"sampledAt": start + 300, "intervalSeconds": 900, "readiness": readiness}
+    stale = {"sampledAt": start + 1200, "intervalSeconds": 900, "readiness": readiness}
+    before_start = {"sampledAt": start + 300, "intervalSeconds": None,
+                    "readiness": {**readiness, "firstHandshakeAt": start - 60}}
+
+    measured = monitor_module._first_handshakes(
+        {"i-fresh": fresh, "i-stale": stale, "i-old": before_start},
+        {"i-fresh": launch, "i-stale": launch, "i-old": launch}
+    )
+    assert measured == {"i-fresh": {"wake": "resume", "firstHandshakeAt": start + 35, "seconds": 35.0}}
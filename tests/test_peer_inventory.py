@@ -0,0 +1,116 @@
+import json
+import time
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from lambda_functions import peer_inventory
+
+
+def _key(index):
+    return f"{index:043d}="
+
+
+def _snapshot(keys, generated_at=None, handshake=0):
+    return {
+        "generatedAt": int(time.time()) if generated_at is None else generated_at,
+        "fields": list(peer_inventory.ROW_FIELDS),
+        "peers": [[key, f"10.8.0.{index + 2}", handshake or None, 1, 2, 1700000000] for index, key in enumerate(keys)],
+    }
+
+
+def _params(**overrides):
+    params, error = peer_inventory.parse_query({key: str(value) for key, value in overrides.items()})
+    assert error is None
+    return params
+
+
+def test_pages_follow_the_last_key_until_exhausted():
+    snapshot = _snapshot([_key(index) for index in range(5)])
+    seen = []
+    cursor = None
+    while True:
+        query = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = peer_inventory.select([("i-1", snapshot)], _params(**query), time.time())
+        seen += [peer["publicKey"] for peer in page["peers"]]
+        assert page["matched"] == 5
+        cursor = page["nextCursor"]
+        if cursor is None:
+            break
+    assert seen == [_key(index) for index in range(5)]
+
+
+def test_cursor_survives_peers_added_before_it():
+    first = peer_inventory.select([("i-1", _snapshot([_key(1), _key(3), _key(5)]))], _params(limit=2), time.time())
+    assert first["nextCursor"] == peer_inventory.encode_cursor(_key(3))
+
+    refreshed = _snapshot([_key(0), _key(1), _key(2), _key(3), _key(5)])
+    second = peer_inventory.select([("i-1", refreshed)], _params(limit=2, cursor=first["nextCursor"]), time.time())
+    assert [peer["publicKey"] for peer in second["peers"]] == [_key(5)]
+    assert second["nextCursor"] is None
+
+
+def test_active_filter_and_pool_merge():
+    now = 1700001000
+    quiet = _snapshot([_key(1), _key(4)], handshake=now - 3600)
+    busy = _snapshot([_key(2), _key(3)], handshake=now - 60)
+    page = peer_inventory.select([("i-a", quiet), ("i-b", busy)], _params(), now, tag_servers=True)
+    assert [(peer["publicKey"], peer["instanceId"]) for peer in page["peers"]] == [
+        (_key(1), "i-a"), (_key(2), "i-b"), (_key(3), "i-b"), (_key(4), "i-a"),
+    ]
+
+    active = peer_inventory.select([("i-a", quiet), ("i-b", busy)], _params(activeWithinMinutes=5), now)
+    assert [peer["publicKey"] for peer in active["peers"]] == [_key(2), _key(3)]
+    assert active["matched"] == 2
+    assert active["peers"][0] == {
+        "publicKey": _key(2),
+        "assignedIp": "10.8.0.2",
+        "latestHandshake": "2023-11-14T22:29:00+00:00",
+        "rxBytes": 1,
+        "txBytes": 2,
+        "registeredAt": "2023-11-14T22:13:20+00:00",
+    }
+
+
+@pytest.mark.parametrize("query", [
+    {"limit": "0"},
+    {"limit": "1001"},
+    {"limit": "ten"},
+    {"activeWithinMinutes": "-5"},
+    {"cursor": "%%%"},
+])
+def test_invalid_queries_are_rejected(query):
+    params, error = peer_inventory.parse_query(query)
+    assert params is None
+    assert error
+
+
+def test_snapshot_output_must_match_row_fields():
+    with pytest.raises(ValueError):
+        peer_inventory.parse_snapshot("")
+    with pytest.raises(ValueError, match="Unexpected inventory fields"):
+        peer_inventory.parse_snapshot(json.dumps({"peers": [], "fields": ["publicKey"]}))
+    assert peer_inventory.parse_snapshot("noise\n" + json.dumps(_snapshot([_key(1)])))["peers"][0][0] == _key(1)
+
+
+def test_snapshots_are_shared_through_s3_until_stale(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    with mock_s3():
+        client = boto3.client("s3", region_name="ap-northeast-1")
+        client.create_bucket(Bucket="peers", CreateBucketConfiguration={"LocationConstraint": "ap-northeast-1"})
+        writer = peer_inventory.SnapshotCache("peers", 30, client)
+        reader = peer_inventory.SnapshotCache("peers", 30, client)
+
+        assert reader.get("i-1") is None
+        writer.put("i-1", _snapshot([_key(1)]))
+        assert reader.get("i-1")["peers"][0][0] == _key(1)
+
+        writer.put("i-2", _snapshot([_key(2)], generated_at=int(time.time()) - 60))
+        assert reader.get("i-2") is None
+
+        client.put_object(Bucket="peers", Key=peer_inventory.output_key("commands", "cmd", "i-1"), Body=b"{}\n")
+        assert reader.command_output("cmd", "i-1") == "{}\n"
+        assert reader.command_output("missing", "i-1") is None
@@ -0,0 +1,630 @@
+import base64
+import importlib
+import json
+import time
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import ANY, Stubber
+from moto import mock_dynamodb, mock_s3
+
+from lambda_functions import wg_peer_manager as manager
+
+INSTANCE_ID = "i-0123456789abcdef0"
+COMMAND_ID = "11111111-2222-3333-4444-555555555555"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _peer_key(index):
+    return f"{index:043d}="
+
+
+@pytest.fixture
+def register_module(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    monkeypatch.setenv("INSTANCE_ID", INSTANCE_ID)
+    monkeypatch.setenv("CLIENT_SUBNET_CIDR", "10.8.0.0/24")
+    monkeypatch.setenv("SERVER_ADDRESS", "10.8.0.1")
+    module = importlib.reload(importlib.import_module("lambda_functions.register_peer"))
+    monkeypatch.setattr(module, "time", FakeClock())
+    return module
+
+
+def _post(body):
+    return {"httpMethod": "POST", "body": json.dumps(body)}
+
+
+def _stub_send(stubber, comment=ANY):
+    stubber.add_response(
+        "send_command",
+        {"Command": {"CommandId": COMMAND_ID}},
+        {
+            "InstanceIds": [INSTANCE_ID],
+            "DocumentName": "AWS-RunShellScript",
+            "Parameters": {"commands": ANY},
+            "TimeoutSeconds": ANY,
+            "Comment": comment,
+        },
+    )
+
+
+def _stub_invocation(stubber, stdout="", status="Success", comment="register-peer"):
+    stubber.add_response(
+        "get_command_invocation",
+        {
+            "Status": status,
+            "Comment": comment,
+            "StandardOutputContent": stdout,
+            "StandardErrorContent": "",
+        },
+        {"CommandId": COMMAND_ID, "InstanceId": INSTANCE_ID},
+    )
+
+
+def _stub_missing_invocation(stubber):
+    stubber.add_client_error(
+        "get_command_invocation",
+        service_error_code="InvocationDoesNotExist",
+        expected_params={"CommandId": COMMAND_ID, "InstanceId": INSTANCE_ID},
+    )
+
+
+def _stub_command(stubber, stdout, status="Success"):
+    _stub_send(stubber)
+    _stub_invocation(stubber, stdout, status)
+
+
+def test_batch_keys_are_sent_to_agent_in_one_command(register_module):
+    keys = [_peer_key(1), _peer_key(2)]
+    commands = register_module._build_ssm_commands({"op": "register", "publicKeys": keys})
+    encoded = commands[0].split("MESSAGE_B64='", 1)[1].split("'", 1)[0]
+    message = json.loads(base64.b64decode(encoded))
+    assert message["op"] == "register"
+    assert message["publicKeys"] == keys
+    assert message["version"] == register_module.PEER_MANAGER_VERSION
+
+
+def test_single_key_response_shape_is_unchanged(register_module):
+    stdout = json.dumps({
+        "results": [{"publicKey": _peer_key(1), "alreadyExists": False, "assignedIp": "10.8.0.2", "presharedKey": "psk"}],
+        "serverPublicKey": "server",
+    })
+    with Stubber(register_module.ssm) as stubber:
+        _stub_command(stubber, stdout)
+        response = register_module.handler(_post({"publicKey": _peer_key(1)}), None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert body["assignedIp"] == "10.8.0.2"
+    assert body["presharedKey"] == "psk"
+    assert body["serverPublicKey"] == "server"
+    assert body["alreadyExists"] is False
+
+
+def test_batch_response_reports_per_key_results(register_module):
+    results = [
+        {"publicKey": _peer_key(1), "alreadyExists": True, "assignedIp": "10.8.0.2", "presharedKey": "a"},
+        {"publicKey": _peer_key(2), "alreadyExists": False, "assignedIp": "10.8.0.3", "presharedKey": "b"},
+        {"publicKey": _peer_key(3), "error": "No available client IP addresses"},
+    ]
+    with Stubber(register_module.ssm) as stubber:
+        _stub_command(stubber, json.dumps({"results": results, "serverPublicKey": "server"}))
+        response = register_module.handler(
+            _post({"publicKeys": [_peer_key(1), _peer_key(2), _peer_key(3)]}),
+            None,
+        )
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert (body["registered"], body["alreadyRegistered"], body["failed"]) == (1, 1, 1)
+    assert body["results"] == results
+
+
+@pytest.mark.parametrize("payload", [
+    {"publicKeys": []},
+    {"publicKeys": "not-a-list"},
+    {"publicKeys": [_peer_key(1), "short"]},
+    {"publicKey": ""},
+])
+def test_invalid_keys_are_rejected(register_module, payload):
+    response = register_module.handler(_post(payload), None)
+    assert response["statusCode"] == 400
+
+
+def test_batch_size_is_limited(register_module, monkeypatch):
+    monkeypatch.setattr(register_module, "MAX_BATCH_SIZE", 2)
+    response = register_module.handler(_post({"publicKeys": [_peer_key(i) for i in range(3)]}), None)
+    assert response["statusCode"] == 400
+
+
+class ManagerWg:
+    def add_peers(self, peers):
+        pass
+
+    def public_key(self):
+        return base64.b64encode(bytes(32)).decode("ascii")
+
+
+@pytest.mark.parametrize("requested", ["100", "250"])
+def test_full_batch_results_fit_in_inline_ssm_output(register_module, monkeypatch, tmp_path, requested):
+    monkeypatch.setenv("REGISTER_MAX_BATCH_SIZE", requested)
+    module = importlib.reload(register_module)
+    monkeypatch.setattr(module, "time", FakeClock())
+    conf = tmp_path / "wg0.conf"
+    conf.write_text("[Interface]\nAddress = 100.100.0.1/16\n", encoding="utf-8")
+    settings = manager.load_settings({"WG_CONF_PATH": str(conf), "CLIENT_SUBNET": "100.100.0.0/16",
+                                      "SERVER_ADDRESS": "100.100.0.1"})
+    keys = [base64.b64encode(index.to_bytes(32, "big")).decode("ascii") for index in range(module.MAX_BATCH_SIZE)]
+    store = manager.PeerStore(settings)
+    with store.locked():
+        # Start at 100.100.100.0 so every result carries a 15-character address.
+        for offset in range(256 * 100):
+            store.allocator._set(offset)
+    stdout = json.dumps(manager.register_peers(keys, settings, ManagerWg(), store))
+
+    with Stubber(module.ssm) as stubber:
+        # SSM cuts inline stdout off at its limit.
+        _stub_command(stubber, stdout[:module.SSM_OUTPUT_LIMIT])
+        response = module.handler(_post({"publicKeys": keys}), None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert body["registered"] == module.MAX_BATCH_SIZE == min(int(requested), 124)
+    assert all(item["assignedIp"].startswith("100.100.1") for item in body["results"])
+
+
+def test_async_post_returns_job_id_without_polling(register_module):
+    with Stubber(register_module.ssm) as stubber:
+        _stub_send(stubber, comment="register-peer-batch")
+        response = register_module.handler(
+            {**_post({"publicKeys": [_peer_key(1)]}), "queryStringParameters": {"async": "true"}},
+            None,
+        )
+        stubber.assert_no_pending_responses()
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 202
+    assert body["jobId"] == COMMAND_ID
+
+
+def test_job_status_reports_progress_then_result(register_module):
+    stdout = json.dumps({
+        "results": [{"publicKey": _peer_key(1), "alreadyExists": False, "assignedIp": "10.8.0.2", "presharedKey": "psk"}],
+        "serverPublicKey": "server",
+    })
+    event = {"httpMethod": "GET", "queryStringParameters": {"jobId": COMMAND_ID}}
+    with Stubber(register_module.ssm) as stubber:
+        _stub_invocation(stubber, status="InProgress")
+        _stub_invocation(stubber, stdout)
+        pending = register_module.handler(event, None)
+        done = register_module.handler(event, None)
+
+    assert json.loads(pending["body"])["status"] == "InProgress"
+    body = json.loads(done["body"])
+    assert done["statusCode"] == 200
+    assert body["status"] == "Success"
+    assert body["assignedIp"] == "10.8.0.2"
+
+
+def test_job_status_ignores_unrelated_commands(register_module):
+    event = {"httpMethod": "GET", "queryStringParameters": {"jobId": COMMAND_ID}}
+    with Stubber(register_module.ssm) as stubber:
+        _stub_invocation(stubber, "secret", comment="something-else")
+        response = register_module.handler(event, None)
+
+    assert response["statusCode"] == 404
+
+
+def test_delete_revokes_keys_and_reports_missing(register_module, journal_events):
+    stdout = json.dumps({"results": [
+        {"publicKey": _peer_key(1), "removed": True, "releasedIp": "10.8.0.2"},
+        {"publicKey": _peer_key(2), "removed": False, "releasedIp": None},
+    ]})
+    with Stubber(register_module.ssm) as stubber:
+        _stub_send(stubber, comment="revoke-peers")
+        _stub_invocation(stubber, stdout, comment="revoke-peers")
+        response = register_module.handler(
+            {"httpMethod": "DELETE", "body": json.dumps({"publicKeys": [_peer_key(1), _peer_key(2)]})},
+            None,
+        )
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert (body["revoked"], body["notFound"]) == (1, 1)
+    assert [(event["kind"], event["publicKeys"], event["instanceIds"]) for event in journal_events] == [
+        ("revoke", [_peer_key(1), _peer_key(2)], [INSTANCE_ID]),
+    ]
+
+
+def test_prune_job_status_reports_pruned_peers(register_module):
+    stdout = json.dumps({
+        "pruned": [{"publicKey": _peer_key(1), "releasedIp": "10.8.0.2", "lastSeen": 1}],
+        "dryRun": True,
+        "inactiveDays": 30,
+        "remaining": 4,
+    })
+    event = {"httpMethod": "GET", "queryStringParameters": {"jobId": COMMAND_ID}}
+    with Stubber(register_module.ssm) as stubber:
+        _stub_invocation(stubber, stdout, comment="prune-peers")
+        response = register_module.handler(event, None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert body["dryRun"] is True
+    assert body["pruned"][0]["releasedIp"] == "10.8.0.2"
+
+
+@pytest.mark.parametrize("payload", [
+    {"inactiveDays": 0},
+    {"inactiveDays": "30"},
+    {"inactiveDays": 30, "dryRun": "yes"},
+    {"publicKeys": []},
+])
+def test_invalid_delete_requests_are_rejected(register_module, payload):
+    response = register_module.handler({"httpMethod": "DELETE", "body": json.dumps(payload)}, None)
+    assert response["statusCode"] == 400
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_backoff_grows_exponentially_up_to_cap():
+    from lambda_functions.register_peer import ExponentialBackoff
+
+    delays = ExponentialBackoff(initial=0.1, factor=2, cap=0.5, jitter=0.5, rng=lambda: 0.0).delays()
+    assert [round(next(delays), 3) for _ in range(5)] == [0.1, 0.2, 0.4, 0.5, 0.5]
+
+    jittered = ExponentialBackoff(initial=0.1, jitter=0.5, rng=lambda: 1.0).delays()
+    assert next(jittered) == pytest.approx(0.05)
+
+
+def test_scripted_status_sequence_reports_poll_metadata(register_module, monkeypatch):
+    monkeypatch.setattr(register_module.random, "random", lambda: 0.0)
+    stdout = json.dumps({
+        "results": [{"publicKey": _peer_key(1), "alreadyExists": False, "assignedIp": "10.8.0.2", "presharedKey": "psk"}],
+        "serverPublicKey": "server",
+    })
+    with Stubber(register_module.ssm) as stubber:
+        _stub_send(stubber)
+        _stub_missing_invocation(stubber)
+        _stub_invocation(stubber, status="Pending")
+        _stub_invocation(stubber, status="InProgress")
+        _stub_invocation(stubber, stdout)
+        response = register_module.handler(_post({"publicKey": _peer_key(1)}), FakeContext(60000))
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert body["poll"] == {"count": 4, "waitedSeconds": 0.7}
+    assert [round(delay, 3) for delay in register_module.time.sleeps] == [0.1, 0.2, 0.4]
+
+
+def test_deadline_follows_remaining_lambda_time(register_module, monkeypatch):
+    monkeypatch.setattr(register_module.random, "random", lambda: 0.0)
+    with Stubber(register_module.ssm) as stubber:
+        _stub_send(stubber)
+        for _ in range(6):
+            _stub_invocation(stubber, status="InProgress")
+        response = register_module.handler(_post({"publicKey": _peer_key(1)}), FakeContext(3000))
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 202
+    assert body["jobId"] == COMMAND_ID
+    assert sum(register_module.time.sleeps) == pytest.approx(1.0)
+
+
+@pytest.fixture
+def config_cache(register_module, monkeypatch):
+    monkeypatch.setenv("CLIENT_CONFIG_TABLE", "vpn-client-configs")
+    monkeypatch.setenv("WG_ENDPOINT", "203.0.113.10:51820")
+    monkeypatch.setenv("CLIENT_DNS", "1.1.1.1")
+    with mock_dynamodb():
+        boto3.client("dynamodb").create_table(
+            TableName="vpn-client-configs",
+            KeySchema=[{"AttributeName": "publicKey", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "publicKey", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        module = importlib.reload(register_module)
+        monkeypatch.setattr(module, "time", FakeClock())
+        yield module
+
+
+def _download(public_key, config="conf"):
+    return {"httpMethod": "GET", "queryStringParameters": {"publicKey": public_key, "config": config}}
+
+
+def test_registered_config_is_downloaded_again_without_ssm(config_cache):
+    stdout = json.dumps({
+        "results": [{"publicKey": _peer_key(1), "alreadyExists": False, "assignedIp": "10.8.0.2", "presharedKey": "psk"}],
+        "serverPublicKey": "server",
+    })
+    with Stubber(config_cache.ssm) as stubber:
+        _stub_command(stubber, stdout)
+        registered = json.loads(config_cache.handler(_post({"publicKey": _peer_key(1), "config": "svg"}), None)["body"])
+        # No SSM responses are queued: any call to the VPN host would fail the test.
+        downloaded = config_cache.handler(_download(_peer_key(1), "png"), None)
+
+    assert "Endpoint = 203.0.113.10:51820" in registered["config"]
+    assert "PresharedKey = psk" in registered["config"] and registered["configComplete"] is False
+    assert registered["qr"]["data"].startswith("<svg")
+    body = json.loads(downloaded["body"])
+    assert downloaded["statusCode"] == 200
+    assert body["config"] == registered["config"]
+    assert body["qr"]["data"].startswith("data:image/png;base64,")
+
+
+def test_revoked_config_is_dropped_from_cache(config_cache):
+    config_cache.bundles.put([{"publicKey": _peer_key(1), "assignedIp": "10.8.0.2", "serverPublicKey": "server"}])
+    stdout = json.dumps({"results": [{"publicKey": _peer_key(1), "removed": True, "releasedIp": "10.8.0.2"}]})
+    with Stubber(config_cache.ssm) as stubber:
+        _stub_send(stubber, comment="revoke-peers")
+        _stub_invocation(stubber, stdout, comment="revoke-peers")
+        config_cache.handler({"httpMethod": "DELETE", "body": json.dumps({"publicKey": _peer_key(1)})}, None)
+
+    response = config_cache.handler(_download(_peer_key(1)), None)
+    assert response["statusCode"] == 404
+
+
+def test_generated_keys_yield_a_complete_config(config_cache, monkeypatch):
+    monkeypatch.setattr(config_cache.client_config, "generate_keypair", lambda: ("private=", _peer_key(3)))
+    stdout = json.dumps({
+        "results": [{"publicKey": _peer_key(3), "alreadyExists": False, "assignedIp": "10.8.0.4", "presharedKey": "psk"}],
+        "serverPublicKey": "server",
+    })
+    with Stubber(config_cache.ssm) as stubber:
+        _stub_command(stubber, stdout)
+        # The private key cannot be fetched later, so the request waits even when asked to go async.
+        response = config_cache.handler(_post({"generateKeys": True, "async": True}), None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert body["publicKey"] == _peer_key(3)
+    assert "PrivateKey = private=" in body["config"] and body["configComplete"] is True
+
+    cached = config_cache.handler(_download(_peer_key(3)), None)
+    assert "private=" not in cached["body"]
+
+
+@pytest.mark.parametrize("payload", [
+    {"publicKey": _peer_key(1), "config": "jpeg"},
+    {"publicKey": _peer_key(1), "generateKeys": True},
+])
+def test_invalid_config_requests_are_rejected(register_module, payload):
+    response = register_module.handler(_post(payload), None)
+    assert response["statusCode"] == 400
+
+
+POOL = [
+    {"instanceId": "i-a", "clientSubnet": "10.8.0.0/24", "serverAddress": "10.8.0.1", "endpoint": "a.example:51820"},
+    {"instanceId": "i-b", "clientSubnet": "10.8.1.0/24", "serverAddress": "10.8.1.1", "endpoint": "b.example:51820"},
+]
+
+
+@pytest.fixture
+def server_pool(register_module, monkeypatch):
+    monkeypatch.setenv("WG_SERVER_POOL", json.dumps(POOL))
+    monkeypatch.setenv("PLACEMENT_TABLE", "vpn-placements")
+    monkeypatch.setenv("PLACEMENT_CACHE_SECONDS", "0")
+    with mock_dynamodb():
+        boto3.client("dynamodb").create_table(
+            TableName="vpn-placements",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        module = importlib.reload(register_module)
+        monkeypatch.setattr(module, "time", FakeClock())
+        yield module
+
+
+def _stub_server(stubber, instance_id, command_id, stdout, comment="register-peer-batch"):
+    stubber.add_response(
+        "send_command",
+        {"Command": {"CommandId": command_id}},
+        {
+            "InstanceIds": [instance_id],
+            "DocumentName": "AWS-RunShellScript",
+            "Parameters": {"commands": ANY},
+            "TimeoutSeconds": ANY,
+            "Comment": comment,
+        },
+    )
+    return command_id, instance_id, {"Status": "Success", "Comment": comment, "StandardOutputContent": stdout}
+
+
+def _server_output(instance_id, keys, remaining):
+    subnet = "10.8.0" if instance_id == "i-a" else "10.8.1"
+    return json.dumps({
+        "results": [
+            {"publicKey": key, "alreadyExists": False, "assignedIp": f"{subnet}.{index + 2}", "presharedKey": "psk"}
+            for index, key in enumerate(keys)
+        ],
+        "serverPublicKey": f"server-{instance_id}",
+        "remaining": remaining,
+    })
+
+
+def test_pool_spreads_new_peers_and_keeps_keys_sticky(server_pool):
+    server_pool.placement.adopt([])  # the primary had no peers before the pool
+    keys = [_peer_key(1), _peer_key(2)]
+    commands = []
+    with Stubber(server_pool.ssm) as stubber:
+        sent = [
+            _stub_server(stubber, "i-a", COMMAND_ID, _server_output("i-a", keys[:1], 1)),
+            _stub_server(stubber, "i-b", COMMAND_ID.replace("1", "9"), _server_output("i-b", keys[1:], 1)),
+        ]
+        server_pool.ssm.meta.events.register(
+            "provide-client-params.ssm.SendCommand",
+            lambda params, **kwargs: commands.append(params["Parameters"]["commands"][0]),
+        )
+        for command_id, instance_id, invocation in sent:
+            stubber.add_response("get_command_invocation", invocation,
+                                 {"CommandId": command_id, "InstanceId": instance_id})
+        response = server_pool.handler(_post({"publicKeys": keys}), None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200 and body["registered"] == 2
+    assert [(item["instanceId"], item["endpoint"], item["serverPublicKey"]) for item in body["results"]] == [
+        ("i-a", "a.example:51820", "server-i-a"),
+        ("i-b", "b.example:51820", "server-i-b"),
+    ]
+    assert "CLIENT_SUBNET=10.8.0.0/24" in commands[0] and "CLIENT_SUBNET=10.8.1.0/24" in commands[1]
+    # The resident agent was installed with the stack-wide subnet, so the slice travels with the request.
+    agent_message = json.loads(base64.b64decode(commands[1].split("MESSAGE_B64='", 1)[1].split("'", 1)[0]))
+    assert (agent_message["clientSubnet"], agent_message["serverAddress"]) == ("10.8.1.0/24", "10.8.1.1")
+    assert server_pool.placement.loads()["i-b"]["peers"] == 1
+
+    # A returning key goes back to its server, and the job ID names the instance.
+    with Stubber(server_pool.ssm) as stubber:
+        _stub_server(stubber, "i-b", COMMAND_ID, "", comment="register-peer")
+        response = server_pool.handler(_post({"publicKey": keys[1], "async": True}), None)
+    assert json.loads(response["body"])["jobId"] == f"{COMMAND_ID}@i-b"
+
+
+def test_pool_job_reports_servers_that_failed_alongside_the_rest(server_pool):
+    server_pool.placement.adopt([])
+    keys = [_peer_key(1), _peer_key(2)]
+    with Stubber(server_pool.ssm) as stubber:
+        sent = [
+            _stub_server(stubber, "i-a", COMMAND_ID, _server_output("i-a", keys[:1], 1)),
+            _stub_server(stubber, "i-b", COMMAND_ID.replace("1", "9"), ""),
+        ]
+        sent[1][2].update({"Status": "Failed", "StandardErrorContent": "wg: device busy"})
+        for command_id, instance_id, invocation in sent:
+            stubber.add_response("get_command_invocation", invocation,
+                                 {"CommandId": command_id, "InstanceId": instance_id})
+        response = server_pool.handler(_post({"publicKeys": keys}), None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 207
+    assert [(item["publicKey"], item["instanceId"]) for item in body["results"]] == [(keys[0], "i-a")]
+    assert body["results"][0]["presharedKey"] == "psk" and body["registered"] == 1
+    assert body["failedServers"] == [{"instanceId": "i-b", "error": "wg: device busy"}]
+    # The key never reached i-b, so its placement there is dropped again.
+    assert server_pool.placement.locate(keys) == {keys[0]: "i-a"}
+    assert server_pool.placement.loads()["i-b"]["peers"] == 0
+
+
+def test_pool_keeps_keys_the_primary_held_before_the_pool(server_pool):
+    inventory = json.dumps({
+        "generatedAt": int(time.time()),
+        "serverPublicKey": "server-i-a",
+        "fields": ["publicKey", "assignedIp", "latestHandshake", "rxBytes", "txBytes", "registeredAt"],
+        "peers": [[_peer_key(index), f"10.8.0.{index + 2}", None, 0, 0, None] for index in range(1, 4)],
+    })
+    existing = json.dumps({
+        "results": [{"publicKey": _peer_key(1), "alreadyExists": True, "assignedIp": "10.8.0.3"}],
+        "serverPublicKey": "server-i-a",
+        "remaining": 3,
+    })
+    # Busier than i-b, so placing the key afresh would send it there.
+    server_pool.placement.report("i-a", 3)
+    with Stubber(server_pool.ssm) as stubber:
+        # The first registration records what the primary already holds, then sends the key there.
+        for command_id, stdout, comment in [(COMMAND_ID.replace("1", "7"), inventory, "peer-inventory"),
+                                            (COMMAND_ID, existing, "register-peer")]:
+            command_id, instance_id, invocation = _stub_server(stubber, "i-a", command_id, stdout, comment)
+            stubber.add_response("get_command_invocation", invocation,
+                                 {"CommandId": command_id, "InstanceId": instance_id})
+        response = server_pool.handler(_post({"publicKey": _peer_key(1)}), None)
+        stubber.assert_no_pending_responses()
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["alreadyExists"] is True
+    # The primary's existing peers now weigh on placement, so new keys go elsewhere.
+    assert server_pool.placement.adopted
+    assert server_pool.placement.assign([_peer_key(2), _peer_key(9)]) == {"i-a": [_peer_key(2)], "i-b": [_peer_key(9)]}
+
+
+def test_pool_job_ids_reject_unknown_instances(server_pool):
+    event = {"httpMethod": "GET", "queryStringParameters": {"jobId": f"{COMMAND_ID}@i-elsewhere"}}
+    assert server_pool.handler(event, None)["statusCode"] == 400
+
+
+@pytest.fixture
+def peer_snapshots(register_module, monkeypatch):
+    monkeypatch.setenv("PEERS_SNAPSHOT_BUCKET", "vpn-peers")
+    with mock_s3():
+        boto3.client("s3").create_bucket(
+            Bucket="vpn-peers", CreateBucketConfiguration={"LocationConstraint": "ap-northeast-1"})
+        module = importlib.reload(register_module)
+        monkeypatch.setattr(module, "time", FakeClock())
+        yield module
+
+
+def _list(**query):
+    return {"httpMethod": "GET", "resource": "/peers", "queryStringParameters": query or None}
+
+
+def test_peer_pages_share_one_snapshot_read_from_s3(peer_snapshots):
+    output = json.dumps({
+        "generatedAt": int(time.time()),
+        "serverPublicKey": "server",
+        "fields": ["publicKey", "assignedIp", "latestHandshake", "rxBytes", "txBytes", "registeredAt"],
+        "peers": [[_peer_key(index), f"10.8.0.{index + 2}", None, 0, 0, None] for index in range(3)],
+    })
+    s3 = boto3.client("s3")
+    # SSM truncates inline output; the complete output is only in the bucket.
+    s3.put_object(Bucket="vpn-peers", Body=output.encode("utf-8"),
+                  Key=f"commands/{COMMAND_ID}/{INSTANCE_ID}/awsrunShellScript/0.awsrunShellScript/stdout")
+    with Stubber(peer_snapshots.ssm) as stubber:
+        stubber.add_response("send_command", {"Command": {"CommandId": COMMAND_ID}}, {
+            "InstanceIds": [INSTANCE_ID],
+            "DocumentName": "AWS-RunShellScript",
+            "Parameters": {"commands": ANY},
+            "TimeoutSeconds": ANY,
+            "Comment": "peer-inventory",
+            "OutputS3BucketName": "vpn-peers",
+            "OutputS3KeyPrefix": "commands",
+        })
+        _stub_invocation(stubber, output[:100], comment="peer-inventory")
+        first = json.loads(peer_snapshots.handler(_list(limit="2"), None)["body"])
+        # No SSM responses are queued: the second page must come from the snapshot.
+        second = json.loads(peer_snapshots.handler(_list(limit="2", cursor=first["nextCursor"]), None)["body"])
+
+    assert [peer["publicKey"] for peer in first["peers"]] == [_peer_key(0), _peer_key(1)]
+    assert first["matched"] == 3 and first["peers"][0]["assignedIp"] == "10.8.0.2"
+    assert [peer["publicKey"] for peer in second["peers"]] == [_peer_key(2)]
+    assert second["nextCursor"] is None
+    shared = json.loads(s3.get_object(Bucket="vpn-peers", Key=f"snapshots/{INSTANCE_ID}.json")["Body"].read())
+    assert len(shared["peers"]) == 3
+
+
+def test_peer_listing_validates_queries(peer_snapshots):
+    assert peer_snapshots.handler(_list(limit="5000"), None)["statusCode"] == 400
+    assert peer_snapshots.handler(_list(instanceId="i-elsewhere"), None)["statusCode"] == 400
+
+
+def test_peer_listing_failures_say_so(peer_snapshots, monkeypatch):
+    def unreadable(instance_id):
+        raise ClientError({"Error": {"Code": "AccessDenied", "Message": "denied"}}, "GetObject")
+
+    monkeypatch.setattr(peer_snapshots.snapshots, "get", unreadable)
+    response = peer_snapshots.handler(_list(), None)
+    assert response["statusCode"] == 500
+    assert json.loads(response["body"])["message"] == "Failed to list peers."
+
+
+def test_peer_listing_requires_a_snapshot_bucket(register_module):
+    response = register_module.handler(_list(), None)
+    assert response["statusCode"] == 404
@@ -1,12 +1,17 @@
 import importlib
 import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as real_datetime
 from types import SimpleNamespace
 
 import boto3
 import pytest
-from moto import mock_ec2, mock_sns
+from moto import mock_dynamodb, mock_ec2
+from moto.dynamodb.models import Table
+
+from common import journal
 
 
 def _set_aws_test_credentials(monkeypatch):
@@ -40,9 +45,8 @@ def moto_environment(monkeypatch):
     monkeypatch.setenv("WEEKDAY_START_HOUR", "0")
     monkeypatch.setenv("WEEKDAY_END_HOUR", "24")
 
-    with mock_ec2(), mock_sns():
+    with mock_ec2():
         ec2_client = boto3.client("ec2")
-        sns_client = boto3.client("sns")
         ami_id = ec2_client.register_image(
             Name="vpn-test-ami",
             Architecture="x86_64",
@@ -57,14 +61,11 @@ def moto_environment(monkeypatch):
         instance_id = reservation["Instances"][0]["InstanceId"]
         monkeypatch.setenv("INSTANCE_ID", instance_id)
 
-        topic_arn = sns_client.create_topic(Name="vpn-start-test")
-        monkeypatch.setenv("START_NOTIFICATION_TOPIC_ARN", topic_arn["TopicArn"])
-
         module = _load_start_module()
         yield module, ec2_client
 
 
-def test_start_denied_outside_window(monkeypatch, moto_environment):
+def test_start_denied_outside_window(monkeypatch, moto_environment, journal_events):
     module, ec2_client = moto_environment
     module.WEEKDAY_START_HOUR = 13
     module.WEEKDAY_END_HOUR = 18
@@ -76,19 +77,12 @@ def test_start_denied_outside_window(monkeypatch, moto_environment):
 
     monkeypatch.setattr(module, "datetime", FrozenDateTime)
 
-    publish_calls = []
-    monkeypatch.setattr(
-        module,
-        "sns",
-        SimpleNamespace(publish=lambda **kwargs: publish_calls.append(kwargs))
-    )
-
     response = module.handler(_mock_event(), None)
     body = json.loads(response["body"])
 
     assert response["statusCode"] == 403
     assert "disabled" in body["message"].lower()
-    assert publish_calls == []
+    assert journal_events == []
 
     # Ensure instance state unchanged
     reservations = ec2_client.describe_instances(InstanceIds=[os.environ["INSTANCE_ID"]])["Reservations"]
@@ -96,44 +90,176 @@ def test_start_denied_outside_window(monkeypatch, moto_environment):
     assert state == "running"
 
 
-def test_start_noop_when_running(monkeypatch, moto_environment):
-    module, _ = moto_environment
+def test_prewarm_trigger_starts_before_window(monkeypatch, moto_environment, journal_events):
+    module, ec2_client = moto_environment
+    module.WEEKDAY_START_HOUR = 13
+    ec2_client.stop_instances(InstanceIds=[os.environ["INSTANCE_ID"]])
 
-    publish_calls = []
-    monkeypatch.setattr(
-        module,
-        "sns",
-        SimpleNamespace(publish=lambda **kwargs: publish_calls.append(kwargs))
-    )
+    class FrozenDateTime(real_datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return real_datetime(2024, 1, 2, 12, 50, tzinfo=tz)  # Tuesday 12:50
+
+    monkeypatch.setattr(module, "datetime", FrozenDateTime)
+
+    # A crafted API body cannot claim to be the scheduler.
+    api_event = {**_mock_event(), "body": json.dumps({"trigger": "prewarm"})}
+    assert module.handler(api_event, None)["statusCode"] == 403
+
+    response = module.handler({"trigger": "prewarm"}, None)
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert (body["state"], body["trigger"]) == ("pending", "prewarm")
+    assert [event["trigger"] for event in journal_events] == ["prewarm"]
+
+
+def test_start_noop_when_running(moto_environment, journal_events):
+    module, _ = moto_environment
 
     response = module.handler(_mock_event(), None)
     body = json.loads(response["body"])
 
     assert response["statusCode"] == 200
     assert body["state"] == "running"
-    assert publish_calls == []
+    assert journal_events == []
 
 
-def test_start_triggers_notification(monkeypatch, moto_environment):
+def test_start_queues_a_journal_event(moto_environment, journal_events):
     module, ec2_client = moto_environment
 
     # Stop instance so the handler issues a start
     ec2_client.stop_instances(InstanceIds=[os.environ["INSTANCE_ID"]])
 
-    publish_calls = []
-    monkeypatch.setattr(
-        module,
-        "sns",
-        SimpleNamespace(publish=lambda **kwargs: publish_calls.append(kwargs) or {"MessageId": "1"})
+    response = module.handler(_mock_event(), SimpleNamespace(aws_request_id="invocation-1"))
+    body = json.loads(response["body"])
+
+    assert response["statusCode"] == 200
+    assert body["state"] == "pending"
+    assert len(journal_events) == 1
+    event = journal_events[0]
+    assert (event["kind"], event["trigger"]) == ("start", "api")
+    assert event["instanceIds"] == [os.environ["INSTANCE_ID"]]
+    assert (event["sourceIp"], event["userAgent"]) == ("198.51.100.10", "pytest")
+    assert (event["requestId"], event["invocationId"]) == ("unit-test-request", "invocation-1")
+
+
+def test_journal_failure_does_not_fail_the_start(monkeypatch, moto_environment):
+    module, ec2_client = moto_environment
+    ec2_client.stop_instances(InstanceIds=[os.environ["INSTANCE_ID"]])
+
+    def unreachable(**kwargs):
+        raise ConnectionError("queue unreachable")
+
+    monkeypatch.setattr(journal, "QUEUE_URL", "https://sqs.ap-northeast-1.amazonaws.com/123456789012/vpn-journal")
+    monkeypatch.setattr(journal, "sqs", SimpleNamespace(send_message=unreachable))
+
+    response = module.handler(_mock_event(), None)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["state"] == "pending"
+
+
+def test_fleet_start_issues_one_bulk_call(monkeypatch, moto_environment, journal_events):
+    module, ec2_client = moto_environment
+    image_id = ec2_client.describe_images(Owners=["self"])["Images"][0]["ImageId"]
+    extra = ec2_client.run_instances(ImageId=image_id, MinCount=2, MaxCount=2)["Instances"]
+    fleet = [os.environ["INSTANCE_ID"]] + [instance["InstanceId"] for instance in extra]
+    ec2_client.stop_instances(InstanceIds=fleet[1:])
+    monkeypatch.setattr(module, "FLEET_MODE", True)
+    monkeypatch.setattr(module, "INSTANCE_IDS", fleet)
+
+    start_calls = []
+    module.ec2.meta.events.register(
+        "provide-client-params.ec2.StartInstances",
+        lambda params, **kwargs: start_calls.append(params["InstanceIds"])
     )
 
     response = module.handler(_mock_event(), None)
     body = json.loads(response["body"])
 
     assert response["statusCode"] == 200
-    assert body["state"] == "pending"
-    assert len(publish_calls) == 1
-    assert publish_calls[0]["TopicArn"] == os.environ["START_NOTIFICATION_TOPIC_ARN"]
-    message = json.loads(publish_calls[0]["Message"])
-    assert message["instanceId"] == os.environ["INSTANCE_ID"]
-    assert "sourceIp" in message
\ No newline at end of file
+    assert start_calls == [fleet[1:]]
+    assert body["started"] == fleet[1:]
+    assert journal_events[0]["instanceIds"] == fleet[1:]
+
+
+@pytest.mark.parametrize("instance_ids", [[["i-1"]], [{"id": "i-1"}], [""]])
+def test_fleet_start_rejects_malformed_instance_ids(monkeypatch, moto_environment, instance_ids):
+    module, _ = moto_environment
+    monkeypatch.setattr(module, "FLEET_MODE", True)
+
+    response = module.handler({**_mock_event(), "body": json.dumps({"instanceIds": instance_ids})}, None)
+
+    assert response["statusCode"] == 400
+    assert "instanceIds" in json.loads(response["body"])["message"]
+
+
+@pytest.fixture
+def operations_table(monkeypatch, moto_environment):
+    with mock_dynamodb():
+        boto3.client("dynamodb").create_table(
+            TableName="vpn-operations",
+            KeySchema=[{"AttributeName": "scope", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "scope", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        # DynamoDB evaluates a conditional write atomically; moto's check-then-put does not.
+        lock = threading.Lock()
+        put_item = Table.put_item
+
+        def atomic_put_item(self, *args, **kwargs):
+            with lock:
+                return put_item(self, *args, **kwargs)
+
+        monkeypatch.setattr(Table, "put_item", atomic_put_item)
+        monkeypatch.setenv("OPERATIONS_TABLE", "vpn-operations")
+        yield _load_start_module(), moto_environment[1]
+
+
+def test_concurrent_starts_share_one_call_and_notification(operations_table, journal_events):
+    module, ec2_client = operations_table
+    ec2_client.stop_instances(InstanceIds=[os.environ["INSTANCE_ID"]])
+    calls = {"StartInstances": 0}
+
+    def count(model, **kwargs):
+        calls[model.name] += 1
+
+    module.ec2.meta.events.register("provide-client-params.ec2.StartInstances", count)
+
+    requests = 10
+    barrier = threading.Barrier(requests)
+
+    def invoke(index):
+        barrier.wait()
+        return module.handler(_mock_event(), SimpleNamespace(aws_request_id=f"request-{index}"))
+
+    with ThreadPoolExecutor(max_workers=requests) as pool:
+        bodies = [json.loads(response["body"]) for response in pool.map(invoke, range(requests))]
+
+    assert calls == {"StartInstances": 1} and len(journal_events) == 1
+    owners = [body for body in bodies if not body.get("coalesced")]
+    joined = [body for body in bodies if body.get("coalesced")]
+    assert len(owners) == 1 and len(joined) == requests - 1
+    assert all(body["state"] == "pending" for body in bodies)
+    assert {body["operation"]["action"] for body in joined} == {"start"}
+
+    # Once the start has finished, late callers get its result; a stop is a new transition.
+    late = json.loads(module.handler(_mock_event(), None)["body"])
+    assert late["coalesced"] is True and late["operation"]["status"] == "done"
+    owned, _ = module.operations.acquire(os.environ["INSTANCE_ID"], "stop")
+    assert owned is True
+    assert calls == {"StartInstances": 1} and len(journal_events) == 1
+
+
+def test_failed_start_releases_its_lease(monkeypatch, operations_table):
+    module, ec2_client = operations_table
+    ec2_client.stop_instances(InstanceIds=[os.environ["INSTANCE_ID"]])
+    current_state = module._current_state
+
+    def failing_state():
+        raise RuntimeError("describe failed")
+
+    monkeypatch.setattr(module, "_current_state", failing_state)
+    assert module.handler(_mock_event(), None)["statusCode"] == 500
+    monkeypatch.setattr(module, "_current_state", current_state)
+    body = json.loads(module.handler(_mock_event(), None)["body"])
+    assert body["state"] == "pending" and "coalesced" not in body
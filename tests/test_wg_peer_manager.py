@@ -0,0 +1,570 @@
+import ipaddress
+import json
+
+import pytest
+
+from lambda_functions import wg_peer_manager as manager
+
+SERVER_KEY = "S" * 43 + "="
+
+
+class FakeWg:
+    def __init__(self, handshakes=None):
+        self.applied = []
+        self.removed = []
+        self.handshakes = handshakes or {}
+        self.transfers = []
+        self.port = 51820
+
+    def add_peers(self, peers):
+        self.applied.append([dict(peer) for peer in peers])
+
+    def remove_peers(self, public_keys):
+        self.removed.append(list(public_keys))
+
+    def latest_handshakes(self):
+        return dict(self.handshakes)
+
+    def dump(self):
+        return [dict(peer) for peer in self.transfers]
+
+    def listen_port(self):
+        return self.port
+
+    def public_key(self):
+        return SERVER_KEY
+
+
+def _peer_key(index):
+    return f"{index:043d}="
+
+
+def _b64_key(index):
+    return manager.base64.b64encode(index.to_bytes(32, "big")).decode("ascii")
+
+
+@pytest.fixture
+def settings(tmp_path):
+    conf = tmp_path / "wg0.conf"
+    conf.write_text("[Interface]\nAddress = 10.8.0.1/24\nListenPort = 51820\n", encoding="utf-8")
+    return manager.load_settings({
+        "WG_CONF_PATH": str(conf),
+        "CLIENT_SUBNET": "10.8.0.0/24",
+        "SERVER_ADDRESS": "10.8.0.1",
+        "WG_READINESS_PATH": str(tmp_path / "readiness.json"),
+    })
+
+
+def test_allocator_skips_reserved_and_reuses_released():
+    subnet = ipaddress.ip_network("10.8.0.0/29")
+    allocator = manager.IpAllocator(subnet)
+    allocator.reserve("10.8.0.1")
+
+    allocated = [str(allocator.allocate()) for _ in range(5)]
+    assert allocated == ["10.8.0.2", "10.8.0.3", "10.8.0.4", "10.8.0.5", "10.8.0.6"]
+    assert allocator.allocate() is None
+
+    assert allocator.release("10.8.0.4")
+    assert not allocator.release("10.8.0.4")
+    assert str(allocator.allocate()) == "10.8.0.4"
+
+
+def test_allocator_reserves_network_hosts_within_subnet():
+    subnet = ipaddress.ip_network("10.8.0.0/24")
+    allocator = manager.IpAllocator.from_allowed_ips(subnet, ["10.8.0.0/28", "172.16.0.0/16", None])
+
+    assert all(allocator.is_allocated(f"10.8.0.{host}") for host in range(1, 15))
+    assert str(allocator.allocate()) == "10.8.0.15"
+
+
+def test_allocator_round_trip_detects_stale_source():
+    subnet = ipaddress.ip_network("10.8.0.0/16")
+    allocator = manager.IpAllocator(subnet)
+    first = allocator.allocate()
+    raw = allocator.dumps({"size": 1, "mtimeNs": 2})
+
+    restored = manager.IpAllocator.loads(raw, subnet, {"size": 1, "mtimeNs": 2})
+    assert restored.is_allocated(first)
+    assert restored.allocate() == first + 1
+
+    assert manager.IpAllocator.loads(raw, subnet, {"size": 9, "mtimeNs": 2}) is None
+    assert manager.IpAllocator.loads(raw, ipaddress.ip_network("10.9.0.0/16")) is None
+
+
+def _register_one(public_key, settings, wg):
+    return manager.register_peers([public_key], settings, wg)["results"][0]
+
+
+def test_register_peer_appends_config_and_persists_allocator(settings):
+    wg = FakeWg()
+
+    first = _register_one(_peer_key(1), settings, wg)
+    second = _register_one(_peer_key(2), settings, wg)
+    repeat = manager.register_peers([_peer_key(1)], settings, wg)
+
+    assert first["assignedIp"] == "10.8.0.2"
+    assert second["assignedIp"] == "10.8.0.3"
+    assert repeat["results"][0]["alreadyExists"] is True
+    assert repeat["results"][0]["assignedIp"] == "10.8.0.2"
+    assert repeat["results"][0]["presharedKey"] == first["presharedKey"]
+    assert repeat["serverPublicKey"] == SERVER_KEY
+    assert [batch[0]["assignedIp"] for batch in wg.applied] == ["10.8.0.2", "10.8.0.3"]
+
+    state = json.loads(open(settings["alloc_path"], "rb").read())
+    assert state["subnet"] == "10.8.0.0/24"
+    assert state["source"]["size"] == len(open(settings["wg_conf_path"], "rb").read())
+
+
+def test_register_peer_rebuilds_allocator_after_manual_edit(settings):
+    wg = FakeWg()
+    _register_one(_peer_key(1), settings, wg)
+
+    with open(settings["wg_conf_path"], "a", encoding="utf-8") as fh:
+        fh.write(f"\n[Peer]\nPublicKey = {_peer_key(9)}\nAllowedIPs = 10.8.0.3/32\n")
+
+    result = _register_one(_peer_key(2), settings, wg)
+    assert result["assignedIp"] == "10.8.0.4"
+
+
+def test_register_batch_writes_once_and_applies_once(settings):
+    wg = FakeWg()
+    _register_one(_peer_key(1), settings, wg)
+    wg.applied.clear()
+
+    keys = [_peer_key(1), _peer_key(2), _peer_key(3), _peer_key(2)]
+    outcome = manager.register_peers(keys, settings, wg)
+
+    assert [item["publicKey"] for item in outcome["results"]] == keys
+    assert [item["alreadyExists"] for item in outcome["results"]] == [True, False, False, False]
+    assert outcome["results"][1] == outcome["results"][3]
+    assert len(wg.applied) == 1
+    assert [peer["assignedIp"] for peer in wg.applied[0]] == ["10.8.0.3", "10.8.0.4"]
+
+    sections = manager.parse_config(settings["wg_conf_path"])
+    peers = [section["data"] for section in sections if section["type"] == "Peer"]
+    assert [peer["PublicKey"] for peer in peers] == [_peer_key(1), _peer_key(2), _peer_key(3)]
+    assert all(len(peer["PreSharedKey"]) == 44 for peer in peers)
+
+
+def test_register_batch_reports_exhaustion_per_key(tmp_path):
+    conf = tmp_path / "wg0.conf"
+    conf.write_text("[Interface]\nAddress = 10.8.0.1/30\n", encoding="utf-8")
+    settings = manager.load_settings({
+        "WG_CONF_PATH": str(conf),
+        "CLIENT_SUBNET": "10.8.0.0/30",
+        "SERVER_ADDRESS": "10.8.0.1",
+    })
+
+    outcome = manager.register_peers([_peer_key(1), _peer_key(2)], settings, FakeWg())
+
+    assert outcome["results"][0]["assignedIp"] == "10.8.0.2"
+    assert outcome["results"][1]["error"] == "No available client IP addresses"
+
+
+def test_agent_reuses_index_until_config_changes(settings, monkeypatch):
+    agent = manager.PeerAgent(settings, FakeWg(), version="v1")
+    scans = []
+    real_scan = manager.scan_peers
+    monkeypatch.setattr(manager, "scan_peers", lambda path: scans.append(path) or real_scan(path))
+
+    first = agent.handle({"op": "register", "version": "v1", "publicKeys": [_peer_key(1)]})
+    repeat = agent.handle({"op": "register", "version": "v1", "publicKeys": [_peer_key(1)]})
+    assert repeat["results"][0]["alreadyExists"] is True
+    assert len(scans) == 1
+
+    with open(settings["wg_conf_path"], "a", encoding="utf-8") as fh:
+        fh.write(f"\n[Peer]\nPublicKey = {_peer_key(9)}\nAllowedIPs = 10.8.0.3/32\n")
+    second = agent.handle({"op": "register", "version": "v1", "publicKeys": [_peer_key(2)]})
+
+    assert len(scans) == 2
+    assert first["results"][0]["assignedIp"] == "10.8.0.2"
+    assert second["results"][0]["assignedIp"] == "10.8.0.4"
+
+
+def test_agent_rejects_stale_callers_and_unknown_ops(settings):
+    agent = manager.PeerAgent(settings, FakeWg(), version="v2")
+
+    assert agent.handle({"op": "register", "version": "v1", "publicKeys": [_peer_key(1)]})["agentError"] == "version-mismatch"
+    assert "agentError" in agent.handle({"op": "bogus", "version": "v2"})
+    assert agent.handle({"op": "register", "version": "v2", "publicKeys": []}) == {"error": "Missing public key"}
+
+
+def test_agent_allocates_from_the_slice_each_request_names(settings):
+    # Installed with the stack-wide subnet, but serving the pool's second slice.
+    agent = manager.PeerAgent(settings, FakeWg(), version="v1")
+    pool_server = {"version": "v1", "clientSubnet": "10.8.1.0/24", "serverAddress": "10.8.1.1"}
+
+    first = agent.handle({**pool_server, "op": "register", "publicKeys": [_peer_key(1)]})
+    second = agent.handle({**pool_server, "op": "register", "publicKeys": [_peer_key(2)]})
+    revoked = agent.handle({**pool_server, "op": "revoke", "publicKeys": [_peer_key(1)]})
+
+    assert [first["results"][0]["assignedIp"], second["results"][0]["assignedIp"]] == ["10.8.1.2", "10.8.1.3"]
+    assert revoked["results"][0]["releasedIp"] == "10.8.1.2"
+    assert agent.handle({**pool_server, "op": "register", "publicKeys": [_peer_key(3)]})["results"][0]["assignedIp"] == "10.8.1.2"
+    assert "agentError" in agent.handle({**pool_server, "op": "register", "clientSubnet": "bogus", "publicKeys": [_peer_key(4)]})
+
+
+def test_script_version_matches_lambda_side(monkeypatch):
+    import importlib
+    from pathlib import Path
+
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    monkeypatch.setenv("INSTANCE_ID", "i-0123456789abcdef0")
+    monkeypatch.setenv("CLIENT_SUBNET_CIDR", "10.8.0.0/24")
+    monkeypatch.setenv("SERVER_ADDRESS", "10.8.0.1")
+    register = importlib.reload(importlib.import_module("lambda_functions.register_peer"))
+
+    assert register.PEER_MANAGER_VERSION == manager.script_version(Path(manager.__file__).read_bytes())
+
+
+def test_store_index_records_byte_ranges_and_survives_rebuild(settings):
+    wg = FakeWg()
+    manager.register_peers([_peer_key(1), _peer_key(2)], settings, wg)
+
+    peers, source = manager.PeerStore(settings)._read_index()
+    assert source == manager._file_fingerprint(settings["wg_conf_path"])
+    raw = open(settings["wg_conf_path"], "rb").read()
+    entry = peers[_peer_key(2)]
+    block = raw[entry["offset"]:entry["offset"] + entry["length"]].decode("utf-8")
+    assert block.lstrip().startswith("[Peer]")
+    assert _peer_key(2) in block
+    registered_at = entry["registeredAt"]
+    assert registered_at
+
+    # A hand edit invalidates the index; the rebuild keeps registration times.
+    with open(settings["wg_conf_path"], "a", encoding="utf-8") as fh:
+        fh.write("\n# manual note\n")
+    store = manager.PeerStore(settings)
+    with store.locked():
+        assert store.peers[_peer_key(2)]["registeredAt"] == registered_at
+        assert store.lookup(_peer_key(1))["assignedIp"] == "10.8.0.2"
+        assert store.lookup(_peer_key(3)) is None
+
+
+def test_torn_index_append_forces_rebuild(settings):
+    manager.register_peers([_peer_key(1)], settings, FakeWg())
+    with open(settings["index_path"], "ab") as fh:
+        fh.write(b'{"publicKey": "partial')
+
+    store = manager.PeerStore(settings)
+    with store.locked():
+        assert store.lookup(_peer_key(1))["assignedIp"] == "10.8.0.2"
+    assert manager.PeerStore(settings)._read_index()[1] is not None
+
+
+def test_unchanged_registration_does_not_rewrite_config(settings):
+    wg = FakeWg()
+    manager.register_peers([_peer_key(1)], settings, wg)
+    before = manager._file_fingerprint(settings["wg_conf_path"])
+
+    manager.register_peers([_peer_key(1)], settings, wg)
+
+    assert manager._file_fingerprint(settings["wg_conf_path"]) == before
+
+
+def test_revoke_cuts_blocks_and_releases_addresses(settings):
+    wg = FakeWg()
+    manager.register_peers([_peer_key(i) for i in range(1, 5)], settings, wg)
+
+    outcome = manager.revoke_peers([_peer_key(2), _peer_key(3), _peer_key(9)], settings, wg)
+
+    assert [item["removed"] for item in outcome["results"]] == [True, True, False]
+    assert outcome["results"][0]["releasedIp"] == "10.8.0.3"
+    assert wg.removed == [[_peer_key(2), _peer_key(3), _peer_key(9)]]
+    assert set(manager.scan_peers(settings["wg_conf_path"])) == {_peer_key(1), _peer_key(4)}
+
+    store = manager.PeerStore(settings)
+    with store.locked():
+        assert store.lookup(_peer_key(4))["assignedIp"] == "10.8.0.5"
+        assert store.lookup(_peer_key(4))["presharedKey"]
+    reused = manager.register_peers([_peer_key(5), _peer_key(6)], settings, wg)
+    assert [item["assignedIp"] for item in reused["results"]] == ["10.8.0.3", "10.8.0.4"]
+
+
+def test_prune_uses_handshakes_and_remembers_last_seen(settings, monkeypatch):
+    day = 86400
+    monkeypatch.setattr(manager.time, "time", lambda: 100 * day)
+    manager.register_peers([_peer_key(1), _peer_key(2), _peer_key(3)], settings, FakeWg())
+
+    # Peer 1 connected at day 105; the interface later restarts and forgets it.
+    wg = FakeWg(handshakes={_peer_key(1): 105 * day})
+    manager.prune_peers(30, settings, wg, now=106 * day)
+    wg.handshakes = {}
+
+    preview = manager.prune_peers(30, settings, wg, dry_run=True, now=133 * day)
+    assert [item["publicKey"] for item in preview["pruned"]] == [_peer_key(2), _peer_key(3)]
+    assert wg.removed == []
+
+    outcome = manager.prune_peers(30, settings, wg, now=136 * day)
+    assert [item["publicKey"] for item in outcome["pruned"]] == [_peer_key(1), _peer_key(2), _peer_key(3)]
+    assert outcome["remaining"] == 0
+    assert manager.scan_peers(settings["wg_conf_path"]) == {}
+
+
+def test_prune_rejects_invalid_window(settings):
+    agent = manager.PeerAgent(settings, FakeWg())
+    assert agent.handle({"op": "prune", "inactiveDays": 0}) == {"error": "inactiveDays must be a positive number"}
+
+
+def test_usage_sample_reports_deltas_and_active_peers(settings):
+    wg = FakeWg()
+    wg.transfers = [
+        {"publicKey": _peer_key(1), "latestHandshake": 990, "rxBytes": 1000, "txBytes": 500},
+        {"publicKey": _peer_key(2), "latestHandshake": 0, "rxBytes": 0, "txBytes": 0},
+    ]
+    first = manager.sample_usage(settings, wg, now=1000)
+    assert (first["rxBytes"], first["txBytes"], first["activePeers"]) == (1000, 500, 1)
+    assert first["intervalSeconds"] is None
+
+    # Peer 1 restarted its counters (interface bounce); peer 2 went quiet after a handshake.
+    wg.transfers = [
+        {"publicKey": _peer_key(1), "latestHandshake": 1850, "rxBytes": 300, "txBytes": 100},
+        {"publicKey": _peer_key(2), "latestHandshake": 1100, "rxBytes": 0, "txBytes": 0},
+    ]
+    second = manager.sample_usage(settings, wg, now=1900)
+    assert (second["rxBytes"], second["txBytes"], second["activePeers"]) == (300, 100, 1)
+    assert second["intervalSeconds"] == 900
+    assert second["topPeers"] == [{"publicKey": _peer_key(1), "rxBytes": 300, "txBytes": 100}]
+    assert second["readiness"] is None
+
+
+def test_inventory_joins_one_dump_with_registration_times(settings, monkeypatch):
+    monkeypatch.setattr(manager.time, "time", lambda: 5000)
+    wg = FakeWg()
+    manager.register_peers([_peer_key(2), _peer_key(1)], settings, wg)
+    wg.transfers = [
+        {"publicKey": _peer_key(2), "allowedIps": "10.8.0.2/32", "latestHandshake": 4990, "rxBytes": 10, "txBytes": 20},
+        {"publicKey": _peer_key(1), "allowedIps": "10.8.0.3/32", "latestHandshake": 0, "rxBytes": 0, "txBytes": 0},
+        {"publicKey": _peer_key(9), "allowedIps": "(none)", "latestHandshake": 0, "rxBytes": 0, "txBytes": 0},
+    ]
+
+    result = manager.PeerAgent(settings, wg).handle({"op": "inventory"})
+
+    assert result["fields"] == list(manager.INVENTORY_FIELDS)
+    assert result["generatedAt"] == 5000
+    assert result["serverPublicKey"] == SERVER_KEY
+    assert result["peers"] == [
+        [_peer_key(1), "10.8.0.3", None, 0, 0, 5000],
+        [_peer_key(2), "10.8.0.2", 4990, 10, 20, 5000],
+        [_peer_key(9), None, None, 0, 0, None],
+    ]
+
+
+def test_wg_dump_streams_peer_lines(tmp_path, monkeypatch):
+    script = tmp_path / "wg"
+    script.write_text(
+        "#!/bin/sh\n"
+        "printf 'priv\\tpub\\t51820\\toff\\n'\n"
+        "printf 'key1\\tpsk\\t1.2.3.4:5\\t10.8.0.2/32\\t1700000000\\t11\\t22\\toff\\n'\n"
+        "printf 'key2\\t(none)\\t(none)\\t10.8.0.3/32\\t0\\t0\\t0\\t25\\n'\n",
+        encoding="utf-8",
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{manager.os.environ['PATH']}")
+
+    assert list(manager.WgCli("wg0").dump()) == [
+        {"publicKey": "key1", "allowedIps": "10.8.0.2/32", "latestHandshake": 1700000000, "rxBytes": 11, "txBytes": 22},
+        {"publicKey": "key2", "allowedIps": "10.8.0.3/32", "latestHandshake": 0, "rxBytes": 0, "txBytes": 0},
+    ]
+
+
+def test_readiness_tracks_first_handshake_after_boot_and_resume(settings):
+    wg = FakeWg(handshakes={_peer_key(1): 900})
+    tracker = manager.ReadinessTracker(settings, wg, woke_at=1000, suspended=0.0)
+
+    tracker.tick(1001, 0.0)
+    assert manager.read_readiness(settings)["firstHandshakeAt"] is None
+    wg.handshakes = {_peer_key(1): 1030, _peer_key(2): 1042}
+    tracker.tick(1050, 0.0)
+    assert manager.read_readiness(settings) == {
+        "wake": "boot",
+        "wokeAt": 1000,
+        "listeningAt": 1001,
+        "announced": False,
+        "firstHandshakeAt": 1030,
+        "secondsToFirstHandshake": 30,
+    }
+
+    # Six hours hibernated: handshakes from before the resume no longer count.
+    tracker.tick(30000, 21600.0)
+    assert manager.read_readiness(settings)["wake"] == "resume"
+    assert manager.read_readiness(settings)["firstHandshakeAt"] is None
+    wg.handshakes[_peer_key(2)] = 30012
+    tracker.tick(30013, 21600.0)
+    assert manager.read_readiness(settings)["secondsToFirstHandshake"] == 12
+
+
+def test_readiness_announces_once_interface_listens_and_retries(settings):
+    wg = FakeWg()
+    wg.port = 0
+    announced = []
+
+    def announce(ready_at):
+        if not announced:
+            announced.append(None)
+            raise OSError("network unreachable")
+        announced.append(ready_at)
+
+    tracker = manager.ReadinessTracker(settings, wg, woke_at=1000, suspended=0.0, announce=announce)
+    tracker.tick(1005, 0.0)
+    assert announced == []
+    wg.port = 51820
+    tracker.tick(1010, 0.0)
+    tracker.tick(1020, 0.0)
+    assert announced == [None, 1010]
+    assert manager.read_readiness(settings)["announced"] is True
+
+
+def test_sigv4_headers_match_botocore(monkeypatch):
+    from datetime import datetime, timezone
+
+    from botocore import auth
+    from botocore.awsrequest import AWSRequest
+    from botocore.credentials import Credentials
+
+    body = b"Action=CreateTags&Version=2016-11-15&ResourceId.1=i-0123&Tag.1.Key=vpn-ready-at&Tag.1.Value=1700000000"
+    now = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    credentials = {"accessKeyId": "AKIDEXAMPLE", "secretAccessKey": "secret", "token": "session-token"}
+    headers = manager.sigv4_headers(
+        "POST", "ec2.ap-northeast-1.amazonaws.com", "ap-northeast-1", "ec2", body, credentials, now.timestamp()
+    )
+
+    monkeypatch.setattr(auth, "get_current_datetime", lambda: now.replace(tzinfo=None))
+    request = AWSRequest(
+        method="POST",
+        url="https://ec2.ap-northeast-1.amazonaws.com/",
+        data=body,
+        headers={"Content-Type": "application/x-www-form-urlencoded; charset=utf-8"},
+    )
+    auth.SigV4Auth(Credentials("AKIDEXAMPLE", "secret", "session-token"), "ec2", "ap-northeast-1").add_auth(request)
+    assert headers["authorization"] == request.headers["Authorization"]
+
+
+class FakeKernel:
+    """Answers generic netlink requests the way the wireguard family does."""
+
+    family = 0x1d
+
+    def __init__(self, peers=()):
+        self.peers = {peer["publicKey"]: peer for peer in peers}
+        self.set_messages = []
+        self.replies = []
+
+    @staticmethod
+    def _message(kind, seq, body, flags=0):
+        return manager.struct.pack("=IHHII", 16 + len(body), kind, flags, seq, 0) + body
+
+    def send(self, data):
+        _, kind, _, seq, _ = manager.struct.unpack_from("=IHHII", data)
+        command = data[16]
+        attrs = dict(manager._nla_parse(data[20:]))
+        if kind == manager.GENL_ID_CTRL:
+            if attrs[manager.CTRL_ATTR_FAMILY_NAME] != b"wireguard\0":
+                self.replies.append(self._message(manager.NLMSG_ERROR, seq, manager.struct.pack("=i", -2)))
+                return
+            body = manager._genl(1, manager._nla(manager.CTRL_ATTR_FAMILY_ID, manager.struct.pack("=H", self.family)))
+            self.replies.append(self._message(kind, seq, body))
+        elif command == manager.WG_CMD_SET_DEVICE:
+            peers = [manager._decode_peer(peer) for _, peer in manager._nla_parse(attrs[manager.WGDEVICE_A_PEERS])]
+            self.set_messages.append(peers)
+            for peer in peers:
+                self.peers[peer["publicKey"]] = peer
+            self.replies.append(self._message(manager.NLMSG_ERROR, seq, manager.struct.pack("=i", 0)))
+        else:
+            # Two dump messages; the second continues the first one's last peer.
+            device = (manager._nla(manager.WGDEVICE_A_PUBLIC_KEY, bytes(32))
+                      + manager._nla(manager.WGDEVICE_A_LISTEN_PORT, manager.struct.pack("=H", 51820)))
+            first = manager._nla_nested(manager.WGDEVICE_A_PEERS, b"".join([
+                self._peer(_b64_key(1), ["10.8.0.2"], handshake=1700000000, rx=11, tx=22),
+                self._peer(_b64_key(2), ["10.8.0.3"]),
+            ]))
+            second = manager._nla_nested(manager.WGDEVICE_A_PEERS, self._peer(_b64_key(2), ["10.9.0.0"], counters=False))
+            for body in (device + first, second):
+                self.replies.append(self._message(self.family, seq, manager._genl(command, body), manager.NLM_F_MULTI))
+            self.replies.append(self._message(manager.NLMSG_DONE, seq, b"\0\0\0\0", manager.NLM_F_MULTI))
+
+    @staticmethod
+    def _peer(key, addresses, handshake=0, rx=0, tx=0, counters=True):
+        allowed = b"".join(manager._nla_nested(0, (
+            manager._nla(manager.WGALLOWEDIP_A_FAMILY, manager.struct.pack("=H", manager.socket.AF_INET))
+            + manager._nla(manager.WGALLOWEDIP_A_IPADDR, ipaddress.ip_address(address).packed)
+            + manager._nla(manager.WGALLOWEDIP_A_CIDR_MASK, bytes([32]))
+        )) for address in addresses)
+        attrs = manager._nla(manager.WGPEER_A_PUBLIC_KEY, manager._key_bytes(key))
+        if counters:
+            attrs += (manager._nla(manager.WGPEER_A_LAST_HANDSHAKE_TIME, manager.struct.pack("=qq", handshake, 0))
+                      + manager._nla(manager.WGPEER_A_RX_BYTES, manager.struct.pack("=Q", rx))
+                      + manager._nla(manager.WGPEER_A_TX_BYTES, manager.struct.pack("=Q", tx)))
+        return manager._nla_nested(0, attrs + manager._nla_nested(manager.WGPEER_A_ALLOWEDIPS, allowed))
+
+    def recv(self, size):
+        return self.replies.pop(0)
+
+    def close(self):
+        pass
+
+
+def test_netlink_applies_many_peers_per_message():
+    kernel = FakeKernel()
+    wg = manager.WgNetlink("wg0", sock=kernel)
+    assert wg.family == FakeKernel.family
+
+    peers = [
+        {"publicKey": _b64_key(index), "assignedIp": str(ipaddress.ip_address("10.8.0.2") + index),
+         "presharedKey": manager.generate_psk()}
+        for index in range(1200)
+    ]
+    wg.add_peers(peers)
+
+    assert len(kernel.set_messages) == 4
+    applied = [peer for message in kernel.set_messages for peer in message]
+    assert [peer["publicKey"] for peer in applied] == [peer["publicKey"] for peer in peers]
+    assert applied[5]["allowed"] == ["10.8.0.7/32"]
+
+    wg.remove_peers([_b64_key(1)])
+    assert [peer["publicKey"] for peer in kernel.set_messages[-1]] == [_b64_key(1)]
+
+
+def test_netlink_batches_fit_the_peers_attribute_length():
+    kernel = FakeKernel()
+    wg = manager.WgNetlink("wg0", sock=kernel)
+    # 7 IPv6 and 599 IPv4 peers encode to 65,532 bytes, just past what a 16-bit nla_len can hold.
+    peers = [
+        {"publicKey": _b64_key(index), "assignedIp": str(ipaddress.ip_address("fd00::2") + index),
+         "presharedKey": manager.generate_psk()}
+        for index in range(7)
+    ] + [
+        {"publicKey": _b64_key(7 + index), "assignedIp": str(ipaddress.ip_address("10.8.0.2") + index),
+         "presharedKey": manager.generate_psk()}
+        for index in range(700)
+    ]
+    assert sum(len(manager._peer_attrs(peer)) for peer in peers[:606]) == 65532
+
+    wg.add_peers(peers)
+
+    applied = [peer for message in kernel.set_messages for peer in message]
+    assert [peer["publicKey"] for peer in applied] == [peer["publicKey"] for peer in peers]
+    assert applied[0]["allowed"] == ["fd00::2/128"]
+    with pytest.raises(ValueError):
+        manager._nla(manager.WGDEVICE_A_PEERS, bytes(65532))
+
+
+def test_netlink_dump_merges_peers_split_across_messages():
+    wg = manager.WgNetlink("wg0", sock=FakeKernel())
+    assert list(wg.dump()) == [
+        {"publicKey": _b64_key(1), "allowedIps": "10.8.0.2/32", "latestHandshake": 1700000000, "rxBytes": 11, "txBytes": 22},
+        {"publicKey": _b64_key(2), "allowedIps": "10.8.0.3/32,10.9.0.0/32", "latestHandshake": 0, "rxBytes": 0, "txBytes": 0},
+    ]
+    assert wg.listen_port() == 51820
+    assert wg.public_key() == manager.base64.b64encode(bytes(32)).decode("ascii")
+
+
+def test_open_wg_falls_back_to_the_cli(monkeypatch):
+    def unavailable(interface):
+        raise OSError(2, "No such file or directory")
+
+    monkeypatch.setattr(manager, "WgNetlink", unavailable)
+    assert isinstance(manager.open_wg("wg0"), manager.WgCli)
+    assert isinstance(manager.open_wg("wg0", "cli"), manager.WgCli)
+    with pytest.raises(OSError):
+        manager.open_wg("wg0", "netlink")